@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Compression ratio, max error and decode speed of the archival codec.
+
+ratio: size of the cache data files over the size of the archive
+max error: largest difference of any decoded component, and its bound
+decode MB/s: decoded float bytes per second, every block of every channel
+rebuild s: time to write the archive back out as an mcx cache
+
+Uses a synthetic cloth-like cache unless real cache xmls or dirs are given.
+Real caches are what matter, synthetic noise compresses worse than cloth.
+
+python benchmarks/bench_cache_codec.py --xml /caches/shot010 --tolerance 0.01 0.001
+python benchmarks/bench_cache_codec.py --frames 500 --verts 50000
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import cache_io  # noqa: E402
+from techanim_flow import cache_codec  # noqa: E402
+
+
+def synthetic_cache(root, frames, verts):
+    """A grid waving in the wind, smooth in space and time like cloth
+
+    Returns:
+        str: xml path
+    """
+    side = int(np.ceil(np.sqrt(verts)))
+    u, v = np.meshgrid(np.linspace(0, 100, side), np.linspace(0, 100, side))
+    u = u.reshape(-1)[:verts]
+    v = v.reshape(-1)[:verts]
+
+    def frames_points():
+        for frame in range(frames):
+            phase = frame * 0.08
+            points = np.empty((verts, 3), dtype=np.float32)
+            points[:, 0] = u + 2.0 * np.sin(v * 0.05 + phase)
+            points[:, 1] = 150.0 + 5.0 * np.sin(u * 0.07 + phase * 1.3)
+            points[:, 2] = v + 3.0 * np.cos(u * 0.04 + phase)
+            yield points
+
+    return cache_io.write_cache(root,
+                                "benchShape",
+                                frames_points(),
+                                1001,
+                                end_frame=1000 + frames)
+
+
+def bench(xml_path, archive_path, tolerance, mode, compression):
+    """Encode, decode and rebuild one cache
+
+    Returns:
+        dict: numbers for the table
+    """
+    start = time.time()
+    cache_codec.encode_cache(xml_path,
+                             archive_path,
+                             tolerance=tolerance,
+                             mode=mode,
+                             compression=compression)
+    encode_seconds = time.time() - start
+
+    decoded_bytes = 0
+    with cache_codec.ArchiveReader(archive_path) as reader:
+        start = time.time()
+        for channel in reader.header["channels"]:
+            for index in range(len(channel["blocks"])):
+                block = reader.get_block(channel["name"], index)
+                decoded_bytes += sum(x.nbytes for x in block)
+        decode_seconds = time.time() - start
+
+    rebuild_dir = os.path.join(os.path.dirname(archive_path), "rebuild")
+    start = time.time()
+    cache_codec.decode_cache(archive_path, rebuild_dir, overwrite=True)
+    rebuild_seconds = time.time() - start
+    shutil.rmtree(rebuild_dir, ignore_errors=True)
+
+    errors = cache_codec.get_max_error(xml_path, archive_path).values()
+    cache_size = sum(os.path.getsize(x) for x in
+                     cache_io.read_description(xml_path).get_data_paths())
+    return {"ratio": cache_size / os.path.getsize(archive_path),
+            "error": max(x["error"] for x in errors),
+            "bound": max(x["bound"] for x in errors),
+            "encode": decoded_bytes / encode_seconds / 1e6,
+            "decode": decoded_bytes / decode_seconds / 1e6,
+            "rebuild": rebuild_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--xml", nargs="*", default=[],
+                        help="existing cache xmls or dirs to use")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--verts", type=int, default=20000)
+    parser.add_argument("--tolerance", type=float, nargs="+",
+                        default=[cache_codec.DEFAULT_TOLERANCE])
+    parser.add_argument("--mode", nargs="+", default=cache_codec.MODES)
+    parser.add_argument("--compression", nargs="+", default=["zlib"])
+    parser.add_argument("--keep", action="store_true")
+    options = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_cache_codec_")
+    try:
+        xml_paths = cache_codec._find_xmls(options.xml)
+        if not xml_paths:
+            xml_paths = [synthetic_cache(root, options.frames, options.verts)]
+
+        header = "{:<24} {:>9} {:>8} {:>6} {:>7} {:>11} {:>11} {:>9} {:>9} {:>9}"
+        row = "{:<24} {:>9} {:>8} {:>6} {:>7.1f} {:>11.6f} {:>11.6f} {:>9.0f} {:>9.0f} {:>9.2f}"
+        print(header.format("cache", "tolerance", "mode", "codec", "ratio",
+                            "max error", "bound", "enc MB/s", "dec MB/s",
+                            "rebuild s"))
+        for xml_path in xml_paths:
+            name = os.path.splitext(os.path.basename(xml_path))[0]
+            for tolerance in options.tolerance:
+                for mode in options.mode:
+                    for compression in options.compression:
+                        archive_path = os.path.join(
+                            root, "{}_{}_{}{}".format(name, mode, compression,
+                                                      cache_codec.ARCHIVE_EXT))
+                        result = bench(xml_path, archive_path, tolerance,
+                                       mode, compression)
+                        print(row.format(name[:24], tolerance, mode,
+                                         compression, result["ratio"],
+                                         result["error"], result["bound"],
+                                         result["encode"], result["decode"],
+                                         result["rebuild"]))
+                        if not options.keep:
+                            os.remove(archive_path)
+    finally:
+        if not options.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print("Kept archives in {}".format(root))
+
+
+if __name__ == "__main__":
+    main()
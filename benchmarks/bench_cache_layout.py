@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Compare attach and scrub times of the cache layouts.
+
+attach: opening a reader, which has to find every sample in the data
+scrub: reading every frame in random order, like scrubbing the timeline
+
+Layouts compared: OneFile walked chunk by chunk, OneFile with the frame index
+sidecar and OneFilePerFrame. Uses synthetic caches unless an existing cache
+xml is given, which is rewritten in every layout first. Run twice or drop the
+os file cache in between for cold numbers.
+
+python benchmarks/bench_cache_layout.py --frames 2000 --verts 50000
+python benchmarks/bench_cache_layout.py --xml /caches/shirtShape.xml
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import cache_io  # noqa: E402
+
+
+def synthetic_frames(frames, verts):
+    """Generator so the source never has to fit in memory
+
+    Args:
+        frames (int): number of frames
+        verts (int): points per frame
+
+    Yields:
+        numpy.ndarray: (verts, 3)
+    """
+    rest = np.random.rand(verts, 3).astype(np.float32)
+    for frame in range(frames):
+        yield rest + np.float32(np.sin(frame * 0.1))
+
+
+def write_layouts(root, frames_points, start_frame, base_name):
+    """Write the same frames in every layout
+
+    Returns:
+        dict: layout name: xml path
+    """
+    one_file_dir = os.path.join(root, "one_file")
+    per_frame_dir = os.path.join(root, "per_frame")
+    one_file = cache_io.CacheWriter(one_file_dir, base_name, start_frame)
+    per_frame = cache_io.CacheWriter(per_frame_dir,
+                                     base_name,
+                                     start_frame,
+                                     cache_type=cache_io.ONE_FILE_PER_FRAME)
+    for index, points in enumerate(frames_points):
+        one_file.write_frame(start_frame + index, points)
+        per_frame.write_frame(start_frame + index, points)
+    indexed_xml = one_file.close()
+    per_frame.close()
+
+    scan_dir = os.path.join(root, "one_file_scan")
+    os.makedirs(scan_dir)
+    for name in os.listdir(one_file_dir):
+        if not name.endswith(cache_io.FRAME_INDEX_EXT):
+            shutil.copy2(os.path.join(one_file_dir, name), scan_dir)
+    return {"OneFile (scan)": os.path.join(scan_dir, base_name + ".xml"),
+            "OneFile (index)": indexed_xml,
+            "OneFilePerFrame": os.path.join(per_frame_dir, base_name + ".xml")}
+
+
+def bench(xml_path, repeats):
+    """Best of the repeats for attach and scrub
+
+    Returns:
+        tuple: attach seconds, scrub seconds
+    """
+    attach_times = []
+    scrub_times = []
+    for _ in range(repeats):
+        start = time.time()
+        reader = cache_io.CacheReader(xml_path)
+        attach_times.append(time.time() - start)
+
+        frames = reader.frames
+        random.shuffle(frames)
+        start = time.time()
+        for frame in frames:
+            float(reader.get_frame(frame).sum())
+        scrub_times.append(time.time() - start)
+        reader.close()
+    return min(attach_times), min(scrub_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--verts", type=int, default=20000)
+    parser.add_argument("--xml", default=None, help="existing cache to use")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--keep", action="store_true")
+    options = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_cache_layout_")
+    try:
+        if options.xml:
+            source = cache_io.CacheReader(options.xml)
+            frames_points = (x[1] for x in source.iter_frames())
+            start_frame = source.frames[0]
+            base_name = source.description.base_name
+        else:
+            frames_points = synthetic_frames(options.frames, options.verts)
+            start_frame = 1001
+            base_name = "benchShape"
+        layouts = write_layouts(root, frames_points, start_frame, base_name)
+
+        print("{:<18} {:>12} {:>12} {:>14}".format("layout", "attach ms",
+                                                   "scrub ms", "ms / frame"))
+        for name, xml_path in sorted(layouts.items()):
+            attach, scrub = bench(xml_path, options.repeats)
+            count = len(cache_io.CacheReader(xml_path).times)
+            print("{:<18} {:>12.2f} {:>12.2f} {:>14.4f}".format(
+                name, attach * 1000, scrub * 1000, scrub * 1000 / count))
+    finally:
+        if not options.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print("Kept caches in {}".format(root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Time the bulk cache state query against the per node lookups it replaced.
+
+per node: a listRelatives and up to two listConnections for every node, what
+is_node_cached did before
+bulk: techanim_manager_utils.get_cache_state, a few queries for every node
+
+Both have to find the same nodes. Builds a scene of --nodes meshes with every
+other one geometry cached through a historySwitch, or times every transform
+of the setups of a scene given with --scene. Runs in mayapy.
+
+mayapy benchmarks/bench_cache_state.py --nodes 500
+mayapy benchmarks/bench_cache_state.py --scene shot010.ma
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import batch  # noqa: E402
+
+
+def per_node_cached(nodes):
+    """is_node_cached as it was, three commands per node
+
+    Returns:
+        set: cached nodes
+    """
+    import maya.cmds as cmds
+
+    cached = set()
+    for node in nodes:
+        for shape in cmds.listRelatives(node, shapes=True) or []:
+            if cmds.listConnections(shape, type="historySwitch"):
+                cached.add(node)
+            elif cmds.listConnections(shape, type="cacheFile"):
+                cached.add(node)
+    return cached
+
+
+def build_scene(count):
+    """Meshes under a group, every other one with a historySwitch and a
+    cacheFile on its inMesh like a geometry cache
+
+    Returns:
+        list: of transforms
+    """
+    import maya.cmds as cmds
+
+    cmds.file(new=True, force=True)
+    group = cmds.group(empty=True, name="bench_setup")
+    nodes = []
+    for index in range(count):
+        node = cmds.polyCube(name="bench_geo{}".format(index),
+                             constructionHistory=False)[0]
+        node = cmds.parent(node, group)[0]
+        nodes.append(node)
+        if index % 2:
+            continue
+        shape = cmds.listRelatives(node, shapes=True)[0]
+        switch = cmds.createNode("historySwitch")
+        cache_file = cmds.createNode("cacheFile")
+        cmds.connectAttr("{}.outCacheData[0]".format(cache_file),
+                         "{}.inPositions[0]".format(switch))
+        cmds.connectAttr("{}.outputGeometry[0]".format(switch),
+                         "{}.inMesh".format(shape),
+                         force=True)
+    return nodes
+
+
+def get_setup_nodes(scene_path):
+    """Every transform of every setup of a scene
+
+    Returns:
+        list: of transforms
+    """
+    import maya.cmds as cmds
+    from techanim_flow import techanim_manager_utils
+
+    batch.open_scene(scene_path)
+    nodes = []
+    for setup_root in techanim_manager_utils.get_all_setups_roots():
+        nodes.extend(cmds.listRelatives(setup_root,
+                                        ad=True,
+                                        type="transform") or [])
+    return nodes
+
+
+def bench(function, nodes, repeats):
+    """Best time of a few runs
+
+    Returns:
+        tuple: seconds, cached nodes of the last run
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        cached = function(nodes)
+        seconds = time.time() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, set(cached)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--scene", default=None, help="scene with setups")
+    parser.add_argument("--repeats", type=int, default=3)
+    options = parser.parse_args()
+
+    batch.initialize()
+    from techanim_flow import techanim_manager_utils
+
+    if options.scene:
+        nodes = get_setup_nodes(os.path.abspath(options.scene))
+    else:
+        nodes = build_scene(options.nodes)
+    per_node, per_node_nodes = bench(per_node_cached, nodes, options.repeats)
+    bulk, bulk_nodes = bench(techanim_manager_utils.get_cache_state,
+                             nodes,
+                             options.repeats)
+    if per_node_nodes != bulk_nodes:
+        print("Different nodes found: {}".format(
+            sorted(per_node_nodes ^ bulk_nodes)))
+        return 1
+    print("{} nodes, {} cached".format(len(nodes), len(bulk_nodes)))
+    print("{:<10} {:>12}".format("query", "ms"))
+    print("{:<10} {:>12.2f}".format("per node", per_node * 1000))
+    print("{:<10} {:>12.2f}".format("bulk", bulk * 1000))
+    print("{:.1f}x".format(per_node / max(bulk, 1e-9)))
+    batch.uninitialize()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
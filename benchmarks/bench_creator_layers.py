@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Time filling the setup layers a node at a time against in bulk.
+
+per node: duplicate, delete history, parent, hide and 9 setAttr to lock and
+hide for every node, what the creator did before
+bulk: techanim_creator_utils.populate_layer as the creator runs it, one
+duplicate, delete history, parent and hide for all the nodes. The renames
+and the 9 setAttr locks per node still go one by one in both.
+
+Every layer of the config between the input and output layers is filled
+with --nodes meshes both ways, from a new scene each time. Runs in mayapy.
+
+mayapy benchmarks/bench_creator_layers.py --nodes 150
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import batch  # noqa: E402
+
+
+def per_node_layer(nodes, group, suffix):
+    """populate_layer as it was
+
+    Returns:
+        list: of the duplicates
+    """
+    import maya.cmds as cmds
+    from techanim_flow import techanim_creator_utils
+
+    duplicates = []
+    for sim_node in nodes:
+        node = cmds.duplicate(sim_node,
+                              n="{}{}".format(sim_node, suffix),
+                              un=False,
+                              ic=False)[0]
+        cmds.delete(node, ch=True)
+        cmds.parent(node, group)
+        cmds.setAttr("{}.v".format(node), 0)
+        techanim_creator_utils.locknHide(node)
+        duplicates.append(node)
+    return duplicates
+
+
+def bulk_layer(nodes, group, suffix):
+    """populate_layer, the path the creator runs"""
+    from techanim_flow import techanim_creator_utils
+
+    techanim_info = dict((x, x) for x in nodes)
+    techanim_creator_utils.populate_layer(techanim_info, group, suffix)
+
+
+def build_scene(count, groups):
+    """Meshes to duplicate and the layer groups, in a new scene
+
+    Returns:
+        list: of meshes
+    """
+    import maya.cmds as cmds
+
+    cmds.file(new=True, force=True)
+    for group in groups:
+        cmds.group(empty=True, name=group)
+    return [cmds.polySphere(name="bench_cloth{}".format(x))[0]
+            for x in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=150)
+    options = parser.parse_args()
+
+    batch.initialize()
+    from techanim_flow import techanim_creator_utils
+
+    config = techanim_creator_utils.CONFIG
+    layers = config["grouping_order"][1:-1]
+    groups = ["{}_{}".format(config["sim_base_name"], x) for x in layers]
+    timings = {}
+    for name, function in [("per node", per_node_layer),
+                           ("bulk", bulk_layer)]:
+        nodes = build_scene(options.nodes, groups)
+        for layer, group in zip(layers, groups):
+            start = time.time()
+            function(nodes, group, "_{}".format(layer))
+            timings.setdefault(layer, {})[name] = time.time() - start
+
+    print("{} nodes per layer".format(options.nodes))
+    row = "{:<14} {:>12} {:>12} {:>8}"
+    print(row.format("layer", "per node s", "bulk s", ""))
+    for layer in layers:
+        per_node = timings[layer]["per node"]
+        bulk = timings[layer]["bulk"]
+        print(row.format(layer,
+                         "{:.3f}".format(per_node),
+                         "{:.3f}".format(bulk),
+                         "{:.1f}x".format(per_node / max(bulk, 1e-9))))
+    batch.uninitialize()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
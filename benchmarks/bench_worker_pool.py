@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Jobs per hour of warm mayapy workers against a mayapy started per job.
+
+Both run the same batch job --jobs times on --workers processes at once. The
+default job only opens the scene and lists its setups, the startup cost is
+most of it, pass a real job with --args to measure that instead. Warm
+includes the time the workers take to warm up.
+
+python benchmarks/bench_worker_pool.py shot010.ma --jobs 64 --workers 8
+python benchmarks/bench_worker_pool.py shot010.ma --args --layers input --start 1001 --end 1010
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import job_scheduler  # noqa: E402
+from techanim_flow import worker_pool  # noqa: E402
+
+
+def get_job_args(scene_path, extra_args, root, index):
+    """Batch arguments of one job, each with its own result
+
+    Returns:
+        list: arguments
+    """
+    result_path = os.path.join(root, "result_{}.json".format(index))
+    args = [scene_path] + (extra_args or ["--describe"])
+    return args + ["--json", result_path]
+
+
+def bench_cold(scene_path, extra_args, jobs, workers, root):
+    """A mayapy per job, at most workers at once
+
+    Returns:
+        dict: seconds and failures
+    """
+    env = job_scheduler.get_job_env()
+    pending = list(range(jobs))
+    running = []
+    failed = 0
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        while pending or running:
+            while pending and len(running) < workers:
+                args = get_job_args(scene_path, extra_args, root, pending.pop())
+                command = job_scheduler.get_batch_command(*args)
+                running.append(subprocess.Popen(command,
+                                                stdout=devnull,
+                                                stderr=subprocess.STDOUT,
+                                                env=env))
+            for proc in list(running):
+                if proc.poll() is not None:
+                    failed += proc.returncode != 0
+                    running.remove(proc)
+            time.sleep(0.05)
+    return {"seconds": time.time() - start, "failed": failed}
+
+
+def bench_warm(scene_path, extra_args, jobs, workers, root):
+    """Warm workers, started together with the clock running
+
+    Returns:
+        dict: seconds, failures and worker startup seconds
+    """
+    pending = list(range(jobs))
+    running = []
+    failed = 0
+    startups = []
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        pool = worker_pool.WorkerPool(workers,
+                                      mayapy=job_scheduler.get_mayapy(),
+                                      env=job_scheduler.get_job_env(),
+                                      max_jobs=0,
+                                      stderr=devnull)
+        with pool:
+            while pending or running:
+                while pending and pool.get_idle_count():
+                    index = pending.pop()
+                    args = get_job_args(scene_path, extra_args, root, index)
+                    log_path = os.path.join(root, "log_{}.txt".format(index))
+                    running.append(pool.submit("{}".format(index),
+                                               args,
+                                               log_path=log_path))
+                for job in list(running):
+                    if job.poll() is not None:
+                        failed += job.returncode != 0
+                        running.remove(job)
+                time.sleep(0.05)
+            startups = [x.ready_seconds for x in pool.workers
+                        if x.ready_seconds is not None]
+    return {"seconds": time.time() - start,
+            "failed": failed,
+            "startup": sum(startups) / max(len(startups), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scene")
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--args", nargs=argparse.REMAINDER, default=None,
+                        help="batch arguments of the job, after the scene")
+    options = parser.parse_args()
+    scene_path = os.path.abspath(options.scene)
+
+    root = tempfile.mkdtemp(prefix="bench_worker_pool_")
+    try:
+        row = "{:<6} {:>6} {:>8} {:>10} {:>11} {:>10} {:>7}"
+        print(row.format("mode", "jobs", "workers", "seconds", "jobs/hour",
+                         "startup s", "failed"))
+        cold = bench_cold(scene_path, options.args, options.jobs,
+                          options.workers, root)
+        print(row.format("cold", options.jobs, options.workers,
+                         "{:.1f}".format(cold["seconds"]),
+                         "{:.0f}".format(options.jobs / cold["seconds"] * 3600),
+                         "", cold["failed"]))
+        warm = bench_warm(scene_path, options.args, options.jobs,
+                          options.workers, root)
+        print(row.format("warm", options.jobs, options.workers,
+                         "{:.1f}".format(warm["seconds"]),
+                         "{:.0f}".format(options.jobs / warm["seconds"] * 3600),
+                         "{:.1f}".format(warm["startup"]), warm["failed"]))
+        print("warm is {:.1f}x cold".format(cold["seconds"] / warm["seconds"]))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
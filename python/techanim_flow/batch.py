@@ -0,0 +1,842 @@
+# -*- coding: utf-8 -*-
+"""Run techanim simulations without the UI, in mayapy.
+
+Opens a scene with maya.standalone, finds the techanim setups in it and
+caches the input layer and then the nCloth nodes of each one, the same as
+pressing the buttons in the manager. Results go to stdout and, if asked, a
+json file.
+
+mayapy -m techanim_flow.batch shot010.ma --start 1001 --end 1100 --json result.json
+mayapy -m techanim_flow.batch shot010.ma --setups char01_TA:techanim_setup --layers sim
+mayapy -m techanim_flow.batch shot010.ma --pipeline
+mayapy -m techanim_flow.batch shot010.ma --layers sim --set shirt_nClothShape.stretchResistance 40
+
+Attributes:
+    EXIT_FAILED (int): at least one setup failed to cache
+    EXIT_NO_SETUPS (int): no setups found, or some of the requested ones are
+    missing, the others are still cached
+    EXIT_OK (int): everything cached
+    EXIT_SCENE_ERROR (int): the scene could not be opened
+    LAYERS (list): what can be cached, in the order it is cached
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+
+# techanim
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_SCENE_ERROR = 2
+EXIT_NO_SETUPS = 3
+LAYER_INPUT = "input"
+LAYER_SIM = "sim"
+LAYERS = [LAYER_INPUT, LAYER_SIM]
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+
+# =============================================================================
+# maya
+# =============================================================================
+
+def initialize():
+    """Start maya.standalone, unless already inside a maya session
+    """
+    import maya.standalone
+    try:
+        maya.standalone.initialize(name="python")
+    except RuntimeError:
+        # already initialized, running from a maya session
+        pass
+
+
+def uninitialize():
+    """Shut maya.standalone down cleanly where the version supports it
+    """
+    import maya.standalone
+    if hasattr(maya.standalone, "uninitialize"):
+        maya.standalone.uninitialize()
+
+
+def open_scene(scene_path):
+    """Open the scene, missing references and plugins are not fatal, maya
+    raises for them even though the scene is open
+
+    Args:
+        scene_path (str): maya file
+
+    Returns:
+        str: the open scene, empty if it did not open
+    """
+    import maya.cmds as cmds
+    try:
+        cmds.file(scene_path, open=True, force=True)
+    except RuntimeError as e:
+        print("Opening {} reported: {}".format(scene_path, e))
+    open_path = cmds.file(q=True, sceneName=True) or ""
+    if os.path.normpath(open_path) != os.path.normpath(scene_path):
+        return ""
+    return open_path
+
+
+def save_scene(scene_path):
+    """Save the open scene with the caches attached under a new name
+
+    Args:
+        scene_path (str): .ma or .mb
+    """
+    import maya.cmds as cmds
+    file_type = "mayaBinary" if scene_path.endswith(".mb") else "mayaAscii"
+    cmds.file(rename=scene_path)
+    cmds.file(save=True, type=file_type, force=True)
+
+
+# =============================================================================
+# progress
+# =============================================================================
+
+class ProgressFile(object):
+    """Write the frame Maya is on to a json file while caching, for whoever
+    started the batch to show progress. Written at most every interval
+    seconds, the same way as the result so a reader never sees half of it.
+
+    with ProgressFile(progress_path, "char01_TA:techanim_setup", 991, 1110):
+        cache_setup(setup, 1001, 1100, preroll=10, postroll=10)
+
+    Attributes:
+        file_path (str): json, nothing is written if None
+    """
+
+    def __init__(self, file_path, setup, start_frame, end_frame, interval=0.5):
+        self.file_path = file_path
+        self.setup = setup
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.interval = interval
+        self._callback = None
+        self._last_write = 0
+
+    def __enter__(self):
+        if self.file_path:
+            import maya.api.OpenMaya as om
+            self._callback = om.MDGMessage.addTimeChangeCallback(
+                self._time_changed)
+            self.write(self.start_frame)
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if self._callback is not None:
+            import maya.api.OpenMaya as om
+            om.MMessage.removeCallback(self._callback)
+            self._callback = None
+        if self.file_path and exc_type is None:
+            self.write(self.end_frame)
+
+    def _time_changed(self, maya_time, *args):
+        if time.time() - self._last_write >= self.interval:
+            self.write(maya_time.value)
+
+    def write(self, frame):
+        """Write the progress file now
+
+        Args:
+            frame (float): frame being cached
+        """
+        data = {"setup": self.setup,
+                "frame": frame,
+                "frame_range": [self.start_frame, self.end_frame],
+                "updated": time.time()}
+        write_result(data, self.file_path)
+        self._last_write = time.time()
+
+
+# =============================================================================
+# simulation
+# =============================================================================
+
+def cache_setup(setup,
+                start_frame,
+                end_frame,
+                preroll=0,
+                postroll=0,
+                layers=None,
+                nodes=None,
+                cache_dir=None,
+                use_store=None,
+                checkpoint_every=0,
+                input_shards=None,
+                sim_chunks=None,
+                chunk_overlap=None,
+                chunk_warmup=None,
+                partition=False,
+                colliders=None,
+                stream=None,
+                pipeline=False,
+                presets=None,
+                attrs=None):
+    """Cache the layers of a setup, stopping at the first layer that fails
+
+    Args:
+        setup (TechAnim_Setup): to cache
+        start_frame (int): first frame of the shot, preroll is added before
+        end_frame (int): last frame of the shot, postroll is added after
+        preroll (int, optional): frames simulated before the start
+        postroll (int, optional): frames simulated after the end
+        layers (list, optional): see LAYERS, defaults to all
+        nodes (list, optional): nCloth names without namespace, defaults to
+        every nCloth in the sim layer
+        cache_dir (str, optional): defaults to the setup cache dir
+        use_store (bool, optional): defaults to the config
+        checkpoint_every (int, optional): frames per checkpoint, 0 is off
+        input_shards (int, optional): mayapy processes caching the input
+        layer, defaults to the config
+        sim_chunks (int, optional): mayapy processes simulating pieces of
+        the range, defaults to the config
+        chunk_overlap (int, optional): frames crossfaded at each seam
+        chunk_warmup (int, optional): frames each chunk settles for
+        partition (bool, optional): split the nCloth into groups that never
+        touch once the input layer is cached, see get_partition_groups
+        colliders (list, optional): nRigid names without namespace, when
+        given the nodes simulate alone with only these colliding
+        stream (str, optional): frame ring path, the input layer is streamed
+        into it, or the nCloth simulated from it, see frame_ring
+        pipeline (bool, optional): cache both layers at once in two more
+        mayapy processes, the input layer streamed to the simulation
+        presets (list, optional): of [node, preset path] applied before
+        simulating, node without namespace
+        attrs (list, optional): of [node.attr, value] set before simulating
+
+    Returns:
+        dict: status, timings and caches per layer
+    """
+    import maya.cmds as cmds
+    from techanim_flow import techanim_creator_utils
+    layers = layers or LAYERS
+    pipelined = False
+    total_start = start_frame - preroll
+    total_end = end_frame + postroll
+    result = {"setup": setup.root_node,
+              "target_namespace": setup.target_namespace,
+              "frame_range": [total_start, total_end],
+              "status": STATUS_OK,
+              "layers": {}}
+
+    for layer in LAYERS:
+        if layer not in layers or result["status"] != STATUS_OK:
+            result["layers"][layer] = {"status": STATUS_SKIPPED}
+            continue
+        layer_result = {"status": STATUS_OK}
+        layer_start = time.time()
+        try:
+            if layer == LAYER_INPUT:
+                if stream:
+                    setup.stream_input_layer(total_start,
+                                             total_end,
+                                             stream,
+                                             cache_dir=cache_dir,
+                                             preroll=preroll,
+                                             postroll=postroll)
+                elif pipeline and LAYER_SIM in layers:
+                    setup.cache_pipelined(total_start,
+                                          total_end,
+                                          nodes=get_sim_layer_nodes(setup,
+                                                                    nodes),
+                                          cache_dir=cache_dir,
+                                          preroll=preroll,
+                                          postroll=postroll)
+                    pipelined = True
+                else:
+                    setup.cache_input_layer(total_start,
+                                            total_end,
+                                            cache_dir=cache_dir,
+                                            use_store=use_store,
+                                            preroll=preroll,
+                                            postroll=postroll,
+                                            shards=input_shards)
+                if not setup.is_input_layer_cached():
+                    raise RuntimeError("The input layer did not get cached.")
+                input_nodes = setup.get_layer_nodes_info([setup.input_layer])
+                layer_nodes = input_nodes.values()[0]
+                if partition:
+                    layer_result["partition"] = get_partition_groups(setup)
+            else:
+                layer_nodes = get_sim_layer_nodes(setup, nodes)
+                if not layer_nodes:
+                    raise RuntimeError("No nCloth nodes to cache.")
+                # nuclei solving none of the nodes, in this setup or any
+                # other, would only slow it down
+                busy_nuclei = [nucleus for nucleus, ncloth_nodes
+                               in setup.get_nucleus_ncloth_nodes().items()
+                               if set(ncloth_nodes) & set(layer_nodes)]
+                idle_nuclei = [x for x in cmds.ls(type="nucleus")
+                               if x not in busy_nuclei]
+                if idle_nuclei:
+                    setup.toggle_nuclei(nuclei=idle_nuclei, value=0)
+                isolate_state = {}
+                wedge_state = {}
+                nuclei_frames = setup.get_start_nuclei_frames()
+                setup.set_start_nuclei_frame(total_start)
+                try:
+                    if presets or attrs:
+                        wedge_state = setup.apply_wedge(presets, attrs)
+                    if colliders is not None:
+                        rigid_nodes = [
+                            x for rigids in setup.get_nucleus_colliders().values()
+                            for x in rigids
+                            if techanim_creator_utils.removeNS(x) in colliders]
+                        isolate_state = setup.isolate_sim_nodes(layer_nodes,
+                                                                rigid_nodes)
+                    if pipelined:
+                        # simulated along with the input layer
+                        layer_result["pipelined"] = True
+                    elif stream:
+                        setup.cache_sim_nodes_streamed(layer_nodes,
+                                                       total_start,
+                                                       total_end,
+                                                       stream,
+                                                       cache_dir=cache_dir,
+                                                       preroll=preroll,
+                                                       postroll=postroll)
+                    elif checkpoint_every:
+                        setup.cache_sim_nodes_checkpointed(
+                            layer_nodes,
+                            total_start,
+                            total_end,
+                            checkpoint_every=checkpoint_every,
+                            cache_dir=cache_dir,
+                            preroll=preroll,
+                            postroll=postroll)
+                    else:
+                        setup.cache_sim_nodes(layer_nodes,
+                                              total_start,
+                                              total_end,
+                                              cache_dir=cache_dir,
+                                              use_store=use_store,
+                                              preroll=preroll,
+                                              postroll=postroll,
+                                              chunks=sim_chunks,
+                                              chunk_overlap=chunk_overlap,
+                                              chunk_warmup=chunk_warmup)
+                finally:
+                    setup.restore_start_nuclei_frames(nuclei_frames)
+                    setup.set_sim_state_attrs(isolate_state)
+                    setup.set_sim_state_attrs(wedge_state)
+                    if idle_nuclei:
+                        setup.toggle_nuclei(nuclei=idle_nuclei, value=1)
+                missing = [x for x in layer_nodes
+                           if not setup.is_node_cached([x])]
+                if missing:
+                    msg = "No cache was made for {}".format(missing)
+                    raise RuntimeError(msg)
+            layer_result["caches"] = setup.get_cached_xml_paths(layer_nodes)
+        except Exception as e:
+            layer_result["status"] = STATUS_FAILED
+            layer_result["error"] = "{}: {}".format(type(e).__name__, e)
+            layer_result["traceback"] = traceback.format_exc()
+            result["status"] = STATUS_FAILED
+        layer_result["seconds"] = round(time.time() - layer_start, 3)
+        result["layers"][layer] = layer_result
+    return result
+
+
+def get_sim_layer_nodes(setup, nodes=None):
+    """nCloth of the sim layer to cache
+
+    Args:
+        setup (TechAnim_Setup): setup
+        nodes (list, optional): names without namespace, defaults to all
+
+    Returns:
+        list: of nCloth transforms
+    """
+    from techanim_flow import techanim_creator_utils
+    layer_nodes = setup.get_ncloth_nodes()
+    if nodes:
+        layer_nodes = [x for x in layer_nodes
+                       if techanim_creator_utils.removeNS(x) in nodes]
+    return layer_nodes
+
+
+def get_partition_groups(setup):
+    """Groups of nCloth that never touch, for a job each. Cloths and
+    colliders are without namespace like --nodes and --colliders take them.
+
+    Args:
+        setup (TechAnim_Setup): with its input layer cached
+
+    Returns:
+        list: of dicts, nucleus, cloths and colliders
+    """
+    from techanim_flow import techanim_creator_utils
+    groups = []
+    for nucleus, partition_info in sorted(setup.get_partition().items()):
+        for group in partition_info["groups"]:
+            groups.append({
+                "nucleus": nucleus,
+                "cloths": [techanim_creator_utils.removeNS(x)
+                           for x in group["cloths"]],
+                "colliders": [techanim_creator_utils.removeNS(x)
+                              for x in group["colliders"]]})
+    return groups
+
+
+def run_batch(scene_path,
+              setups=None,
+              start_frame=None,
+              end_frame=None,
+              preroll=None,
+              postroll=None,
+              layers=None,
+              nodes=None,
+              cache_dir=None,
+              use_store=None,
+              checkpoint_every=0,
+              input_shards=None,
+              sim_chunks=None,
+              chunk_overlap=None,
+              chunk_warmup=None,
+              partition=False,
+              colliders=None,
+              stream=None,
+              pipeline=False,
+              save_as=None,
+              progress_path=None,
+              presets=None,
+              attrs=None):
+    """Open a scene and cache its setups. Maya has to be initialized.
+
+    Args:
+        scene_path (str): maya file
+        setups (list, optional): setup roots, defaults to every setup
+        start_frame (int, optional): defaults to the playback start
+        end_frame (int, optional): defaults to the playback end
+        preroll (int, optional): defaults to the config
+        postroll (int, optional): defaults to the config
+        layers (list, optional): see LAYERS, defaults to all
+        nodes (list, optional): nCloth names without namespace
+        cache_dir (str, optional): defaults to each setup cache dir
+        use_store (bool, optional): defaults to the config
+        checkpoint_every (int, optional): frames per checkpoint, 0 is off
+        input_shards (int, optional): mayapy processes caching the input
+        layer, defaults to the config
+        sim_chunks (int, optional): mayapy processes simulating pieces of
+        the range, defaults to the config
+        chunk_overlap (int, optional): frames crossfaded at each seam
+        chunk_warmup (int, optional): frames each chunk settles for
+        partition (bool, optional): report groups of nCloth that never touch
+        colliders (list, optional): nRigid names without namespace, the
+        nodes simulate alone with only these colliding
+        stream (str, optional): frame ring path, see cache_setup
+        pipeline (bool, optional): both layers at once, see cache_setup
+        save_as (str, optional): save the scene with the caches attached
+        progress_path (str, optional): json the frame being cached is
+        written to, see ProgressFile
+        presets (list, optional): of [node, preset path], see cache_setup
+        attrs (list, optional): of [node.attr, value], see cache_setup
+
+    Returns:
+        dict: result with an exit_code
+    """
+    import maya.cmds as cmds
+    from techanim_flow import techanim_manager_utils
+
+    result = {"scene": scene_path,
+              "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "setups": []}
+    start = time.time()
+    if not open_scene(scene_path):
+        result["error"] = "Could not open {}".format(scene_path)
+        result["exit_code"] = EXIT_SCENE_ERROR
+        return result
+
+    if start_frame is None:
+        start_frame = int(cmds.playbackOptions(q=True, min=True))
+    if end_frame is None:
+        end_frame = int(cmds.playbackOptions(q=True, max=True))
+    if preroll is None:
+        preroll = config_io.CONFIG.get("preroll", 0)
+    if postroll is None:
+        postroll = config_io.CONFIG.get("postroll", 0)
+    result["frame_range"] = [start_frame, end_frame]
+    result["preroll"] = preroll
+    result["postroll"] = postroll
+
+    setup_roots = techanim_manager_utils.get_all_setups_roots()
+    missing = []
+    if setups:
+        missing = [x for x in setups if x not in setup_roots]
+        if missing:
+            result["error"] = "Setups not in the scene: {}".format(missing)
+        setup_roots = [x for x in setup_roots if x in setups]
+    if not setup_roots:
+        result.setdefault("error", "No techanim setups found.")
+        result["exit_code"] = EXIT_NO_SETUPS
+        return result
+
+    for setup_root in setup_roots:
+        print("Caching {}".format(setup_root))
+        try:
+            setup = techanim_manager_utils.TechAnim_Setup(setup_root)
+        except Exception as e:
+            result["setups"].append({"setup": setup_root,
+                                     "status": STATUS_FAILED,
+                                     "error": "{}: {}".format(type(e).__name__, e),
+                                     "traceback": traceback.format_exc()})
+            continue
+        progress = ProgressFile(progress_path,
+                                setup_root,
+                                start_frame - preroll,
+                                end_frame + postroll)
+        with progress:
+            setup_result = cache_setup(setup,
+                                       start_frame,
+                                       end_frame,
+                                       preroll=preroll,
+                                       postroll=postroll,
+                                       layers=layers,
+                                       nodes=nodes,
+                                       cache_dir=cache_dir,
+                                       use_store=use_store,
+                                       checkpoint_every=checkpoint_every,
+                                       input_shards=input_shards,
+                                       sim_chunks=sim_chunks,
+                                       chunk_overlap=chunk_overlap,
+                                       chunk_warmup=chunk_warmup,
+                                       partition=partition,
+                                       colliders=colliders,
+                                       stream=stream,
+                                       pipeline=pipeline,
+                                       presets=presets,
+                                       attrs=attrs)
+        print("{}: {}".format(setup_root, setup_result["status"]))
+        result["setups"].append(setup_result)
+
+    failed = [x for x in result["setups"] if x["status"] != STATUS_OK]
+    if save_as and not failed and not missing:
+        save_scene(save_as)
+        result["saved_as"] = save_as
+    result["seconds"] = round(time.time() - start, 3)
+    if failed:
+        result["exit_code"] = EXIT_FAILED
+    elif missing:
+        # whoever asked for them expects their caches
+        result["exit_code"] = EXIT_NO_SETUPS
+    else:
+        result["exit_code"] = EXIT_OK
+    return result
+
+
+def describe_scene(scene_path):
+    """Open a scene and list its setups, the nCloth of every nucleus and
+    their vertex counts, what a scheduler needs to split a shot into jobs
+    and guess their memory. Maya has to be initialized.
+
+    Args:
+        scene_path (str): maya file
+
+    Returns:
+        dict: result with an exit_code
+    """
+    import maya.cmds as cmds
+    from techanim_flow import techanim_creator_utils
+    from techanim_flow import techanim_manager_utils
+
+    result = {"scene": scene_path, "setups": {}}
+    if not open_scene(scene_path):
+        result["error"] = "Could not open {}".format(scene_path)
+        result["exit_code"] = EXIT_SCENE_ERROR
+        return result
+    result["frame_range"] = [int(cmds.playbackOptions(q=True, min=True)),
+                             int(cmds.playbackOptions(q=True, max=True))]
+    for setup_root in techanim_manager_utils.get_all_setups_roots():
+        setup = techanim_manager_utils.TechAnim_Setup(setup_root)
+        nuclei = {}
+        vertices = {}
+        for nucleus, nodes in setup.get_nucleus_ncloth_nodes().items():
+            nuclei[nucleus] = [techanim_creator_utils.removeNS(x)
+                               for x in nodes]
+            for node in nodes:
+                node_name = techanim_creator_utils.removeNS(node)
+                vertices[node_name] = cmds.polyEvaluate(node, vertex=True)
+        # the input layer deforms every mesh of the techanim_nodes info
+        input_nodes = setup.techanim_info.get(
+            techanim_creator_utils.RENDER_INPUT_KEY, {}).values()
+        input_vertices = sum([cmds.polyEvaluate(x, vertex=True)
+                              for x in input_nodes if cmds.objExists(x)])
+        result["setups"][setup_root] = {
+            "target_namespace": setup.target_namespace,
+            "nuclei": nuclei,
+            "vertices": vertices,
+            "input_vertices": input_vertices}
+    if result["setups"]:
+        result["exit_code"] = EXIT_OK
+    else:
+        result["error"] = "No techanim setups found."
+        result["exit_code"] = EXIT_NO_SETUPS
+    return result
+
+
+def attach_results(scene_path, result_paths, save_as=None):
+    """Open a scene and attach the caches listed in batch results, to bring
+    caches made by separate processes into one scene, replacing the caches
+    the nodes already had. Maya has to be initialized.
+
+    Args:
+        scene_path (str): maya file
+        result_paths (list): batch result jsons
+        save_as (str, optional): save the scene with the caches attached
+
+    Returns:
+        dict: result with an exit_code
+    """
+    from techanim_flow import techanim_manager_utils
+
+    result = {"scene": scene_path, "attached": {}}
+    if not open_scene(scene_path):
+        result["error"] = "Could not open {}".format(scene_path)
+        result["exit_code"] = EXIT_SCENE_ERROR
+        return result
+    setup_roots = techanim_manager_utils.get_all_setups_roots()
+    failed = []
+    for result_path in result_paths:
+        with open(result_path, "r") as f:
+            batch_result = json.load(f)
+        for setup_result in batch_result.get("setups", []):
+            setup_root = setup_result["setup"]
+            if setup_root not in setup_roots:
+                failed.append(setup_root)
+                continue
+            setup = techanim_manager_utils.TechAnim_Setup(setup_root)
+            attached = result["attached"].setdefault(setup_root, [])
+            for layer in LAYERS:
+                layer_result = setup_result.get("layers", {}).get(layer, {})
+                caches = layer_result.get("caches", {})
+                if not caches:
+                    continue
+                # caches of an earlier run in the scene make way for these
+                if layer == LAYER_INPUT:
+                    setup.delete_input_layer_cache()
+                else:
+                    setup.delete_sim_cache(list(caches.keys()))
+                for node, xml_paths in caches.items():
+                    for xml_path in xml_paths:
+                        setup.attach_cache(xml_path, node)
+                        attached.append(xml_path)
+    if failed:
+        result["error"] = "Setups not in the scene: {}".format(failed)
+        result["exit_code"] = EXIT_FAILED
+        return result
+    if save_as:
+        save_scene(save_as)
+        result["saved_as"] = save_as
+    result["exit_code"] = EXIT_OK
+    return result
+
+
+def write_result(result, file_path):
+    """Write the result json, next to the destination then moved in place
+
+    Args:
+        result (dict): from run_batch
+        file_path (str): output path
+    """
+    config_io.write_json(result, file_path)
+
+
+def get_peak_memory():
+    """Peak resident memory of this process so far, for the scheduler to
+    learn what its jobs need. A warm worker's covers every job it ran.
+
+    Returns:
+        float: MB, None where the system does not tell
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac, kilobytes everywhere else
+    if sys.platform == "darwin":
+        return round(peak / 1024 ** 2, 1)
+    return round(peak / 1024, 1)
+
+
+def parse_attr_value(value):
+    """Value of a --set from the command line, json so ints, bools, lists
+    for compound attrs and quoted strings come through as such. Anything
+    that is not json is taken as a string.
+
+    Args:
+        value (str): as typed
+
+    Returns:
+        object: value to set
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def get_parser():
+    """Arguments of the command line, shared with anything that builds
+    batch command lines
+
+    Returns:
+        argparse.ArgumentParser: parser
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("scene", help="maya scene to simulate")
+    parser.add_argument("--setups", nargs="+", default=None,
+                        help="setup roots, defaults to all in the scene")
+    parser.add_argument("--start", type=int, default=None,
+                        help="defaults to the playback start")
+    parser.add_argument("--end", type=int, default=None,
+                        help="defaults to the playback end")
+    parser.add_argument("--preroll", type=int, default=None)
+    parser.add_argument("--postroll", type=int, default=None)
+    parser.add_argument("--layers", nargs="+", choices=LAYERS, default=LAYERS)
+    parser.add_argument("--nodes", nargs="+", default=None,
+                        help="nCloth names without namespace, default all")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--checkpoint-every", type=int,
+                        default=config_io.CONFIG.get("checkpoint_every", 0),
+                        help="frames per sim checkpoint, 0 is off, defaults "
+                        "to the config")
+    parser.add_argument("--input-shards", type=int, default=None,
+                        help="mayapy processes caching the input layer")
+    parser.add_argument("--sim-chunks", type=int, default=None,
+                        help="mayapy processes simulating pieces of the range")
+    parser.add_argument("--chunk-overlap", type=int, default=None)
+    parser.add_argument("--chunk-warmup", type=int, default=None)
+    parser.add_argument("--partition", action="store_true",
+                        help="report groups of nCloth that never touch")
+    parser.add_argument("--colliders", nargs="*", default=None,
+                        help="simulate --nodes alone, only these nRigid collide")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="cache the input layer and simulate at once")
+    parser.add_argument("--preset", dest="presets", nargs=2, action="append",
+                        default=None, metavar=("NODE", "PRESET"),
+                        help="apply a preset_share preset before simulating")
+    parser.add_argument("--set", dest="attrs", nargs=2, action="append",
+                        default=None, metavar=("NODE.ATTR", "VALUE"),
+                        help="set an attribute before simulating, the "
+                        "value is json: 40, true, [0, 1, 0] or text")
+    parser.add_argument("--stream", default=None,
+                        help="frame ring, stream the input layer to it with "
+                        "--layers input, simulate from it with --layers sim")
+    store_group = parser.add_mutually_exclusive_group()
+    store_group.add_argument("--store", dest="use_store",
+                             action="store_true", default=None)
+    store_group.add_argument("--no-store", dest="use_store",
+                             action="store_false")
+    parser.add_argument("--save-as", default=None,
+                        help="save the scene with the caches attached")
+    parser.add_argument("--json", dest="json_path", default=None)
+    parser.add_argument("--progress", default=None,
+                        help="json updated with the frame being cached")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--describe", action="store_true",
+                            help="only list the setups and nuclei")
+    mode_group.add_argument("--attach", nargs="+", default=None,
+                            metavar="RESULT",
+                            help="attach the caches of batch result jsons")
+    return parser
+
+
+def run_args(args=None):
+    """Run a batch command line in this process, Maya has to be initialized.
+    Warm workers run one after another without starting Maya again.
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: see the EXIT_ constants
+    """
+    parser = get_parser()
+    options = parser.parse_args(args)
+    if options.stream and len(options.layers) != 1:
+        parser.error("--stream needs one of --layers input or --layers sim")
+    scene_path = os.path.abspath(options.scene)
+    try:
+        if options.describe:
+            result = describe_scene(scene_path)
+        elif options.attach:
+            result = attach_results(scene_path,
+                                    options.attach,
+                                    save_as=options.save_as)
+        else:
+            result = run_batch(scene_path,
+                               setups=options.setups,
+                               start_frame=options.start,
+                               end_frame=options.end,
+                               preroll=options.preroll,
+                               postroll=options.postroll,
+                               layers=options.layers,
+                               nodes=options.nodes,
+                               cache_dir=options.cache_dir,
+                               use_store=options.use_store,
+                               checkpoint_every=options.checkpoint_every,
+                               input_shards=options.input_shards,
+                               sim_chunks=options.sim_chunks,
+                               chunk_overlap=options.chunk_overlap,
+                               chunk_warmup=options.chunk_warmup,
+                               partition=options.partition,
+                               colliders=options.colliders,
+                               stream=options.stream,
+                               pipeline=options.pipeline,
+                               save_as=options.save_as,
+                               progress_path=options.progress,
+                               presets=options.presets,
+                               attrs=[[plug, parse_attr_value(value)]
+                                      for plug, value in options.attrs or []])
+    except Exception as e:
+        result = {"scene": options.scene,
+                  "error": "{}: {}".format(type(e).__name__, e),
+                  "traceback": traceback.format_exc(),
+                  "exit_code": EXIT_FAILED}
+    result["peak_memory_mb"] = get_peak_memory()
+    if options.json_path:
+        write_result(result, options.json_path)
+    if result.get("error"):
+        print(result["error"])
+    print("Exit code {}".format(result["exit_code"]))
+    return result["exit_code"]
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: see the EXIT_ constants
+    """
+    # bad arguments exit before paying for maya
+    get_parser().parse_args(args)
+    initialize()
+    exit_code = run_args(args)
+    uninitialize()
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,719 @@
+# -*- coding: utf-8 -*-
+"""Lossy, error bounded archival codec for techanim caches, without Maya.
+
+Points are quantized to a grid of twice the tolerance, so no point is ever
+further than the tolerance from its original position (plus the float32
+rounding of the decoded value). Per frame the quantized offsets from a rest
+pose, or from the previous frame, are stored as the smallest integer type
+that fits, byte shuffled and entropy coded. Offsets from the previous frame
+are taken between quantized frames, errors never accumulate.
+
+Frames are stored in blocks so decoding is a few vectorized numpy calls per
+block, fast enough to rebuild an mcx when it is needed again.
+
+python -m techanim_flow.cache_codec encode shirtShape.xml -o /archive -t 0.01
+python -m techanim_flow.cache_codec decode /archive/shirtShape.tacc -o /caches
+
+Attributes:
+    ARCHIVE_EXT (str): extension of an encoded cache
+    ARCHIVE_VERSION (int): bumped when the layout changes
+    COMPRESSORS (dict): name: (compress, decompress)
+    DEFAULT_BLOCK_SIZE (int): frames per block
+    DEFAULT_TOLERANCE (float): max error in scene units, 0.01 is 0.1mm in cm
+    MODE_PREVIOUS (str): offsets from the previous frame, best for cloth
+    MODE_REST (str): offsets from the rest pose, every frame stands alone
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import bz2
+import glob
+import json
+import zlib
+import struct
+import argparse
+
+import numpy as np
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+ARCHIVE_EXT = ".tacc"
+ARCHIVE_VERSION = 1
+DEFAULT_TOLERANCE = 0.01
+DEFAULT_BLOCK_SIZE = 64
+MODE_REST = "rest"
+MODE_PREVIOUS = "previous"
+MODES = [MODE_PREVIOUS, MODE_REST]
+COMPRESSORS = {"zlib": (zlib.compress, zlib.decompress),
+               "bz2": (bz2.compress, bz2.decompress)}
+try:
+    import lzma
+    COMPRESSORS["lzma"] = (lzma.compress, lzma.decompress)
+except ImportError:
+    pass
+
+_MAGIC = b"TACC"
+_FOOTER_FMT = "<Q"
+_ONE = np.uint64(1)
+_UINT_DTYPES = ["<u1", "<u2", "<u4", "<u8"]
+
+
+# =============================================================================
+# integer packing
+# =============================================================================
+
+def _zigzag(values):
+    """Signed to unsigned so small negative numbers stay small
+
+    Args:
+        values (numpy.ndarray): int64
+
+    Returns:
+        numpy.ndarray: uint64
+    """
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def _unzigzag(values):
+    """Inverse of _zigzag
+
+    Args:
+        values (numpy.ndarray): uint64
+
+    Returns:
+        numpy.ndarray: int64
+    """
+    return ((values >> _ONE) ^ (np.uint64(0) - (values & _ONE))).view(np.int64)
+
+
+def _shuffle(values):
+    """Group the bytes of every element by significance, the high bytes of
+    small offsets are mostly zero and compress to nothing
+
+    Args:
+        values (numpy.ndarray): any contiguous array
+
+    Returns:
+        bytes: shuffled
+    """
+    values = np.ascontiguousarray(values).reshape(-1)
+    raw = values.view(np.uint8).reshape(-1, values.dtype.itemsize)
+    return raw.T.tobytes()
+
+
+def _unshuffle(data, dtype):
+    """Inverse of _shuffle
+
+    Args:
+        data (bytes): shuffled
+        dtype (str): numpy dtype of the elements
+
+    Returns:
+        numpy.ndarray: flat
+    """
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not raw.size:
+        return np.zeros(0, dtype=dtype)
+    raw = raw.reshape(dtype.itemsize, -1).T
+    return np.ascontiguousarray(raw).view(dtype).reshape(-1)
+
+
+def _pack_ints(values):
+    """Zigzag into the smallest unsigned type that holds every value
+
+    Args:
+        values (numpy.ndarray): int64
+
+    Returns:
+        tuple: shuffled bytes, dtype str
+    """
+    values = _zigzag(np.ascontiguousarray(values, dtype=np.int64))
+    top = int(values.max()) if values.size else 0
+    for dtype in _UINT_DTYPES:
+        if top <= np.iinfo(dtype).max:
+            return _shuffle(values.astype(dtype)), dtype
+
+
+def _unpack_ints(data, dtype):
+    """Inverse of _pack_ints
+
+    Args:
+        data (bytes): shuffled
+        dtype (str): unsigned dtype it was packed as
+
+    Returns:
+        numpy.ndarray: flat int64
+    """
+    return _unzigzag(_unshuffle(data, dtype).astype(np.uint64))
+
+
+# =============================================================================
+# writing
+# =============================================================================
+
+class _BlobWriter(object):
+
+    """Append compressed blobs to the archive, remembering where they are
+    """
+
+    def __init__(self, f, compression):
+        super(_BlobWriter, self).__init__()
+        self.f = f
+        self.compress = COMPRESSORS[compression][0]
+
+    def write(self, data):
+        """Compress and append
+
+        Args:
+            data (bytes): raw
+
+        Returns:
+            list: offset, compressed length, raw length
+        """
+        compressed = self.compress(data)
+        offset = self.f.tell()
+        self.f.write(compressed)
+        return [offset, len(compressed), len(data)]
+
+
+def _encode_block(blobs, frames, reference, step, mode, dtype):
+    """Encode consecutive frames of a channel
+
+    Args:
+        blobs (_BlobWriter): archive
+        frames (list): of arrays
+        reference (numpy.ndarray): quantized rest, None when unusable
+        step (float): quantization step
+        mode (str): MODE_REST or MODE_PREVIOUS
+        dtype (str): decoded dtype
+
+    Returns:
+        dict: block info
+    """
+    shapes = [list(x.shape) for x in frames]
+    quantizable = (reference is not None and
+                   all(x == list(reference.shape) for x in shapes))
+    if quantizable:
+        values = np.stack([np.asarray(x, dtype=np.float64) for x in frames])
+        limit = np.iinfo(np.int64).max // 4 * step
+        quantizable = (np.isfinite(values).all() and
+                       float(np.abs(values).max()) < limit)
+    if not quantizable:
+        # NaNs, changing topology or absurd values are stored as they are
+        raw = np.concatenate([np.asarray(x, dtype=dtype).reshape(-1)
+                              for x in frames])
+        return {"encoding": "raw",
+                "frames": len(frames),
+                "shapes": shapes,
+                "data": blobs.write(_shuffle(raw))}
+
+    quantized = np.round(values / step).astype(np.int64)
+    if mode == MODE_PREVIOUS:
+        offsets = np.empty_like(quantized)
+        offsets[0] = quantized[0] - reference
+        offsets[1:] = quantized[1:] - quantized[:-1]
+    else:
+        offsets = quantized - reference
+    data, int_dtype = _pack_ints(offsets)
+    return {"encoding": "quantized",
+            "frames": len(frames),
+            "int_dtype": int_dtype,
+            "data": blobs.write(data)}
+
+
+def encode_cache(xml_path,
+                 archive_path=None,
+                 tolerance=DEFAULT_TOLERANCE,
+                 mode=MODE_PREVIOUS,
+                 block_size=DEFAULT_BLOCK_SIZE,
+                 compression="zlib",
+                 rest_points=None):
+    """Encode a cache into a single archive file
+
+    Args:
+        xml_path (str): cache description
+        archive_path (str, optional): defaults to <xml name>.tacc next to it
+        tolerance (float, optional): max error per component, scene units
+        mode (str, optional): MODE_PREVIOUS or MODE_REST
+        block_size (int, optional): frames per block
+        compression (str, optional): see COMPRESSORS
+        rest_points (dict, optional): channel: rest pose array, defaults to
+        the first frame of the channel
+
+    Returns:
+        str: path to the archive
+
+    Raises:
+        ValueError: on a bad tolerance, mode or compression
+    """
+    if tolerance <= 0:
+        raise ValueError("Tolerance has to be above 0: {}".format(tolerance))
+    if mode not in MODES:
+        raise ValueError("Unknown mode {}, use one of {}".format(mode, MODES))
+    if compression not in COMPRESSORS:
+        msg = "Unknown compression {}, use one of {}"
+        raise ValueError(msg.format(compression, sorted(COMPRESSORS)))
+    if not archive_path:
+        archive_path = "{}{}".format(os.path.splitext(xml_path)[0],
+                                     ARCHIVE_EXT)
+    rest_points = rest_points or {}
+    step = 2.0 * tolerance
+    block_size = max(int(block_size), 1)
+
+    reader = cache_io.CacheReader(xml_path)
+    desc = reader.description
+    times = reader.times
+    header = {"version": ARCHIVE_VERSION,
+              "tolerance": tolerance,
+              "step": step,
+              "mode": mode,
+              "compression": compression,
+              "block_size": block_size,
+              "base_name": desc.base_name,
+              "cache_type": desc.cache_type,
+              "cache_format": desc.cache_format,
+              "time_per_frame": desc.time_per_frame,
+              "times": times,
+              "channels": []}
+
+    temp_path = config_io.get_temp_path(archive_path)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(_MAGIC)
+            blobs = _BlobWriter(f, compression)
+            for channel_desc in desc.channels:
+                channel = channel_desc["ChannelName"]
+                first = reader.get_time(times[0], channel) if times else None
+                dtype = first.dtype.newbyteorder("<").str if times else "<f4"
+                rest = rest_points.get(channel, first)
+                reference = None
+                reference_blob = None
+                if rest is not None:
+                    rest = np.asarray(rest, dtype=np.float64)
+                    if np.isfinite(rest).all():
+                        reference = np.round(rest / step).astype(np.int64)
+                        data, int_dtype = _pack_ints(reference)
+                        reference_blob = [blobs.write(data), int_dtype]
+                channel_header = {
+                    "name": channel,
+                    "info": dict((k, v) for k, v in channel_desc.items()
+                                 if k in ["ChannelType",
+                                          "ChannelInterpretation"]),
+                    "dtype": dtype,
+                    "shape": list(reference.shape) if reference is not None
+                    else None,
+                    "reference": reference_blob,
+                    "blocks": []}
+                for block_start in range(0, len(times), block_size):
+                    block_times = times[block_start:block_start + block_size]
+                    frames = [reader.get_time(x, channel) for x in block_times]
+                    channel_header["blocks"].append(
+                        _encode_block(blobs, frames, reference, step, mode,
+                                      dtype))
+                header["channels"].append(channel_header)
+
+            header_offset = f.tell()
+            f.write(json.dumps(header).encode("utf-8"))
+            f.write(struct.pack(_FOOTER_FMT, header_offset))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        reader.close()
+    config_io.replace_file(temp_path, archive_path)
+    return archive_path
+
+
+# =============================================================================
+# reading
+# =============================================================================
+
+class ArchiveReader(object):
+
+    """Decode an archive block by block. The last decoded block of every
+    channel is kept, reading frames in order decodes every block once.
+
+    with ArchiveReader("/archive/shirtShape.tacc") as reader:
+        points = reader.get_frame(1001)
+
+    Attributes:
+        archive_path (str): path to the archive
+        header (dict): layout and description of the encoded cache
+    """
+
+    def __init__(self, archive_path):
+        super(ArchiveReader, self).__init__()
+        self.archive_path = archive_path
+        self._file = open(archive_path, "rb")
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            self._file.close()
+            msg = "{} is not a techanim cache archive.".format(archive_path)
+            raise cache_io.CacheFormatError(msg)
+        footer_size = struct.calcsize(_FOOTER_FMT)
+        self._file.seek(-footer_size, os.SEEK_END)
+        footer_offset = self._file.tell()
+        header_offset = struct.unpack(_FOOTER_FMT,
+                                      self._file.read(footer_size))[0]
+        self._file.seek(header_offset)
+        header_data = self._file.read(footer_offset - header_offset)
+        self.header = json.loads(header_data.decode("utf-8"))
+        if self.header["version"] > ARCHIVE_VERSION:
+            msg = "{} is archive version {}, this reads up to {}"
+            raise cache_io.CacheFormatError(msg.format(archive_path,
+                                                       self.header["version"],
+                                                       ARCHIVE_VERSION))
+        self._decompress = COMPRESSORS[self.header["compression"]][1]
+        self._channels = dict((x["name"], x) for x in self.header["channels"])
+        self._time_index = dict((x, i) for i, x in enumerate(self.times))
+        self._references = {}
+        self._blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.archive_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._blocks = {}
+
+    @property
+    def times(self):
+        return self.header["times"]
+
+    @property
+    def frames(self):
+        return [x / self.header["time_per_frame"] for x in self.times]
+
+    @property
+    def channels(self):
+        return [x["name"] for x in self.header["channels"]]
+
+    def _read_blob(self, blob):
+        """Read and decompress
+
+        Args:
+            blob (list): offset, compressed length, raw length
+
+        Returns:
+            bytes: raw
+        """
+        self._file.seek(blob[0])
+        return self._decompress(self._file.read(blob[1]))
+
+    def _get_reference(self, channel):
+        """Quantized rest pose of a channel
+
+        Args:
+            channel (str): name
+
+        Returns:
+            numpy.ndarray: int64
+        """
+        if channel not in self._references:
+            info = self._channels[channel]
+            blob, int_dtype = info["reference"]
+            reference = _unpack_ints(self._read_blob(blob), int_dtype)
+            self._references[channel] = reference.reshape(info["shape"])
+        return self._references[channel]
+
+    def get_block(self, channel, block_index):
+        """Decode every frame of a block
+
+        Args:
+            channel (str): name
+            block_index (int): index of the block
+
+        Returns:
+            numpy.ndarray: (frames, count, 3) for quantized blocks, a list of
+            arrays for raw ones
+        """
+        key = (channel, block_index)
+        if key in self._blocks:
+            return self._blocks[key]
+        info = self._channels[channel]
+        block = info["blocks"][block_index]
+        data = self._read_blob(block["data"])
+        if block["encoding"] == "raw":
+            values = _unshuffle(data, info["dtype"])
+            decoded = []
+            offset = 0
+            for shape in block["shapes"]:
+                size = int(np.prod(shape))
+                decoded.append(values[offset:offset + size].reshape(shape))
+                offset += size
+        else:
+            shape = [block["frames"]] + info["shape"]
+            offsets = _unpack_ints(data, block["int_dtype"]).reshape(shape)
+            if self.header["mode"] == MODE_PREVIOUS:
+                offsets = np.cumsum(offsets, axis=0, out=offsets)
+            quantized = offsets + self._get_reference(channel)
+            decoded = (quantized * self.header["step"]).astype(info["dtype"])
+        # only the latest block per channel is kept
+        for cached_key in [x for x in self._blocks if x[0] == channel]:
+            self._blocks.pop(cached_key)
+        self._blocks[key] = decoded
+        return decoded
+
+    def get_time(self, time, channel=None):
+        """Decoded data of a sample by time
+
+        Args:
+            time (int): ticks
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: native byte order
+
+        Raises:
+            KeyError: if the time is not in the archive
+        """
+        channel = channel or self.channels[0]
+        if time not in self._time_index:
+            raise KeyError("No sample at time {} in {}".format(time, self))
+        index = self._time_index[time]
+        block_size = self.header["block_size"]
+        block = self.get_block(channel, index // block_size)
+        return block[index % block_size]
+
+    def get_frame(self, frame, channel=None):
+        """Decoded data of a frame, see get_time
+
+        Args:
+            frame (float): frame number
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: native byte order
+        """
+        time = int(round(frame * self.header["time_per_frame"]))
+        return self.get_time(time, channel)
+
+    def iter_frames(self, channel=None):
+        """Iterate over every sample in time order
+
+        Args:
+            channel (str, optional): defaults to the first channel
+
+        Yields:
+            tuple: frame, numpy.ndarray
+        """
+        for time in self.times:
+            yield (time / self.header["time_per_frame"],
+                   self.get_time(time, channel))
+
+
+def decode_cache(archive_path,
+                 cache_dir,
+                 base_name=None,
+                 cache_type=None,
+                 overwrite=False):
+    """Rebuild a maya cache from an archive
+
+    Args:
+        archive_path (str): encoded cache
+        cache_dir (str): output directory
+        base_name (str, optional): defaults to the original name
+        cache_type (str, optional): defaults to the original distribution
+        overwrite (bool, optional): allow replacing an existing cache
+
+    Returns:
+        str: path to the xml
+
+    Raises:
+        IOError: output exists and overwrite is False
+    """
+    with ArchiveReader(archive_path) as reader:
+        header = reader.header
+        base_name = base_name or header["base_name"]
+        xml_path = os.path.join(cache_dir, "{}.xml".format(base_name))
+        if os.path.exists(xml_path) and not overwrite:
+            raise IOError("Cache already exists: {}".format(xml_path))
+        times = reader.times
+        time_per_frame = header["time_per_frame"]
+        channel_info = dict((x["name"], x["info"]) for x in header["channels"])
+        writer = cache_io.CacheWriter(
+            cache_dir,
+            base_name,
+            times[0] / time_per_frame if times else 0,
+            end_frame=times[-1] / time_per_frame if times else None,
+            channels=reader.channels,
+            fps=cache_io.TICKS_PER_SECOND / time_per_frame,
+            cache_type=cache_type or header["cache_type"],
+            cache_format=header["cache_format"],
+            channel_info=channel_info)
+        with writer:
+            for time in times:
+                points = dict((x, reader.get_time(time, x))
+                              for x in reader.channels)
+                writer.write_frame(time / time_per_frame, points)
+    return writer.xml_path
+
+
+def get_max_error(xml_path, archive_path):
+    """Largest difference between a cache and its archive, per channel.
+    The bound is the tolerance plus half the spacing of the decoded dtype
+    at the largest value, the float32 rounding of the decoded points.
+
+    Args:
+        xml_path (str): original cache
+        archive_path (str): encoded cache
+
+    Returns:
+        dict: channel: {"error": max abs error, "bound": guaranteed max},
+        NaNs compare equal
+    """
+    errors = {}
+    with cache_io.CacheReader(xml_path) as cache:
+        with ArchiveReader(archive_path) as archive:
+            tolerance = archive.header["tolerance"]
+            times = cache.times
+            for channel in cache.channels:
+                error = 0.0
+                largest = 0.0
+                dtype = None
+                for time in times:
+                    original = cache.get_time(time, channel)
+                    decoded = archive.get_time(time, channel)
+                    dtype = decoded.dtype
+                    original = original.astype(np.float64)
+                    diff = np.abs(original - decoded.astype(np.float64))
+                    diff[np.isnan(original) & np.isnan(decoded)] = 0.0
+                    finite = np.abs(original[np.isfinite(original)])
+                    if diff.size:
+                        error = max(error, float(np.nanmax(diff)))
+                    if finite.size:
+                        largest = max(largest, float(finite.max()))
+                rounding = 0.0
+                if dtype is not None:
+                    rounding = float(np.spacing(dtype.type(largest))) / 2
+                errors[channel] = {"error": error,
+                                   "bound": tolerance + rounding}
+    return errors
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def _find_xmls(paths):
+    """Cache xmls from files and directories
+
+    Args:
+        paths (list): of xmls or dirs
+
+    Returns:
+        list: of xml paths
+    """
+    xml_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            xml_paths.extend(x.xml_path
+                             for x in cache_io.get_cache_descriptions(path))
+        else:
+            xml_paths.append(path)
+    return xml_paths
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: 0 on success, 1 if a verified archive is over tolerance
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    encode_parser = subparsers.add_parser("encode", help="cache to archive")
+    encode_parser.add_argument("paths", nargs="+", help="cache xmls or dirs")
+    encode_parser.add_argument("-o", "--output", default=None,
+                               help="archive dir, defaults next to the xml")
+    encode_parser.add_argument("-t", "--tolerance", type=float,
+                               default=DEFAULT_TOLERANCE)
+    encode_parser.add_argument("-m", "--mode", choices=MODES,
+                               default=MODE_PREVIOUS)
+    encode_parser.add_argument("-b", "--block-size", type=int,
+                               default=DEFAULT_BLOCK_SIZE)
+    encode_parser.add_argument("-c", "--compression",
+                               choices=sorted(COMPRESSORS), default="zlib")
+    encode_parser.add_argument("--verify", action="store_true",
+                               help="decode again and check the error")
+    decode_parser = subparsers.add_parser("decode", help="archive to cache")
+    decode_parser.add_argument("paths", nargs="+", help="archives or dirs")
+    decode_parser.add_argument("-o", "--output", required=True,
+                               help="cache dir")
+    decode_parser.add_argument("--cache-type", default=None,
+                               choices=cache_io.CACHE_DISTRIBUTIONS)
+    decode_parser.add_argument("--overwrite", action="store_true")
+    options = parser.parse_args(args)
+
+    result = 0
+    if options.command == "encode":
+        if options.output and not os.path.exists(options.output):
+            os.makedirs(options.output)
+        for xml_path in _find_xmls(options.paths):
+            archive_path = None
+            if options.output:
+                name = os.path.splitext(os.path.basename(xml_path))[0]
+                archive_path = os.path.join(options.output, name + ARCHIVE_EXT)
+            archive_path = encode_cache(xml_path,
+                                        archive_path,
+                                        tolerance=options.tolerance,
+                                        mode=options.mode,
+                                        block_size=options.block_size,
+                                        compression=options.compression)
+            cache_size = sum(os.path.getsize(x) for x in
+                             cache_io.read_description(xml_path).get_data_paths())
+            ratio = cache_size / max(os.path.getsize(archive_path), 1)
+            msg = "{} -> {} ({:.1f}x)".format(xml_path, archive_path, ratio)
+            if options.verify:
+                errors = get_max_error(xml_path, archive_path).values()
+                error = max([x["error"] for x in errors] or [0.0])
+                msg = "{} max error {:.6f}".format(msg, error)
+                if any(x["error"] > x["bound"] for x in errors):
+                    msg = "{} OVER TOLERANCE".format(msg)
+                    result = 1
+            print(msg)
+    elif options.command == "decode":
+        archive_paths = []
+        for path in options.paths:
+            if os.path.isdir(path):
+                pattern = os.path.join(path, "*{}".format(ARCHIVE_EXT))
+                archive_paths.extend(sorted(glob.glob(pattern)))
+            else:
+                archive_paths.append(path)
+        for archive_path in archive_paths:
+            xml_path = decode_cache(archive_path,
+                                    options.output,
+                                    cache_type=options.cache_type,
+                                    overwrite=options.overwrite)
+            print("{} -> {}".format(archive_path, xml_path))
+    else:
+        parser.print_help()
+        result = 2
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
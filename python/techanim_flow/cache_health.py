@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""Scan a techanim cache root for broken simulations, without Maya.
+
+Every cache xml found under the root is checked in a process pool for
+NaN/inf points, bounding box blow ups, per frame velocity spikes and missing
+frames. Results are written as json and/or csv.
+
+python -m techanim_flow.cache_health /path/to/cache_root --json report.json
+
+Attributes:
+    BLOWUP_FACTOR (float): bbox diagonal over the median diagonal that flags
+    a frame
+    CSV_FIELDS (list): columns of the csv report
+    MIN_VELOCITY (float): velocities below this are never a spike, avoids
+    flagging caches that barely move
+    SPIKE_FACTOR (float): max vertex velocity over the median max velocity
+    that flags a frame
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import csv
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+BLOWUP_FACTOR = 10.0
+SPIKE_FACTOR = 10.0
+MIN_VELOCITY = 1e-3
+
+STATUS_OK = "ok"
+STATUS_PROBLEM = "problem"
+STATUS_ERROR = "error"
+
+CSV_FIELDS = ["status",
+              "xml_path",
+              "channel",
+              "frames",
+              "verts",
+              "nan_frames",
+              "blowup_frames",
+              "spike_frames",
+              "missing_frames",
+              "max_velocity",
+              "error"]
+
+
+# =============================================================================
+# checks
+# =============================================================================
+
+def find_cache_xmls(cache_root):
+    """Walk the root for anything that could be a cache description
+
+    Args:
+        cache_root (str): top dir to search
+
+    Returns:
+        list: of xml paths
+    """
+    xml_paths = []
+    for dir_name, subdir_list, file_list in os.walk(cache_root):
+        for file_name in file_list:
+            if file_name.lower().endswith(".xml"):
+                xml_paths.append(os.path.join(dir_name, file_name))
+    xml_paths.sort()
+    return xml_paths
+
+
+def get_frame_stats(reader, channel):
+    """One pass over the cache collecting per frame numbers, only a single
+    frame is converted to native floats at a time.
+
+    Args:
+        reader (CacheReader): opened cache
+        channel (str): channel to check
+
+    Returns:
+        dict: of numpy arrays, one value per sample
+    """
+    times = reader.times
+    non_finite = np.zeros(len(times), dtype=np.int64)
+    diagonal = np.zeros(len(times))
+    velocity = np.zeros(len(times))
+    previous = None
+    for index, time_value in enumerate(times):
+        points = reader.get_time(time_value, channel).astype(np.float64)
+        finite = np.isfinite(points).all(axis=-1)
+        non_finite[index] = points.shape[0] - np.count_nonzero(finite)
+        valid = points[finite]
+        if valid.size:
+            diagonal[index] = np.linalg.norm(valid.max(axis=0) -
+                                             valid.min(axis=0))
+        if previous is not None and previous.shape == points.shape:
+            delta = points - previous
+            delta = delta[np.isfinite(delta).all(axis=-1)]
+            if delta.size:
+                velocity[index] = np.sqrt((delta * delta).sum(axis=-1).max())
+        previous = points
+    return {"times": np.array(times),
+            "non_finite": non_finite,
+            "diagonal": diagonal,
+            "velocity": velocity}
+
+
+def get_missing_frames(reader):
+    """Compare the sampled times to what the xml promises
+
+    Args:
+        reader (CacheReader): opened cache
+
+    Returns:
+        list: of missing frame numbers
+    """
+    desc = reader.description
+    if not desc.channels:
+        return []
+    rate = desc.channels[0].get("SamplingRate", desc.time_per_frame)
+    start = desc.channels[0].get("StartTime", desc.start_time)
+    end = desc.channels[0].get("EndTime", desc.end_time)
+    expected = set(range(start, end + 1, rate or desc.time_per_frame))
+    missing = sorted(expected.difference(reader.frame_index.keys()))
+    return [desc.time_to_frame(x) for x in missing]
+
+
+def _flag_outliers(values, factor, minimum=0.0):
+    """Indices of values more than factor times the median
+
+    Args:
+        values (numpy.ndarray): per frame values
+        factor (float): multiplier over the median
+        minimum (float, optional): values under this are never flagged
+
+    Returns:
+        numpy.ndarray: of indices
+    """
+    if not values.size:
+        return np.array([], dtype=np.int64)
+    median = np.median(values)
+    threshold = max(median * factor, minimum)
+    return np.flatnonzero(values > threshold)
+
+
+def check_cache(xml_path,
+                blowup_factor=BLOWUP_FACTOR,
+                spike_factor=SPIKE_FACTOR,
+                min_velocity=MIN_VELOCITY):
+    """Run every check on every channel of a single cache
+
+    Args:
+        xml_path (str): cache description
+        blowup_factor (float, optional): see BLOWUP_FACTOR
+        spike_factor (float, optional): see SPIKE_FACTOR
+        min_velocity (float, optional): see MIN_VELOCITY
+
+    Returns:
+        list: of result dicts, one per channel
+    """
+    results = []
+    try:
+        reader = cache_io.CacheReader(xml_path)
+    except cache_io.NotACacheError:
+        return results
+    except Exception as e:
+        return [{"status": STATUS_ERROR, "xml_path": xml_path,
+                 "error": "{}: {}".format(type(e).__name__, e)}]
+    try:
+        missing_frames = get_missing_frames(reader)
+        for channel in reader.channels:
+            result = {"xml_path": xml_path,
+                      "channel": channel,
+                      "missing_frames": missing_frames}
+            try:
+                stats = get_frame_stats(reader, channel)
+            except Exception as e:
+                result["status"] = STATUS_ERROR
+                result["error"] = "{}: {}".format(type(e).__name__, e)
+                results.append(result)
+                continue
+            frames = stats["times"] / reader.description.time_per_frame
+            nan_index = np.flatnonzero(stats["non_finite"])
+            blowup_index = _flag_outliers(stats["diagonal"], blowup_factor)
+            spike_index = _flag_outliers(stats["velocity"],
+                                         spike_factor,
+                                         minimum=min_velocity)
+            result["frames"] = len(frames)
+            result["verts"] = reader.get_point_count(channel)
+            result["nan_frames"] = frames[nan_index].tolist()
+            result["blowup_frames"] = frames[blowup_index].tolist()
+            result["spike_frames"] = frames[spike_index].tolist()
+            result["max_velocity"] = float(stats["velocity"].max()
+                                           if frames.size else 0.0)
+            problems = [result["nan_frames"],
+                        result["blowup_frames"],
+                        result["spike_frames"],
+                        missing_frames]
+            result["status"] = STATUS_PROBLEM if any(problems) else STATUS_OK
+            results.append(result)
+    finally:
+        reader.close()
+    return results
+
+
+def _check_cache_star(args):
+    """Pool.imap only passes one argument
+
+    Args:
+        args (tuple): xml_path, check_cache kwargs
+
+    Returns:
+        list: check_cache results
+    """
+    xml_path, kwargs = args
+    return check_cache(xml_path, **kwargs)
+
+
+def scan_cache_root(cache_root, workers=None, **kwargs):
+    """Check every cache under the root in a process pool
+
+    Args:
+        cache_root (str): top dir to search
+        workers (int, optional): processes, defaults to cpu count
+        **kwargs: passed to check_cache
+
+    Returns:
+        list: of result dicts sorted by path
+    """
+    xml_paths = find_cache_xmls(cache_root)
+    if not xml_paths:
+        return []
+    workers = min(workers or multiprocessing.cpu_count(), len(xml_paths))
+    jobs = [(x, kwargs) for x in xml_paths]
+    results = []
+    if workers < 2:
+        for job in jobs:
+            results.extend(_check_cache_star(job))
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for job_results in pool.imap_unordered(_check_cache_star, jobs):
+                results.extend(job_results)
+        finally:
+            pool.close()
+            pool.join()
+    results.sort(key=lambda x: (x["xml_path"], x.get("channel") or ""))
+    return results
+
+
+# =============================================================================
+# reports
+# =============================================================================
+
+def write_json_report(results, file_path, cache_root=None):
+    """Write the results with a small summary on top
+
+    Args:
+        results (list): of check_cache dicts
+        file_path (str): output path
+        cache_root (str, optional): recorded in the report
+    """
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    data = {"cache_root": cache_root,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "summary": summary,
+            "results": results}
+    config_io.write_json(data, file_path)
+
+
+def write_csv_report(results, file_path):
+    """One row per checked channel, frame lists are space separated
+
+    Args:
+        results (list): of check_cache dicts
+        file_path (str): output path
+    """
+    # the csv module wants bytes on python 2
+    if sys.version_info[0] < 3:
+        f = open(file_path, "wb")
+    else:
+        f = open(file_path, "w", newline="")
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for result in results:
+            row = []
+            for field in CSV_FIELDS:
+                value = result.get(field, "")
+                if isinstance(value, list):
+                    value = " ".join(str(x) for x in value)
+                row.append(value)
+            writer.writerow(row)
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: 0 all good, 1 problems found, 2 unreadable caches
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cache_root",
+                        nargs="?",
+                        default=config_io.get_cache_root(),
+                        help="root to scan, defaults to the techanim cache dir")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", default=None)
+    parser.add_argument("--csv", dest="csv_path", default=None)
+    parser.add_argument("--blowup-factor", type=float, default=BLOWUP_FACTOR)
+    parser.add_argument("--spike-factor", type=float, default=SPIKE_FACTOR)
+    parser.add_argument("--min-velocity", type=float, default=MIN_VELOCITY)
+    options = parser.parse_args(args)
+
+    start = time.time()
+    results = scan_cache_root(options.cache_root,
+                              workers=options.workers,
+                              blowup_factor=options.blowup_factor,
+                              spike_factor=options.spike_factor,
+                              min_velocity=options.min_velocity)
+    if options.json_path:
+        write_json_report(results, options.json_path, options.cache_root)
+    if options.csv_path:
+        write_csv_report(results, options.csv_path)
+
+    statuses = [x["status"] for x in results]
+    for result in results:
+        if result["status"] != STATUS_OK:
+            print("{}: {} {}".format(result["status"].upper(),
+                                     result["xml_path"],
+                                     result.get("channel") or ""))
+    msg = "Checked {} channels in {:.1f}s: {} ok, {} problems, {} errors"
+    print(msg.format(len(results),
+                     time.time() - start,
+                     statuses.count(STATUS_OK),
+                     statuses.count(STATUS_PROBLEM),
+                     statuses.count(STATUS_ERROR)))
+    if STATUS_ERROR in statuses:
+        return 2
+    if STATUS_PROBLEM in statuses:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
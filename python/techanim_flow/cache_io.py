@@ -0,0 +1,1214 @@
+# -*- coding: utf-8 -*-
+"""Read and write Maya geometry/nCloth caches (mcx/mcc) without Maya.
+
+The xml description is parsed with the standard library and the data file is
+memory mapped, so asking for a frame only touches the bytes of that frame.
+Points come back as a view into the map, no copy is made. Use
+`.astype(numpy.float32)` if a native byte order copy is needed.
+Writing streams one frame at a time, memory does not grow with the range.
+AsyncCacheWriter does the writing on a thread, for callers with something
+better to do than wait on disk.
+
+Attributes:
+    CACHE_DISTRIBUTIONS (list): supported cache file distributions
+    CHANNEL_TYPES (dict): xml ChannelType: data chunk tag
+    DATA_DTYPES (dict): data chunk tag: numpy dtype str (big endian)
+    FRAME_INDEX_EXT (str): sidecar extension of the frame offset index
+    FRAME_INDEX_VERSION (int): bumped when the sidecar layout changes
+    MCC_EXT (str): 32bit cache format/extension
+    MCX_EXT (str): 64bit cache format/extension
+    ONE_FILE (str): cache distribution, all frames in a single file
+    ONE_FILE_PER_FRAME (str): cache distribution, one file per frame
+    TICKS_PER_SECOND (int): maya internal time unit
+    VECTOR_TAGS (list): data tags that store 3 values per element
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import re
+import glob
+import json
+import mmap
+import struct
+import threading
+import xml.etree.ElementTree as ET
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# techanim
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+TICKS_PER_SECOND = 6000
+MCX_EXT = "mcx"
+MCC_EXT = "mcc"
+ONE_FILE = "OneFile"
+ONE_FILE_PER_FRAME = "OneFilePerFrame"
+CACHE_DISTRIBUTIONS = [ONE_FILE, ONE_FILE_PER_FRAME]
+FRAME_INDEX_EXT = ".idx.json"
+FRAME_INDEX_VERSION = 1
+
+CHANNEL_TYPES = {"FloatVectorArray": b"FVCA",
+                 "DoubleVectorArray": b"DVCA",
+                 "FloatArray": b"FBCA",
+                 "DoubleArray": b"DBLA"}
+DATA_DTYPES = {b"FVCA": ">f4",
+               b"DVCA": ">f8",
+               b"FBCA": ">f4",
+               b"DBLA": ">f8"}
+VECTOR_TAGS = [b"FVCA", b"DVCA"]
+
+# size of the chunk size field, and the group tags per format
+_SIZE_FMT = {MCX_EXT: ">Q", MCC_EXT: ">I"}
+_GROUP_TAG = {MCX_EXT: b"FOR8", MCC_EXT: b"FOR4"}
+_RANGE_REGEX = re.compile(r"^\s*(-?\d+)\s*-\s*(-?\d+)\s*$")
+_FRAME_FILE_REGEX = re.compile(r"Frame(-?\d+)(?:Tick(-?\d+))?\.\w+$")
+_TAG_REGEX = re.compile(b"^[A-Z0-9]{4}$")
+
+
+class CacheFormatError(Exception):
+    """Raised when a cache file does not follow the expected layout"""
+
+
+class NotACacheError(CacheFormatError):
+    """Raised when an xml is not a cache description at all"""
+
+
+def _require_numpy():
+    """Arrays are only needed for the point data, the rest works without
+
+    Raises:
+        ImportError: if numpy is not available in this interpreter
+    """
+    if np is None:
+        raise ImportError("numpy is required to read cache point data.")
+
+
+# =============================================================================
+# xml description
+# =============================================================================
+
+class CacheDescription(object):
+
+    """Contents of the xml that maya writes next to every cache
+
+    Attributes:
+        base_name (str): name of the xml without extension, also the data name
+        cache_dir (str): directory the xml lives in
+        cache_format (str): mcx or mcc
+        cache_type (str): OneFile or OneFilePerFrame
+        channels (list): of dicts, one per channel, with the xml attrs
+        end_time (int): in ticks
+        extra (list): of the free form extra strings maya stores
+        start_time (int): in ticks
+        time_per_frame (int): ticks per frame
+        xml_path (str): path to the xml
+    """
+
+    def __init__(self, xml_path):
+        super(CacheDescription, self).__init__()
+        self.xml_path = os.path.abspath(xml_path)
+        self.cache_dir = os.path.dirname(self.xml_path)
+        self.base_name = os.path.splitext(os.path.basename(xml_path))[0]
+        self.cache_type = ONE_FILE
+        self.cache_format = MCX_EXT
+        self.time_per_frame = 250
+        self.start_time = 0
+        self.end_time = 0
+        self.channels = []
+        self.extra = []
+        self._parse()
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.xml_path)
+
+    def _parse(self):
+        """Fill the attributes from the xml
+        """
+        root = ET.parse(self.xml_path).getroot()
+        if root.tag != "Autodesk_Cache_File":
+            msg = "{} is not a cache description.".format(self.xml_path)
+            raise NotACacheError(msg)
+        cache_type = root.find("cacheType")
+        if cache_type is not None:
+            self.cache_type = cache_type.get("Type", ONE_FILE)
+            self.cache_format = cache_type.get("Format", MCX_EXT)
+        time_per_frame = root.find("cacheTimePerFrame")
+        if time_per_frame is not None:
+            self.time_per_frame = int(time_per_frame.get("TimePerFrame"))
+        time_range = root.find("time")
+        if time_range is not None:
+            results = _RANGE_REGEX.match(time_range.get("Range", ""))
+            if results:
+                self.start_time = int(results.group(1))
+                self.end_time = int(results.group(2))
+        self.extra = [x.text or "" for x in root.findall("extra")]
+
+        channels = root.find("Channels")
+        if channels is None:
+            return
+        for channel in channels:
+            info = dict(channel.attrib)
+            for attr in ["SamplingRate", "StartTime", "EndTime"]:
+                if attr in info:
+                    info[attr] = int(info[attr])
+            self.channels.append(info)
+
+    @property
+    def channel_names(self):
+        """Names of the channels in the order they are stored
+
+        Returns:
+            list: of str
+        """
+        return [x["ChannelName"] for x in self.channels]
+
+    @property
+    def start_frame(self):
+        return self.start_time / self.time_per_frame
+
+    @property
+    def end_frame(self):
+        return self.end_time / self.time_per_frame
+
+    @property
+    def fps(self):
+        return TICKS_PER_SECOND / self.time_per_frame
+
+    def frame_to_time(self, frame):
+        """Convert a (sub)frame into ticks
+
+        Args:
+            frame (float): frame number
+
+        Returns:
+            int: ticks
+        """
+        return int(round(frame * self.time_per_frame))
+
+    def time_to_frame(self, time):
+        """Convert ticks into a frame
+
+        Args:
+            time (int): ticks
+
+        Returns:
+            float: frame number
+        """
+        return time / self.time_per_frame
+
+    def get_data_paths(self):
+        """Data files described by this xml.
+
+        Returns:
+            list: of paths, one for OneFile, one per sample for OneFilePerFrame
+        """
+        if self.cache_type == ONE_FILE:
+            name = "{}.{}".format(self.base_name, self.cache_format)
+            return [os.path.join(self.cache_dir, name)]
+        pattern = "{}Frame*.{}".format(self.base_name, self.cache_format)
+        return glob.glob(os.path.join(self.cache_dir, pattern))
+
+
+def read_description(xml_path):
+    """Convenience, parse a cache xml
+
+    Args:
+        xml_path (str): path to cache xml
+
+    Returns:
+        CacheDescription: parsed xml
+    """
+    return CacheDescription(xml_path)
+
+
+def get_cache_descriptions(cache_dir):
+    """Get every cache described in a directory
+
+    Args:
+        cache_dir (str): directory containing xml/mcx pairs
+
+    Returns:
+        list: of CacheDescription
+    """
+    descriptions = []
+    for xml_path in sorted(glob.glob(os.path.join(cache_dir, "*.xml"))):
+        try:
+            descriptions.append(CacheDescription(xml_path))
+        except (ET.ParseError, CacheFormatError):
+            # not every xml in a directory is going to be a cache
+            continue
+    return descriptions
+
+
+# =============================================================================
+# IFF chunk layout
+# =============================================================================
+
+def _is_tag(buf, offset):
+    """Chunk tags are always 4 upper case letters or digits
+
+    Args:
+        buf (mmap): mapped file
+        offset (int): position of the potential tag
+
+    Returns:
+        bool: looks like a tag
+    """
+    return bool(_TAG_REGEX.match(buf[offset:offset + 4]))
+
+
+def _next_offset(buf, data_offset, size, end):
+    """Find the start of the chunk following the data of this one. Data is
+    padded to 4 bytes, some writers pad mcx data to 8, accept either.
+
+    Args:
+        buf (mmap): mapped file
+        data_offset (int): where the data of the current chunk starts
+        size (int): size of the data
+        end (int): end of the enclosing group
+
+    Returns:
+        int: offset of the next chunk
+    """
+    offset = data_offset + size + (-size % 4)
+    if offset >= end or _is_tag(buf, offset):
+        return offset
+    offset_8 = data_offset + size + (-size % 8)
+    if offset_8 <= end and (offset_8 == end or _is_tag(buf, offset_8)):
+        return offset_8
+    return offset
+
+
+def read_chunks(buf, offset, end, cache_format=MCX_EXT):
+    """Walk the chunks between offset and end, without reading any data
+
+    Args:
+        buf (mmap): mapped file
+        offset (int): start
+        end (int): end
+        cache_format (str, optional): mcx or mcc
+
+    Yields:
+        tuple: tag, offset of data, size of data
+    """
+    size_fmt = _SIZE_FMT[cache_format]
+    size_len = struct.calcsize(size_fmt)
+    while offset < end:
+        tag = buf[offset:offset + 4]
+        if len(tag) < 4:
+            break
+        size = struct.unpack_from(size_fmt, buf, offset + 4)[0]
+        data_offset = offset + 4 + size_len
+        if data_offset + size > end:
+            msg = "Chunk {} at {} runs past its group."
+            raise CacheFormatError(msg.format(tag, offset))
+        yield tag, data_offset, size
+        offset = _next_offset(buf, data_offset, size, end)
+
+
+def _read_int(buf, offset):
+    return struct.unpack_from(">i", buf, offset)[0]
+
+
+def _read_str(buf, offset, size):
+    return buf[offset:offset + size].rstrip(b"\x00").decode("utf-8")
+
+
+def index_cache_file(buf, cache_format=MCX_EXT, default_time=None):
+    """Build a frame index of a single data file by walking its chunk headers
+
+    Args:
+        buf (mmap): mapped data file
+        cache_format (str, optional): mcx or mcc
+        default_time (int, optional): time to use for samples without a TIME
+        chunk, which is the case for OneFilePerFrame files
+
+    Returns:
+        dict: {time: {channel: (tag, data_offset, count)}}
+
+    Raises:
+        CacheFormatError: if the file is not a cache
+    """
+    group_tag = _GROUP_TAG[cache_format]
+    file_size = len(buf)
+    frame_index = {}
+    for tag, data_offset, size in read_chunks(buf, 0, file_size, cache_format):
+        if tag != group_tag:
+            raise CacheFormatError("Unexpected top level chunk {}".format(tag))
+        group_type = buf[data_offset:data_offset + 4]
+        if group_type == b"CACH":
+            continue
+        if group_type != b"MYCH":
+            raise CacheFormatError("Unknown group {}".format(group_type))
+        time = default_time
+        channel = None
+        count = 0
+        group_end = data_offset + size
+        for sub_tag, sub_offset, sub_size in read_chunks(buf,
+                                                         data_offset + 4,
+                                                         group_end,
+                                                         cache_format):
+            if sub_tag == b"TIME":
+                time = _read_int(buf, sub_offset)
+            elif sub_tag == b"CHNM":
+                channel = _read_str(buf, sub_offset, sub_size)
+            elif sub_tag == b"SIZE":
+                count = _read_int(buf, sub_offset)
+            elif sub_tag in DATA_DTYPES:
+                frame_index.setdefault(time, {})[channel] = (sub_tag,
+                                                             sub_offset,
+                                                             count)
+    return frame_index
+
+
+def read_header_times(buf, cache_format=MCX_EXT):
+    """Read the STIM and ETIM of the header group
+
+    Args:
+        buf (mmap): mapped data file
+        cache_format (str, optional): mcx or mcc
+
+    Returns:
+        tuple: start time, end time. None if not found
+    """
+    start_time = end_time = None
+    for tag, data_offset, size in read_chunks(buf, 0, len(buf), cache_format):
+        if buf[data_offset:data_offset + 4] != b"CACH":
+            break
+        for sub_tag, sub_offset, _ in read_chunks(buf,
+                                                  data_offset + 4,
+                                                  data_offset + size,
+                                                  cache_format):
+            if sub_tag == b"STIM":
+                start_time = _read_int(buf, sub_offset)
+            elif sub_tag == b"ETIM":
+                end_time = _read_int(buf, sub_offset)
+        break
+    return start_time, end_time
+
+
+def map_file(path):
+    """Memory map a file read only
+
+    Args:
+        path (str): file path
+
+    Returns:
+        mmap: read only map of the entire file
+    """
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# =============================================================================
+# frame index
+# =============================================================================
+
+def get_frame_index_path(xml_path):
+    """Sidecar path of the frame index for a cache
+
+    Args:
+        xml_path (str): cache description
+
+    Returns:
+        str: path
+    """
+    return "{}{}".format(os.path.splitext(xml_path)[0], FRAME_INDEX_EXT)
+
+
+def _get_file_stamp(path):
+    """Size and mtime, enough to tell if an index went stale
+
+    Args:
+        path (str): data file
+
+    Returns:
+        list: [size, mtime]
+    """
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def write_frame_index(xml_path):
+    """Walk a OneFile cache once and store where every sample lives, so
+    readers can seek without touching the rest of the data file
+
+    Args:
+        xml_path (str): cache description
+
+    Returns:
+        str: path of the sidecar, None for OneFilePerFrame caches
+
+    Raises:
+        CacheFormatError: if a sample is missing a channel of the xml
+    """
+    desc = CacheDescription(xml_path)
+    if desc.cache_type != ONE_FILE:
+        return None
+    data_path = desc.get_data_paths()[0]
+    buf = map_file(data_path)
+    try:
+        frame_index = index_cache_file(buf, desc.cache_format)
+    finally:
+        buf.close()
+
+    times = sorted(frame_index.keys())
+    for time in times:
+        missing = [x for x in desc.channel_names if x not in frame_index[time]]
+        if missing:
+            msg = "Sample {} of {} has no {}"
+            raise CacheFormatError(msg.format(time, data_path, missing))
+    channels = {}
+    for channel in desc.channel_names:
+        tags = set(frame_index[x][channel][0] for x in times)
+        channels[channel] = {
+            "tag": tags.pop().decode("ascii") if len(tags) == 1 else None,
+            "offsets": [frame_index[x][channel][1] for x in times],
+            "counts": [frame_index[x][channel][2] for x in times]}
+    data = {"version": FRAME_INDEX_VERSION,
+            "data_file": os.path.basename(data_path),
+            "stamp": _get_file_stamp(data_path),
+            "times": times,
+            "channels": channels}
+
+    index_path = get_frame_index_path(xml_path)
+    config_io.write_json(data, index_path, indent=None)
+    return index_path
+
+
+def read_frame_index(xml_path, description=None):
+    """Load the sidecar index if it is still valid for the data file
+
+    Args:
+        xml_path (str): cache description
+        description (CacheDescription, optional): already parsed xml
+
+    Returns:
+        dict: {time: {channel: (tag, data_offset, count)}}, None if missing,
+        stale or unreadable
+    """
+    index_path = get_frame_index_path(xml_path)
+    if not os.path.exists(index_path):
+        return None
+    desc = description or CacheDescription(xml_path)
+    try:
+        with open(index_path, "r") as f:
+            data = json.load(f)
+        data_path = os.path.join(desc.cache_dir, data["data_file"])
+        if (data["version"] != FRAME_INDEX_VERSION or
+                data["stamp"] != _get_file_stamp(data_path)):
+            return None
+        frame_index = dict((x, {}) for x in data["times"])
+        for channel, info in data["channels"].items():
+            if info["tag"] is None:
+                return None
+            tag = info["tag"].encode("ascii")
+            for time, offset, count in zip(data["times"],
+                                           info["offsets"],
+                                           info["counts"]):
+                frame_index[time][channel] = (tag, offset, count)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+    return frame_index
+
+
+def write_cache_dir_indices(cache_dir, force=False):
+    """Make sure every OneFile cache in the dir has an up to date index
+
+    Args:
+        cache_dir (str): directory containing xml/mcx pairs
+        force (bool, optional): rewrite valid indices too
+
+    Returns:
+        list: of written index paths
+    """
+    written = []
+    for desc in get_cache_descriptions(cache_dir):
+        if desc.cache_type != ONE_FILE:
+            continue
+        if not force and read_frame_index(desc.xml_path, desc) is not None:
+            continue
+        try:
+            written.append(write_frame_index(desc.xml_path))
+        except (IOError, OSError, CacheFormatError) as e:
+            print("Could not index {}: {}".format(desc.xml_path, e))
+    return written
+
+
+# =============================================================================
+# reader
+# =============================================================================
+
+class CacheReader(object):
+
+    """Memory mapped access to the frames of a maya cache
+
+    with CacheReader("/caches/shirtShape.xml") as reader:
+        points = reader.get_frame(1001)
+
+    Attributes:
+        description (CacheDescription): parsed xml
+        frame_index (dict): {time: {channel: (tag, offset, count)}}, for
+        OneFilePerFrame the offsets are into the file of that time
+    """
+
+    def __init__(self, xml_path):
+        super(CacheReader, self).__init__()
+        self.description = CacheDescription(xml_path)
+        self.frame_index = {}
+        self._maps = {}
+        self._time_paths = {}
+        self._build_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__,
+                               self.description.xml_path)
+
+    def _build_index(self):
+        """Find where every sample lives, from the sidecar index when there
+        is a valid one, walking the data file(s) otherwise
+        """
+        desc = self.description
+        if desc.cache_type == ONE_FILE:
+            path = desc.get_data_paths()[0]
+            buf = self._get_map(path)
+            self.frame_index = read_frame_index(desc.xml_path, desc)
+            if self.frame_index is None:
+                self.frame_index = index_cache_file(buf, desc.cache_format)
+            for time in self.frame_index:
+                self._time_paths[time] = path
+            return
+
+        for path in desc.get_data_paths():
+            results = _FRAME_FILE_REGEX.search(os.path.basename(path))
+            if not results:
+                continue
+            time = desc.frame_to_time(int(results.group(1)))
+            if results.group(2):
+                time += int(results.group(2))
+            buf = map_file(path)
+            try:
+                info = index_cache_file(buf, desc.cache_format, time)
+            finally:
+                buf.close()
+            self.frame_index.update(info)
+            self._time_paths[time] = path
+
+    def _get_map(self, path):
+        """Map on demand. OneFilePerFrame only keeps the latest file mapped
+        so long caches do not run out of file handles.
+
+        Args:
+            path (str): data file
+
+        Returns:
+            mmap: read only map
+        """
+        if path in self._maps:
+            return self._maps[path]
+        if self.description.cache_type == ONE_FILE_PER_FRAME:
+            self.close()
+        buf = map_file(path)
+        self._maps[path] = buf
+        return buf
+
+    def close(self):
+        """Drop the maps. They are unmapped once no returned array references
+        them anymore, closing them explicitly would pull the data out from
+        under those arrays.
+        """
+        self._maps = {}
+
+    @property
+    def times(self):
+        """Sorted times of every sample in the cache
+
+        Returns:
+            list: of ints, ticks
+        """
+        return sorted(self.frame_index.keys())
+
+    @property
+    def frames(self):
+        """Sorted frame numbers of every sample
+
+        Returns:
+            list: of floats
+        """
+        return [self.description.time_to_frame(x) for x in self.times]
+
+    @property
+    def channels(self):
+        return self.description.channel_names
+
+    def get_point_count(self, channel=None):
+        """Number of elements stored for a channel on the first sample
+
+        Args:
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            int: count
+        """
+        channel = channel or self.channels[0]
+        return self.frame_index[self.times[0]][channel][2]
+
+    def get_time(self, time, channel=None):
+        """Get the data of a sample by time
+
+        Args:
+            time (int): ticks
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: (count, 3) for vector channels, (count,) otherwise.
+            Big endian view into the mapped file.
+
+        Raises:
+            KeyError: if the time or channel is not in the cache
+        """
+        _require_numpy()
+        channel = channel or self.channels[0]
+        if time not in self.frame_index:
+            msg = "No sample at time {} in {}".format(time, self)
+            raise KeyError(msg)
+        tag, offset, count = self.frame_index[time][channel]
+        buf = self._get_map(self._time_paths[time])
+        width = 3 if tag in VECTOR_TAGS else 1
+        data = np.frombuffer(buf,
+                             dtype=DATA_DTYPES[tag],
+                             count=count * width,
+                             offset=offset)
+        if width == 3:
+            return data.reshape(count, 3)
+        return data
+
+    def get_frame(self, frame, channel=None):
+        """Get the data of a frame, see get_time
+
+        Args:
+            frame (float): frame number
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: (count, 3) view into the mapped file
+        """
+        return self.get_time(self.description.frame_to_time(frame), channel)
+
+    def iter_frames(self, channel=None):
+        """Iterate over every sample in time order
+
+        Args:
+            channel (str, optional): defaults to the first channel
+
+        Yields:
+            tuple: frame, numpy.ndarray
+        """
+        for time in self.times:
+            yield (self.description.time_to_frame(time),
+                   self.get_time(time, channel))
+
+
+def get_cache_readers(cache_dir):
+    """Readers for every cache in a directory
+
+    Args:
+        cache_dir (str): directory containing xml/mcx pairs
+
+    Returns:
+        list: of CacheReader
+    """
+    return [CacheReader(x.xml_path) for x in get_cache_descriptions(cache_dir)]
+
+
+# =============================================================================
+# writer
+# =============================================================================
+
+def _pack_size(size, cache_format):
+    return struct.pack(_SIZE_FMT[cache_format], size)
+
+
+def _pack_chunk(tag, data, cache_format=MCX_EXT):
+    """Tag, size and data padded to 4 bytes
+
+    Args:
+        tag (bytes): 4 letter tag
+        data (bytes): payload
+        cache_format (str, optional): mcx or mcc
+
+    Returns:
+        bytes: the chunk
+    """
+    padding = b"\x00" * (-len(data) % 4)
+    return b"".join([tag, _pack_size(len(data), cache_format), data, padding])
+
+
+def _pack_group(group_type, content, cache_format=MCX_EXT):
+    """Wrap chunks in a FOR4/FOR8 group
+
+    Args:
+        group_type (bytes): CACH or MYCH
+        content (bytes): packed chunks
+        cache_format (str, optional): mcx or mcc
+
+    Returns:
+        bytes: the group
+    """
+    return b"".join([_GROUP_TAG[cache_format],
+                     _pack_size(len(content) + 4, cache_format),
+                     group_type,
+                     content])
+
+
+def _pack_int(value):
+    return struct.pack(">i", value)
+
+
+def write_description(xml_path,
+                      channels,
+                      start_time,
+                      end_time,
+                      time_per_frame=250,
+                      cache_type=ONE_FILE,
+                      cache_format=MCX_EXT,
+                      channel_type="FloatVectorArray",
+                      extra=None,
+                      channel_info=None):
+    """Write a cache xml the way maya does, so it can be attached like any
+    other cache.
+
+    Args:
+        xml_path (str): output path
+        channels (list): of channel names
+        start_time (int): ticks
+        end_time (int): ticks
+        time_per_frame (int, optional): ticks per frame
+        cache_type (str, optional): OneFile or OneFilePerFrame
+        cache_format (str, optional): mcx or mcc
+        channel_type (str, optional): see CHANNEL_TYPES
+        extra (list, optional): of strings stored as <extra>
+        channel_info (dict, optional): channel: {xml attr: value}, overrides
+        ChannelType/ChannelInterpretation per channel
+    """
+    channel_info = channel_info or {}
+    root = ET.Element("Autodesk_Cache_File")
+    ET.SubElement(root, "cacheType", Type=cache_type, Format=cache_format)
+    ET.SubElement(root, "time", Range="{}-{}".format(start_time, end_time))
+    ET.SubElement(root, "cacheTimePerFrame", TimePerFrame=str(time_per_frame))
+    ET.SubElement(root, "cacheVersion", Version="2.0")
+    for info in extra or ["techanim_flow cache_io"]:
+        ET.SubElement(root, "extra").text = info
+    channels_element = ET.SubElement(root, "Channels")
+    for index, channel in enumerate(channels):
+        info = channel_info.get(channel, {})
+        ET.SubElement(channels_element,
+                      "channel{}".format(index),
+                      ChannelName=channel,
+                      ChannelType=info.get("ChannelType", channel_type),
+                      ChannelInterpretation=info.get("ChannelInterpretation",
+                                                     "positions"),
+                      SamplingType="Regular",
+                      SamplingRate=str(time_per_frame),
+                      StartTime=str(start_time),
+                      EndTime=str(end_time))
+
+    lines = ['<?xml version="1.0"?>', "<Autodesk_Cache_File>"]
+    for element in root:
+        if element.tag == "Channels":
+            lines.append("  <Channels>")
+            for channel in element:
+                lines.append("    {}".format(ET.tostring(channel).decode("utf-8")))
+            lines.append("  </Channels>")
+        else:
+            lines.append("  {}".format(ET.tostring(element).decode("utf-8")))
+    lines.append("</Autodesk_Cache_File>")
+    with open(xml_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+class CacheWriter(object):
+
+    """Stream frames into a maya compatible cache, one frame in memory at a
+    time. The xml is written on close, once the written range is known.
+
+    with CacheWriter(cache_dir, "shirtShape", start_frame=1001) as writer:
+        for frame, points in frames:
+            writer.write_frame(frame, points)
+
+    Attributes:
+        base_name (str): name of the xml/data files
+        cache_dir (str): output directory
+        cache_format (str): mcx or mcc
+        cache_type (str): OneFile or OneFilePerFrame
+        channel_info (dict): channel: {ChannelType, ChannelInterpretation},
+        for caches whose channels do not all share channel_type
+        channel_type (str): see CHANNEL_TYPES
+        channels (list): of channel names, defaults to the base_name
+        data_paths (list): of written data files
+        end_time (int): last written time
+        start_time (int): first time, written in the header
+        time_per_frame (int): ticks per frame
+        xml_path (str): path of the xml once closed
+    """
+
+    def __init__(self,
+                 cache_dir,
+                 base_name,
+                 start_frame,
+                 end_frame=None,
+                 channels=None,
+                 fps=24,
+                 cache_type=ONE_FILE,
+                 cache_format=MCX_EXT,
+                 channel_type="FloatVectorArray",
+                 channel_info=None):
+        super(CacheWriter, self).__init__()
+        _require_numpy()
+        self.cache_dir = cache_dir
+        self.base_name = base_name
+        self.channels = channels or [base_name]
+        self.cache_type = cache_type
+        self.cache_format = cache_format
+        self.channel_type = channel_type
+        self.channel_info = channel_info or {}
+        self.time_per_frame = int(round(TICKS_PER_SECOND / fps))
+        self.start_time = int(round(start_frame * self.time_per_frame))
+        if end_frame is None:
+            end_frame = start_frame
+        self.end_time = int(round(end_frame * self.time_per_frame))
+        self.xml_path = os.path.join(cache_dir, "{}.xml".format(base_name))
+        self.data_paths = []
+        self._tags = {}
+        for channel in self.channels:
+            info = self.channel_info.get(channel, {})
+            self._tags[channel] = CHANNEL_TYPES[info.get("ChannelType",
+                                                         channel_type)]
+        self._file = None
+        self._etim_offset = None
+        self._last_time = None
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        if cache_type == ONE_FILE:
+            self._open_one_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(write_xml=exc_type is None)
+
+    def _header(self, start_time, end_time):
+        """CACH group, keeps track of where ETIM lives to patch it later
+
+        Args:
+            start_time (int): ticks
+            end_time (int): ticks
+
+        Returns:
+            bytes: packed header group
+        """
+        vrsn = _pack_chunk(b"VRSN", b"0.1\x00", self.cache_format)
+        stim = _pack_chunk(b"STIM", _pack_int(start_time), self.cache_format)
+        etim = _pack_chunk(b"ETIM", _pack_int(end_time), self.cache_format)
+        group = _pack_group(b"CACH", vrsn + stim + etim, self.cache_format)
+        self._etim_offset = len(group) - 4
+        return group
+
+    def _open_one_file(self):
+        name = "{}.{}".format(self.base_name, self.cache_format)
+        path = os.path.join(self.cache_dir, name)
+        self._file = open(path, "wb")
+        self._file.write(self._header(self.start_time, self.end_time))
+        self.data_paths.append(path)
+
+    def _pack_channels(self, channel_points):
+        """CHNM, SIZE and data chunks of every channel of a sample
+
+        Args:
+            channel_points (dict): channel: array
+
+        Returns:
+            bytes: packed chunks
+        """
+        packed = []
+        for channel in self.channels:
+            tag = self._tags[channel]
+            width = 3 if tag in VECTOR_TAGS else 1
+            points = np.ascontiguousarray(channel_points[channel],
+                                          dtype=DATA_DTYPES[tag])
+            count = points.size // width
+            name = channel.encode("utf-8") + b"\x00"
+            packed.append(_pack_chunk(b"CHNM", name, self.cache_format))
+            packed.append(_pack_chunk(b"SIZE", _pack_int(count),
+                                      self.cache_format))
+            packed.append(_pack_chunk(tag, points.tobytes(),
+                                      self.cache_format))
+        return b"".join(packed)
+
+    def write_frame(self, frame, points):
+        """Append a sample. Frames have to be written in increasing order.
+
+        Args:
+            frame (float): frame number
+            points (numpy.ndarray, dict): (verts, 3) array for single channel
+            caches, or channel: array
+
+        Raises:
+            ValueError: if the frame is not after the previous one
+        """
+        if not isinstance(points, dict):
+            points = {self.channels[0]: points}
+        time = int(round(frame * self.time_per_frame))
+        if self._last_time is not None and time <= self._last_time:
+            msg = "Frame {} written out of order in {}"
+            raise ValueError(msg.format(frame, self.base_name))
+
+        if self.cache_type == ONE_FILE:
+            content = _pack_chunk(b"TIME", _pack_int(time), self.cache_format)
+            content += self._pack_channels(points)
+            self._file.write(_pack_group(b"MYCH", content, self.cache_format))
+        else:
+            # like maya, the frame before a subframe sample and the ticks
+            # after it, frame -1.5 is Frame-2Tick125 not Frame-1Tick-125
+            whole_frame = time // self.time_per_frame
+            sub_tick = time % self.time_per_frame
+            name = "{}Frame{}".format(self.base_name, whole_frame)
+            if sub_tick:
+                name = "{}Tick{}".format(name, sub_tick)
+            path = os.path.join(self.cache_dir,
+                                "{}.{}".format(name, self.cache_format))
+            with open(path, "wb") as f:
+                f.write(self._header(time, time))
+                f.write(_pack_group(b"MYCH",
+                                    self._pack_channels(points),
+                                    self.cache_format))
+            self.data_paths.append(path)
+        self._last_time = time
+
+    def write_frames(self, frames_points, start_frame=None):
+        """Write consecutive frames from an iterable
+
+        Args:
+            frames_points (iterable): of (verts, 3) arrays or dicts, a
+            (frames, verts, 3) array works too
+            start_frame (float, optional): defaults to the writer start
+        """
+        if start_frame is None:
+            start_frame = self.start_time / self.time_per_frame
+        for index, points in enumerate(frames_points):
+            self.write_frame(start_frame + index, points)
+
+    def close(self, write_xml=True):
+        """Finish the data file, fixing the end time of the header if the
+        stream did not reach the expected end, then write the xml and the
+        frame index
+
+        Args:
+            write_xml (bool, optional): skip the xml, used when aborting
+
+        Returns:
+            str: path to the xml
+        """
+        if self._last_time is not None:
+            self.end_time = self._last_time
+        if self._file is not None:
+            self._file.seek(self._etim_offset)
+            self._file.write(_pack_int(self.end_time))
+            self._file.close()
+            self._file = None
+        if write_xml:
+            write_description(self.xml_path,
+                              self.channels,
+                              self.start_time,
+                              self.end_time,
+                              time_per_frame=self.time_per_frame,
+                              cache_type=self.cache_type,
+                              cache_format=self.cache_format,
+                              channel_type=self.channel_type,
+                              channel_info=self.channel_info)
+            if self.cache_type == ONE_FILE:
+                write_frame_index(self.xml_path)
+        return self.xml_path
+
+
+def write_cache(cache_dir, base_name, frames_points, start_frame, **kwargs):
+    """Convenience, write a whole block or stream of frames as a cache
+
+    Args:
+        cache_dir (str): output directory
+        base_name (str): name of the xml/data files
+        frames_points (iterable): (frames, verts, 3) array or a generator of
+        (verts, 3) arrays
+        start_frame (float): frame of the first sample
+        **kwargs: passed to CacheWriter
+
+    Returns:
+        str: path to the written xml
+    """
+    if "end_frame" not in kwargs and hasattr(frames_points, "__len__"):
+        kwargs["end_frame"] = start_frame + len(frames_points) - 1
+    with CacheWriter(cache_dir, base_name, start_frame, **kwargs) as writer:
+        writer.write_frames(frames_points)
+    return writer.xml_path
+
+
+class AsyncCacheWriter(object):
+
+    """Several CacheWriters fed from one thread in the background, frames are
+    queued and written while the caller evaluates the next one. A full queue
+    blocks the caller, memory stays bounded when the disk is slower.
+
+    writer = AsyncCacheWriter({"shirtShape": CacheWriter(...)})
+    writer.write_frame("shirtShape", 1001, points)
+    xml_paths = writer.close()
+
+    Attributes:
+        writers (dict): name: CacheWriter
+    """
+
+    def __init__(self, writers, max_frames=8):
+        super(AsyncCacheWriter, self).__init__()
+        self.writers = writers
+        self._queue = queue.Queue(max_frames)
+        self._error = None
+        self._thread = threading.Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__,
+                               sorted(self.writers.keys()))
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            name, frame, points = item
+            try:
+                self.writers[name].write_frame(frame, points)
+            except Exception as e:
+                self._error = e
+
+    def write_frame(self, name, frame, points):
+        """Queue a sample of one of the caches, see CacheWriter.write_frame.
+        The points are written later, pass a copy if they are reused.
+
+        Args:
+            name (str): of the writer
+            frame (float): frame number
+            points (numpy.ndarray, dict): see CacheWriter.write_frame
+
+        Raises:
+            Exception: the first error of the thread, if there was one
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((name, frame, points))
+
+    def close(self, write_xml=True):
+        """Write what is queued and close every writer
+
+        Args:
+            write_xml (bool, optional): skip the xmls, used when aborting
+
+        Returns:
+            dict: name: xml path
+
+        Raises:
+            Exception: the first error of the thread, if there was one
+        """
+        self._queue.put(None)
+        self._thread.join()
+        write_xml = write_xml and self._error is None
+        xml_paths = {}
+        for name, writer in self.writers.items():
+            xml_paths[name] = writer.close(write_xml=write_xml)
+        if self._error is not None:
+            raise self._error
+        return xml_paths
+
+
+def merge_caches(xml_paths,
+                 cache_dir,
+                 base_name=None,
+                 cache_type=ONE_FILE,
+                 overwrite=False):
+    """Concatenate caches of the same geometry into one, in the order given.
+    Samples already written by an earlier cache are skipped, so overlapping
+    segments keep the data of the first one.
+
+    Args:
+        xml_paths (list): of cache xmls, every one with the same channels
+        cache_dir (str): output directory
+        base_name (str, optional): defaults to the name of the first cache
+        cache_type (str, optional): OneFile or OneFilePerFrame
+        overwrite (bool, optional): allow replacing an existing cache
+
+    Returns:
+        str: path to the merged xml
+
+    Raises:
+        IOError: output exists and overwrite is False
+        CacheFormatError: if the channels of the caches do not match
+    """
+    readers = [CacheReader(x) for x in xml_paths]
+    first = readers[0].description
+    base_name = base_name or first.base_name
+    xml_path = os.path.join(cache_dir, "{}.xml".format(base_name))
+    if os.path.exists(xml_path) and not overwrite:
+        raise IOError("Cache already exists: {}".format(xml_path))
+    for reader in readers[1:]:
+        if reader.channels != first.channel_names:
+            msg = "Channels of {} do not match {}"
+            raise CacheFormatError(msg.format(reader, first.xml_path))
+
+    channel_info = dict((x["ChannelName"], x) for x in first.channels)
+    start_time = min(x.times[0] for x in readers if x.times)
+    end_time = max(x.times[-1] for x in readers if x.times)
+    writer = CacheWriter(cache_dir,
+                         base_name,
+                         start_time / first.time_per_frame,
+                         end_frame=end_time / first.time_per_frame,
+                         channels=first.channel_names,
+                         fps=first.fps,
+                         cache_type=cache_type,
+                         cache_format=first.cache_format,
+                         channel_info=channel_info)
+    last_time = None
+    with writer:
+        for reader in readers:
+            for time in reader.times:
+                if last_time is not None and time <= last_time:
+                    continue
+                points = dict((x, reader.get_time(time, x))
+                              for x in reader.channels)
+                writer.write_frame(time / first.time_per_frame, points)
+                last_time = time
+            reader.close()
+    return writer.xml_path
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Manifest written next to techanim caches at cache time.
+
+One small json per cache dir answers "what is cached here, and for which
+range" without querying the scene or parsing every cache xml.
+
+<cache dir>/techanim_manifest.json
+    {"version": 1,
+     "setup": "techanim_setup",
+     "target_namespace": "char01",
+     "updated": "2020-01-01T12:00:00",
+     "caches": {
+        "shirt_nCloth": {"layer": "sim",
+                         "node": "char01_TA:shirt_nCloth",
+                         "xml": ["shirt_nClothShape.xml"],
+                         "frame_range": [975, 1125],
+                         "preroll": 25,
+                         "postroll": 25,
+                         "distribution": "OneFile",
+                         "vertex_counts": {"shirt_nClothShape": 5000},
+                         "files": {"shirt_nClothShape.mcx": 60000000},
+                         "size": 60001234,
+                         "seconds": 120.5,
+                         "seconds_per_frame": 0.8,
+                         "cached_at": "2020-01-01T12:00:00",
+                         "inputs_key": "ab12...",
+                         "input_hashes": {...}}}}
+
+Attributes:
+    LOCK_TIMEOUT (int): seconds before a manifest lock is taken as stale
+    MANIFEST_NAME (str): file name of the manifest in the cache dir
+    MANIFEST_VERSION (int): bumped when the layout changes
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import json
+import time
+import errno
+import contextlib
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+MANIFEST_NAME = "techanim_manifest.json"
+MANIFEST_VERSION = 1
+LOCK_TIMEOUT = 60
+
+
+# =============================================================================
+# functions
+# =============================================================================
+
+def get_manifest_path(cache_dir):
+    """Path of the manifest of a cache dir
+
+    Args:
+        cache_dir (str): path
+
+    Returns:
+        str: path
+    """
+    return os.path.join(cache_dir, MANIFEST_NAME)
+
+
+def read_manifest(cache_dir, prune=True):
+    """Read the manifest of a cache dir
+
+    Args:
+        cache_dir (str): path
+        prune (bool, optional): drop entries whose xml is gone from disk
+
+    Returns:
+        dict: manifest, None if the dir has none
+    """
+    try:
+        with open(get_manifest_path(cache_dir), "r") as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if prune:
+        for name, entry in list(manifest.get("caches", {}).items()):
+            for xml_name in entry.get("xml", []):
+                if not os.path.exists(os.path.join(cache_dir, xml_name)):
+                    manifest["caches"].pop(name)
+                    break
+    return manifest
+
+
+def write_manifest(cache_dir, manifest):
+    """Write next to the destination and move it in place
+
+    Args:
+        cache_dir (str): path
+        manifest (dict): to store
+    """
+    config_io.write_json(manifest,
+                         get_manifest_path(cache_dir),
+                         sort_keys=True)
+
+
+@contextlib.contextmanager
+def lock_manifest(cache_dir):
+    """Hold the manifest of a cache dir while it is read and written back,
+    batch jobs caching different nuclei into one dir update it together.
+    A lock older than LOCK_TIMEOUT is left from a dead process and is taken.
+
+    Args:
+        cache_dir (str): path
+    """
+    lock_path = "{}.lock".format(get_manifest_path(cache_dir))
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+                os.remove(lock_path)
+                continue
+        except OSError:
+            continue
+        time.sleep(0.1)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def describe_cache(xml_path):
+    """Files, sizes and vertex counts of a cache, from the xml and the
+    frame index, the frame data is not read
+
+    Args:
+        xml_path (str): cache description
+
+    Returns:
+        dict: xml, files, size, vertex_counts and cached frame_range
+    """
+    reader = cache_io.CacheReader(xml_path)
+    try:
+        vertex_counts = {}
+        for channel in reader.channels:
+            vertex_counts[channel] = reader.get_point_count(channel)
+        desc = reader.description
+        file_paths = [xml_path] + sorted(desc.get_data_paths())
+    finally:
+        reader.close()
+    files = {}
+    for file_path in file_paths:
+        files[os.path.basename(file_path)] = os.path.getsize(file_path)
+    return {"xml": os.path.basename(xml_path),
+            "files": files,
+            "size": sum(files.values()),
+            "vertex_counts": vertex_counts,
+            "cached_range": [desc.start_frame, desc.end_frame]}
+
+
+def update_manifest(cache_dir, caches, setup=None, target_namespace=None):
+    """Add or replace cache entries in the manifest of a cache dir. The
+    per cache info of describe_cache is filled in for every xml.
+
+    Args:
+        cache_dir (str): path
+        caches (dict): name: entry, entry["xml"] is a list of xml paths in
+        the dir, anything else in the entry is stored as is
+        setup (str, optional): setup root the caches belong to
+        target_namespace (str, optional): namespace the setup drives
+
+    Returns:
+        dict: the written manifest
+    """
+    described = {}
+    for name, entry in caches.items():
+        entry = dict(entry)
+        entry["files"] = {}
+        entry["vertex_counts"] = {}
+        xml_names = []
+        for xml_path in entry.get("xml", []):
+            info = describe_cache(xml_path)
+            xml_names.append(info["xml"])
+            entry["files"].update(info["files"])
+            entry["vertex_counts"].update(info["vertex_counts"])
+        entry["xml"] = xml_names
+        entry["size"] = sum(entry["files"].values())
+        described[name] = entry
+    with lock_manifest(cache_dir):
+        manifest = read_manifest(cache_dir) or {"caches": {}}
+        manifest["version"] = MANIFEST_VERSION
+        if setup is not None:
+            manifest["setup"] = setup
+        if target_namespace is not None:
+            manifest["target_namespace"] = target_namespace
+        manifest["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        manifest["caches"].update(described)
+        write_manifest(cache_dir, manifest)
+    return manifest
+
+
+def get_cached_ranges(cache_dir, layer=None):
+    """What is cached in a dir and for which range
+
+    Args:
+        cache_dir (str): path
+        layer (str, optional): only entries of this layer, input or sim
+
+    Returns:
+        dict: name: [start, end], empty if there is no manifest
+    """
+    manifest = read_manifest(cache_dir) or {}
+    ranges = {}
+    for name, entry in manifest.get("caches", {}).items():
+        if layer and entry.get("layer") != layer:
+            continue
+        ranges[name] = entry.get("frame_range")
+    return ranges
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""Factorize cloth caches into a vertex basis plus per frame coefficients,
+without Maya.
+
+Cloth moves in far fewer ways than it has vertices. A cache is stored as its
+mean shape, a handful of basis shapes and a few coefficients per frame,
+usually a small fraction of the mcx, which is what matters when streaming
+dozens of garments over the network for review. Rebuilding a frame is a
+single matrix multiply.
+
+The number of components is the smallest that keeps the rms vertex error
+under the budget, then grown until the largest vertex error is under
+max_error if one is given.
+
+python -m techanim_flow.cache_pca compress shirtShape.xml -o /review --rms 0.02
+python -m techanim_flow.cache_pca expand /review/shirtShape.pca.npz -o /caches
+
+Attributes:
+    BASIS_EXT (str): extension of a factorized cache
+    BASIS_VERSION (int): bumped when the layout changes
+    DEFAULT_RMS_ERROR (float): rms vertex error budget in scene units
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import glob
+import json
+import argparse
+
+import numpy as np
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+BASIS_EXT = ".pca.npz"
+BASIS_VERSION = 1
+DEFAULT_RMS_ERROR = 0.02
+# frames reconstructed at a time when measuring the max error
+_ERROR_BLOCK = 128
+
+
+# =============================================================================
+# factorization
+# =============================================================================
+
+def read_channel_matrix(reader, channel):
+    """Every frame of a channel as one row, in float32
+
+    Args:
+        reader (CacheReader): opened cache
+        channel (str): name
+
+    Returns:
+        numpy.ndarray: (frames, count * width)
+
+    Raises:
+        CacheFormatError: if the point count changes or there are NaNs
+    """
+    times = reader.times
+    first = reader.get_time(times[0], channel)
+    matrix = np.empty((len(times), first.size), dtype=np.float32)
+    for index, time in enumerate(times):
+        points = reader.get_time(time, channel)
+        if points.shape != first.shape:
+            msg = "{} changes point count at time {}, cannot factorize."
+            raise cache_io.CacheFormatError(msg.format(reader, time))
+        matrix[index] = points.reshape(-1)
+    if not np.isfinite(matrix).all():
+        msg = "{} has non finite points, cannot factorize.".format(reader)
+        raise cache_io.CacheFormatError(msg)
+    return matrix
+
+
+def get_max_vertex_error(centered, coefficients, basis, width):
+    """Largest distance between a vertex and its reconstruction
+
+    Args:
+        centered (numpy.ndarray): (frames, values), mean removed
+        coefficients (numpy.ndarray): (frames, components)
+        basis (numpy.ndarray): (components, values)
+        width (int): values per vertex
+
+    Returns:
+        float: distance in scene units
+    """
+    max_error = 0.0
+    for start in range(0, centered.shape[0], _ERROR_BLOCK):
+        end = start + _ERROR_BLOCK
+        residual = centered[start:end] - coefficients[start:end].dot(basis)
+        residual = residual.reshape(residual.shape[0], -1, width)
+        distance = np.sqrt((residual * residual).sum(axis=-1))
+        if distance.size:
+            max_error = max(max_error, float(distance.max()))
+    return max_error
+
+
+def factorize(matrix,
+              rms_error=DEFAULT_RMS_ERROR,
+              max_error=None,
+              max_components=None,
+              width=3):
+    """Principal components of the frames, as few as the budget allows.
+    Solved through the frames x frames gram matrix, caches have far fewer
+    frames than values.
+
+    Args:
+        matrix (numpy.ndarray): (frames, values) from read_channel_matrix
+        rms_error (float, optional): rms vertex error budget
+        max_error (float, optional): largest vertex error allowed
+        max_components (int, optional): never use more than this
+        width (int, optional): values per vertex
+
+    Returns:
+        dict: mean (values,), basis (components, values), coefficients
+        (frames, components), rms_error and max_error reached
+    """
+    frame_count, value_count = matrix.shape
+    vertex_count = max(value_count // width, 1)
+    mean = matrix.mean(axis=0, dtype=np.float64)
+    centered = matrix - mean.astype(np.float32)
+    gram = centered.astype(np.float64).dot(centered.T.astype(np.float64))
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    order = np.argsort(eigenvalues)[::-1]
+    eigenvalues = np.clip(eigenvalues[order], 0.0, None)
+    eigenvectors = eigenvectors[:, order]
+    rank = int(np.count_nonzero(eigenvalues > eigenvalues[0] * 1e-12)
+               if eigenvalues.size and eigenvalues[0] > 0 else 0)
+    limit = rank if max_components is None else min(rank, max_components)
+
+    # residual energy per component count, straight from the eigenvalues
+    remaining = np.concatenate([np.cumsum(eigenvalues[::-1])[::-1], [0.0]])
+    rms = np.sqrt(remaining / (frame_count * vertex_count))
+    component_count = limit
+    for count in range(limit + 1):
+        if rms[count] <= rms_error:
+            component_count = count
+            break
+
+    def solve(count):
+        values = eigenvalues[:count]
+        vectors = eigenvectors[:, :count]
+        scale = np.sqrt(values)
+        basis = (vectors.T.dot(centered.astype(np.float64)) /
+                 scale[:, None]).astype(np.float32)
+        coefficients = (vectors * scale).astype(np.float32)
+        return basis, coefficients
+
+    basis, coefficients = solve(component_count)
+    reached = get_max_vertex_error(centered, coefficients, basis, width)
+    while (max_error is not None and
+           reached > max_error and
+           component_count < limit):
+        component_count = min(limit, int(component_count * 1.5) + 1)
+        basis, coefficients = solve(component_count)
+        reached = get_max_vertex_error(centered, coefficients, basis, width)
+    return {"mean": mean.astype(np.float32),
+            "basis": basis,
+            "coefficients": coefficients,
+            "rms_error": float(rms[component_count]),
+            "max_error": reached}
+
+
+def compress_cache(xml_path,
+                   basis_path=None,
+                   rms_error=DEFAULT_RMS_ERROR,
+                   max_error=None,
+                   max_components=None):
+    """Factorize every channel of a cache into a basis file
+
+    Args:
+        xml_path (str): cache description
+        basis_path (str, optional): defaults to <xml name>.pca.npz next to it
+        rms_error (float, optional): rms vertex error budget
+        max_error (float, optional): largest vertex error allowed
+        max_components (int, optional): never use more than this per channel
+
+    Returns:
+        str: path to the basis file
+    """
+    if not basis_path:
+        basis_path = "{}{}".format(os.path.splitext(xml_path)[0], BASIS_EXT)
+    arrays = {}
+    with cache_io.CacheReader(xml_path) as reader:
+        desc = reader.description
+        header = {"version": BASIS_VERSION,
+                  "base_name": desc.base_name,
+                  "cache_type": desc.cache_type,
+                  "cache_format": desc.cache_format,
+                  "time_per_frame": desc.time_per_frame,
+                  "times": reader.times,
+                  "channels": []}
+        for index, channel_desc in enumerate(desc.channels):
+            channel = channel_desc["ChannelName"]
+            sample = reader.get_time(reader.times[0], channel)
+            width = sample.shape[1] if sample.ndim == 2 else 1
+            matrix = read_channel_matrix(reader, channel)
+            result = factorize(matrix,
+                               rms_error=rms_error,
+                               max_error=max_error,
+                               max_components=max_components,
+                               width=width)
+            for key in ["mean", "basis", "coefficients"]:
+                arrays["{}_{}".format(key, index)] = result[key]
+            header["channels"].append({
+                "name": channel,
+                "info": dict((k, v) for k, v in channel_desc.items()
+                             if k in ["ChannelType", "ChannelInterpretation"]),
+                "shape": list(sample.shape),
+                "components": int(result["basis"].shape[0]),
+                "rms_error": result["rms_error"],
+                "max_error": result["max_error"]})
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"),
+                                     dtype=np.uint8)
+    # np.savez adds .npz to anything not ending in it
+    temp_path = "{}.npz".format(config_io.get_temp_path(
+        basis_path[:-len(".npz")] if basis_path.endswith(".npz")
+        else basis_path))
+    np.savez(temp_path, **arrays)
+    config_io.replace_file(temp_path, basis_path)
+    return basis_path
+
+
+# =============================================================================
+# reading
+# =============================================================================
+
+class BasisReader(object):
+
+    """Reconstruct frames from a basis file, each one a single matrix
+    multiply
+
+    with BasisReader("/review/shirtShape.pca.npz") as reader:
+        points = reader.get_frame(1001)
+
+    Attributes:
+        basis_path (str): path to the basis file
+        header (dict): layout and description of the factorized cache
+    """
+
+    def __init__(self, basis_path):
+        super(BasisReader, self).__init__()
+        self.basis_path = basis_path
+        with np.load(basis_path) as data:
+            self.header = json.loads(data["header"].tobytes().decode("utf-8"))
+            if self.header["version"] > BASIS_VERSION:
+                msg = "{} is basis version {}, this reads up to {}"
+                raise cache_io.CacheFormatError(
+                    msg.format(basis_path, self.header["version"],
+                               BASIS_VERSION))
+            self._arrays = {}
+            for index, channel in enumerate(self.header["channels"]):
+                self._arrays[channel["name"]] = [
+                    data["mean_{}".format(index)],
+                    data["basis_{}".format(index)],
+                    data["coefficients_{}".format(index)]]
+        self._time_index = dict((x, i) for i, x in enumerate(self.times))
+        self._shapes = dict((x["name"], x["shape"])
+                            for x in self.header["channels"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.basis_path)
+
+    def close(self):
+        self._arrays = {}
+
+    @property
+    def times(self):
+        return self.header["times"]
+
+    @property
+    def frames(self):
+        return [x / self.header["time_per_frame"] for x in self.times]
+
+    @property
+    def channels(self):
+        return [x["name"] for x in self.header["channels"]]
+
+    def get_time(self, time, channel=None):
+        """Reconstructed sample by time
+
+        Args:
+            time (int): ticks
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: float32, (count, 3) for vector channels
+
+        Raises:
+            KeyError: if the time is not in the basis file
+        """
+        channel = channel or self.channels[0]
+        if time not in self._time_index:
+            raise KeyError("No sample at time {} in {}".format(time, self))
+        mean, basis, coefficients = self._arrays[channel]
+        points = mean + coefficients[self._time_index[time]].dot(basis)
+        return points.reshape(self._shapes[channel])
+
+    def get_frame(self, frame, channel=None):
+        """Reconstructed frame, see get_time
+
+        Args:
+            frame (float): frame number
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: float32
+        """
+        time = int(round(frame * self.header["time_per_frame"]))
+        return self.get_time(time, channel)
+
+    def get_frames(self, frames, channel=None):
+        """Several frames in one matrix multiply, for playback buffers
+
+        Args:
+            frames (list): of frame numbers
+            channel (str, optional): defaults to the first channel
+
+        Returns:
+            numpy.ndarray: (frames, count, 3)
+        """
+        channel = channel or self.channels[0]
+        mean, basis, coefficients = self._arrays[channel]
+        time_per_frame = self.header["time_per_frame"]
+        rows = [self._time_index[int(round(x * time_per_frame))]
+                for x in frames]
+        points = mean + coefficients[rows].dot(basis)
+        return points.reshape([len(rows)] + self._shapes[channel])
+
+    def iter_frames(self, channel=None):
+        """Iterate over every sample in time order
+
+        Args:
+            channel (str, optional): defaults to the first channel
+
+        Yields:
+            tuple: frame, numpy.ndarray
+        """
+        for time in self.times:
+            yield (time / self.header["time_per_frame"],
+                   self.get_time(time, channel))
+
+
+def expand_cache(basis_path,
+                 cache_dir,
+                 base_name=None,
+                 cache_type=None,
+                 overwrite=False):
+    """Write the reconstructed frames back out as a maya cache
+
+    Args:
+        basis_path (str): factorized cache
+        cache_dir (str): output directory
+        base_name (str, optional): defaults to the original name
+        cache_type (str, optional): defaults to the original distribution
+        overwrite (bool, optional): allow replacing an existing cache
+
+    Returns:
+        str: path to the xml
+
+    Raises:
+        IOError: output exists and overwrite is False
+    """
+    with BasisReader(basis_path) as reader:
+        header = reader.header
+        base_name = base_name or header["base_name"]
+        xml_path = os.path.join(cache_dir, "{}.xml".format(base_name))
+        if os.path.exists(xml_path) and not overwrite:
+            raise IOError("Cache already exists: {}".format(xml_path))
+        times = reader.times
+        time_per_frame = header["time_per_frame"]
+        channel_info = dict((x["name"], x["info"]) for x in header["channels"])
+        writer = cache_io.CacheWriter(
+            cache_dir,
+            base_name,
+            times[0] / time_per_frame,
+            end_frame=times[-1] / time_per_frame,
+            channels=reader.channels,
+            fps=cache_io.TICKS_PER_SECOND / time_per_frame,
+            cache_type=cache_type or header["cache_type"],
+            cache_format=header["cache_format"],
+            channel_info=channel_info)
+        with writer:
+            for time in times:
+                points = dict((x, reader.get_time(time, x))
+                              for x in reader.channels)
+                writer.write_frame(time / time_per_frame, points)
+    return writer.xml_path
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: 0 on success
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    compress_parser = subparsers.add_parser("compress",
+                                            help="cache to basis file")
+    compress_parser.add_argument("paths", nargs="+",
+                                 help="cache xmls or dirs")
+    compress_parser.add_argument("-o", "--output", default=None,
+                                 help="defaults next to the xml")
+    compress_parser.add_argument("--rms", type=float,
+                                 default=DEFAULT_RMS_ERROR,
+                                 help="rms vertex error budget")
+    compress_parser.add_argument("--max-error", type=float, default=None,
+                                 help="largest vertex error allowed")
+    compress_parser.add_argument("--max-components", type=int, default=None)
+    expand_parser = subparsers.add_parser("expand",
+                                          help="basis file to cache")
+    expand_parser.add_argument("paths", nargs="+",
+                               help="basis files or dirs")
+    expand_parser.add_argument("-o", "--output", required=True,
+                               help="cache dir")
+    expand_parser.add_argument("--cache-type", default=None,
+                               choices=cache_io.CACHE_DISTRIBUTIONS)
+    expand_parser.add_argument("--overwrite", action="store_true")
+    options = parser.parse_args(args)
+
+    if options.command == "compress":
+        if options.output and not os.path.exists(options.output):
+            os.makedirs(options.output)
+        xml_paths = []
+        for path in options.paths:
+            if os.path.isdir(path):
+                xml_paths.extend(x.xml_path for x in
+                                 cache_io.get_cache_descriptions(path))
+            else:
+                xml_paths.append(path)
+        for xml_path in xml_paths:
+            basis_path = None
+            if options.output:
+                name = os.path.splitext(os.path.basename(xml_path))[0]
+                basis_path = os.path.join(options.output, name + BASIS_EXT)
+            basis_path = compress_cache(xml_path,
+                                        basis_path,
+                                        rms_error=options.rms,
+                                        max_error=options.max_error,
+                                        max_components=options.max_components)
+            cache_size = sum(os.path.getsize(x) for x in
+                             cache_io.read_description(xml_path).get_data_paths())
+            ratio = cache_size / max(os.path.getsize(basis_path), 1)
+            with BasisReader(basis_path) as reader:
+                for channel in reader.header["channels"]:
+                    msg = "{} {}: {} components, rms {:.4f}, max {:.4f} ({:.1f}x)"
+                    print(msg.format(basis_path,
+                                     channel["name"],
+                                     channel["components"],
+                                     channel["rms_error"],
+                                     channel["max_error"],
+                                     ratio))
+    elif options.command == "expand":
+        basis_paths = []
+        for path in options.paths:
+            if os.path.isdir(path):
+                pattern = os.path.join(path, "*{}".format(BASIS_EXT))
+                basis_paths.extend(sorted(glob.glob(pattern)))
+            else:
+                basis_paths.append(path)
+        for basis_path in basis_paths:
+            xml_path = expand_cache(basis_path,
+                                    options.output,
+                                    cache_type=options.cache_type,
+                                    overwrite=options.overwrite)
+            print("{} -> {}".format(basis_path, xml_path))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,613 @@
+# -*- coding: utf-8 -*-
+"""Keep the techanim cache root under quota, without Maya.
+
+Every cache dir made by the manager, and every cache store entry, carries a
+small info file recording who made it, for what show and when it was last
+used. Sizes are measured when scanning. When a show, or a user within a show,
+is over its quota the least recently used dirs are removed first. Pinned dirs
+and dirs in use by a running Maya session are never removed.
+
+python -m techanim_flow.cache_quota [cache_root] --dry-run --json report.json
+
+Quotas come from "cache_quota_gb" in the config:
+    {"default": 500, "ATC": 2000, "ATC/rafael": 300}
+"show" applies to all users of the show, "show/user" to one user in it and
+"default" to any show without its own. 0 or missing means no limit.
+
+Attributes:
+    IN_USE_PREFIX (str): marker file left in a dir by a Maya session using it
+    IN_USE_TIMEOUT (int): seconds before a marker from another host is stale
+    INFO_NAME (str): owner, show and last access of a cache dir
+    PIN_NAME (str): a dir with this file is never evicted
+    SHOW_ENV (str): env var with the current show
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import socket
+import getpass
+import argparse
+import platform
+
+# techanim
+from techanim_flow import config_io
+from techanim_flow import cache_store
+
+# =============================================================================
+# constants
+# =============================================================================
+INFO_NAME = ".techanim_info.json"
+PIN_NAME = ".techanim_pin"
+IN_USE_PREFIX = ".techanim_in_use"
+IN_USE_TIMEOUT = 7 * 24 * 60 * 60
+SHOW_ENV = "TECHANIM_SHOW"
+DEFAULT_SHOW = "default"
+QUOTA_CONFIG_KEY = "cache_quota_gb"
+GB = 1024 ** 3
+
+
+# =============================================================================
+# cache dir info
+# =============================================================================
+
+def get_show():
+    """The show caches are made for
+
+    Returns:
+        str: from the env, or default
+    """
+    return os.environ.get(SHOW_ENV) or DEFAULT_SHOW
+
+
+def get_user():
+    """User caches are made by
+
+    Returns:
+        str: login name
+    """
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "unknown"
+
+
+def read_info(cache_dir):
+    """Info of a cache dir
+
+    Args:
+        cache_dir (str): path
+
+    Returns:
+        dict: info, empty if the dir was never registered
+    """
+    try:
+        with open(os.path.join(cache_dir, INFO_NAME), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _write_info(cache_dir, info):
+    """Write next to the destination and move it in place
+
+    Args:
+        cache_dir (str): path
+        info (dict): to store
+    """
+    config_io.write_json(info,
+                         os.path.join(cache_dir, INFO_NAME),
+                         sort_keys=True)
+
+
+def touch(cache_dir, show=None, user=None):
+    """Record that a cache dir was just used, registering it if new
+
+    Args:
+        cache_dir (str): path
+        show (str, optional): defaults to get_show, only used when new
+        user (str, optional): defaults to get_user, only used when new
+
+    Returns:
+        dict: the updated info
+    """
+    info = read_info(cache_dir)
+    now = time.time()
+    info.setdefault("show", show or get_show())
+    info.setdefault("user", user or get_user())
+    info.setdefault("created", now)
+    info["last_access"] = now
+    try:
+        _write_info(cache_dir, info)
+    except (IOError, OSError):
+        # read only caches still work, they are just not tracked
+        pass
+    return info
+
+
+def get_dir_size(cache_dir):
+    """Bytes used by everything in the dir
+
+    Args:
+        cache_dir (str): path
+
+    Returns:
+        int: bytes
+    """
+    size = 0
+    for dir_name, subdir_list, file_list in os.walk(cache_dir):
+        for file_name in file_list:
+            try:
+                size += os.lstat(os.path.join(dir_name, file_name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def get_last_access(cache_dir, info=None):
+    """Last access from the info, or the newest file for dirs that were
+    never registered. File atimes are not trusted, most volumes are noatime.
+
+    Args:
+        cache_dir (str): path
+        info (dict, optional): already read info
+
+    Returns:
+        float: seconds since epoch
+    """
+    info = read_info(cache_dir) if info is None else info
+    if info.get("last_access"):
+        return info["last_access"]
+    last_access = os.path.getmtime(cache_dir)
+    for dir_name, subdir_list, file_list in os.walk(cache_dir):
+        for file_name in file_list:
+            try:
+                mtime = os.path.getmtime(os.path.join(dir_name, file_name))
+            except OSError:
+                continue
+            last_access = max(last_access, mtime)
+    return last_access
+
+
+# =============================================================================
+# pinning and in use markers
+# =============================================================================
+
+def pin(cache_dir, reason=""):
+    """Never evict this dir
+
+    Args:
+        cache_dir (str): path
+        reason (str, optional): stored in the pin file for whoever finds it
+    """
+    with open(os.path.join(cache_dir, PIN_NAME), "w") as f:
+        f.write("{} {}\n".format(get_user(), reason))
+
+
+def unpin(cache_dir):
+    """Allow the dir to be evicted again
+
+    Args:
+        cache_dir (str): path
+    """
+    pin_path = os.path.join(cache_dir, PIN_NAME)
+    if os.path.exists(pin_path):
+        os.remove(pin_path)
+
+
+def is_pinned(cache_dir):
+    """Is the dir pinned
+
+    Args:
+        cache_dir (str): path
+
+    Returns:
+        bool: True False
+    """
+    return os.path.exists(os.path.join(cache_dir, PIN_NAME))
+
+
+def _get_in_use_name(host=None, pid=None):
+    """Marker file name for a process
+
+    Args:
+        host (str, optional): defaults to this host
+        pid (int, optional): defaults to this process
+
+    Returns:
+        str: file name
+    """
+    return "{}.{}.{}".format(IN_USE_PREFIX,
+                             host or socket.gethostname(),
+                             pid or os.getpid())
+
+
+def mark_in_use(cache_dir):
+    """Mark the dir as used by this process, the marker goes stale on its
+    own once the process is gone
+
+    Args:
+        cache_dir (str): path
+    """
+    marker_path = os.path.join(cache_dir, _get_in_use_name())
+    try:
+        with open(marker_path, "w") as f:
+            f.write(time.strftime("%Y-%m-%dT%H:%M:%S"))
+    except (IOError, OSError):
+        pass
+
+
+def release_in_use(cache_dir):
+    """Remove the marker of this process
+
+    Args:
+        cache_dir (str): path
+    """
+    marker_path = os.path.join(cache_dir, _get_in_use_name())
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+
+
+def is_pid_alive(pid):
+    """Is a process running on this host
+
+    Args:
+        pid (int): process id
+
+    Returns:
+        bool: True False
+    """
+    if platform.system() == "Windows":
+        # os.kill terminates the process on windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        process_query_limited_information = 0x1000
+        still_active = 259
+        handle = kernel32.OpenProcess(process_query_limited_information,
+                                      False,
+                                      pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == still_active
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def get_in_use_markers(cache_dir, timeout=IN_USE_TIMEOUT):
+    """Live in use markers of a dir. Markers from this host are live while
+    their process runs, markers from other hosts until they time out.
+
+    Args:
+        cache_dir (str): path
+        timeout (int, optional): see IN_USE_TIMEOUT
+
+    Returns:
+        list: of [host, pid]
+    """
+    markers = []
+    this_host = socket.gethostname()
+    try:
+        file_names = os.listdir(cache_dir)
+    except OSError:
+        return markers
+    for file_name in file_names:
+        if not file_name.startswith(IN_USE_PREFIX + "."):
+            continue
+        host, _, pid = file_name[len(IN_USE_PREFIX) + 1:].rpartition(".")
+        try:
+            pid = int(pid)
+        except ValueError:
+            continue
+        if host == this_host:
+            if not is_pid_alive(pid):
+                continue
+        else:
+            marker_path = os.path.join(cache_dir, file_name)
+            try:
+                if time.time() - os.path.getmtime(marker_path) > timeout:
+                    continue
+            except OSError:
+                continue
+        markers.append([host, pid])
+    return markers
+
+
+# =============================================================================
+# ledger
+# =============================================================================
+
+def get_techanim_dir(cache_root=None):
+    """The dir all techanim cache dirs are made in
+
+    Args:
+        cache_root (str, optional): defaults to the configured cache root
+
+    Returns:
+        str: path
+    """
+    cache_root = cache_root or config_io.get_cache_root()
+    if os.path.basename(os.path.normpath(cache_root)) == config_io.CACHE_DIR_NAME:
+        return cache_root
+    return os.path.join(cache_root, config_io.CACHE_DIR_NAME)
+
+
+def find_cache_dirs(cache_root=None, store_root=None):
+    """Cache dirs made by the manager plus every cache store entry
+
+    Args:
+        cache_root (str, optional): defaults to the configured cache root
+        store_root (str, optional): defaults to the configured store root
+
+    Returns:
+        list: of paths
+    """
+    techanim_dir = get_techanim_dir(cache_root)
+    suffix = config_io.CONFIG.get("cache_dir_suffix", "_techanim")
+    cache_dirs = []
+    if os.path.isdir(techanim_dir):
+        for dir_name in sorted(os.listdir(techanim_dir)):
+            dir_path = os.path.join(techanim_dir, dir_name)
+            if dir_name.endswith(suffix) and os.path.isdir(dir_path):
+                cache_dirs.append(dir_path)
+    if store_root is None and cache_root:
+        store_root = os.path.join(techanim_dir, cache_store.STORE_DIR_NAME)
+    cache_dirs.extend(cache_store.get_entries(store_root))
+    return cache_dirs
+
+
+def get_ledger(cache_dirs, timeout=IN_USE_TIMEOUT):
+    """Owner, size, last access and protection of every cache dir
+
+    Args:
+        cache_dirs (list): of paths
+        timeout (int, optional): see IN_USE_TIMEOUT
+
+    Returns:
+        list: of dicts sorted least recently used first
+    """
+    ledger = []
+    for cache_dir in cache_dirs:
+        if not os.path.isdir(cache_dir):
+            continue
+        info = read_info(cache_dir)
+        ledger.append({"path": cache_dir,
+                       "show": info.get("show", DEFAULT_SHOW),
+                       "user": info.get("user", "unknown"),
+                       "size": get_dir_size(cache_dir),
+                       "last_access": get_last_access(cache_dir, info),
+                       "pinned": is_pinned(cache_dir),
+                       "in_use": get_in_use_markers(cache_dir, timeout)})
+    ledger.sort(key=lambda x: x["last_access"])
+    return ledger
+
+
+# =============================================================================
+# eviction
+# =============================================================================
+
+def get_quotas(config=None):
+    """Quotas in bytes from the config
+
+    Args:
+        config (dict, optional): defaults to the techanim config
+
+    Returns:
+        dict: "default", "show" or "show/user": bytes
+    """
+    config = config_io.CONFIG if config is None else config
+    quotas = {}
+    for key, value in (config.get(QUOTA_CONFIG_KEY) or {}).items():
+        if key == "#" or not value:
+            continue
+        quotas[key] = int(float(value) * GB)
+    return quotas
+
+
+def get_scopes(ledger, quotas):
+    """Group the ledger by the quotas that apply to it
+
+    Args:
+        ledger (list): from get_ledger
+        quotas (dict): from get_quotas
+
+    Returns:
+        dict: "show" or "show/user": [quota, [ledger entries]], only scopes
+        with a quota
+    """
+    scopes = {}
+    for entry in ledger:
+        show_key = entry["show"]
+        user_key = "{}/{}".format(entry["show"], entry["user"])
+        if quotas.get(user_key):
+            scopes.setdefault(user_key, [quotas[user_key], []])
+            scopes[user_key][1].append(entry)
+        show_quota = quotas.get(show_key, quotas.get("default"))
+        if show_quota:
+            scopes.setdefault(show_key, [show_quota, []])
+            scopes[show_key][1].append(entry)
+    return scopes
+
+
+def get_over_quota(ledger, quotas):
+    """Scopes using more than their quota
+
+    Args:
+        ledger (list): from get_ledger
+        quotas (dict): from get_quotas
+
+    Returns:
+        dict: scope: bytes over quota
+    """
+    over_quota = {}
+    for scope, (quota, entries) in get_scopes(ledger, quotas).items():
+        used = sum(x["size"] for x in entries)
+        if used > quota:
+            over_quota[scope] = used - quota
+    return over_quota
+
+
+def get_evictions(ledger, quotas):
+    """Least recently used dirs to remove so every show, and every user in
+    a show, is under quota
+
+    Args:
+        ledger (list): from get_ledger
+        quotas (dict): from get_quotas
+
+    Returns:
+        list: of ledger entries to evict, in eviction order
+    """
+    scopes = get_scopes(ledger, quotas)
+    evictions = []
+    evicted = set()
+    # users first, whatever they free counts toward their show
+    for scope in sorted(scopes, key=lambda x: "/" not in x):
+        quota, entries = scopes[scope]
+        used = sum(x["size"] for x in entries if x["path"] not in evicted)
+        for entry in entries:
+            if used <= quota:
+                break
+            if (entry["path"] in evicted or
+                    entry["pinned"] or
+                    entry["in_use"]):
+                continue
+            evictions.append(entry)
+            evicted.add(entry["path"])
+            used -= entry["size"]
+    evictions.sort(key=lambda x: x["last_access"])
+    return evictions
+
+
+def evict(cache_dir, timeout=IN_USE_TIMEOUT):
+    """Remove a cache dir, unless it got pinned or used since the ledger
+    was made
+
+    Args:
+        cache_dir (str): path
+        timeout (int, optional): see IN_USE_TIMEOUT
+
+    Returns:
+        bool: True if removed
+    """
+    if is_pinned(cache_dir) or get_in_use_markers(cache_dir, timeout):
+        return False
+    # an entry without its info file is incomplete and never looked up
+    store_info = os.path.join(cache_dir, cache_store.STORE_INFO_NAME)
+    if os.path.exists(store_info):
+        os.remove(store_info)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return not os.path.exists(cache_dir)
+
+
+def enforce_quotas(cache_root=None,
+                   store_root=None,
+                   quotas=None,
+                   dry_run=False,
+                   timeout=IN_USE_TIMEOUT):
+    """Scan, then evict least recently used dirs until under quota
+
+    Args:
+        cache_root (str, optional): defaults to the configured cache root
+        store_root (str, optional): defaults to the configured store root
+        quotas (dict, optional): defaults to get_quotas
+        dry_run (bool, optional): report only, remove nothing
+        timeout (int, optional): see IN_USE_TIMEOUT
+
+    Returns:
+        dict: ledger, evicted, skipped and freed bytes
+    """
+    quotas = get_quotas() if quotas is None else quotas
+    ledger = get_ledger(find_cache_dirs(cache_root, store_root), timeout)
+    evicted = []
+    skipped = []
+    freed = 0
+    for entry in get_evictions(ledger, quotas):
+        if dry_run or evict(entry["path"], timeout):
+            evicted.append(entry["path"])
+            freed += entry["size"]
+        else:
+            skipped.append(entry["path"])
+    return {"date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "dry_run": dry_run,
+            "quotas": quotas,
+            "ledger": ledger,
+            "evicted": evicted,
+            "skipped": skipped,
+            "freed": freed}
+
+
+def main(args=None):
+    """Command line entry, meant for cron
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: 0 under quota, 1 still over quota after evicting, pinned and
+        in use dirs can keep a scope over
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cache_root",
+                        nargs="?",
+                        default=None,
+                        help="defaults to the techanim cache dir")
+    parser.add_argument("--store-root", default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--json", dest="json_path", default=None)
+    parser.add_argument("--default-gb",
+                        type=float,
+                        default=None,
+                        help="overrides the default quota from the config")
+    parser.add_argument("--in-use-timeout",
+                        type=int,
+                        default=IN_USE_TIMEOUT,
+                        help="seconds before other hosts markers are stale")
+    options = parser.parse_args(args)
+
+    quotas = get_quotas()
+    if options.default_gb is not None:
+        quotas["default"] = int(options.default_gb * GB)
+    report = enforce_quotas(cache_root=options.cache_root,
+                            store_root=options.store_root,
+                            quotas=quotas,
+                            dry_run=options.dry_run,
+                            timeout=options.in_use_timeout)
+    if options.json_path:
+        config_io.write_json(report, options.json_path)
+
+    verb = "Would evict" if options.dry_run else "Evicted"
+    for path in report["evicted"]:
+        print("{}: {}".format(verb, path))
+    for path in report["skipped"]:
+        print("Skipped, in use or pinned: {}".format(path))
+    msg = "{} {} dirs, {:.2f} GB of {:.2f} GB"
+    print(msg.format(verb,
+                     len(report["evicted"]),
+                     report["freed"] / GB,
+                     sum(x["size"] for x in report["ledger"]) / GB))
+
+    remaining = [x for x in report["ledger"]
+                 if x["path"] not in report["evicted"]]
+    over_quota = get_over_quota(remaining, quotas)
+    for scope, over in sorted(over_quota.items()):
+        print("Over quota: {} by {:.2f} GB".format(scope, over / GB))
+    return 1 if over_quota else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""Stitch nCloth caches simulated in overlapping chunks, without Maya.
+
+A long range is split into chunks that are simulated at the same time. Every
+chunk but the first starts earlier than the frame it takes over at, first
+a warmup so the cloth settles from the input pose, then an overlap window
+where it is crossfaded in over the chunk before it:
+
+    chunk 0  |=====================|
+    chunk 1          |warmup|overlap|====================|
+                                    ^ seam, chunk 1 only from here
+
+Inside the window every vertex moves from the previous chunk to the next
+with a smoothstep weight. Two simulations of the same cloth never agree
+exactly, the seam report says by how much, so artists can judge a shot:
+
+    max_gap      largest distance between the chunks at one vertex and frame
+                 inside the window, what the crossfade has to hide
+    step_ratio   largest per frame vertex motion in the window over the one
+                 just before it, well above 1 is a visible pop
+
+Attributes:
+    REPORT_SUFFIX (str): seam report written next to a stitched cache
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+REPORT_SUFFIX = "_seams.json"
+
+
+# =============================================================================
+# chunks
+# =============================================================================
+
+def get_chunks(start_frame, end_frame, chunks, overlap=10, warmup=25):
+    """Split a range into chunks to simulate apart
+
+    Args:
+        start_frame (int): first frame, preroll included
+        end_frame (int): last frame
+        chunks (int): how many
+        overlap (int, optional): frames crossfaded at every seam
+        warmup (int, optional): frames simulated before the overlap and
+        thrown away, for the cloth to settle
+
+    Returns:
+        list: of dicts, sim_start and sim_end to simulate, seam the frame the
+        chunk takes over at, blend_start where the crossfade starts
+    """
+    chunks = max(min(chunks, end_frame - start_frame), 1)
+    length = (end_frame - start_frame) / chunks
+    seams = [int(round(start_frame + length * x)) for x in range(chunks)]
+    seams.append(end_frame)
+    chunk_list = []
+    for index in range(chunks):
+        seam = seams[index]
+        blend_start = seam - overlap if index else seam
+        sim_start = blend_start - warmup if index else seam
+        chunk_list.append({"sim_start": sim_start,
+                           "sim_end": seams[index + 1],
+                           "seam": seam,
+                           "blend_start": blend_start})
+    return chunk_list
+
+
+def get_blend_weight(frame, blend_start, seam):
+    """Weight of the later chunk, smoothstep over the window
+
+    Args:
+        frame (float): frame number
+        blend_start (float): weight 0 here
+        seam (float): weight 1 here and after
+
+    Returns:
+        float: 0 to 1
+    """
+    if frame >= seam:
+        return 1.0
+    if frame <= blend_start:
+        return 0.0
+    s = (frame - blend_start) / (seam - blend_start)
+    return s * s * (3.0 - 2.0 * s)
+
+
+# =============================================================================
+# stitching
+# =============================================================================
+
+class _SeamStats(object):
+    """Gaps and steps seen around one seam while stitching
+    """
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.max_gap = 0.0
+        self.gap_sum = 0.0
+        self.gap_count = 0
+        self.max_gap_frame = None
+        self.max_gap_vertex = None
+        self.max_gap_channel = None
+        self.max_step = 0.0
+        self.baseline_step = 0.0
+
+    def add_gap(self, frame, channel, prev_points, next_points):
+        gaps = np.linalg.norm(next_points.astype(np.float64) - prev_points,
+                              axis=1)
+        if not gaps.size:
+            return
+        vertex = int(np.argmax(gaps))
+        if gaps[vertex] >= self.max_gap:
+            self.max_gap = float(gaps[vertex])
+            self.max_gap_frame = frame
+            self.max_gap_vertex = vertex
+            self.max_gap_channel = channel
+        self.gap_sum += float(gaps.sum())
+        self.gap_count += gaps.size
+
+    def to_dict(self):
+        baseline = self.baseline_step
+        return {"seam": self.chunk["seam"],
+                "blend_range": [self.chunk["blend_start"], self.chunk["seam"]],
+                "max_gap": self.max_gap,
+                "mean_gap": self.gap_sum / max(self.gap_count, 1),
+                "max_gap_frame": self.max_gap_frame,
+                "max_gap_vertex": self.max_gap_vertex,
+                "max_gap_channel": self.max_gap_channel,
+                "max_step": self.max_step,
+                "baseline_step": baseline,
+                "step_ratio": self.max_step / baseline if baseline else None}
+
+
+def stitch_caches(xml_paths,
+                  chunks,
+                  cache_dir,
+                  base_name=None,
+                  cache_type=cache_io.ONE_FILE,
+                  overwrite=False):
+    """Crossfade the caches of one geometry simulated in chunks into one
+
+    Args:
+        xml_paths (list): a cache per chunk, in chunk order
+        chunks (list): from get_chunks, the ranges they were simulated with
+        cache_dir (str): output directory
+        base_name (str, optional): defaults to the name of the first cache
+        cache_type (str, optional): OneFile or OneFilePerFrame
+        overwrite (bool, optional): allow replacing an existing cache
+
+    Returns:
+        tuple: merged xml path, list of seam reports, see the module doc
+
+    Raises:
+        IOError: output exists and overwrite is False
+        CacheFormatError: if the channels of the caches do not match
+        KeyError: if a chunk is missing a sample it is needed for
+    """
+    readers = [cache_io.CacheReader(x) for x in xml_paths]
+    first = readers[0].description
+    base_name = base_name or first.base_name
+    xml_path = os.path.join(cache_dir, "{}.xml".format(base_name))
+    if os.path.exists(xml_path) and not overwrite:
+        raise IOError("Cache already exists: {}".format(xml_path))
+    for reader in readers[1:]:
+        if reader.channels != first.channel_names:
+            msg = "Channels of {} do not match {}"
+            raise cache_io.CacheFormatError(msg.format(reader, first.xml_path))
+
+    # every sample from where a chunk is kept, the crossfade included
+    times = set()
+    for index, reader in enumerate(readers):
+        keep_time = first.frame_to_time(chunks[index]["blend_start"])
+        times.update([x for x in reader.times if x >= keep_time])
+    times = sorted(times)
+
+    seam_stats = [_SeamStats(x) for x in chunks[1:]]
+    channel_info = dict((x["ChannelName"], x) for x in first.channels)
+    writer = cache_io.CacheWriter(cache_dir,
+                                  base_name,
+                                  first.time_to_frame(times[0]),
+                                  end_frame=first.time_to_frame(times[-1]),
+                                  channels=first.channel_names,
+                                  fps=first.fps,
+                                  cache_type=cache_type,
+                                  cache_format=first.cache_format,
+                                  channel_info=channel_info)
+    last_points = None
+    last_frame = None
+    with writer:
+        for time in times:
+            frame = first.time_to_frame(time)
+            index = 0
+            for chunk_index, chunk in enumerate(chunks):
+                if chunk_index and frame >= chunk["blend_start"]:
+                    index = chunk_index
+            chunk = chunks[index]
+            weight = 1.0
+            if index:
+                weight = get_blend_weight(frame,
+                                          chunk["blend_start"],
+                                          chunk["seam"])
+            # samples on the seam are compared too, with no overlap that
+            # is the only frame both chunks have
+            in_window = index and frame <= chunk["seam"] and \
+                time in readers[index - 1].frame_index
+
+            points = {}
+            for channel in first.channel_names:
+                next_points = readers[index].get_time(time, channel)
+                if not in_window:
+                    points[channel] = next_points
+                    continue
+                prev_points = readers[index - 1].get_time(time, channel)
+                if next_points.ndim == 2:
+                    seam_stats[index - 1].add_gap(frame,
+                                                  channel,
+                                                  prev_points,
+                                                  next_points)
+                blended = (prev_points.astype(np.float64) * (1.0 - weight) +
+                           next_points.astype(np.float64) * weight)
+                points[channel] = blended.astype(next_points.dtype.newbyteorder("="))
+            writer.write_frame(frame, points)
+
+            if last_points is not None:
+                step = 0.0
+                for channel, channel_points in points.items():
+                    if channel_points.ndim != 2:
+                        continue
+                    moves = np.linalg.norm(
+                        channel_points.astype(np.float64) - last_points[channel],
+                        axis=1)
+                    if moves.size:
+                        step = max(step, float(moves.max()))
+                _add_step(seam_stats, last_frame, frame, step)
+            last_points = points
+            last_frame = frame
+
+    for reader in readers:
+        reader.close()
+    return writer.xml_path, [x.to_dict() for x in seam_stats]
+
+
+def _add_step(seam_stats, last_frame, frame, step):
+    """File a per frame motion under the window it ends in, or under the
+    frames just before a window as its baseline
+    """
+    for stats in seam_stats:
+        blend_start = stats.chunk["blend_start"]
+        seam = stats.chunk["seam"]
+        window = max(seam - blend_start, 1)
+        if blend_start < frame <= seam + 1:
+            stats.max_step = max(stats.max_step, step)
+        elif blend_start - window <= last_frame and frame <= blend_start:
+            stats.baseline_step = max(stats.baseline_step, step)
+
+
+def write_report(xml_path, seams):
+    """Write the seam report next to a stitched cache
+
+    Args:
+        xml_path (str): stitched cache
+        seams (list): from stitch_caches
+
+    Returns:
+        str: report path
+    """
+    report_path = "{}{}".format(os.path.splitext(xml_path)[0], REPORT_SUFFIX)
+    report = {"cache": os.path.basename(xml_path),
+              "max_gap": max([x["max_gap"] for x in seams] or [0.0]),
+              "seams": seams}
+    config_io.write_json(report, report_path, sort_keys=True)
+    return report_path
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Content addressed storage for techanim caches.
+
+A cache is stored under a key that is the hash of everything that went into
+making it: input caches, nCloth/nucleus settings, frame range and so on. If a
+cache is requested again with identical inputs the stored one is attached
+instead of simulating again.
+
+<cache root>/techanim/store/ab/abcdef.../
+    store_info.json     inputs, caches per node, written last
+    shirtShape.xml
+    shirtShape.mcx
+
+Attributes:
+    HASH_BLOCK_SIZE (int): bytes read at a time when hashing files
+    HASH_SIDECAR_EXT (str): remembers the hash of a cache next to it
+    STORE_DIR_NAME (str): name of the store dir under the techanim cache dir
+    STORE_INFO_NAME (str): marks an entry as complete
+    STORE_VERSION (int): part of every key, bump to invalidate all entries
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+# techanim
+from techanim_flow import cache_io
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+STORE_VERSION = 2
+STORE_DIR_NAME = "store"
+STORE_INFO_NAME = "store_info.json"
+HASH_SIDECAR_EXT = ".sha1.json"
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+TEMP_DIR_EXT = ".tmp"
+STALE_TEMP_SECONDS = 24 * 60 * 60
+
+
+# =============================================================================
+# hashing
+# =============================================================================
+
+def hash_file(file_path, hasher=None):
+    """Feed a file to a hasher without reading it into memory at once
+
+    Args:
+        file_path (str): path
+        hasher (hashlib object, optional): defaults to a new sha1
+
+    Returns:
+        hashlib object: the hasher
+    """
+    hasher = hasher or hashlib.sha1()
+    with open(file_path, "rb") as f:
+        block = f.read(HASH_BLOCK_SIZE)
+        while block:
+            hasher.update(block)
+            block = f.read(HASH_BLOCK_SIZE)
+    return hasher
+
+
+def _get_stamps(file_paths):
+    """Size and mtime of files, to tell if a remembered hash went stale
+
+    Args:
+        file_paths (list): of paths
+
+    Returns:
+        list: of [name, size, mtime]
+    """
+    stamps = []
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        stamps.append([os.path.basename(file_path),
+                       stat.st_size,
+                       int(stat.st_mtime)])
+    return stamps
+
+
+def hash_cache(xml_path):
+    """Hash the contents of a cache, xml plus data files. The result is
+    remembered next to the cache so multi GB input caches are only read
+    once.
+
+    Args:
+        xml_path (str): cache description
+
+    Returns:
+        str: hex digest
+    """
+    desc = cache_io.read_description(xml_path)
+    file_paths = [xml_path] + sorted(desc.get_data_paths())
+    stamps = _get_stamps(file_paths)
+    sidecar_path = "{}{}".format(os.path.splitext(xml_path)[0],
+                                 HASH_SIDECAR_EXT)
+    try:
+        with open(sidecar_path, "r") as f:
+            remembered = json.load(f)
+        if remembered["stamps"] == stamps:
+            return remembered["sha1"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    hasher = hashlib.sha1()
+    for file_path in file_paths:
+        hash_file(file_path, hasher)
+    digest = hasher.hexdigest()
+    try:
+        config_io.write_json({"stamps": stamps, "sha1": digest},
+                             sidecar_path,
+                             indent=None)
+    except (IOError, OSError):
+        # read only caches still hash fine, just not remembered
+        pass
+    return digest
+
+
+def get_inputs_key(inputs):
+    """Key of an entry, the hash of the inputs that made it
+
+    Args:
+        inputs (dict): anything json serializable describing the inputs
+
+    Returns:
+        str: hex digest
+    """
+    data = {"store_version": STORE_VERSION, "inputs": inputs}
+    dumped = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(dumped.encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# store
+# =============================================================================
+
+def get_store_root():
+    """The store lives in the techanim dir of the cache root, unless the
+    config says otherwise
+
+    Returns:
+        str: path
+    """
+    store_root = config_io.CONFIG.get("cache_store_dir")
+    if store_root:
+        return store_root
+    cache_root = config_io.get_cache_root()
+    if os.path.basename(cache_root) != config_io.CACHE_DIR_NAME:
+        cache_root = os.path.join(cache_root, config_io.CACHE_DIR_NAME)
+    return os.path.join(cache_root, STORE_DIR_NAME)
+
+
+def get_entry_dir(key, store_root=None):
+    """Directory of an entry, sharded on the first two characters so no
+    single dir ends up with thousands of entries
+
+    Args:
+        key (str): from get_inputs_key
+        store_root (str, optional): defaults to get_store_root
+
+    Returns:
+        str: path
+    """
+    store_root = store_root or get_store_root()
+    return os.path.join(store_root, key[:2], key)
+
+
+def get_entries(store_root=None):
+    """Every complete entry in the store
+
+    Args:
+        store_root (str, optional): defaults to get_store_root
+
+    Returns:
+        list: of entry dirs
+    """
+    store_root = store_root or get_store_root()
+    entries = []
+    if not os.path.isdir(store_root):
+        return entries
+    for shard in sorted(os.listdir(store_root)):
+        shard_dir = os.path.join(store_root, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for key in sorted(os.listdir(shard_dir)):
+            if key.endswith(TEMP_DIR_EXT):
+                continue
+            entry_dir = os.path.join(shard_dir, key)
+            if os.path.exists(os.path.join(entry_dir, STORE_INFO_NAME)):
+                entries.append(entry_dir)
+    return entries
+
+
+def lookup(key, store_root=None):
+    """Find a complete entry for the key
+
+    Args:
+        key (str): from get_inputs_key
+        store_root (str, optional): defaults to get_store_root
+
+    Returns:
+        dict: the entry info with absolute cache paths, None on a miss
+    """
+    entry_dir = get_entry_dir(key, store_root)
+    info_path = os.path.join(entry_dir, STORE_INFO_NAME)
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    caches = {}
+    for node, xml_names in info["caches"].items():
+        xml_paths = [os.path.join(entry_dir, x) for x in xml_names]
+        if not all(os.path.exists(x) for x in xml_paths):
+            return None
+        caches[node] = xml_paths
+    info["caches"] = caches
+    info["entry_dir"] = entry_dir
+    return info
+
+
+def begin_entry(key, store_root=None):
+    """Get an empty dir next to the entry of the key to cache into, only
+    this process writes to it. Temp dirs of attempts that died long ago are
+    removed.
+
+    Args:
+        key (str): from get_inputs_key
+        store_root (str, optional): defaults to get_store_root
+
+    Returns:
+        str: temp dir, pass it to commit_entry
+    """
+    entry_dir = get_entry_dir(key, store_root)
+    shard_dir = os.path.dirname(entry_dir)
+    if not os.path.isdir(shard_dir):
+        try:
+            os.makedirs(shard_dir)
+        except OSError:
+            # made by another process in the meantime
+            if not os.path.isdir(shard_dir):
+                raise
+    for name in os.listdir(shard_dir):
+        if not (name.startswith(key) and name.endswith(TEMP_DIR_EXT)):
+            continue
+        temp_dir = os.path.join(shard_dir, name)
+        try:
+            age = time.time() - os.path.getmtime(temp_dir)
+        except OSError:
+            continue
+        if age > STALE_TEMP_SECONDS:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return tempfile.mkdtemp(prefix="{}.".format(key),
+                            suffix=TEMP_DIR_EXT,
+                            dir=shard_dir)
+
+
+def commit_entry(key, inputs, caches, temp_dir, store_root=None):
+    """Mark an entry as complete and move it into place, after its caches
+    were written into the temp dir from begin_entry. If another process
+    committed the key first, its entry is kept and the temp dir removed.
+
+    Args:
+        key (str): from get_inputs_key
+        inputs (dict): that made the key, stored for inspection
+        caches (dict): node: [xml paths inside the temp dir]
+        temp_dir (str): from begin_entry
+        store_root (str, optional): defaults to get_store_root
+
+    Returns:
+        str: path to the info file of the entry
+
+    Raises:
+        ValueError: if a cache does not live in the temp dir
+        OSError: if the temp dir could not be moved into place
+    """
+    entry_dir = get_entry_dir(key, store_root)
+    relative_caches = {}
+    for node, xml_paths in caches.items():
+        relative_caches[node] = []
+        for xml_path in xml_paths:
+            if not os.path.abspath(xml_path).startswith(
+                    os.path.abspath(temp_dir)):
+                msg = "{} is not in the store temp dir {}"
+                raise ValueError(msg.format(xml_path, temp_dir))
+            relative_caches[node].append(os.path.relpath(xml_path, temp_dir))
+    info = {"key": key,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "inputs": inputs,
+            "caches": relative_caches}
+    config_io.write_json(info,
+                         os.path.join(temp_dir, STORE_INFO_NAME),
+                         sort_keys=True)
+
+    for attempt in range(2):
+        try:
+            os.rename(temp_dir, entry_dir)
+            break
+        except OSError:
+            if lookup(key, store_root):
+                # another process stored the same inputs first, a store hit
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                break
+            if attempt:
+                raise
+            # left over by an entry evicted halfway, never looked up
+            shutil.rmtree(entry_dir, ignore_errors=True)
+    return os.path.join(entry_dir, STORE_INFO_NAME)
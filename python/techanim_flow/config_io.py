@@ -2,6 +2,8 @@
 """Grab the config file for both creator and manager
 
 Attributes:
+    CACHE_DIR_ENV (str): env var pinning the cache dir for a maya session
+    CACHE_DIR_NAME (str): dir made under the cache root for all techanim data
     CONFIG (dict): configuration from from a json
     TECHANIM_CONFIG_NAME (str): json/config file name
     TECHANIM_ENV_CONFIG (str): env var name
@@ -10,6 +12,7 @@ Attributes:
 # python
 import os
 import json
+import tempfile
 
 __author__ = "Rafael Villar"
 __license__ = "MIT"
@@ -23,6 +26,9 @@ __credits__ = ["Bae Jaechul", "www.studioanima.co.jp/en/"]
 
 TECHANIM_ENV_CONFIG = "TECHANIM_ENV_CONFIG"
 TECHANIM_CONFIG_NAME = "techanim_config.json"
+# This allows the setup(s) to choose only one cache dir per maya session
+CACHE_DIR_ENV = "TECHANIM_CACHE_SESSION_DIR"
+CACHE_DIR_NAME = "techanim"
 
 
 def get_environment_config(env_name):
@@ -44,3 +50,62 @@ def get_environment_config(env_name):
 
 
 CONFIG = get_environment_config(TECHANIM_ENV_CONFIG)
+
+
+def get_cache_root():
+    """The root all techanim cache dirs are made under, the session env var
+    wins over the config. An empty value means the system temp dir, so does
+    one that is not absolute on this os, a drive letter on linux would
+    otherwise end up as dirs in the working dir.
+
+    Returns:
+        str: path, may not exist yet
+    """
+    cache_root = os.environ.get(CACHE_DIR_ENV, CONFIG.get("cache_dir"))
+    if not cache_root or not os.path.isabs(cache_root):
+        return tempfile.gettempdir()
+    return cache_root
+
+
+def get_temp_path(file_path):
+    """Temp file next to the destination, the pid in its name so processes
+    writing the same file never write into the same temp file
+
+    Args:
+        file_path (str): destination
+
+    Returns:
+        str: path
+    """
+    return "{}.{}.tmp".format(file_path, os.getpid())
+
+
+def replace_file(temp_path, file_path):
+    """Move a finished temp file onto the destination. os.rename replaces
+    the destination in one step everywhere but windows, where it has to be
+    removed first and a reader may miss it for a moment.
+
+    Args:
+        temp_path (str): written next to the destination
+        file_path (str): destination
+    """
+    if os.name == "nt" and os.path.exists(file_path):
+        os.remove(file_path)
+    os.rename(temp_path, file_path)
+
+
+def write_json(data, file_path, sort_keys=False, indent=4):
+    """Write json next to the destination and move it in place, a crash while
+    writing never leaves a half written file behind and a reader never sees
+    half a file
+
+    Args:
+        data (dict): to store
+        file_path (str): destination
+        sort_keys (bool, optional): sort the keys of dicts
+        indent (int, optional): None writes it on one line
+    """
+    temp_path = get_temp_path(file_path)
+    with open(temp_path, "w") as f:
+        json.dump(data, f, sort_keys=sort_keys, indent=indent)
+    replace_file(temp_path, file_path)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""Ring buffer of mesh frames in shared memory, between two processes.
+
+One process evaluates the rig and puts every frame of the input layer in the
+ring, another takes them out in order as the input of the simulation, so
+both run at once instead of one after the other through disk. The ring is
+a file mapped by both, in /dev/shm where there is one so it never touches
+disk, the temp dir elsewhere.
+
+    producer                              consumer
+    ring = FrameRing.create(path, [["shirtShape", 5120]])
+    ring.put(1001, {"shirtShape": points})
+                                          ring = FrameRing.attach(path)
+                                          frame, points = ring.get()
+    ring.finish()                         ring.get() is None, all read
+
+A full ring blocks the producer, an empty one the consumer. Either side
+can give up, the other one gets a FrameRingError instead of waiting. There
+is one producer and one consumer, each only ever writes its own counter, so
+no lock is needed.
+
+Layout, little endian:
+    0     magic, version, slots, slot bytes, layout bytes
+    64    frames written, frames read, producer state, consumer state
+    128   frame number of every slot, then the layout json
+    data  slots of float32 points, channel after channel in layout order
+
+Attributes:
+    DEFAULT_SLOTS (int): frames the ring holds
+    RING_DIR (str): where rings are made, shared memory when available
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import json
+import mmap
+import time
+import struct
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# =============================================================================
+# constants
+# =============================================================================
+MAGIC = b"TARB"
+VERSION = 1
+DEFAULT_SLOTS = 16
+RING_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+RING_EXT = ".ring"
+
+_HEADER_FMT = str("<4sIIQI")
+_WRITTEN_OFFSET = 64
+_READ_OFFSET = 72
+_PRODUCER_OFFSET = 80
+_CONSUMER_OFFSET = 84
+_FRAMES_OFFSET = 128
+_ALIGN = 64
+
+RUNNING = 0
+FINISHED = 1
+FAILED = 2
+
+
+class FrameRingError(Exception):
+    """The other side failed, gave up or never showed up
+    """
+
+
+def get_ring_path(name):
+    """Path of a ring, in shared memory when the system has it
+
+    Args:
+        name (str): unique to the two processes
+
+    Returns:
+        str: path
+    """
+    return os.path.join(RING_DIR, "{}{}".format(name, RING_EXT))
+
+
+def _align(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def _wait(condition, timeout, message):
+    """Poll until condition is true, backing off to 10ms between polls
+
+    Raises:
+        FrameRingError: on timeout
+    """
+    end_time = None if timeout is None else time.time() + timeout
+    delay = 0.0005
+    while not condition():
+        if end_time is not None and time.time() > end_time:
+            raise FrameRingError(message)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+
+
+# =============================================================================
+# ring
+# =============================================================================
+
+class FrameRing(object):
+    """A mapped ring, made with create or attach
+
+    Attributes:
+        channels (list): of [name, point count], the layout of a frame
+        path (str): of the mapped file
+        slots (int): frames the ring holds
+    """
+
+    def __init__(self, path, file_obj, buf, slots, channels):
+        self.path = path
+        self.slots = slots
+        self.channels = channels
+        self._file = file_obj
+        self._buf = buf
+        self._sizes = [count * 3 for _, count in channels]
+        self.slot_size = sum(self._sizes)
+        self._frames_offset = _FRAMES_OFFSET
+        layout_offset = _FRAMES_OFFSET + slots * 8
+        layout_bytes = struct.unpack_from(_HEADER_FMT, buf, 0)[4]
+        self._data_offset = _align(layout_offset + layout_bytes)
+        self._slots_array = np.frombuffer(
+            buf,
+            dtype="<f4",
+            count=slots * self.slot_size,
+            offset=self._data_offset).reshape(slots, self.slot_size)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @classmethod
+    def create(cls, path, channels, slots=DEFAULT_SLOTS):
+        """Make the ring, as the producer. The magic goes in last, a
+        consumer attaching early never sees half a header.
+
+        Args:
+            path (str): see get_ring_path, replaced if it exists
+            channels (list): of [name, point count]
+            slots (int, optional): frames the ring holds
+
+        Returns:
+            FrameRing: ring
+        """
+        channels = [[name, int(count)] for name, count in channels]
+        slots = max(int(slots), 1)
+        layout = json.dumps(channels).encode("utf-8")
+        layout_offset = _FRAMES_OFFSET + slots * 8
+        data_offset = _align(layout_offset + len(layout))
+        slot_size = sum([x[1] * 3 for x in channels])
+        size = data_offset + slots * max(slot_size, 1) * 4
+        if os.path.exists(path):
+            os.remove(path)
+        file_obj = open(path, "w+b")
+        file_obj.truncate(size)
+        buf = mmap.mmap(file_obj.fileno(), size)
+        buf[layout_offset:layout_offset + len(layout)] = layout
+        struct.pack_into(_HEADER_FMT, buf, 0,
+                         b"\x00" * 4, VERSION, slots, slot_size, len(layout))
+        buf[0:4] = MAGIC
+        return cls(path, file_obj, buf, slots, channels)
+
+    @classmethod
+    def attach(cls, path, timeout=None):
+        """Map a ring made by the producer, waiting for it to appear
+
+        Args:
+            path (str): see get_ring_path
+            timeout (float, optional): seconds, None waits forever
+
+        Returns:
+            FrameRing: ring
+
+        Raises:
+            FrameRingError: nothing showed up in time, or not a ring
+        """
+        def is_ready():
+            try:
+                with open(path, "rb") as f:
+                    return f.read(4) == MAGIC
+            except (IOError, OSError):
+                return False
+
+        _wait(is_ready, timeout, "No frame ring at {}".format(path))
+        file_obj = open(path, "r+b")
+        buf = mmap.mmap(file_obj.fileno(), 0)
+        _, version, slots, _, layout_bytes = struct.unpack_from(
+            _HEADER_FMT, buf, 0)
+        if version != VERSION:
+            buf.close()
+            file_obj.close()
+            raise FrameRingError("{} is version {}".format(path, version))
+        layout_offset = _FRAMES_OFFSET + slots * 8
+        layout = buf[layout_offset:layout_offset + layout_bytes]
+        channels = json.loads(layout.decode("utf-8"))
+        return cls(path, file_obj, buf, slots, channels)
+
+    # =========================================================================
+    # counters
+    # =========================================================================
+
+    def _get(self, fmt, offset):
+        return struct.unpack_from(fmt, self._buf, offset)[0]
+
+    def _set(self, fmt, offset, value):
+        struct.pack_into(fmt, self._buf, offset, value)
+
+    @property
+    def written(self):
+        return self._get(str("<Q"), _WRITTEN_OFFSET)
+
+    @property
+    def read(self):
+        return self._get(str("<Q"), _READ_OFFSET)
+
+    @property
+    def producer_state(self):
+        return self._get(str("<i"), _PRODUCER_OFFSET)
+
+    @property
+    def consumer_state(self):
+        return self._get(str("<i"), _CONSUMER_OFFSET)
+
+    # =========================================================================
+    # producer
+    # =========================================================================
+
+    def put(self, frame, points, timeout=None):
+        """Copy a frame into the next free slot, waiting for one
+
+        Args:
+            frame (float): frame number
+            points (dict): channel: (points, 3) array, every channel
+            timeout (float, optional): seconds, None waits forever
+
+        Raises:
+            FrameRingError: the consumer gave up, or no slot freed in time
+        """
+        def has_room():
+            if self.consumer_state == FAILED:
+                raise FrameRingError("The consumer of {} gave up.".format(
+                    self.path))
+            return self.written - self.read < self.slots
+
+        _wait(has_room, timeout, "No free slot in {}".format(self.path))
+        written = self.written
+        slot = written % self.slots
+        start = 0
+        for (name, _), size in zip(self.channels, self._sizes):
+            channel_points = np.asarray(points[name], dtype="<f4").reshape(-1)
+            if channel_points.size != size:
+                msg = "{} has {} points, the ring expects {}"
+                raise ValueError(msg.format(name,
+                                            channel_points.size // 3,
+                                            size // 3))
+            self._slots_array[slot, start:start + size] = channel_points
+            start += size
+        self._set(str("<d"), self._frames_offset + slot * 8, frame)
+        # the count goes last, the consumer never reads a slot being written
+        self._set(str("<Q"), _WRITTEN_OFFSET, written + 1)
+
+    def finish(self, failed=False):
+        """No more frames, the consumer stops once it read the rest
+
+        Args:
+            failed (bool, optional): the consumer raises instead
+        """
+        self._set(str("<i"), _PRODUCER_OFFSET, FAILED if failed else FINISHED)
+
+    # =========================================================================
+    # consumer
+    # =========================================================================
+
+    def get(self, timeout=None):
+        """Take the next frame out, waiting for it
+
+        Args:
+            timeout (float, optional): seconds, None waits forever
+
+        Returns:
+            tuple: frame, {channel: (points, 3) array}. None once the
+            producer finished and every frame was read
+
+        Raises:
+            FrameRingError: the producer failed, or no frame came in time
+        """
+        def has_frame():
+            if self.written > self.read:
+                return True
+            state = self.producer_state
+            if state == FAILED:
+                raise FrameRingError("The producer of {} failed.".format(
+                    self.path))
+            # a last look at the count, it may have moved before finishing
+            return state == FINISHED
+
+        _wait(has_frame, timeout, "No frame in {}".format(self.path))
+        read = self.read
+        if self.written <= read:
+            return None
+        slot = read % self.slots
+        frame = self._get(str("<d"), self._frames_offset + slot * 8)
+        points = {}
+        start = 0
+        for (name, _), size in zip(self.channels, self._sizes):
+            data = self._slots_array[slot, start:start + size]
+            points[name] = data.reshape(-1, 3).copy()
+            start += size
+        self._set(str("<Q"), _READ_OFFSET, read + 1)
+        return frame, points
+
+    def abort(self):
+        """Give up reading, the producer raises instead of waiting
+        """
+        self._set(str("<i"), _CONSUMER_OFFSET, FAILED)
+
+    # =========================================================================
+    # cleanup
+    # =========================================================================
+
+    def close(self, unlink=False):
+        """Unmap the ring
+
+        Args:
+            unlink (bool, optional): remove the file too, the other side
+            keeps its mapping where the system allows it
+        """
+        self._slots_array = None
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if unlink:
+            remove_ring(self.path)
+
+
+def remove_ring(path):
+    """Remove a ring file, ignoring one that is gone or still mapped
+
+    Args:
+        path (str): see get_ring_path
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,561 @@
+# -*- coding: utf-8 -*-
+"""Pack a simulation job into a bundle that runs anywhere, without Maya.
+
+A bundle holds the scene, the caches and presets it needs and the config,
+with every path in them made relative to the bundle. Files are stored once
+by content in the objects dir of the bundle root and hardlinked into each
+bundle, so an input cache shared by many jobs takes its space once:
+
+<bundle root>/objects/ab/abcdef...     content, named by its sha1
+<bundle root>/<bundle>/bundle.json     manifest, files, sources and job
+<bundle root>/<bundle>/scene/          the scene and its references
+<bundle root>/<bundle>/caches/<n>/     a dir of caches the scene uses
+<bundle root>/<bundle>/presets/
+<bundle root>/<bundle>/config/techanim_config.json
+
+Paths in the scene, the config and the job arguments are written with a
+token in place of the bundle dir. Unpacking links the files into a job dir
+on the worker and puts the job dir in place of the token, only .ma scenes
+can be rewritten this way.
+
+python -m techanim_flow.job_bundle pack /bundles shot010 --scene shot010.ma --cache-dirs /caches/shot010 -- --layers sim
+python -m techanim_flow.job_bundle unpack /bundles/shot010 /jobs/shot010
+python -m techanim_flow.job_bundle run /jobs/shot010
+
+Attributes:
+    BUNDLE_TOKEN (str): stands for the bundle dir in rewritten files
+    MANIFEST_NAME (str): manifest of a bundle or job dir
+    OBJECTS_DIR_NAME (str): content store of a bundle root
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+
+# techanim
+from techanim_flow import batch
+from techanim_flow import cache_io
+from techanim_flow import config_io
+from techanim_flow import cache_store
+from techanim_flow import job_scheduler
+
+# =============================================================================
+# constants
+# =============================================================================
+BUNDLE_VERSION = 1
+BUNDLE_TOKEN = "__TECHANIM_BUNDLE__"
+MANIFEST_NAME = "bundle.json"
+OBJECTS_DIR_NAME = "objects"
+HASHES_NAME = "hashes.json"
+SCENE_DIR_NAME = "scene"
+CACHES_DIR_NAME = "caches"
+PRESETS_DIR_NAME = "presets"
+CONFIG_DIR_NAME = "config"
+OUTPUT_DIR_NAME = "output"
+# files whose paths are rewritten, everything else is stored as is
+TEMPLATED_EXTS = [".ma", ".json", ".preset", ".xml"]
+# config values that point at shared storage, pointed into the job dir
+CONFIG_PATHS = {"cache_dir": OUTPUT_DIR_NAME,
+                "PRESET_SHARE_BASE_DIR": PRESETS_DIR_NAME,
+                "cache_store_dir": "",
+                "mayapy": ""}
+
+
+# =============================================================================
+# paths
+# =============================================================================
+
+def get_bundle_path(rel_path):
+    """A path inside the bundle as it is written in rewritten files
+
+    Args:
+        rel_path (str): relative to the bundle dir
+
+    Returns:
+        str: token path
+    """
+    return "/".join([BUNDLE_TOKEN] + rel_path.replace("\\", "/").split("/"))
+
+
+def get_path_forms(path):
+    """The ways a path can be spelled in a maya scene or json
+
+    Args:
+        path (str): absolute
+
+    Returns:
+        list: of spellings, longest first
+    """
+    path = os.path.normpath(os.path.abspath(path))
+    forward = path.replace("\\", "/")
+    forms = set([path, forward])
+    if "\\" in path:
+        forms.add(path.replace("\\", "\\\\"))
+    return sorted(forms, key=len, reverse=True)
+
+
+def rewrite_paths(data, path_map, token=None):
+    """Replace the sources of a bundle in the content of a file
+
+    Args:
+        data (bytes): file content
+        path_map (dict): source path: relative path in the bundle
+        token (str, optional): replaces BUNDLE_TOKEN afterwards, to resolve
+        the paths of an unpacked job
+
+    Returns:
+        bytes: new content
+    """
+    replacements = []
+    for source, rel_path in path_map.items():
+        for form in get_path_forms(source):
+            replacements.append([form, get_bundle_path(rel_path)])
+    # longest first, so a dir never replaces part of a file inside it
+    replacements.sort(key=lambda x: len(x[0]), reverse=True)
+    for form, bundle_path in replacements:
+        data = data.replace(form.encode("utf-8"), bundle_path.encode("utf-8"))
+    if token is not None:
+        data = data.replace(BUNDLE_TOKEN.encode("utf-8"),
+                            token.replace("\\", "/").encode("utf-8"))
+    return data
+
+
+def link_file(src_path, dst_path):
+    """Hardlink a file, copy it where links are not possible, across drives
+    or on file systems without them
+
+    Args:
+        src_path (str): existing file
+        dst_path (str): new file, replaced if it exists
+    """
+    dst_dir = os.path.dirname(dst_path)
+    if not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    try:
+        os.link(src_path, dst_path)
+    except (OSError, AttributeError):
+        shutil.copy2(src_path, dst_path)
+
+
+# =============================================================================
+# content store
+# =============================================================================
+
+class ObjectStore(object):
+    """Files of a bundle root by content. Hashes are remembered by size and
+    mtime, multi GB caches are only read once however many bundles use them.
+
+    Attributes:
+        objects_dir (str): path
+    """
+
+    def __init__(self, bundle_root):
+        self.objects_dir = os.path.join(os.path.abspath(bundle_root),
+                                        OBJECTS_DIR_NAME)
+        if not os.path.isdir(self.objects_dir):
+            os.makedirs(self.objects_dir)
+        self._hashes_path = os.path.join(self.objects_dir, HASHES_NAME)
+        try:
+            with open(self._hashes_path, "r") as f:
+                self._hashes = json.load(f)
+        except (IOError, OSError, ValueError):
+            self._hashes = {}
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.objects_dir)
+
+    def get_object_path(self, sha1):
+        return os.path.join(self.objects_dir, sha1[:2], sha1)
+
+    def hash_file(self, file_path):
+        """sha1 of a file, remembered until it changes
+
+        Args:
+            file_path (str): path
+
+        Returns:
+            str: hex digest
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        stamp = [stat.st_size, int(stat.st_mtime)]
+        remembered = self._hashes.get(file_path)
+        if remembered and remembered[:2] == stamp:
+            return remembered[2]
+        sha1 = cache_store.hash_file(file_path).hexdigest()
+        self._hashes[file_path] = stamp + [sha1]
+        return sha1
+
+    def add_file(self, file_path):
+        """Store a copy of a file, once however often it is added. A copy,
+        not a link, a cache rewritten in place later never changes a bundle.
+
+        Args:
+            file_path (str): path
+
+        Returns:
+            tuple: sha1, stored object path, True if it was new
+        """
+        sha1 = self.hash_file(file_path)
+        object_path = self.get_object_path(sha1)
+        if os.path.exists(object_path):
+            return sha1, object_path, False
+        if not os.path.isdir(os.path.dirname(object_path)):
+            os.makedirs(os.path.dirname(object_path))
+        temp_path = config_io.get_temp_path(object_path)
+        shutil.copy2(file_path, temp_path)
+        config_io.replace_file(temp_path, object_path)
+        return sha1, object_path, True
+
+    def add_data(self, data):
+        """Store content made here, a rewritten file
+
+        Args:
+            data (bytes): content
+
+        Returns:
+            tuple: sha1, stored object path, True if it was new
+        """
+        sha1 = hashlib.sha1(data).hexdigest()
+        object_path = self.get_object_path(sha1)
+        if os.path.exists(object_path):
+            return sha1, object_path, False
+        if not os.path.isdir(os.path.dirname(object_path)):
+            os.makedirs(os.path.dirname(object_path))
+        temp_path = config_io.get_temp_path(object_path)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        config_io.replace_file(temp_path, object_path)
+        return sha1, object_path, True
+
+    def save(self):
+        """Remember the hashes for the next pack
+        """
+        batch.write_result(self._hashes, self._hashes_path)
+
+
+# =============================================================================
+# packing
+# =============================================================================
+
+def get_cache_files(cache_dir):
+    """Files of the caches in a dir, their data, frame indices and the
+    manifest, leaving out anything else kept there
+
+    Args:
+        cache_dir (str): path
+
+    Returns:
+        list: of paths
+    """
+    file_paths = []
+    for desc in cache_io.get_cache_descriptions(cache_dir):
+        file_paths.append(desc.xml_path)
+        file_paths.extend(sorted(desc.get_data_paths()))
+        index_path = cache_io.get_frame_index_path(desc.xml_path)
+        if os.path.exists(index_path):
+            file_paths.append(index_path)
+    manifest_path = os.path.join(cache_dir, "techanim_manifest.json")
+    if os.path.exists(manifest_path):
+        file_paths.append(manifest_path)
+    return file_paths
+
+
+def get_bundle_config(config=None):
+    """Config for the bundle, the values pointing at shared storage pointed
+    into the job dir instead
+
+    Args:
+        config (dict, optional): defaults to the one in use
+
+    Returns:
+        dict: config
+    """
+    config = dict(config or config_io.CONFIG)
+    for key, rel_path in CONFIG_PATHS.items():
+        if key in config:
+            config[key] = get_bundle_path(rel_path) if rel_path else ""
+    return config
+
+
+def pack(bundle_root,
+         name,
+         scene_path,
+         references=None,
+         cache_dirs=None,
+         presets=None,
+         args=None,
+         config=None,
+         job=None):
+    """Make a bundle, see the module doc
+
+    Args:
+        bundle_root (str): bundles and their shared objects go here
+        name (str): of the bundle dir, replaced if it exists
+        scene_path (str): .ma the job opens, see get_job_command
+        references (list, optional): files the scene references
+        cache_dirs (list, optional): dirs of caches the scene uses, only
+        the caches in them are taken
+        presets (list, optional): preset files the job arguments use
+        args (list, optional): batch arguments after the scene, paths of
+        the files above in them are rewritten like in the scene
+        config (dict, optional): defaults to the one in use
+        job (dict, optional): anything to keep in the manifest about the job
+
+    Returns:
+        str: bundle dir
+
+    Raises:
+        ValueError: the scene is not a .ma
+    """
+    if not scene_path.endswith(".ma"):
+        raise ValueError("Only .ma scenes can be bundled: {}".format(scene_path))
+    bundle_dir = os.path.join(os.path.abspath(bundle_root), name)
+    if os.path.exists(bundle_dir):
+        shutil.rmtree(bundle_dir)
+    store = ObjectStore(bundle_root)
+
+    # what goes where, relative to the bundle dir
+    path_map = {}
+    file_map = {}
+    scene_rel = "/".join([SCENE_DIR_NAME, os.path.basename(scene_path)])
+    file_map[scene_rel] = scene_path
+    path_map[scene_path] = scene_rel
+    for reference in references or []:
+        rel_path = "/".join([SCENE_DIR_NAME, "references",
+                             os.path.basename(reference)])
+        file_map[rel_path] = reference
+        path_map[reference] = rel_path
+    for index, cache_dir in enumerate(cache_dirs or []):
+        dir_rel = "/".join([CACHES_DIR_NAME, "{}".format(index)])
+        path_map[cache_dir] = dir_rel
+        for file_path in get_cache_files(cache_dir):
+            file_map["/".join([dir_rel, os.path.basename(file_path)])] = file_path
+    for preset_path in presets or []:
+        rel_path = "/".join([PRESETS_DIR_NAME, os.path.basename(preset_path)])
+        file_map[rel_path] = preset_path
+        path_map[preset_path] = rel_path
+
+    files = {}
+    new_bytes = 0
+    total_bytes = 0
+    for rel_path, file_path in sorted(file_map.items()):
+        if os.path.splitext(file_path)[1] in TEMPLATED_EXTS:
+            with open(file_path, "rb") as f:
+                data = rewrite_paths(f.read(), path_map)
+            sha1, object_path, is_new = store.add_data(data)
+        else:
+            sha1, object_path, is_new = store.add_file(file_path)
+        size = os.path.getsize(object_path)
+        total_bytes += size
+        new_bytes += size if is_new else 0
+        link_file(object_path, os.path.join(bundle_dir, rel_path))
+        files[rel_path] = {"sha1": sha1, "size": size}
+
+    config_data = json.dumps(get_bundle_config(config), indent=4)
+    config_data = rewrite_paths(config_data.encode("utf-8"), path_map)
+    config_rel = "/".join([CONFIG_DIR_NAME, config_io.TECHANIM_CONFIG_NAME])
+    sha1, object_path, _ = store.add_data(config_data)
+    link_file(object_path, os.path.join(bundle_dir, config_rel))
+    files[config_rel] = {"sha1": sha1, "size": len(config_data)}
+    store.save()
+
+    args = ["{}".format(x) for x in args or []]
+    args = rewrite_paths(json.dumps(args).encode("utf-8"), path_map)
+    manifest = {"version": BUNDLE_VERSION,
+                "name": name,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "scene": scene_rel,
+                "config": config_rel,
+                "args": json.loads(args.decode("utf-8")),
+                "job": job or {},
+                "sources": dict((v, k) for k, v in path_map.items()),
+                "files": files,
+                "bytes": total_bytes,
+                "new_bytes": new_bytes}
+    batch.write_result(manifest, os.path.join(bundle_dir, MANIFEST_NAME))
+    print("Packed {}, {:.1f} MB of which {:.1f} MB new".format(
+        bundle_dir, total_bytes / 1e6, new_bytes / 1e6))
+    return bundle_dir
+
+
+def read_manifest(bundle_dir):
+    """Manifest of a bundle or job dir
+
+    Args:
+        bundle_dir (str): path
+
+    Returns:
+        dict: manifest, None if there is none
+    """
+    try:
+        with open(os.path.join(bundle_dir, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+# =============================================================================
+# unpacking
+# =============================================================================
+
+def unpack(bundle_dir, job_dir, verify=False):
+    """Rebuild a runnable job dir from a bundle. Files are linked from the
+    bundle, the ones with paths in them are written with the job dir in
+    place of the token.
+
+    Args:
+        bundle_dir (str): made by pack, copied or synced as is
+        job_dir (str): made if missing, its files are replaced
+        verify (bool, optional): check the sha1 of every file first
+
+    Returns:
+        dict: manifest of the job dir
+
+    Raises:
+        IOError: not a bundle, or a file does not match the manifest
+    """
+    bundle_dir = os.path.abspath(bundle_dir)
+    job_dir = os.path.abspath(job_dir)
+    manifest = read_manifest(bundle_dir)
+    if manifest is None:
+        raise IOError("No {} in {}".format(MANIFEST_NAME, bundle_dir))
+    for rel_path, file_info in sorted(manifest["files"].items()):
+        src_path = os.path.join(bundle_dir, *rel_path.split("/"))
+        dst_path = os.path.join(job_dir, *rel_path.split("/"))
+        if verify:
+            sha1 = cache_store.hash_file(src_path).hexdigest()
+            if sha1 != file_info["sha1"]:
+                raise IOError("{} does not match the manifest".format(src_path))
+        if os.path.splitext(rel_path)[1] in TEMPLATED_EXTS:
+            with open(src_path, "rb") as f:
+                data = rewrite_paths(f.read(), {}, token=job_dir)
+            if not os.path.isdir(os.path.dirname(dst_path)):
+                os.makedirs(os.path.dirname(dst_path))
+            with open(dst_path, "wb") as f:
+                f.write(data)
+        else:
+            link_file(src_path, dst_path)
+    output_dir = os.path.join(job_dir, OUTPUT_DIR_NAME)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    args = rewrite_paths(json.dumps(manifest["args"]).encode("utf-8"),
+                         {},
+                         token=job_dir)
+    manifest["args"] = json.loads(args.decode("utf-8"))
+    manifest["bundle"] = bundle_dir
+    batch.write_result(manifest, os.path.join(job_dir, MANIFEST_NAME))
+    return manifest
+
+
+def get_job_command(job_dir):
+    """Batch command and environment of an unpacked job
+
+    Args:
+        job_dir (str): from unpack
+
+    Returns:
+        tuple: command list, environment dict
+    """
+    job_dir = os.path.abspath(job_dir)
+    manifest = read_manifest(job_dir)
+    scene_path = os.path.join(job_dir, *manifest["scene"].split("/"))
+    command = job_scheduler.get_batch_command(scene_path, *manifest["args"])
+    env = job_scheduler.get_job_env()
+    env[config_io.TECHANIM_ENV_CONFIG] = os.path.join(
+        job_dir, *manifest["config"].split("/"))
+    env[config_io.CACHE_DIR_ENV] = os.path.join(job_dir, OUTPUT_DIR_NAME)
+    return command, env
+
+
+def run_job(job_dir):
+    """Run an unpacked job in mayapy, output to job.log in the job dir
+
+    Args:
+        job_dir (str): from unpack
+
+    Returns:
+        int: exit code, see batch
+    """
+    command, env = get_job_command(job_dir)
+    print(" ".join(command))
+    with open(os.path.join(job_dir, "job.log"), "w") as log_file:
+        return subprocess.call(command,
+                               stdout=log_file,
+                               stderr=subprocess.STDOUT,
+                               env=env)
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub_parsers = parser.add_subparsers(dest="command")
+
+    pack_parser = sub_parsers.add_parser("pack", help="make a bundle")
+    pack_parser.add_argument("bundle_root")
+    pack_parser.add_argument("name")
+    pack_parser.add_argument("--scene", required=True, help=".ma to run")
+    pack_parser.add_argument("--references", nargs="+", default=None)
+    pack_parser.add_argument("--cache-dirs", nargs="+", default=None)
+    pack_parser.add_argument("--presets", nargs="+", default=None)
+    pack_parser.add_argument("args", nargs=argparse.REMAINDER,
+                             help="batch arguments after --")
+
+    unpack_parser = sub_parsers.add_parser("unpack", help="make a job dir")
+    unpack_parser.add_argument("bundle_dir")
+    unpack_parser.add_argument("job_dir")
+    unpack_parser.add_argument("--verify", action="store_true")
+
+    run_parser = sub_parsers.add_parser("run", help="run a job dir")
+    run_parser.add_argument("job_dir")
+
+    options = parser.parse_args(args)
+    if options.command == "pack":
+        batch_args = options.args
+        if batch_args and batch_args[0] == "--":
+            batch_args = batch_args[1:]
+        pack(options.bundle_root,
+             options.name,
+             os.path.abspath(options.scene),
+             references=[os.path.abspath(x) for x in options.references or []],
+             cache_dirs=[os.path.abspath(x) for x in options.cache_dirs or []],
+             presets=[os.path.abspath(x) for x in options.presets or []],
+             args=batch_args)
+        return 0
+    if options.command == "unpack":
+        manifest = unpack(options.bundle_dir, options.job_dir,
+                          verify=options.verify)
+        print("Unpacked {} files to {}".format(len(manifest["files"]),
+                                               options.job_dir))
+        return 0
+    exit_code = run_job(options.job_dir)
+    print("Exit code {}".format(exit_code))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Peak memory of scheduler jobs, and packing them onto a machine's RAM.
+
+Heavy nCloth jobs landing on one machine run it out of memory and the
+kernel kills them, whole runs lost. The job_scheduler starts a job only if
+its estimated peak fits next to the jobs already running, queueing it
+otherwise, and a job bigger than the whole budget runs alone.
+
+A job's estimate comes from, first to last:
+    history    what the same job peaked at on earlier runs, scaled by its
+               vertices when they changed, plus job_memory_margin
+    vertices   job_memory_base_mb plus job_memory_per_vertex_kb of its kind
+               for every vertex, the vertices come from batch --describe
+    base       job_memory_base_mb, nothing else is known
+
+Batch results record the peak of their process, the scheduler adds it to
+the history file when a job is done. A warm worker's peak covers every job
+it ran before, so its history errs high.
+
+Attributes:
+    DEFAULT_MEMORY_FRACTION (float): of the physical RAM used when no budget
+    is configured
+    HISTORY_ENV (str): env var with the history file
+    HISTORY_SIZE (int): runs kept per job
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+
+# techanim
+from techanim_flow import config_io
+from techanim_flow import cache_quota
+
+# =============================================================================
+# constants
+# =============================================================================
+HISTORY_ENV = "TECHANIM_JOB_MEMORY"
+HISTORY_NAME = "job_memory.json"
+HISTORY_SIZE = 10
+DEFAULT_MEMORY_FRACTION = 0.9
+DEFAULT_BASE_MB = 3000
+DEFAULT_MARGIN = 1.2
+DEFAULT_PER_VERTEX_KB = {"input": 2, "sim": 8, "export": 1}
+MB = 1024 ** 2
+
+SOURCE_HISTORY = "history"
+SOURCE_VERTICES = "vertices"
+SOURCE_BASE = "base"
+
+
+# =============================================================================
+# machine
+# =============================================================================
+
+def get_physical_memory_mb():
+    """RAM of this machine
+
+    Returns:
+        int: MB, None if it could not be found
+    """
+    if sys.platform == "win32":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong),
+                        ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong),
+                        ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong),
+                        ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong),
+                        ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+        return int(status.ullTotalPhys // MB)
+    try:
+        pages = os.sysconf(str("SC_PHYS_PAGES"))
+        page_size = os.sysconf(str("SC_PAGE_SIZE"))
+    except (AttributeError, ValueError, OSError):
+        return None
+    if pages <= 0 or page_size <= 0:
+        return None
+    return int(pages * page_size // MB)
+
+
+def get_memory_budget(memory_gb=None):
+    """Memory the jobs of a scheduler may use at once
+
+    Args:
+        memory_gb (float, optional): 0 or None uses the config, then
+        DEFAULT_MEMORY_FRACTION of the physical RAM
+
+    Returns:
+        int: MB, None is no limit
+    """
+    memory_gb = memory_gb or config_io.CONFIG.get("scheduler_memory_gb", 0)
+    if memory_gb:
+        return int(memory_gb * 1024)
+    physical_mb = get_physical_memory_mb()
+    if not physical_mb:
+        return None
+    return int(physical_mb * DEFAULT_MEMORY_FRACTION)
+
+
+# =============================================================================
+# history
+# =============================================================================
+
+def get_history_path():
+    """The history file, env var first, then the config, then the techanim
+    dir of the cache root so every machine shares it. A relative path is
+    taken from the techanim dir, never from the working dir.
+
+    Returns:
+        str: absolute path
+    """
+    history_path = (os.environ.get(HISTORY_ENV)
+                    or config_io.CONFIG.get("job_memory_history")
+                    or HISTORY_NAME)
+    return os.path.abspath(os.path.join(cache_quota.get_techanim_dir(),
+                                        history_path))
+
+
+def read_history(history_path=None):
+    """Past peaks of every job key
+
+    Args:
+        history_path (str, optional): defaults to get_history_path
+
+    Returns:
+        dict: key: [{"peak_mb", "vertices", "seconds", "time"}], oldest first
+    """
+    try:
+        with open(history_path or get_history_path(), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def get_job_key(job):
+    """What a job is the same as on other runs, its kind, setup and nucleus.
+    Partition groups and wedges of a nucleus share the key.
+
+    Args:
+        job (dict): of the job state
+
+    Returns:
+        str: key
+    """
+    parts = [job["kind"], job.get("setup") or job["id"]]
+    if job.get("nucleus"):
+        parts.append(job["nucleus"])
+    return ":".join(parts)
+
+
+def record_job(job, peak_mb, history_path=None):
+    """Add the peak of a done job to the history. Read again right before
+    writing, other schedulers share the file.
+
+    Args:
+        job (dict): done job
+        peak_mb (float): from its batch result
+        history_path (str, optional): defaults to get_history_path
+    """
+    history_path = history_path or get_history_path()
+    history = read_history(history_path)
+    runs = history.setdefault(get_job_key(job), [])
+    runs.append({"peak_mb": peak_mb,
+                 "vertices": job.get("vertices"),
+                 "seconds": job.get("seconds"),
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S")})
+    del runs[:-HISTORY_SIZE]
+    history_dir = os.path.dirname(history_path)
+    try:
+        if history_dir and not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+        config_io.write_json(history, history_path, sort_keys=True)
+    except (IOError, OSError) as e:
+        print("Could not record memory of {}: {}".format(job["id"], e))
+
+
+def get_result_peak(result_path):
+    """Peak memory a batch result recorded
+
+    Args:
+        result_path (str): batch result json
+
+    Returns:
+        float: MB, None if it has none
+    """
+    try:
+        with open(result_path, "r") as f:
+            return json.load(f).get("peak_memory_mb")
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+# =============================================================================
+# estimate
+# =============================================================================
+
+def estimate_job(job, history=None, config=None):
+    """Peak memory a job will need
+
+    Args:
+        job (dict): of the job state, vertices if batch --describe had them
+        history (dict, optional): from read_history
+        config (dict, optional): defaults to the loaded config
+
+    Returns:
+        tuple: MB, and the source, SOURCE_HISTORY, SOURCE_VERTICES or
+        SOURCE_BASE
+    """
+    config = config or config_io.CONFIG
+    base_mb = config.get("job_memory_base_mb", DEFAULT_BASE_MB)
+    vertices = job.get("vertices")
+    runs = (history or {}).get(get_job_key(job))
+    if runs:
+        margin = config.get("job_memory_margin", DEFAULT_MARGIN)
+        peaks = []
+        for past_run in runs:
+            peak_mb = past_run["peak_mb"]
+            past_vertices = past_run.get("vertices")
+            if vertices and past_vertices:
+                # only what is above the base grows with the vertices
+                extra_mb = max(peak_mb - base_mb, 0)
+                peak_mb = base_mb + extra_mb * vertices / past_vertices
+            peaks.append(peak_mb)
+        return int(max(peaks) * margin), SOURCE_HISTORY
+    if vertices:
+        per_vertex_kb = config.get("job_memory_per_vertex_kb",
+                                   DEFAULT_PER_VERTEX_KB)
+        extra_mb = vertices * per_vertex_kb.get(job["kind"], 0) / 1024
+        return int(base_mb + extra_mb), SOURCE_VERTICES
+    return int(base_mb), SOURCE_BASE
+
+
+def get_node_vertices(node_vertices, nodes):
+    """Vertices of some nCloth
+
+    Args:
+        node_vertices (dict): node: vertex count, from batch --describe
+        nodes (list): nCloth names without namespace
+
+    Returns:
+        int: total, None if any node is unknown
+    """
+    if not node_vertices or any([x not in node_vertices for x in nodes]):
+        return None
+    return sum([node_vertices[x] for x in nodes])
+
+
+# =============================================================================
+# packing
+# =============================================================================
+
+def fits(estimate_mb, used_mb, running, workers, budget_mb):
+    """Can a job start next to the running ones
+
+    Args:
+        estimate_mb (int): of the job
+        used_mb (int): estimates of the running jobs
+        running (int): jobs running
+        workers (int): jobs at once
+        budget_mb (int): None is no limit
+
+    Returns:
+        bool: True False
+    """
+    if running >= workers:
+        return False
+    if budget_mb is None or not running:
+        # alone it runs even if bigger than the budget, never deadlocked
+        return True
+    return used_mb + estimate_mb <= budget_mb
+
+
+def plan_packing(jobs, done, workers, budget_mb, history=None):
+    """Waves of jobs the scheduler would start together, every wave waiting
+    for the one before. Jobs added later by a partition are not known yet.
+
+    Args:
+        jobs (list): of the job state still to run
+        done (set): ids of the jobs already done
+        workers (int): jobs at once
+        budget_mb (int): None is no limit
+        history (dict, optional): from read_history
+
+    Returns:
+        list: of waves, {"jobs": [{"id", "memory_mb", "source", "alone"}],
+        "memory_bound": True if a ready job waits for memory, not workers}
+    """
+    done = set(done)
+    pending = list(jobs)
+    waves = []
+    while pending:
+        ready = [x for x in pending if set(x["deps"]) <= done]
+        if not ready:
+            break
+        wave = {"jobs": [], "memory_bound": False}
+        used_mb = 0
+        for job in ready:
+            if len(wave["jobs"]) >= workers:
+                break
+            estimate_mb, source = estimate_job(job, history)
+            if not fits(estimate_mb, used_mb, len(wave["jobs"]), workers,
+                        budget_mb):
+                # the scheduler queues in order, nothing after it starts
+                wave["memory_bound"] = True
+                break
+            used_mb += estimate_mb
+            wave["jobs"].append({"id": job["id"],
+                                 "memory_mb": estimate_mb,
+                                 "source": source,
+                                 "alone": (budget_mb is not None
+                                           and estimate_mb > budget_mb)})
+        waves.append(wave)
+        started = set([x["id"] for x in wave["jobs"]])
+        done |= started
+        pending = [x for x in pending if x["id"] not in started]
+    return waves
+
+
+def print_plan(waves, workers, budget_mb):
+    """Report of plan_packing
+
+    Args:
+        waves (list): from plan_packing
+        workers (int): jobs at once
+        budget_mb (int): None is no limit
+    """
+    budget = "no limit" if budget_mb is None else "{} MB".format(budget_mb)
+    print("Packing on {} workers, memory budget {}".format(workers, budget))
+    row = "{:>5}  {:<60} {:>10}  {:<9} {}"
+    print(row.format("wave", "job", "memory MB", "source", ""))
+    for index, wave in enumerate(waves):
+        for planned in wave["jobs"]:
+            note = "over budget, runs alone" if planned["alone"] else ""
+            print(row.format(index + 1,
+                             planned["id"][:60],
+                             planned["memory_mb"],
+                             planned["source"],
+                             note))
+        total_mb = sum([x["memory_mb"] for x in wave["jobs"]])
+        note = ", memory bound" if wave["memory_bound"] else ""
+        print("{:>5}  {} jobs, {} MB{}".format("", len(wave["jobs"]),
+                                               total_mb, note))
@@ -0,0 +1,1151 @@
+# -*- coding: utf-8 -*-
+"""Local scheduler caching a whole shot with a pool of mayapy processes.
+
+A shot is split into jobs with explicit dependencies:
+    input:<setup>            caches the input layer of a setup, saves a scene
+    sim:<setup>:<nucleus>    caches the nCloth of one nucleus, from that scene
+    export                   attaches every cache to the shot scene, saves it
+
+With --partition the input jobs also find groups of nCloth that never come
+close to each other, and each group becomes its own sim job once the input
+layer is done, sim:<setup>:<nucleus>:<group>, with the rest of the nucleus
+taken out of the solve. See nucleus_partition.
+
+Jobs whose dependencies are done run on up to --workers mayapy processes at
+once, each one running techanim_flow.batch. Failed jobs are retried, jobs
+depending on a job that failed for good are skipped. No queue or service is
+needed, everything lives in the work dir:
+
+<work dir>/techanim_jobs.json      state of every job, rewritten on change
+<work dir>/techanim_jobs.cancel    cancel requests for a running scheduler
+<work dir>/logs/<job>.<attempt>.log
+<work dir>/results/<job>.json      batch result of every job
+<work dir>/scenes/                 input layer scenes and the exported shot
+
+python -m techanim_flow.job_scheduler run /work/shot010 --scene shot010.ma --start 1001 --end 1100 --workers 48
+python -m techanim_flow.job_scheduler status /work/shot010
+python -m techanim_flow.job_scheduler cancel /work/shot010 [job ...]
+python -m techanim_flow.job_scheduler retry /work/shot010 [job ...]
+
+Running "run" again on a work dir resumes it, jobs that were running when
+the scheduler stopped start over. With --warm the jobs run on a
+worker_pool.WorkerPool instead, mayapy starts once per worker, not per job.
+
+Jobs are also packed onto the memory of the machine, --memory-gb, a job
+starts only if its estimated peak fits next to the running ones, else it
+and the jobs after it wait, see job_memory. --dry-run prints the planned
+packing instead of running.
+
+python -m techanim_flow.job_scheduler run /work/shot010 --scene shot010.ma --memory-gb 192 --dry-run
+
+Attributes:
+    CANCEL_NAME (str): cancel requests, one job id per line, "*" for all
+    MAYAPY_ENV (str): env var with the mayapy executable
+    STATE_NAME (str): job state file in the work dir
+    STATUSES (list): every job status
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import re
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+import multiprocessing
+
+# techanim
+from techanim_flow import batch
+from techanim_flow import config_io
+from techanim_flow import job_memory
+from techanim_flow import cache_quota
+from techanim_flow import worker_pool
+
+# =============================================================================
+# constants
+# =============================================================================
+STATE_NAME = "techanim_jobs.json"
+CANCEL_NAME = "techanim_jobs.cancel"
+STATE_VERSION = 1
+MAYAPY_ENV = "TECHANIM_MAYAPY"
+CANCEL_ALL = "*"
+POLL_INTERVAL = 0.5
+
+KIND_INPUT = "input"
+KIND_SIM = "sim"
+KIND_EXPORT = "export"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+SKIPPED = "skipped"
+STATUSES = [PENDING, RUNNING, DONE, FAILED, CANCELLED, SKIPPED]
+FINISHED = [DONE, FAILED, CANCELLED, SKIPPED]
+
+
+# =============================================================================
+# helpers
+# =============================================================================
+
+def get_mayapy():
+    """The mayapy to run jobs with, env var first, then the config, then the
+    one next to the running maya
+
+    Returns:
+        str: executable
+    """
+    mayapy = os.environ.get(MAYAPY_ENV) or config_io.CONFIG.get("mayapy")
+    if mayapy:
+        return mayapy
+    if os.environ.get("MAYA_LOCATION"):
+        exe_name = "mayapy.exe" if sys.platform == "win32" else "mayapy"
+        mayapy = os.path.join(os.environ["MAYA_LOCATION"], "bin", exe_name)
+        if os.path.exists(mayapy):
+            return mayapy
+    return "mayapy"
+
+
+def get_worker_count(workers=None):
+    """Number of jobs to run at once
+
+    Args:
+        workers (int, optional): 0 or None uses the config, then the cores
+
+    Returns:
+        int: at least 1
+    """
+    workers = workers or config_io.CONFIG.get("scheduler_workers", 0)
+    return max(workers or multiprocessing.cpu_count(), 1)
+
+
+def get_job_env():
+    """Environment of the jobs, techanim_flow has to import in mayapy
+
+    Returns:
+        dict: environment
+    """
+    env = dict(os.environ)
+    python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    python_paths = [python_dir]
+    if env.get("PYTHONPATH"):
+        python_paths.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(python_paths)
+    return env
+
+
+def get_safe_name(name):
+    """Node names as file names, namespaces and paths use : and |
+
+    Args:
+        name (str): job id or node
+
+    Returns:
+        str: name
+    """
+    return re.sub(r"[^\w.-]+", "_", name).strip("_")
+
+
+def get_batch_command(scene_path, *args):
+    """Command line of a batch job
+
+    Args:
+        scene_path (str): maya file
+        *args: more batch arguments
+
+    Returns:
+        list: command
+    """
+    command = [get_mayapy(), "-m", "techanim_flow.batch", scene_path]
+    command.extend(["{}".format(x) for x in args])
+    return command
+
+
+def run_describe(scene_path, work_dir):
+    """List the setups and nuclei of a scene, in mayapy
+
+    Args:
+        scene_path (str): maya file
+        work_dir (str): the result is kept here
+
+    Returns:
+        dict: see batch.describe_scene
+
+    Raises:
+        RuntimeError: if the scene could not be described
+    """
+    result_path = os.path.join(work_dir, "results", "describe.json")
+    command = get_batch_command(scene_path, "--describe", "--json", result_path)
+    print(" ".join(command))
+    exit_code = subprocess.call(command, env=get_job_env())
+    try:
+        with open(result_path, "r") as f:
+            result = json.load(f)
+    except (IOError, OSError, ValueError):
+        result = {"error": "No result from mayapy, exit code {}".format(exit_code)}
+    if exit_code != batch.EXIT_OK:
+        raise RuntimeError(result.get("error", "Describe failed."))
+    return result
+
+
+# =============================================================================
+# job graph
+# =============================================================================
+
+def new_job(job_id, kind, command, deps=None, retries=0, **info):
+    """A job of the state file
+
+    Args:
+        job_id (str): unique in the shot
+        kind (str): input, sim or export
+        command (list): to run
+        deps (list, optional): ids of jobs that have to be done first
+        retries (int, optional): extra attempts after a failure
+        **info: stored as is, setup, nucleus, result path...
+
+    Returns:
+        dict: job
+    """
+    job = {"id": job_id,
+           "kind": kind,
+           "command": command,
+           "deps": deps or [],
+           "status": PENDING,
+           "attempts": 0,
+           "max_attempts": retries + 1,
+           "exit_code": None,
+           "pid": None,
+           "started": None,
+           "finished": None,
+           "seconds": None,
+           "log": None,
+           "error": None}
+    job.update(info)
+    return job
+
+
+def expand_shot(scene_path,
+                work_dir,
+                description,
+                start_frame,
+                end_frame,
+                preroll,
+                postroll,
+                setups=None,
+                retries=1,
+                checkpoint_every=0,
+                use_store=None,
+                export_path=None,
+                partition=False,
+                prefix=""):
+    """Split a shot into input, sim and export jobs
+
+    Args:
+        scene_path (str): shot scene
+        work_dir (str): scenes, results and logs go here
+        description (dict): from batch.describe_scene
+        start_frame (int): first frame of the shot
+        end_frame (int): last frame of the shot
+        preroll (int): frames simulated before the start
+        postroll (int): frames simulated after the end
+        setups (list, optional): setup roots, defaults to every setup
+        retries (int, optional): extra attempts of a failed job
+        checkpoint_every (int, optional): frames per sim checkpoint
+        use_store (bool, optional): defaults to the config
+        export_path (str, optional): shot scene with every cache attached,
+        defaults to the scenes dir
+        partition (bool, optional): a sim job per group of nCloth that never
+        touch, added once the input layer is cached, see expand_partition
+        prefix (str, optional): of every job id, to run many shots in one
+        state
+
+    Returns:
+        list: of jobs, dependencies first
+    """
+    scenes_dir = os.path.join(work_dir, "scenes")
+    results_dir = os.path.join(work_dir, "results")
+    scene_ext = os.path.splitext(scene_path)[1] or ".ma"
+    range_args = ["--start", start_frame,
+                  "--end", end_frame,
+                  "--preroll", preroll,
+                  "--postroll", postroll]
+    if use_store is not None:
+        range_args.append("--store" if use_store else "--no-store")
+
+    jobs = []
+    result_paths = []
+    for setup_root, setup_info in sorted(description["setups"].items()):
+        if setups and setup_root not in setups:
+            continue
+        input_id = "{}{}:{}".format(prefix, KIND_INPUT, setup_root)
+        input_scene = os.path.join(scenes_dir,
+                                   "{}{}".format(get_safe_name(input_id),
+                                                 scene_ext))
+        result_path = os.path.join(results_dir,
+                                   "{}.json".format(get_safe_name(input_id)))
+        command = get_batch_command(scene_path,
+                                    "--setups", setup_root,
+                                    "--layers", batch.LAYER_INPUT,
+                                    "--save-as", input_scene,
+                                    "--json", result_path,
+                                    *range_args)
+        # always given, 0 turns off the checkpoint_every of the config
+        sim_args = list(range_args) + ["--checkpoint-every", checkpoint_every]
+        node_vertices = setup_info.get("vertices")
+        input_job = new_job(input_id,
+                            KIND_INPUT,
+                            command,
+                            retries=retries,
+                            setup=setup_root,
+                            result=result_path,
+                            vertices=setup_info.get("input_vertices"))
+        if prefix:
+            input_job["prefix"] = prefix
+        jobs.append(input_job)
+        result_paths.append(result_path)
+        if partition:
+            # sim jobs come from the partition found by the input job
+            command.append("--partition")
+            input_job.update({"partition": True,
+                              "scene": input_scene,
+                              "sim_args": sim_args,
+                              "nuclei": setup_info["nuclei"],
+                              "node_vertices": node_vertices})
+            continue
+
+        for nucleus, nodes in sorted(setup_info["nuclei"].items()):
+            if not nodes:
+                continue
+            sim_job = new_sim_job(input_job,
+                                  input_scene,
+                                  nucleus,
+                                  nodes,
+                                  sim_args,
+                                  retries=retries,
+                                  node_vertices=node_vertices)
+            jobs.append(sim_job)
+            result_paths.append(sim_job["result"])
+
+    if not jobs:
+        return jobs
+    if not export_path:
+        scene_name = os.path.splitext(os.path.basename(scene_path))[0]
+        export_path = os.path.join(scenes_dir, "{}_techanim{}".format(scene_name,
+                                                                      scene_ext))
+    result_path = os.path.join(results_dir, "{}.json".format(KIND_EXPORT))
+    command = get_batch_command(scene_path,
+                                "--attach", *result_paths)
+    command.extend(["--save-as", export_path, "--json", result_path])
+    jobs.append(new_job("{}{}".format(prefix, KIND_EXPORT),
+                        KIND_EXPORT,
+                        command,
+                        deps=[x["id"] for x in jobs],
+                        retries=retries,
+                        result=result_path,
+                        scene=export_path))
+    return jobs
+
+
+def new_sim_job(input_job,
+                input_scene,
+                nucleus,
+                nodes,
+                sim_args,
+                retries=0,
+                colliders=None,
+                group=None,
+                node_vertices=None):
+    """Sim job of some nCloth of a nucleus, from the scene of the input job
+
+    Args:
+        input_job (dict): job caching the input layer of the setup
+        input_scene (str): saved by the input job
+        nucleus (str): solving the nodes
+        nodes (list): nCloth names without namespace
+        sim_args (list): range, store and checkpoint arguments
+        retries (int, optional): extra attempts of a failed job
+        colliders (list, optional): simulate the nodes alone with only these
+        nRigid colliding
+        group (int, optional): index of the partition group
+        node_vertices (dict, optional): node: vertex count, to guess the
+        memory of the job
+
+    Returns:
+        dict: job
+    """
+    setup_root = input_job["setup"]
+    sim_id = "{}{}:{}:{}".format(input_job.get("prefix", ""),
+                                 KIND_SIM,
+                                 setup_root,
+                                 nucleus)
+    if group is not None:
+        sim_id = "{}:{}".format(sim_id, group)
+    results_dir = os.path.dirname(input_job["result"])
+    result_path = os.path.join(results_dir,
+                               "{}.json".format(get_safe_name(sim_id)))
+    args = ["--setups", setup_root,
+            "--layers", batch.LAYER_SIM,
+            "--json", result_path,
+            "--nodes"] + nodes
+    if colliders is not None:
+        args.append("--colliders")
+        args.extend(colliders)
+    return new_job(sim_id,
+                   KIND_SIM,
+                   get_batch_command(input_scene, *(args + sim_args)),
+                   deps=[input_job["id"]],
+                   retries=retries,
+                   setup=setup_root,
+                   nucleus=nucleus,
+                   result=result_path,
+                   vertices=job_memory.get_node_vertices(node_vertices, nodes))
+
+
+def expand_partition(state, input_job):
+    """Add the sim jobs of a done partition input job, a job per group it
+    found, and have the export job wait for them and attach their caches.
+    Without a partition in its result, a job per nucleus like without
+    --partition.
+
+    Args:
+        state (dict): job state
+        input_job (dict): done, with partition in its info
+
+    Returns:
+        list: new jobs
+    """
+    groups = None
+    try:
+        with open(input_job["result"], "r") as f:
+            result = json.load(f)
+        for setup_result in result["setups"]:
+            groups = setup_result["layers"][batch.LAYER_INPUT]["partition"]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    retries = input_job["max_attempts"] - 1
+    node_vertices = input_job.get("node_vertices")
+    sim_jobs = []
+    if groups is None:
+        print("No partition for {}, a job per nucleus".format(input_job["id"]))
+        for nucleus, nodes in sorted(input_job["nuclei"].items()):
+            if nodes:
+                sim_jobs.append(new_sim_job(input_job,
+                                            input_job["scene"],
+                                            nucleus,
+                                            nodes,
+                                            input_job["sim_args"],
+                                            retries=retries,
+                                            node_vertices=node_vertices))
+    else:
+        for index, group in enumerate(groups):
+            sim_jobs.append(new_sim_job(input_job,
+                                        input_job["scene"],
+                                        group["nucleus"],
+                                        group["cloths"],
+                                        input_job["sim_args"],
+                                        retries=retries,
+                                        colliders=group["colliders"],
+                                        group=index,
+                                        node_vertices=node_vertices))
+    input_job["partition"] = False
+
+    jobs = state["jobs"]
+    export_jobs = [x for x in jobs
+                   if x["kind"] == KIND_EXPORT and input_job["id"] in x["deps"]]
+    insert_index = len(jobs)
+    for export_job in export_jobs:
+        insert_index = min(insert_index, jobs.index(export_job))
+        command = export_job["command"]
+        attach_end = command.index("--save-as")
+        command[attach_end:attach_end] = [x["result"] for x in sim_jobs]
+        export_job["deps"].extend([x["id"] for x in sim_jobs])
+    jobs[insert_index:insert_index] = sim_jobs
+    return sim_jobs
+
+
+# =============================================================================
+# state
+# =============================================================================
+
+def get_state_path(work_dir):
+    return os.path.join(work_dir, STATE_NAME)
+
+
+def read_state(work_dir):
+    """Read the job state of a work dir
+
+    Args:
+        work_dir (str): path
+
+    Returns:
+        dict: state, None if there is none
+    """
+    try:
+        with open(get_state_path(work_dir), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_state(work_dir, state):
+    """Write next to the destination and move it in place, a reader never
+    sees half a file
+
+    Args:
+        work_dir (str): path
+        state (dict): to store
+    """
+    state["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    config_io.write_json(state, get_state_path(work_dir))
+
+
+def is_scheduler_running(state):
+    """Is a scheduler on this host working on the state
+
+    Args:
+        state (dict): job state
+
+    Returns:
+        bool: True False
+    """
+    pid = state.get("scheduler_pid")
+    return bool(pid) and pid != os.getpid() and cache_quota.is_pid_alive(pid)
+
+
+def request_cancel(work_dir, job_ids=None):
+    """Cancel jobs, through the running scheduler if there is one
+
+    Args:
+        work_dir (str): path
+        job_ids (list, optional): defaults to every job
+
+    Returns:
+        list: ids cancelled right away, empty when left to the scheduler
+    """
+    state = read_state(work_dir)
+    if state is None:
+        raise ValueError("No jobs in {}".format(work_dir))
+    job_ids = job_ids or [CANCEL_ALL]
+    if is_scheduler_running(state):
+        with open(os.path.join(work_dir, CANCEL_NAME), "a") as f:
+            f.write("\n".join(job_ids) + "\n")
+        return []
+    cancelled = cancel_jobs(state, job_ids)
+    write_state(work_dir, state)
+    return cancelled
+
+
+def cancel_jobs(state, job_ids):
+    """Mark unfinished jobs cancelled, running ones are terminated by the
+    scheduler
+
+    Args:
+        state (dict): job state
+        job_ids (list): ids, CANCEL_ALL for every job
+
+    Returns:
+        list: ids cancelled
+    """
+    cancelled = []
+    for job in state["jobs"]:
+        if CANCEL_ALL not in job_ids and job["id"] not in job_ids:
+            continue
+        if job["status"] in FINISHED:
+            continue
+        job["status"] = CANCELLED
+        job["error"] = "Cancelled"
+        cancelled.append(job["id"])
+    return cancelled
+
+
+def reset_jobs(state, job_ids=None):
+    """Put failed, cancelled and skipped jobs back to pending with fresh
+    attempts
+
+    Args:
+        state (dict): job state
+        job_ids (list, optional): defaults to every unfinished job
+
+    Returns:
+        list: ids reset
+    """
+    reset = []
+    for job in state["jobs"]:
+        if job_ids and job["id"] not in job_ids:
+            continue
+        if job["status"] not in [FAILED, CANCELLED, SKIPPED]:
+            continue
+        job["status"] = PENDING
+        job["attempts"] = 0
+        job["error"] = None
+        reset.append(job["id"])
+    return reset
+
+
+def get_status_counts(state):
+    """Jobs per status
+
+    Args:
+        state (dict): job state
+
+    Returns:
+        dict: status: count
+    """
+    counts = dict([(x, 0) for x in STATUSES])
+    for job in state["jobs"]:
+        counts[job["status"]] += 1
+    return counts
+
+
+def plan_state(state, workers, memory_mb, history=None):
+    """Packing of the jobs left in a state, see job_memory.plan_packing.
+    Running jobs start over on resume, so they are planned too.
+
+    Args:
+        state (dict): job state
+        workers (int): jobs at once
+        memory_mb (int): budget, None is no limit
+        history (dict, optional): defaults to job_memory.read_history
+
+    Returns:
+        list: of waves
+    """
+    if history is None:
+        history = job_memory.read_history()
+    done = [x["id"] for x in state["jobs"] if x["status"] == DONE]
+    jobs = [x for x in state["jobs"] if x["status"] in [PENDING, RUNNING]]
+    return job_memory.plan_packing(jobs, done, workers, memory_mb, history)
+
+
+# =============================================================================
+# scheduler
+# =============================================================================
+
+class JobScheduler(object):
+    """Runs the jobs of a work dir on a pool of processes until every job
+    is finished or the scheduler is stopped
+
+    Attributes:
+        history (dict): past peaks of jobs, see job_memory.read_history
+        memory_mb (int): estimated peaks of running jobs stay under it, None
+        is no limit
+        pool (WorkerPool): warm workers, None starts a mayapy per job
+        procs (dict): job id: running subprocess.Popen or WarmJob
+        state (dict): job state, written on every change
+        work_dir (str): path
+        workers (int): jobs running at once
+    """
+
+    def __init__(self, work_dir, workers=None, warm=False, memory_gb=None):
+        self.work_dir = os.path.abspath(work_dir)
+        self.workers = get_worker_count(workers)
+        self.memory_mb = job_memory.get_memory_budget(memory_gb)
+        self.history = job_memory.read_history()
+        self.pool = None
+        if warm:
+            self.pool = worker_pool.WorkerPool(self.workers,
+                                               mayapy=get_mayapy(),
+                                               env=get_job_env())
+        self.state = read_state(self.work_dir)
+        if self.state is None:
+            raise ValueError("No jobs in {}".format(self.work_dir))
+        self.procs = {}
+        self._log_files = {}
+        self._stop = False
+
+    def __str__(self):
+        return "{} {}".format(self.__class__.__name__, self.work_dir)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.work_dir)
+
+    @property
+    def jobs(self):
+        return self.state["jobs"]
+
+    def get_job(self, job_id):
+        for job in self.jobs:
+            if job["id"] == job_id:
+                return job
+
+    def save(self):
+        write_state(self.work_dir, self.state)
+
+    def stop(self, *args):
+        """Stop after terminating the running jobs, they rerun on resume
+        """
+        self._stop = True
+
+    def get_ready_jobs(self):
+        """Pending jobs with every dependency done, in state order
+
+        Returns:
+            list: of jobs
+        """
+        done = set([x["id"] for x in self.jobs if x["status"] == DONE])
+        return [x for x in self.jobs
+                if x["status"] == PENDING and set(x["deps"]) <= done]
+
+    def get_used_memory(self):
+        """Estimated peaks of the running jobs
+
+        Returns:
+            int: MB
+        """
+        return sum([self.get_job(x).get("memory_mb") or 0
+                    for x in self.procs])
+
+    def can_start(self, job):
+        """Is there a worker and memory for a job, its estimate is stored on
+        it for the ones started after
+
+        Args:
+            job (dict): ready job
+
+        Returns:
+            bool: True False
+        """
+        memory_mb, source = job_memory.estimate_job(job, self.history)
+        job["memory_mb"] = memory_mb
+        job["memory_source"] = source
+        return job_memory.fits(memory_mb,
+                               self.get_used_memory(),
+                               len(self.procs),
+                               self.workers,
+                               self.memory_mb)
+
+    def skip_blocked_jobs(self):
+        """Pending jobs depending on a job that will never be done are
+        skipped, repeated until nothing changes so it goes down the graph
+
+        Returns:
+            bool: if any job was skipped
+        """
+        skipped = False
+        changed = True
+        while changed:
+            changed = False
+            blocked = set([x["id"] for x in self.jobs
+                           if x["status"] in [FAILED, CANCELLED, SKIPPED]])
+            for job in self.jobs:
+                if job["status"] != PENDING:
+                    continue
+                bad_deps = [x for x in job["deps"] if x in blocked]
+                if bad_deps:
+                    job["status"] = SKIPPED
+                    job["error"] = "Dependencies not done: {}".format(bad_deps)
+                    changed = skipped = True
+        return skipped
+
+    def start_job(self, job):
+        """Run a job in its own process, or on a warm worker, output goes to
+        its log
+
+        Args:
+            job (dict): to start
+        """
+        job["attempts"] += 1
+        logs_dir = os.path.join(self.work_dir, "logs")
+        log_path = os.path.join(logs_dir, "{}.{}.log".format(
+            get_safe_name(job["id"]), job["attempts"]))
+        log_file = None
+        try:
+            if self.pool:
+                # the batch arguments, without mayapy -m techanim_flow.batch
+                proc = self.pool.submit(job["id"],
+                                        job["command"][3:],
+                                        log_path=log_path)
+            else:
+                log_file = open(log_path, "w")
+                proc = subprocess.Popen(job["command"],
+                                        stdout=log_file,
+                                        stderr=subprocess.STDOUT,
+                                        env=get_job_env())
+        except OSError as e:
+            if log_file:
+                log_file.close()
+            job["status"] = FAILED
+            job["error"] = "Could not start {}: {}".format(job["command"][0], e)
+            return
+        self.procs[job["id"]] = proc
+        self._log_files[job["id"]] = log_file
+        job["status"] = RUNNING
+        job["pid"] = proc.pid
+        job["log"] = log_path
+        job["started"] = time.time()
+        job["finished"] = None
+        job["exit_code"] = None
+        job["error"] = None
+        print("Started {} ({}/{})".format(job["id"],
+                                          job["attempts"],
+                                          job["max_attempts"]))
+
+    def finish_job(self, job, exit_code, interrupted=False):
+        """Record how a job ended, retry it if it has attempts left
+
+        Args:
+            job (dict): finished job
+            exit_code (int): of its process
+            interrupted (bool, optional): stopped with the scheduler, not
+            failed, it runs again on resume
+        """
+        self.procs.pop(job["id"], None)
+        log_file = self._log_files.pop(job["id"])
+        if log_file:
+            log_file.close()
+        job["pid"] = None
+        job["exit_code"] = exit_code
+        job["finished"] = time.time()
+        job["seconds"] = round(job["finished"] - job["started"], 3)
+        if interrupted:
+            job["status"] = PENDING
+            job["attempts"] -= 1
+            return
+        if job["status"] == CANCELLED:
+            return
+        if exit_code == batch.EXIT_OK:
+            job["status"] = DONE
+            print("Done {} in {}s".format(job["id"], job["seconds"]))
+            peak_mb = job_memory.get_result_peak(job["result"])
+            if peak_mb:
+                job["peak_memory_mb"] = peak_mb
+                job_memory.record_job(job, peak_mb)
+                self.history = job_memory.read_history()
+            if job.get("partition"):
+                for sim_job in expand_partition(self.state, job):
+                    print("Added {}: {}".format(sim_job["id"],
+                                                " ".join(sim_job["command"][3:])))
+            return
+        job["error"] = self.get_job_error(job)
+        if job["attempts"] < job["max_attempts"]:
+            job["status"] = PENDING
+            print("Retrying {}: {}".format(job["id"], job["error"]))
+        else:
+            job["status"] = FAILED
+            print("Failed {}: {}".format(job["id"], job["error"]))
+
+    def get_job_error(self, job):
+        """First error of the batch result of a job
+
+        Args:
+            job (dict): finished job
+
+        Returns:
+            str: error
+        """
+        error = "Exit code {}".format(job["exit_code"])
+        try:
+            with open(job["result"], "r") as f:
+                result = json.load(f)
+        except (IOError, OSError, ValueError, KeyError):
+            return error
+        if result.get("error"):
+            return result["error"]
+        for setup_result in result.get("setups", []):
+            for layer_result in setup_result.get("layers", {}).values():
+                if layer_result.get("error"):
+                    return layer_result["error"]
+            if setup_result.get("error"):
+                return setup_result["error"]
+        return error
+
+    def terminate_job(self, job):
+        """Kill the process of a running job and wait for it
+
+        Args:
+            job (dict): running job
+
+        Returns:
+            int: exit code of the process
+        """
+        proc = self.procs[job["id"]]
+        try:
+            proc.terminate()
+        except OSError:
+            # already gone
+            pass
+        return proc.wait()
+
+    def apply_cancel_requests(self):
+        """Cancel the jobs requested through the cancel file
+
+        Returns:
+            bool: if any job was cancelled
+        """
+        cancel_path = os.path.join(self.work_dir, CANCEL_NAME)
+        if not os.path.exists(cancel_path):
+            return False
+        with open(cancel_path, "r") as f:
+            job_ids = [x.strip() for x in f.read().splitlines() if x.strip()]
+        os.remove(cancel_path)
+        cancelled = cancel_jobs(self.state, job_ids)
+        for job_id in cancelled:
+            job = self.get_job(job_id)
+            if job_id in self.procs:
+                self.finish_job(job, self.terminate_job(job))
+            print("Cancelled {}".format(job_id))
+        return bool(cancelled)
+
+    def resume(self):
+        """Jobs left running by a scheduler that died start over
+        """
+        for job in self.jobs:
+            if job["status"] == RUNNING:
+                job["status"] = PENDING
+                job["pid"] = None
+                job["attempts"] = max(job["attempts"] - 1, 0)
+
+    def run(self):
+        """Run until every job is finished, or stop is called
+
+        Returns:
+            bool: True if every job is done
+        """
+        if is_scheduler_running(self.state):
+            msg = "A scheduler is running on {}, pid {}"
+            raise RuntimeError(msg.format(self.work_dir,
+                                          self.state["scheduler_pid"]))
+        for dir_name in ["logs", "results", "scenes"]:
+            dir_path = os.path.join(self.work_dir, dir_name)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        self.resume()
+        self.state["scheduler_pid"] = os.getpid()
+        self.state["workers"] = self.workers
+        self.state["memory_mb"] = self.memory_mb
+        self.save()
+        if self.pool:
+            self.pool.start()
+        try:
+            while not self._stop:
+                changed = self.apply_cancel_requests()
+                for job_id, proc in list(self.procs.items()):
+                    exit_code = proc.poll()
+                    if exit_code is not None:
+                        self.finish_job(self.get_job(job_id), exit_code)
+                        changed = True
+                changed = self.skip_blocked_jobs() or changed
+                for job in self.get_ready_jobs():
+                    # queued in order, jobs after one waiting for memory
+                    # would keep a big job from ever starting
+                    if not self.can_start(job):
+                        break
+                    self.start_job(job)
+                    changed = True
+                if changed:
+                    self.save()
+                if not self.procs and not self.get_ready_jobs():
+                    break
+                time.sleep(POLL_INTERVAL)
+        finally:
+            for job_id in list(self.procs.keys()):
+                job = self.get_job(job_id)
+                self.finish_job(job, self.terminate_job(job), interrupted=True)
+            if self.pool:
+                self.pool.shutdown()
+            self.state["scheduler_pid"] = None
+            self.save()
+        return all([x["status"] == DONE for x in self.jobs])
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def print_status(state):
+    """Table of the jobs of a state
+
+    Args:
+        state (dict): job state
+    """
+    row = "{:<60} {:<10} {:>8} {:>10} {:>10}  {}"
+    print(row.format("job", "status", "attempts", "seconds", "peak MB",
+                     "error"))
+    for job in state["jobs"]:
+        print(row.format(job["id"][:60],
+                         job["status"],
+                         "{}/{}".format(job["attempts"], job["max_attempts"]),
+                         job["seconds"] if job["seconds"] is not None else "",
+                         job.get("peak_memory_mb") or "",
+                         job["error"] or ""))
+    counts = get_status_counts(state)
+    print(", ".join(["{} {}".format(counts[x], x) for x in STATUSES]))
+
+
+def run(options):
+    """Expand the shot on a new work dir and run, or resume
+
+    Returns:
+        int: 0 if every job is done
+    """
+    work_dir = os.path.abspath(options.work_dir)
+    state = read_state(work_dir)
+    if state is None:
+        if not options.scene:
+            print("--scene is needed to start a new work dir")
+            return 2
+        scene_path = os.path.abspath(options.scene)
+        for dir_name in ["logs", "results", "scenes"]:
+            dir_path = os.path.join(work_dir, dir_name)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        description = run_describe(scene_path, work_dir)
+        start_frame = options.start
+        if start_frame is None:
+            start_frame = description["frame_range"][0]
+        end_frame = options.end
+        if end_frame is None:
+            end_frame = description["frame_range"][1]
+        preroll = options.preroll
+        if preroll is None:
+            preroll = config_io.CONFIG.get("preroll", 0)
+        postroll = options.postroll
+        if postroll is None:
+            postroll = config_io.CONFIG.get("postroll", 0)
+        jobs = expand_shot(scene_path,
+                           work_dir,
+                           description,
+                           start_frame,
+                           end_frame,
+                           preroll,
+                           postroll,
+                           setups=options.setups,
+                           retries=options.retries,
+                           checkpoint_every=options.checkpoint_every,
+                           use_store=options.use_store,
+                           export_path=options.export,
+                           partition=options.partition)
+        if not jobs:
+            print("No setups to cache in {}".format(scene_path))
+            return 3
+        state = {"version": STATE_VERSION,
+                 "scene": scene_path,
+                 "frame_range": [start_frame, end_frame],
+                 "preroll": preroll,
+                 "postroll": postroll,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "scheduler_pid": None,
+                 "jobs": jobs}
+        if not options.dry_run:
+            write_state(work_dir, state)
+    elif options.scene and os.path.abspath(options.scene) != state["scene"]:
+        print("{} is working on {}".format(work_dir, state["scene"]))
+        return 2
+
+    if options.dry_run:
+        workers = get_worker_count(options.workers)
+        memory_mb = job_memory.get_memory_budget(options.memory_gb)
+        job_memory.print_plan(plan_state(state, workers, memory_mb),
+                              workers,
+                              memory_mb)
+        return 0
+
+    warm = options.warm
+    if warm is None:
+        warm = config_io.CONFIG.get("scheduler_warm", False)
+    scheduler = JobScheduler(work_dir,
+                             workers=options.workers,
+                             warm=warm,
+                             memory_gb=options.memory_gb)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    print("Running {} jobs on {} workers, {} MB".format(len(scheduler.jobs),
+                                                        scheduler.workers,
+                                                        scheduler.memory_mb))
+    all_done = scheduler.run()
+    print_status(scheduler.state)
+    return 0 if all_done else 1
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub_parsers = parser.add_subparsers(dest="command")
+
+    run_parser = sub_parsers.add_parser("run", help="start or resume")
+    run_parser.add_argument("work_dir")
+    run_parser.add_argument("--scene", default=None,
+                            help="shot scene, needed on a new work dir")
+    run_parser.add_argument("--setups", nargs="+", default=None)
+    run_parser.add_argument("--start", type=int, default=None)
+    run_parser.add_argument("--end", type=int, default=None)
+    run_parser.add_argument("--preroll", type=int, default=None)
+    run_parser.add_argument("--postroll", type=int, default=None)
+    run_parser.add_argument("--workers", type=int, default=None,
+                            help="defaults to the config, then the cores")
+    run_parser.add_argument("--memory-gb", type=float, default=None,
+                            help="defaults to the config, then most of the RAM")
+    run_parser.add_argument("--dry-run", action="store_true",
+                            help="print the planned packing, run nothing")
+    run_parser.add_argument("--retries", type=int,
+                            default=config_io.CONFIG.get("scheduler_retries", 1))
+    run_parser.add_argument("--checkpoint-every", type=int,
+                            default=config_io.CONFIG.get("checkpoint_every", 0))
+    store_group = run_parser.add_mutually_exclusive_group()
+    store_group.add_argument("--store", dest="use_store",
+                             action="store_true", default=None)
+    store_group.add_argument("--no-store", dest="use_store",
+                             action="store_false")
+    run_parser.add_argument("--export", default=None,
+                            help="shot scene to save with every cache")
+    run_parser.add_argument("--partition", action="store_true",
+                            help="a sim job per group of nCloth that never touch")
+    warm_group = run_parser.add_mutually_exclusive_group()
+    warm_group.add_argument("--warm", dest="warm", action="store_true",
+                            default=None,
+                            help="run jobs on warm mayapy workers")
+    warm_group.add_argument("--cold", dest="warm", action="store_false",
+                            help="start a mayapy per job")
+
+    for name, help_text in [("status", "print the jobs"),
+                            ("cancel", "cancel jobs, all by default"),
+                            ("retry", "reset failed jobs, all by default")]:
+        sub_parser = sub_parsers.add_parser(name, help=help_text)
+        sub_parser.add_argument("work_dir")
+        if name != "status":
+            sub_parser.add_argument("jobs", nargs="*")
+
+    options = parser.parse_args(args)
+    if options.command == "run":
+        return run(options)
+
+    work_dir = os.path.abspath(options.work_dir)
+    state = read_state(work_dir)
+    if state is None:
+        print("No jobs in {}".format(work_dir))
+        return 2
+    if options.command == "cancel":
+        cancelled = request_cancel(work_dir, options.jobs)
+        if cancelled:
+            print("Cancelled {}".format(", ".join(cancelled)))
+        else:
+            print("Cancel requested from the running scheduler")
+    elif options.command == "retry":
+        if is_scheduler_running(state):
+            print("Stop the running scheduler first")
+            return 1
+        reset = reset_jobs(state, options.jobs)
+        write_state(work_dir, state)
+        print("Reset {} jobs, run again to continue".format(len(reset)))
+    else:
+        print_status(state)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
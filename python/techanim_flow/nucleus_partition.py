@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Find which cloths can ever touch, from input layer caches, without Maya.
+
+Every frame the bounding box of each object is swept to the next frame, so
+fast moves between samples are not missed, and grown by the collision
+thickness of the object. Two cloths whose boxes never meet cannot interact
+and can be solved apart, on their own nucleus or in their own batch job.
+Colliders never move because of a cloth, so they only decide which group
+has to see them and never join groups together.
+
+    groups = partition(cloth_tracks, collider_tracks, padding)
+    [{"cloths": ["shirt", "scarf"], "colliders": ["body"]},
+     {"cloths": ["hat"], "colliders": ["head"]}]
+
+Boxes are conservative, two cloths found apart never touch, two found
+together might not either.
+
+Input caches are where the cloth is driven to, not where it simulates to,
+the margin is how far the cloth may stray from them.
+
+Attributes:
+    DEFAULT_MARGIN (float): scene units added between every pair
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# techanim
+from techanim_flow import cache_io
+
+# =============================================================================
+# constants
+# =============================================================================
+DEFAULT_MARGIN = 1.0
+
+
+# =============================================================================
+# bounds
+# =============================================================================
+
+def get_bounds_track(xml_paths):
+    """Bounding box of a geometry at every sample of its caches, swept to
+    the next sample
+
+    Args:
+        xml_paths (list): caches of one object, usually one
+
+    Returns:
+        dict: times, sorted ticks. mins and maxs, (samples, 3) arrays
+    """
+    mins = {}
+    maxs = {}
+    for xml_path in xml_paths:
+        with cache_io.CacheReader(xml_path) as reader:
+            for time in reader.times:
+                for channel in reader.channels:
+                    points = reader.get_time(time, channel)
+                    if points.ndim != 2 or not len(points):
+                        continue
+                    low = points.min(axis=0).astype(np.float64)
+                    high = points.max(axis=0).astype(np.float64)
+                    if time in mins:
+                        low = np.minimum(low, mins[time])
+                        high = np.maximum(high, maxs[time])
+                    mins[time] = low
+                    maxs[time] = high
+    times = sorted(mins.keys())
+    track = {"times": np.array(times, dtype=np.int64),
+             "mins": np.array([mins[x] for x in times]).reshape(-1, 3),
+             "maxs": np.array([maxs[x] for x in times]).reshape(-1, 3)}
+    return sweep_track(track)
+
+
+def sweep_track(track):
+    """Grow every box to cover the next one too, what the object passes
+    through between the two samples
+
+    Args:
+        track (dict): see get_bounds_track
+
+    Returns:
+        dict: same layout
+    """
+    mins = track["mins"].copy()
+    maxs = track["maxs"].copy()
+    if len(mins) > 1:
+        mins[:-1] = np.minimum(mins[:-1], mins[1:])
+        maxs[:-1] = np.maximum(maxs[:-1], maxs[1:])
+    return {"times": track["times"], "mins": mins, "maxs": maxs}
+
+
+def get_contact_times(track_a, track_b, distance):
+    """Samples at which two boxes are closer than a distance
+
+    Args:
+        track_a (dict): see get_bounds_track
+        track_b (dict): see get_bounds_track
+        distance (float): boxes closer than this count as touching
+
+    Returns:
+        numpy.ndarray: ticks, empty if they never touch
+    """
+    times = np.intersect1d(track_a["times"], track_b["times"])
+    if not len(times):
+        # nothing cached at common times, assume the worst
+        return np.union1d(track_a["times"], track_b["times"])[:1]
+    index_a = np.searchsorted(track_a["times"], times)
+    index_b = np.searchsorted(track_b["times"], times)
+    low_a = track_a["mins"][index_a] - distance
+    high_a = track_a["maxs"][index_a] + distance
+    low_b = track_b["mins"][index_b]
+    high_b = track_b["maxs"][index_b]
+    touching = ((low_a <= high_b) & (low_b <= high_a)).all(axis=1)
+    return times[touching]
+
+
+# =============================================================================
+# partition
+# =============================================================================
+
+class _UnionFind(object):
+
+    def __init__(self, names):
+        self.parents = dict((x, x) for x in names)
+
+    def find(self, name):
+        root = name
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[name] != root:
+            self.parents[name], name = root, self.parents[name]
+        return root
+
+    def union(self, name_a, name_b):
+        root_a = self.find(name_a)
+        root_b = self.find(name_b)
+        if root_a != root_b:
+            self.parents[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def partition(cloth_tracks,
+              collider_tracks=None,
+              padding=None,
+              margin=DEFAULT_MARGIN,
+              links=None):
+    """Split cloths into groups that never interact
+
+    Args:
+        cloth_tracks (dict): name: track, see get_bounds_track
+        collider_tracks (dict, optional): name: track of passive objects
+        padding (dict, optional): name: collision thickness, 0 if missing
+        margin (float, optional): added between every pair
+        links (list, optional): of lists of cloths that have to stay
+        together whatever their bounds, like cloths sharing a constraint
+
+    Returns:
+        dict: groups, list of {"cloths", "colliders"} largest first. contacts,
+        list of [name, name, first contact tick]
+    """
+    collider_tracks = collider_tracks or {}
+    padding = padding or {}
+    cloths = sorted(cloth_tracks.keys())
+    union_find = _UnionFind(cloths)
+    contacts = []
+
+    for link in links or []:
+        link = [x for x in link if x in cloth_tracks]
+        for name in link[1:]:
+            union_find.union(link[0], name)
+
+    for index, name_a in enumerate(cloths):
+        for name_b in cloths[index + 1:]:
+            distance = padding.get(name_a, 0) + padding.get(name_b, 0) + margin
+            times = get_contact_times(cloth_tracks[name_a],
+                                      cloth_tracks[name_b],
+                                      distance)
+            if len(times):
+                union_find.union(name_a, name_b)
+                contacts.append([name_a, name_b, int(times[0])])
+
+    collider_contacts = {}
+    for collider in sorted(collider_tracks.keys()):
+        for cloth in cloths:
+            distance = padding.get(collider, 0) + padding.get(cloth, 0) + margin
+            times = get_contact_times(collider_tracks[collider],
+                                      cloth_tracks[cloth],
+                                      distance)
+            if len(times):
+                collider_contacts.setdefault(collider, []).append(cloth)
+                contacts.append([cloth, collider, int(times[0])])
+
+    group_info = {}
+    for cloth in cloths:
+        group_info.setdefault(union_find.find(cloth), []).append(cloth)
+    groups = []
+    for group_cloths in group_info.values():
+        colliders = sorted([x for x, touched in collider_contacts.items()
+                            if set(touched) & set(group_cloths)])
+        groups.append({"cloths": sorted(group_cloths),
+                       "colliders": colliders})
+    groups.sort(key=lambda x: (-len(x["cloths"]), x["cloths"]))
+    return {"groups": groups, "contacts": contacts}
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""Cache every shot of a manifest overnight, in one command.
+
+The manifest lists the shots, a json list of objects or a csv with a header,
+with these fields, only scene is needed:
+
+    name        unique, defaults to the scene name
+    scene       maya file, relative to the manifest
+    setups      setup roots, space or ; separated, default all
+    start, end  frame range, default the scene's
+    preroll     default the config
+    postroll    default the config
+    priority    higher shots start first, default 0
+
+Every shot is described at once, then split into jobs like job_scheduler
+does, their ids starting with the shot name, and every job of the sequence
+runs on the same workers and memory budget, the ready jobs of a higher
+priority shot first:
+
+<work dir>/techanim_jobs.json      state of every job of every shot
+<work dir>/shots/<shot>/           scenes, results of one shot
+<work dir>/sequence.json           report, status, timings and caches per shot
+
+python -m techanim_flow.sequence run /work/sq010 --manifest sq010.csv --workers 48
+python -m techanim_flow.sequence report /work/sq010
+
+Running again on a work dir resumes it. status, cancel and retry of
+job_scheduler work on it too.
+
+Attributes:
+    REPORT_NAME (str): report in the work dir
+    SHOTS_DIR_NAME (str): dir of the shot dirs in the work dir
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import re
+import sys
+import csv
+import json
+import time
+import signal
+import argparse
+from multiprocessing.pool import ThreadPool
+
+# techanim
+from techanim_flow import batch
+from techanim_flow import config_io
+from techanim_flow import job_memory
+from techanim_flow import job_scheduler
+
+# =============================================================================
+# constants
+# =============================================================================
+REPORT_NAME = "sequence.json"
+SHOTS_DIR_NAME = "shots"
+INT_FIELDS = ["start", "end", "preroll", "postroll", "priority"]
+
+SHOT_ERROR = "error"
+
+
+# =============================================================================
+# manifest
+# =============================================================================
+
+def read_manifest(manifest_path):
+    """Shots of a json or csv manifest
+
+    Args:
+        manifest_path (str): .json, anything else is read as csv
+
+    Returns:
+        list: of shots, {"name", "scene", "setups", "start", "end",
+        "preroll", "postroll", "priority"}, None when not given
+
+    Raises:
+        ValueError: a shot without scene, two shots with one name
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, "r") as f:
+        if manifest_path.lower().endswith(".json"):
+            rows = json.load(f)
+            if isinstance(rows, dict):
+                rows = rows["shots"]
+        else:
+            rows = list(csv.DictReader(f))
+
+    shots = []
+    for index, row in enumerate(rows):
+        row = dict([(key.strip().lower(), value) for key, value in row.items()
+                    if key and value not in [None, ""]])
+        if not row.get("scene"):
+            raise ValueError("Shot {} of {} has no scene".format(index + 1,
+                                                                 manifest_path))
+        scene_path = os.path.join(manifest_dir, row["scene"].strip())
+        name = row.get("name") or os.path.splitext(os.path.basename(scene_path))[0]
+        setups = row.get("setups")
+        if setups and not isinstance(setups, list):
+            setups = [x for x in re.split(r"[\s;]+", setups) if x]
+        shot = {"name": job_scheduler.get_safe_name(name.strip()),
+                "scene": os.path.normpath(scene_path),
+                "setups": setups or None}
+        for field in INT_FIELDS:
+            value = row.get(field)
+            shot[field] = None if value is None else int(value)
+        shot["priority"] = shot["priority"] or 0
+        shots.append(shot)
+
+    names = [x["name"] for x in shots]
+    duplicates = sorted(set([x for x in names if names.count(x) > 1]))
+    if duplicates:
+        raise ValueError("Shots named twice in {}: {}".format(manifest_path,
+                                                              duplicates))
+    return shots
+
+
+def get_shot_dir(work_dir, shot):
+    return os.path.join(work_dir, SHOTS_DIR_NAME, shot["name"])
+
+
+def get_shot_prefix(shot):
+    """Start of the id of every job of a shot, partition jobs added later
+    included
+
+    Args:
+        shot (dict): from read_manifest
+
+    Returns:
+        str: prefix
+    """
+    return "{}/".format(shot["name"])
+
+
+def describe_shots(work_dir, shots, workers):
+    """Describe every shot at once, a mayapy each
+
+    Args:
+        work_dir (str): of the sequence
+        shots (list): from read_manifest
+        workers (int): describes at once
+
+    Returns:
+        dict: name: description, or {"error"} if it could not be described
+    """
+    def describe(shot):
+        shot_dir = get_shot_dir(work_dir, shot)
+        for dir_name in ["results", "scenes"]:
+            dir_path = os.path.join(shot_dir, dir_name)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        try:
+            return job_scheduler.run_describe(shot["scene"], shot_dir)
+        except RuntimeError as e:
+            return {"error": "{}".format(e)}
+
+    pool = ThreadPool(max(min(workers, len(shots)), 1))
+    try:
+        descriptions = pool.map(describe, shots)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip([x["name"] for x in shots], descriptions))
+
+
+def expand_sequence(work_dir,
+                    shots,
+                    descriptions,
+                    retries=1,
+                    checkpoint_every=0,
+                    use_store=None,
+                    partition=False):
+    """Jobs of every shot in one list, higher priority shots first, so their
+    ready jobs start first
+
+    Args:
+        work_dir (str): of the sequence
+        shots (list): from read_manifest, their frame ranges and error are
+        filled in
+        descriptions (dict): from describe_shots
+        retries (int, optional): extra attempts of a failed job
+        checkpoint_every (int, optional): frames per sim checkpoint
+        use_store (bool, optional): defaults to the config
+        partition (bool, optional): see job_scheduler.expand_shot
+
+    Returns:
+        list: of jobs, dependencies first
+    """
+    jobs = []
+    for shot in sorted(shots, key=lambda x: -x["priority"]):
+        description = descriptions[shot["name"]]
+        shot["error"] = description.get("error")
+        if shot["error"]:
+            print("Could not describe {}: {}".format(shot["name"],
+                                                     shot["error"]))
+            continue
+        if shot["start"] is None:
+            shot["start"] = description["frame_range"][0]
+        if shot["end"] is None:
+            shot["end"] = description["frame_range"][1]
+        if shot["preroll"] is None:
+            shot["preroll"] = config_io.CONFIG.get("preroll", 0)
+        if shot["postroll"] is None:
+            shot["postroll"] = config_io.CONFIG.get("postroll", 0)
+        shot_jobs = job_scheduler.expand_shot(shot["scene"],
+                                              get_shot_dir(work_dir, shot),
+                                              description,
+                                              shot["start"],
+                                              shot["end"],
+                                              shot["preroll"],
+                                              shot["postroll"],
+                                              setups=shot["setups"],
+                                              retries=retries,
+                                              checkpoint_every=checkpoint_every,
+                                              use_store=use_store,
+                                              partition=partition,
+                                              prefix=get_shot_prefix(shot))
+        if not shot_jobs:
+            shot["error"] = "No setups to cache"
+        jobs.extend(shot_jobs)
+    return jobs
+
+
+# =============================================================================
+# report
+# =============================================================================
+
+def get_job_caches(job):
+    """Cache dirs a done job made, from its batch result
+
+    Args:
+        job (dict): of the job state
+
+    Returns:
+        list: of paths
+    """
+    cache_dirs = []
+    try:
+        with open(job["result"], "r") as f:
+            result = json.load(f)
+        for setup_result in result.get("setups", []):
+            for layer_result in setup_result.get("layers", {}).values():
+                for xml_paths in layer_result.get("caches", {}).values():
+                    cache_dirs.extend([os.path.dirname(x) for x in xml_paths])
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    return cache_dirs
+
+
+def get_shot_status(jobs):
+    """One status for the jobs of a shot
+
+    Args:
+        jobs (list): of the shot
+
+    Returns:
+        str: done when all are, failed once the rest finished, else
+        running or pending
+    """
+    statuses = set([x["status"] for x in jobs])
+    if statuses == set([job_scheduler.DONE]):
+        return job_scheduler.DONE
+    if job_scheduler.RUNNING in statuses:
+        return job_scheduler.RUNNING
+    if statuses <= set(job_scheduler.FINISHED):
+        return job_scheduler.FAILED
+    return job_scheduler.PENDING
+
+
+def get_report(state):
+    """Status, timings and caches of every shot
+
+    Args:
+        state (dict): job state of a sequence work dir
+
+    Returns:
+        dict: shots in priority order
+    """
+    report = {"manifest": state["manifest"],
+              "created": state["created"],
+              "shots": []}
+    for shot in sorted(state["shots"], key=lambda x: -x["priority"]):
+        prefix = get_shot_prefix(shot)
+        jobs = [x for x in state["jobs"] if x["id"].startswith(prefix)]
+        shot_report = dict(shot)
+        shot_report.update({"status": SHOT_ERROR,
+                            "jobs": job_scheduler.get_status_counts({"jobs": jobs}),
+                            "seconds": None,
+                            "wall_seconds": None,
+                            "caches": [],
+                            "export": None,
+                            "errors": {}})
+        report["shots"].append(shot_report)
+        if not jobs:
+            continue
+        shot_report["status"] = get_shot_status(jobs)
+        shot_report["seconds"] = round(sum([x["seconds"] or 0 for x in jobs]),
+                                       3)
+        started = [x["started"] for x in jobs if x["started"]]
+        finished = [x["finished"] for x in jobs if x["finished"]]
+        if started and finished:
+            shot_report["wall_seconds"] = round(max(finished) - min(started), 3)
+        caches = []
+        for job in jobs:
+            if job["error"]:
+                shot_report["errors"][job["id"]] = job["error"]
+            if job["status"] != job_scheduler.DONE:
+                continue
+            if job["kind"] == job_scheduler.KIND_EXPORT:
+                shot_report["export"] = job["scene"]
+            else:
+                caches.extend(get_job_caches(job))
+        shot_report["caches"] = sorted(set(caches))
+    return report
+
+
+def write_report(work_dir, report):
+    """Write the report of a sequence work dir
+
+    Args:
+        work_dir (str): path
+        report (dict): from get_report
+
+    Returns:
+        str: report path
+    """
+    report_path = os.path.join(work_dir, REPORT_NAME)
+    batch.write_result(report, report_path)
+    return report_path
+
+
+def print_report(report):
+    """Table of the shots
+
+    Args:
+        report (dict): from get_report
+    """
+    row = "{:<24} {:>8} {:<8} {:>11} {:>10} {:>10} {:>7}  {}"
+    print(row.format("shot", "priority", "status", "range", "seconds",
+                     "wall", "caches", "export or error"))
+    for shot in report["shots"]:
+        frame_range = ""
+        if shot["start"] is not None:
+            frame_range = "{}-{}".format(shot["start"], shot["end"])
+        note = shot["export"] or shot["error"] or ""
+        if not note and shot["errors"]:
+            note = "; ".join(["{}: {}".format(key, value) for key, value
+                              in sorted(shot["errors"].items())])
+        print(row.format(shot["name"][:24],
+                         shot["priority"],
+                         shot["status"],
+                         frame_range,
+                         shot["seconds"] if shot["seconds"] is not None else "",
+                         shot["wall_seconds"] or "",
+                         len(shot["caches"]),
+                         note))
+    statuses = [x["status"] for x in report["shots"]]
+    print(", ".join(["{} {}".format(statuses.count(x), x) for x
+                     in sorted(set(statuses))]))
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def run(options):
+    """Expand the manifest on a new work dir and run, or resume
+
+    Returns:
+        int: 0 if every shot is done
+    """
+    work_dir = os.path.abspath(options.work_dir)
+    state = job_scheduler.read_state(work_dir)
+    workers = job_scheduler.get_worker_count(options.workers)
+    if state is None:
+        if not options.manifest:
+            print("--manifest is needed to start a new work dir")
+            return 2
+        manifest_path = os.path.abspath(options.manifest)
+        try:
+            shots = read_manifest(manifest_path)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            print("Could not read {}: {}".format(manifest_path, e))
+            return 2
+        if not shots:
+            print("No shots in {}".format(manifest_path))
+            return 2
+        for dir_name in ["logs", "results", "scenes"]:
+            dir_path = os.path.join(work_dir, dir_name)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        descriptions = describe_shots(work_dir, shots, workers)
+        jobs = expand_sequence(work_dir,
+                               shots,
+                               descriptions,
+                               retries=options.retries,
+                               checkpoint_every=options.checkpoint_every,
+                               use_store=options.use_store,
+                               partition=options.partition)
+        state = {"version": job_scheduler.STATE_VERSION,
+                 "manifest": manifest_path,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "scheduler_pid": None,
+                 "shots": shots,
+                 "jobs": jobs}
+        if not options.dry_run:
+            job_scheduler.write_state(work_dir, state)
+    elif "shots" not in state:
+        print("{} is not a sequence work dir".format(work_dir))
+        return 2
+
+    if options.dry_run:
+        memory_mb = job_memory.get_memory_budget(options.memory_gb)
+        job_memory.print_plan(job_scheduler.plan_state(state,
+                                                       workers,
+                                                       memory_mb),
+                              workers,
+                              memory_mb)
+        return 0
+
+    all_done = True
+    if state["jobs"]:
+        warm = options.warm
+        if warm is None:
+            warm = config_io.CONFIG.get("scheduler_warm", False)
+        scheduler = job_scheduler.JobScheduler(work_dir,
+                                               workers=options.workers,
+                                               warm=warm,
+                                               memory_gb=options.memory_gb)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        print("Running {} jobs of {} shots on {} workers".format(
+            len(scheduler.jobs), len(state["shots"]), scheduler.workers))
+        all_done = scheduler.run()
+        state = scheduler.state
+    report = get_report(state)
+    print_report(report)
+    print("Report in {}".format(write_report(work_dir, report)))
+    if not all_done or any([x["error"] for x in state["shots"]]):
+        return 1
+    return 0
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub_parsers = parser.add_subparsers(dest="command")
+
+    run_parser = sub_parsers.add_parser("run", help="start or resume")
+    run_parser.add_argument("work_dir")
+    run_parser.add_argument("--manifest", default=None,
+                            help="json or csv of shots, needed on a new work dir")
+    run_parser.add_argument("--workers", type=int, default=None,
+                            help="defaults to the config, then the cores")
+    run_parser.add_argument("--memory-gb", type=float, default=None,
+                            help="defaults to the config, then most of the RAM")
+    run_parser.add_argument("--dry-run", action="store_true",
+                            help="print the planned packing, run nothing")
+    run_parser.add_argument("--retries", type=int,
+                            default=config_io.CONFIG.get("scheduler_retries", 1))
+    run_parser.add_argument("--checkpoint-every", type=int,
+                            default=config_io.CONFIG.get("checkpoint_every", 0))
+    store_group = run_parser.add_mutually_exclusive_group()
+    store_group.add_argument("--store", dest="use_store",
+                             action="store_true", default=None)
+    store_group.add_argument("--no-store", dest="use_store",
+                             action="store_false")
+    run_parser.add_argument("--partition", action="store_true",
+                            help="a sim job per group of nCloth that never touch")
+    warm_group = run_parser.add_mutually_exclusive_group()
+    warm_group.add_argument("--warm", dest="warm", action="store_true",
+                            default=None,
+                            help="run jobs on warm mayapy workers")
+    warm_group.add_argument("--cold", dest="warm", action="store_false",
+                            help="start a mayapy per job")
+
+    report_parser = sub_parsers.add_parser("report",
+                                           help="print and write the report")
+    report_parser.add_argument("work_dir")
+
+    options = parser.parse_args(args)
+    if options.command == "run":
+        return run(options)
+
+    work_dir = os.path.abspath(options.work_dir)
+    state = job_scheduler.read_state(work_dir)
+    if state is None or "shots" not in state:
+        print("No sequence in {}".format(work_dir))
+        return 2
+    report = get_report(state)
+    print_report(report)
+    print("Report in {}".format(write_report(work_dir, report)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -23,8 +23,10 @@ from __future__ import unicode_literals
 
 # standard
 import copy
+import time
 import traceback
 from functools import wraps
+from contextlib import contextmanager
 
 # dcc
 import maya.mel as mel
@@ -89,6 +91,90 @@ def locknHide(node, attrs=LOCK_ATTRS):
                   lock=True, k=False) for attr in attrs]
 
 
+def locknHide_nodes(nodes, attrs=LOCK_ATTRS):
+    """locknHide on every node, one setAttr per attr and node, nothing is
+    batched. Stays on setAttr, so redoing a setup brings the locks back with
+    the nodes.
+
+    Args:
+        nodes (list): of node names
+        attrs (list, optional): list of attrs
+    """
+    for node in nodes:
+        locknHide(node, attrs=attrs)
+
+
+def duplicate_nodes(nodes,
+                    names,
+                    group,
+                    delete_history=False,
+                    hide=False,
+                    **kwargs):
+    """Duplicate, parent and hide many nodes with a command for all of them
+    instead of one each. The renames and the locks, see locknHide_nodes,
+    still go one by one.
+
+    Args:
+        nodes (list): of nodes to duplicate
+        names (list): of the duplicates, namespace is removed like
+        duplicate -n does
+        group (str): to parent them to
+        delete_history (bool, optional): delete the history of the duplicates
+        hide (bool, optional): hide the duplicates
+        **kwargs: duplicate flags
+
+    Returns:
+        list: of the duplicates, in the order of nodes
+    """
+    if not nodes:
+        return []
+    duplicates = cmds.duplicate(nodes, rr=True, **kwargs)
+    # duplicate -n makes the node in the current namespace
+    namespace = cmds.namespaceInfo(currentNamespace=True, absoluteName=True)
+    namespace = "{}:".format(namespace.rstrip(":"))
+    duplicates = [cmds.rename(node, "{}{}".format(namespace, removeNS(name)))
+                  for node, name in zip(duplicates, names)]
+    if delete_history:
+        cmds.delete(duplicates, ch=True)
+    duplicates = cmds.parent(duplicates, group)
+    if hide:
+        cmds.hide(duplicates)
+    locknHide_nodes(duplicates)
+    return duplicates
+
+
+class SetupTimings(object):
+    """Seconds every step of building a setup took, printed as a table
+
+        timings = SetupTimings()
+        with timings.time("input layer"):
+            create_input_layer(info)
+        timings.print_timings()
+
+    Attributes:
+        timings (list): of [step, seconds] in the order they ran
+    """
+
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def time(self, step):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings.append([step, time.time() - start])
+
+    def print_timings(self):
+        row = "{:<30} {:>10}"
+        print(row.format("layer", "seconds"))
+        for step, seconds in self.timings:
+            print(row.format(step, "{:.3f}".format(seconds)))
+        total = sum([x[1] for x in self.timings])
+        print(row.format("total", "{:.3f}".format(total)))
+
+
 def create_wrap(driver,
                 driven,
                 weightThreshold=0,
@@ -154,6 +240,18 @@ def removeNS(name):
     return name.rpartition(":")[2]
 
 
+def get_leaf(name):
+    """Name of a node without the path cmds.parent may return
+
+    Args:
+        name (str): name
+
+    Returns:
+        str: name without |path|
+    """
+    return name.rpartition("|")[2]
+
+
 def chunks(aList, n):
     """Yield successive n-sized chunks from l."""
     for i in xrange(0, len(aList), n):
@@ -222,40 +320,47 @@ def create_rigid_nodes(rigid_nodes, nucleus_node):
         rigid_nodes (list): of rigid/passive nodes to connect to nucleus
         nucleus_node (str): nucleus node to connect to
     """
-    connection_order = []
     # the sim layer is the middle portion of the layers, this could be
     # configured differently
     sim_index = CONFIG["grouping_order"].index(CONFIG["sim_layer"])
-    # only duplicating up to the disired sim layer
-    for rNode in rigid_nodes:
-        for layer in CONFIG["grouping_order"][:sim_index + 1]:
+    # only duplicating up to the disired sim layer, a layer at a time
+    layer_nodes = {}
+    for layer in CONFIG["grouping_order"][:sim_index + 1]:
+        names = []
+        for rNode in rigid_nodes:
             rigid_node = "{}_{}".format(rNode, layer)
             if layer == CONFIG["sim_layer"]:
                 rigid_node = "{}_{}{}{}".format(rNode,
                                                 layer,
                                                 CONFIG["rigid_suffix"],
                                                 CONFIG["nCloth_output_suffix"])
-            rigid_node = cmds.duplicate(rNode,
-                                        n=removeNS(rigid_node),
-                                        un=False)[0]
-            # adding the source geo to start the connections
-            if rNode not in connection_order:
-                connection_order.append(rNode)
-            connection_order.append(rigid_node)
-            cmds.parent(rigid_node, layer)
-            locknHide(rigid_node)
-            # on source layer, make it a rigid object
-            if layer == CONFIG["sim_layer"]:
-                cmds.select(cl=True)
-                cmds.select(rigid_node, nucleus_node)
-                rigid_shape = mel.eval("makeCollideNCloth;")[0]
-                rigid_trans = cmds.listRelatives(rigid_shape, p=True)[0]
-                rigid_name = rigid_node.replace(CONFIG["nCloth_output_suffix"],
-                                                "")
-                # rigid_name = "{}{}".format(rigid_name, CONFIG["rigid_suffix"])
-                rigid_trans = cmds.rename(rigid_trans, rigid_name)
-                cmds.parent(rigid_trans, layer)
-                locknHide(rigid_trans)
+            names.append(rigid_node)
+        layer_nodes[layer] = duplicate_nodes(rigid_nodes,
+                                             names,
+                                             layer,
+                                             un=False)
+
+    # on source layer, make it a rigid object
+    rigid_transforms = []
+    for rigid_node in layer_nodes.get(CONFIG["sim_layer"], []):
+        cmds.select(cl=True)
+        cmds.select(rigid_node, nucleus_node)
+        rigid_shape = mel.eval("makeCollideNCloth;")[0]
+        rigid_trans = cmds.listRelatives(rigid_shape, p=True)[0]
+        rigid_name = get_leaf(rigid_node).replace(
+            CONFIG["nCloth_output_suffix"], "")
+        # rigid_name = "{}{}".format(rigid_name, CONFIG["rigid_suffix"])
+        rigid_transforms.append(cmds.rename(rigid_trans, rigid_name))
+    if rigid_transforms:
+        rigid_transforms = cmds.parent(rigid_transforms, CONFIG["sim_layer"])
+        locknHide_nodes(rigid_transforms)
+
+    # adding the source geo to start the connections
+    connection_order = []
+    for index, rNode in enumerate(rigid_nodes):
+        connection_order.append(rNode)
+        for layer in CONFIG["grouping_order"][:sim_index + 1]:
+            connection_order.append(get_leaf(layer_nodes[layer][index]))
 
     # create all the connections with the collected info
     for rigid_layers in chunks(connection_order[1:], sim_index + 2):
@@ -304,29 +409,31 @@ def populate_connection_layer(techanim_info,
         wrap (bool, optional): create a wrap between the keys:value
     """
 
-    for driverR_node, driveN_node in techanim_info.iteritems():
-        input_driveR_node = "{}{}".format(driverR_node, suffix)
-        input_driveR_node = cmds.duplicate(driverR_node,
-                                           n=removeNS(input_driveR_node),
-                                           un=False,
-                                           ic=False)[0]
-        cmds.parent(input_driveR_node, groupA)
-        locknHide(input_driveR_node)
-
-        input_driveN_node = "{}{}".format(driveN_node, suffix)
-        input_driveN_node = cmds.duplicate(driveN_node,
-                                           n=removeNS(input_driveN_node),
-                                           un=False,
-                                           ic=False)[0]
-        cmds.parent(input_driveN_node, groupB)
-        locknHide(input_driveN_node)
-        if wrap:
-            wrapDeformer = create_wrap(input_driveR_node,
-                                       input_driveN_node,
-                                       exclusiveBind=exclusiveBind,
-                                       falloffMode=falloffMode)
-            cmds.rename(wrapDeformer, "{}_wrap".format(input_driveR_node))
-            cmds.select(cl=True)
+    driveR_nodes = techanim_info.keys()
+    driveN_nodes = [techanim_info[x] for x in driveR_nodes]
+    input_driveR_nodes = duplicate_nodes(
+        driveR_nodes,
+        ["{}{}".format(x, suffix) for x in driveR_nodes],
+        groupA,
+        un=False,
+        ic=False)
+    input_driveN_nodes = duplicate_nodes(
+        driveN_nodes,
+        ["{}{}".format(x, suffix) for x in driveN_nodes],
+        groupB,
+        un=False,
+        ic=False)
+    if not wrap:
+        return
+    for input_driveR_node, input_driveN_node in zip(input_driveR_nodes,
+                                                    input_driveN_nodes):
+        wrapDeformer = create_wrap(input_driveR_node,
+                                   input_driveN_node,
+                                   exclusiveBind=exclusiveBind,
+                                   falloffMode=falloffMode)
+        cmds.rename(wrapDeformer,
+                    "{}_wrap".format(get_leaf(input_driveR_node)))
+        cmds.select(cl=True)
 
 
 def populate_layer(techanim_info, group, suffix):
@@ -337,16 +444,14 @@ def populate_layer(techanim_info, group, suffix):
         group (str): name of group to parent sim nodes to
         suffix (str): _something
     """
-    for render_node, sim_node in techanim_info.iteritems():
-        node = "{}{}".format(sim_node, suffix)
-        node = cmds.duplicate(sim_node,
-                              n=removeNS(node),
-                              un=False,
-                              ic=False)[0]
-        cmds.delete(node, ch=True)
-        cmds.parent(node, group)
-        cmds.setAttr("{}.v".format(node), 0)
-        locknHide(node)
+    sim_nodes = techanim_info.values()
+    duplicate_nodes(sim_nodes,
+                    ["{}{}".format(x, suffix) for x in sim_nodes],
+                    group,
+                    delete_history=True,
+                    hide=True,
+                    un=False,
+                    ic=False)
 
 
 @create_chunk
@@ -360,21 +465,21 @@ def add_driven_render_nodes(driver, driven, exclusiveBind=1, falloffMode=1):
         exclusiveBind (int, optional): wrap settings
         falloffMode (int, optional): wrap settings
     """
-    for render_node in driven:
-        dup_node_name = "{}{}".format(render_node, CONFIG["output_suffix"])
-        dup_node = cmds.duplicate(render_node,
-                                  n=removeNS(dup_node_name),
-                                  un=False)[0]
-        cmds.parent(dup_node, CONFIG["render_output"])
-        cmds.delete(dup_node, ch=True)
-        locknHide(dup_node)
-
+    if not isinstance(driven, list):
+        driven = [driven]
+    dup_nodes = duplicate_nodes(
+        driven,
+        ["{}{}".format(x, CONFIG["output_suffix"]) for x in driven],
+        CONFIG["render_output"],
+        delete_history=True,
+        un=False)
+    for dup_node in dup_nodes:
         cmds.select(cl=True)
         wrapDeformer = create_wrap(driver,
                                    dup_node,
                                    exclusiveBind=exclusiveBind,
                                    falloffMode=falloffMode)
-        cmds.rename(wrapDeformer, "{}_wrap".format(dup_node))
+        cmds.rename(wrapDeformer, "{}_wrap".format(get_leaf(dup_node)))
         cmds.select(cl=True)
 
 
@@ -463,21 +568,28 @@ def create_setup(techanim_info, setup_options=None):
     if not setup_options:
         setup_options = DEFAULT_SETUP_OPTIONS
     techanim_info = copy.deepcopy(techanim_info)
-    create_techanim_grouping()
+    timings = SetupTimings()
+    with timings.time("grouping"):
+        create_techanim_grouping()
     rigid_nodes = techanim_info.get(RIGID_KEY, [])
 
-    create_input_layer(techanim_info[RENDER_SIM_KEY], **setup_options)
+    with timings.time(CONFIG["grouping_order"][0]):
+        create_input_layer(techanim_info[RENDER_SIM_KEY], **setup_options)
 
     sim_layers = CONFIG["grouping_order"][1:-1]
     for layer in sim_layers:
         group = "{}_{}".format(CONFIG["sim_base_name"], layer)
         suffix = "_{}".format(layer)
-        populate_layer(techanim_info[RENDER_SIM_KEY], group, suffix)
+        with timings.time(layer):
+            populate_layer(techanim_info[RENDER_SIM_KEY], group, suffix)
 
-    create_output_layer(techanim_info[RENDER_SIM_KEY], **setup_options)
-    create_layer_connections(techanim_info[RENDER_SIM_KEY])
+    with timings.time(CONFIG["grouping_order"][-1]):
+        create_output_layer(techanim_info[RENDER_SIM_KEY], **setup_options)
+    with timings.time("layer connections"):
+        create_layer_connections(techanim_info[RENDER_SIM_KEY])
     print(rigid_nodes, "RIGID")
-    create_ncloth_setup(rigid_nodes)
+    with timings.time("nCloth and rigid nodes"):
+        create_ncloth_setup(rigid_nodes)
 
     input_info = {}
     for render_geo in techanim_info[RENDER_SIM_KEY].keys():
@@ -493,3 +605,4 @@ def create_setup(techanim_info, setup_options=None):
     set_info(CONFIG["techanim_root"], CONFIG_ATTR, CONFIG)
 
     cmds.select(CONFIG["techanim_root"])
+    timings.print_timings()
@@ -9,6 +9,7 @@ Auto T-pose
 Auto T-pose for alembic
 
 Attributes:
+    BACKGROUND_POLL_MS (int): how often background simulations are checked
     CONFIG (dict): A config from either module or env var
     DIR_PATH (str): filepath to this file
     DISPLAY_NODE_INT (int): dict key for information in the UI
@@ -38,7 +39,9 @@ try:
 except Exception:
     from PySide2 import QtWidgets, QtGui, QtCore
 
+from techanim_flow import wedge
 from techanim_flow import ui_utils
+from techanim_flow import cache_io
 from techanim_flow import preset_share_ui
 from techanim_flow import techanim_creator_utils
 from techanim_flow import techanim_manager_utils
@@ -80,6 +83,9 @@ os.environ["PRESET_SHARE_BASE_DIR"] = CONFIG["PRESET_SHARE_BASE_DIR"]
 
 SUPPORTED_TOGGLE_ATTRS = ["isDynamic", "enable"]
 
+# how often running background simulations are checked on, ms
+BACKGROUND_POLL_MS = 500
+
 
 def show(hide_menu=False, *args):
     """To launch the ui and not get the same instance
@@ -130,6 +136,10 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         self.techanim_setup_nodes = []
         self.techanim_view_widgets = []
         self.active_setup = None
+        self.background_sims = []
+        self.background_timer = QtCore.QTimer(self)
+        self.background_timer.setInterval(BACKGROUND_POLL_MS)
+        self.background_timer.timeout.connect(self.update_background_sims)
 
         self.reconnect_signals()
 
@@ -202,8 +212,13 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         self.delete_input_layer_btn.clicked.connect(self._delete_cache_input_layer)
         self.setup_select_cb.currentIndexChanged.connect(self.setup_selection_changed)
         self.create_ncache_btn.clicked.connect(self.create_ncache)
+        self.background_ncache_btn.clicked.connect(self.simulate_in_background)
+        self.load_wedges_btn.clicked.connect(self.load_wedges)
+        self.wedge_cb.activated.connect(self._set_wedge)
         self.delete_ncache_btn.clicked.connect(self.delete_ncache)
         self.open_ncache_dir_btn.clicked.connect(self.open_cache_dir)
+        self.cache_distribution_cb.currentIndexChanged.connect(self._set_cache_distribution)
+        self.pin_cache_dir_cb.toggled.connect(self._set_pin_cache_dir)
         self.refresh_btn.clicked.connect(self.total_refresh)
         self.start_frame_sb.valueChanged.connect(self._set_start_frame)
         self.preroll_sb.valueChanged.connect(self._set_start_frame)
@@ -213,7 +228,9 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         """Cache the input layer nodes. All of them.
         """
         self.active_setup.cache_input_layer(self.total_start_frame,
-                                            self.total_end_frame)
+                                            self.total_end_frame,
+                                            preroll=self.preroll_sb.value(),
+                                            postroll=self.postroll_sb.value())
         self.color_input_cache_button()
         cmds.currentTime(self.total_start_frame)
 
@@ -244,29 +261,27 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
 
         Args:
             collected_setups (bool, optional): Refresh without recollecting
-
-        Returns:
-            None: If there are no active setups chosen, skip the rest
         """
         if collected_setups:
             print("Re-Collecting techanim_setups...")
             self.get_techanim_setups()
             self.populate_setup_list()
+        # colors the views of the setup it finds
         self.setup_selection_changed()
-        if not self.active_setup:
-            return
-        self.set_sim_view_info()
-        self.color_sim_view()
-        self.color_input_cache_button()
 
-    def color_sim_view(self):
+    def color_sim_view(self, cache_state=None):
         """Color qlistwidgentitems depending on the sim node they represent
+
+        Args:
+            cache_state (dict, optional): from get_cache_state of the setup,
+            queried if not provided
         """
         blank = QtGui.QBrush()
         blank.setColor(self.grey_color)
         green_brush = QtGui.QBrush()
         green_brush.setColor(self.green_color)
-        cached_nodes = self.active_setup.is_sim_layer_cached()
+        cached_nodes = set(self.active_setup.is_sim_layer_cached(cache_state))
+        cached_ranges = self.active_setup.get_cached_ranges(layer="sim")
         for index in range(self.sim_view_widget.count()):
             item = self.sim_view_widget.item(index)
             long_name = item.data(LONG_NAME_INT)
@@ -274,6 +289,9 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
             if item.data(LONG_NAME_INT) in cached_nodes:
                 # italic = True
                 text = "{} (Cached)".format(short_name)
+                if cached_ranges.get(short_name):
+                    text = "{} (Cached {}-{})".format(short_name,
+                                                      *cached_ranges[short_name])
             else:
                 # italic = False
                 text = short_name
@@ -289,15 +307,26 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
                         item.setFont(font)
                         item.setText(text)
 
-    def color_input_cache_button(self):
+    def color_input_cache_button(self, cache_state=None):
         """If the input layer is cached, color it green, grey if not.
+
+        Args:
+            cache_state (dict, optional): from get_cache_state of the setup,
+            queried if not provided
         """
         text = "Input Layer is NOT Cached"
         color = self.grey_color.darker(250)
 
-        if self.active_setup and self.active_setup.is_input_layer_cached():
+        if (self.active_setup
+                and self.active_setup.is_input_layer_cached(cache_state)):
             text = "Input Layer is Cached"
             color = self.green_color
+            cached_ranges = self.active_setup.get_cached_ranges(layer="input")
+            cached_ranges = [x for x in cached_ranges.values() if x]
+            if cached_ranges:
+                text = "Input Layer is Cached {}-{}".format(
+                    min(x[0] for x in cached_ranges),
+                    max(x[1] for x in cached_ranges))
 
         self.cache_input_layer_btn.setText(text)
         button_palette = self.cache_input_layer_btn.palette()
@@ -336,9 +365,55 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
             if setup_node.root_node == setup_name:
                 self.active_setup = setup_node
                 self.activate_setup(setup_node)
-        self.color_input_cache_button()
+        # one query of the whole setup for both layers
+        cache_state = None
+        if self.active_setup:
+            cache_state = self.active_setup.get_cache_state()
+        self.color_input_cache_button(cache_state)
         self.set_sim_view_info()
-        self.color_sim_view()
+        self.color_sim_view(cache_state)
+        self.refresh_cache_distribution()
+        self.refresh_pin_cache_dir()
+
+    def refresh_pin_cache_dir(self):
+        """Show if the cache dir of the active setup is pinned
+        """
+        if not self.active_setup:
+            return
+        self.pin_cache_dir_cb.blockSignals(True)
+        self.pin_cache_dir_cb.setChecked(self.active_setup.is_cache_dir_pinned())
+        self.pin_cache_dir_cb.blockSignals(False)
+
+    @check_for_active
+    def _set_pin_cache_dir(self, *args):
+        """Pin or unpin the cache dir of the active setup
+
+        Args:
+            *args: throwaway from signal
+        """
+        pinned = self.pin_cache_dir_cb.isChecked()
+        self.active_setup.set_cache_dir_pinned(pinned)
+
+    def refresh_cache_distribution(self):
+        """Show the cache distribution stored on the active setup
+        """
+        if not self.active_setup:
+            return
+        distribution = self.active_setup.get_cache_distribution()
+        self.cache_distribution_cb.blockSignals(True)
+        self.cache_distribution_cb.setCurrentIndex(
+            self.cache_distribution_cb.findText(distribution))
+        self.cache_distribution_cb.blockSignals(False)
+
+    @check_for_active
+    def _set_cache_distribution(self, *args):
+        """Store the chosen distribution on the active setup
+
+        Args:
+            *args: throwaway from signal
+        """
+        distribution = self.cache_distribution_cb.currentText()
+        self.active_setup.set_cache_distribution(distribution)
 
     def views_layout(self):
         """create the views layout
@@ -637,12 +712,11 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         if self.active_setup:
             self.active_setup.set_start_nuclei_frame(self.total_start_frame)
 
-    @check_for_active
-    def create_ncache(self):
-        """cache selected ncloth nodes from the setup
+    def get_selected_ncloth(self):
+        """nCloth nodes selected in the sim view, warns if there are none
 
         Returns:
-            None: if not a setup ncloth node skip
+            list: of nCloth transforms
         """
         suffix = self.active_setup.setup_config["nCloth_suffix"]
         to_cache = []
@@ -654,14 +728,127 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         if not to_cache:
             msg = "No nCloth <node>{} nodes selected!".format(suffix)
             ui_utils.genericWarning(self, msg)
+        return to_cache
+
+    @check_for_active
+    def create_ncache(self):
+        """cache selected ncloth nodes from the setup
+
+        Returns:
+            None: if not a setup ncloth node skip
+        """
+        to_cache = self.get_selected_ncloth()
+        if not to_cache:
             return
         self.active_setup.set_start_nuclei_frame(self.total_start_frame)
-        self.active_setup.cache_sim_nodes(to_cache,
-                                          self.total_start_frame,
-                                          self.total_end_frame)
+        if self.checkpoint_sb.value():
+            self.active_setup.cache_sim_nodes_checkpointed(
+                to_cache,
+                self.total_start_frame,
+                self.total_end_frame,
+                checkpoint_every=self.checkpoint_sb.value(),
+                preroll=self.preroll_sb.value(),
+                postroll=self.postroll_sb.value())
+        else:
+            self.active_setup.cache_sim_nodes(to_cache,
+                                              self.total_start_frame,
+                                              self.total_end_frame,
+                                              preroll=self.preroll_sb.value(),
+                                              postroll=self.postroll_sb.value())
         self.active_setup.set_start_nuclei_frame(self.start_frame)
         self.color_sim_view()
 
+    @check_for_active
+    def simulate_in_background(self):
+        """Simulate the selected ncloth nodes in a local mayapy, the caches
+        are attached once it is done. Maya stays free meanwhile.
+
+        Returns:
+            None: if not a setup ncloth node skip
+        """
+        to_cache = self.get_selected_ncloth()
+        if not to_cache:
+            return
+        running = [node for background_sim in self.background_sims
+                   for node in background_sim.nodes if node in to_cache]
+        if running:
+            msg = "Already simulating in the background: {}".format(running)
+            ui_utils.genericWarning(self, msg)
+            return
+        background_sim = self.active_setup.start_background_sim(
+            to_cache,
+            self.total_start_frame,
+            self.total_end_frame,
+            preroll=self.preroll_sb.value(),
+            postroll=self.postroll_sb.value(),
+            checkpoint_every=self.checkpoint_sb.value())
+        self.background_sims.append(background_sim)
+        self.background_pb.setValue(0)
+        self.background_pb.show()
+        self.background_timer.start()
+
+    def update_background_sims(self):
+        """Show the progress of the background simulations, attach the caches
+        of the finished ones
+        """
+        progress = []
+        for background_sim in list(self.background_sims):
+            if background_sim.poll() is None:
+                progress.append(background_sim.get_progress())
+                continue
+            self.background_sims.remove(background_sim)
+            try:
+                background_sim.attach()
+            except RuntimeError as e:
+                msg = "Background simulation failed, see {}\n{}".format(
+                    background_sim.log_path, e)
+                ui_utils.genericWarning(self, msg)
+            if self.active_setup:
+                self.color_sim_view()
+        if progress:
+            self.background_pb.setValue(int(min(progress) * 100))
+            msg = "{} background simulation(s) running".format(len(progress))
+            self.background_pb.setToolTip(msg)
+        else:
+            self.background_timer.stop()
+            self.background_pb.hide()
+
+    @check_for_active
+    def load_wedges(self):
+        """Pick a wedge work dir and list its simulated wedges
+        """
+        work_dir = QtWidgets.QFileDialog.getExistingDirectory(self,
+                                                              "Wedge Work Dir")
+        if not work_dir:
+            return
+        summary = wedge.read_summary(work_dir)
+        if not summary:
+            msg = "No {} in {}".format(wedge.SUMMARY_NAME, work_dir)
+            ui_utils.genericWarning(self, msg)
+            return
+        self.wedge_cb.clear()
+        for wedge_info in summary["wedges"]:
+            if wedge_info["caches"]:
+                self.wedge_cb.addItem(wedge_info["label"], wedge_info)
+        if not self.wedge_cb.count():
+            msg = "No wedge of {} has caches yet.".format(work_dir)
+            ui_utils.genericWarning(self, msg)
+        self.wedge_cb.setVisible(bool(self.wedge_cb.count()))
+        self.wedge_cb.setToolTip("Wedges of {}".format(summary["setup"]))
+
+    @check_for_active
+    def _set_wedge(self, index):
+        """Attach the caches of the chosen wedge
+
+        Args:
+            index (int): of the wedge in the combobox
+        """
+        wedge_info = self.wedge_cb.itemData(index)
+        if not wedge_info:
+            return
+        self.active_setup.attach_wedge(wedge_info)
+        self.color_sim_view()
+
     def eventFilter(self, QObject, QEvent):
         """Catch the WhatsThis even on any widget and display its howto layer
 
@@ -759,19 +946,68 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         layout = QtWidgets.QVBoxLayout()
         group_widget.setLayout(layout)
         self.create_ncache_btn = QtWidgets.QPushButton("Create nCache")
+        self.background_ncache_btn = QtWidgets.QPushButton("Simulate in Background")
+        msg = ("Simulate in a local mayapy from a snapshot of the scene, the "
+               "caches are attached when it is done.")
+        self.background_ncache_btn.setToolTip(msg)
+        self.background_pb = QtWidgets.QProgressBar()
+        self.background_pb.setRange(0, 100)
+        self.background_pb.hide()
+        self.load_wedges_btn = QtWidgets.QPushButton("Load Wedges")
+        msg = "Flip between the caches of a wedge run, see techanim_flow.wedge"
+        self.load_wedges_btn.setToolTip(msg)
+        self.wedge_cb = QtWidgets.QComboBox()
+        self.wedge_cb.hide()
         self.delete_ncache_btn = QtWidgets.QPushButton("Delete nCache")
         self.open_ncache_dir_btn = QtWidgets.QPushButton("Open Cache Dir")
+        self.pin_cache_dir_cb = QtWidgets.QCheckBox("Pin Cache Dir")
+        msg = "Pinned cache dirs are never removed by the quota cleanup."
+        self.pin_cache_dir_cb.setToolTip(msg)
+        self.cache_distribution_cb = QtWidgets.QComboBox()
+        self.cache_distribution_cb.addItems(cache_io.CACHE_DISTRIBUTIONS)
+        msg = ("OneFile: single file per node, indexed for fast seeking.\n"
+               "OneFilePerFrame: survives a crash mid cache.")
+        self.cache_distribution_cb.setToolTip(msg)
+        self.checkpoint_sb = QtWidgets.QSpinBox()
+        self.checkpoint_sb.setPrefix("Checkpoint Every: ")
+        self.checkpoint_sb.setSpecialValueText("Checkpoint: Off")
+        self.checkpoint_sb.setMaximum(100000)
+        self.checkpoint_sb.setMinimum(0)
+        self.checkpoint_sb.setValue(CONFIG.get("checkpoint_every", 0))
+        self.checkpoint_sb.setButtonSymbols(QtWidgets.QAbstractSpinBox.NoButtons)
+        msg = ("Cache in segments of this many frames. Re-running the same "
+               "cache after a crash continues from the last segment.")
+        self.checkpoint_sb.setToolTip(msg)
         style = QtWidgets.QStyle
         self.open_ncache_dir_btn.setIcon(self.style().standardIcon(getattr(style, "SP_TitleBarMaxButton")))
         layout.addWidget(self.create_ncache_btn)
+        layout.addWidget(self.background_ncache_btn)
+        layout.addWidget(self.background_pb)
+        layout.addWidget(self.load_wedges_btn)
+        layout.addWidget(self.wedge_cb)
         layout.addWidget(self.delete_ncache_btn)
         layout.addWidget(self.open_ncache_dir_btn)
+        layout.addWidget(self.pin_cache_dir_cb)
+        layout.addWidget(self.cache_distribution_cb)
+        layout.addWidget(self.checkpoint_sb)
         self.create_ncache_btn.setMinimumWidth(150)
         self.create_ncache_btn.setMaximumWidth(250)
+        self.background_ncache_btn.setMinimumWidth(150)
+        self.background_ncache_btn.setMaximumWidth(250)
+        self.background_pb.setMinimumWidth(150)
+        self.background_pb.setMaximumWidth(250)
+        self.load_wedges_btn.setMinimumWidth(150)
+        self.load_wedges_btn.setMaximumWidth(250)
+        self.wedge_cb.setMinimumWidth(150)
+        self.wedge_cb.setMaximumWidth(250)
         self.delete_ncache_btn.setMinimumWidth(150)
         self.delete_ncache_btn.setMaximumWidth(250)
         self.open_ncache_dir_btn.setMinimumWidth(150)
         self.open_ncache_dir_btn.setMaximumWidth(250)
+        self.cache_distribution_cb.setMinimumWidth(150)
+        self.cache_distribution_cb.setMaximumWidth(250)
+        self.checkpoint_sb.setMinimumWidth(150)
+        self.checkpoint_sb.setMaximumWidth(250)
         layout.setAlignment(QtCore.Qt.AlignCenter)
         return group_widget
 
@@ -852,6 +1088,19 @@ class TechAnimSetupManagerUI(QtWidgets.QDialog):
         super(TechAnimSetupManagerUI, self).show()
         self.refresh(collected_setups=True)
 
+    def closeEvent(self, event):
+        """Background simulations stop with the UI, nothing would attach
+        their caches
+
+        Args:
+            event (QtGui.QCloseEvent): standard close event
+        """
+        self.background_timer.stop()
+        for background_sim in self.background_sims:
+            background_sim.cancel()
+        self.background_sims = []
+        super(TechAnimSetupManagerUI, self).closeEvent(event)
+
 
 if __name__ == '__main__':
     os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
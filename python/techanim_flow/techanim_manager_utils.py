@@ -9,7 +9,11 @@ from __future__ import unicode_literals
 import os
 import ast
 import copy
+import json
+import time
+import atexit
 import pprint
+import shutil
 import tempfile
 import platform
 import subprocess
@@ -17,7 +21,19 @@ from functools import wraps
 
 import maya.cmds as cmds
 import maya.mel as mel
-
+import maya.api.OpenMaya as om
+
+from techanim_flow import cache_io
+from techanim_flow import config_io
+from techanim_flow import frame_ring
+from techanim_flow import job_bundle
+from techanim_flow import cache_quota
+from techanim_flow import cache_manifest
+from techanim_flow import cache_store
+from techanim_flow import cache_stitch
+from techanim_flow import job_scheduler
+from techanim_flow import nucleus_partition
+from techanim_flow import preset_share_utils
 from techanim_flow import techanim_creator_utils
 reload(techanim_creator_utils)
 
@@ -27,8 +43,46 @@ reload(techanim_creator_utils)
 # convenience, it was annoying to type over again
 CONFIG = techanim_creator_utils.CONFIG
 # This allows the setup(s) to choose only one cache dir per maya session
-CACHE_DIR_ENV = "TECHANIM_CACHE_SESSION_DIR"
-CACHE_DIR_NAME = "techanim"
+CACHE_DIR_ENV = config_io.CACHE_DIR_ENV
+CACHE_DIR_NAME = config_io.CACHE_DIR_NAME
+# OneFile or OneFilePerFrame, stored on the setup config
+CACHE_DISTRIBUTION_KEY = "cache_distribution"
+# checkpointed caching keeps its segments and state under the cache dir
+CHECKPOINT_DIR_NAME = "checkpoints"
+CHECKPOINT_FILE_NAME = "checkpoint.json"
+# reuse caches made from identical inputs instead of simulating again
+CACHE_STORE_KEY = "cache_store"
+# these change with the current frame, not with the setup
+TIME_ATTRS = ["currentTime", "time"]
+# input layer caching split between mayapy processes
+INPUT_SHARDS_KEY = "input_cache_shards"
+SHARDS_DIR_NAME = "shards"
+# nCloth simulated in overlapping chunks, crossfaded together
+SIM_CHUNKS_KEY = "sim_chunks"
+SIM_CHUNK_OVERLAP_KEY = "sim_chunk_overlap"
+SIM_CHUNK_WARMUP_KEY = "sim_chunk_warmup"
+CHUNKS_DIR_NAME = "chunks"
+# cloths that can never touch are solved apart
+PARTITION_MARGIN_KEY = "partition_margin"
+# input layer streamed to the sim through shared memory, both at once
+PIPELINE_DIR_NAME = "pipeline"
+PIPELINE_SLOTS_KEY = "pipeline_slots"
+PIPELINE_TIMEOUT_KEY = "pipeline_timeout"
+# nCloth simulated by a local mayapy while the artist keeps working
+BACKGROUND_DIR_NAME = "background"
+# scene snapshots made for job bundles
+BUNDLE_DIR_NAME = "bundle"
+# seconds a cache dir is not touched again after being touched
+TOUCH_INTERVAL = 60
+# nCloth.cacheableAttributes, positions only
+POSITIONS_CACHEABLE = 0
+# nCloth.cacheableAttributes, positions velocity and internal state. Needed
+# to pick up a simulation exactly where a segment left off
+FULL_STATE_CACHEABLE = 2
+# cache dir: when this session last touched it, its in use marker is
+# released with the scene
+_TOUCHED_DIRS = {}
+_RELEASE_CALLBACKS = []
 
 # =============================================================================
 # general functions
@@ -118,6 +172,201 @@ def get_temp_dir(root_dir, prefix="", suffix=""):
     return temp_dir
 
 
+def write_json(data, file_path):
+    """Write json next to the destination and move it in place, a crash while
+    writing never leaves a half written file behind
+
+    Args:
+        data (dict): to store
+        file_path (str): destination
+    """
+    config_io.write_json(data, file_path)
+
+
+def read_json(file_path):
+    """Read json, None if missing or unreadable
+
+    Args:
+        file_path (str): path
+
+    Returns:
+        dict: contents
+    """
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_frame_segments(start_frame, end_frame, segment_length):
+    """Split a range into consecutive segments sharing their boundary frame
+
+    Args:
+        start_frame (int): start
+        end_frame (int): end
+        segment_length (int): frames per segment
+
+    Returns:
+        list: of [start, end]
+    """
+    if segment_length < 1 or end_frame <= start_frame:
+        return [[start_frame, end_frame]]
+    segments = []
+    for seg_start in range(int(start_frame), int(end_frame), segment_length):
+        segments.append([seg_start, min(seg_start + segment_length,
+                                        end_frame)])
+    return segments
+
+
+def get_mesh_points(mesh, world_space=True):
+    """Points of a mesh shape, or of a plug holding a mesh like the
+    outputMesh of an nCloth, without going through getAttr
+
+    Args:
+        mesh (str): mesh shape or plug
+        world_space (bool, optional): of a shape, a plug has no space
+
+    Returns:
+        numpy.ndarray: (points, 3) float32
+    """
+    selection = om.MSelectionList()
+    selection.add(mesh)
+    if "." in mesh:
+        points = om.MFnMesh(selection.getPlug(0).asMObject()).getPoints()
+    else:
+        space = om.MSpace.kWorld if world_space else om.MSpace.kObject
+        points = om.MFnMesh(selection.getDagPath(0)).getPoints(space)
+    return cache_io.np.array(points, dtype="float32").reshape(-1, 4)[:, :3]
+
+
+def set_mesh_points(shape, points, world_space=True):
+    """Move the points of a mesh shape with no history driving it
+
+    Args:
+        shape (str): mesh shape
+        points (numpy.ndarray): (points, 3)
+        world_space (bool, optional): space of the points
+    """
+    selection = om.MSelectionList()
+    selection.add(shape)
+    space = om.MSpace.kWorld if world_space else om.MSpace.kObject
+    om.MFnMesh(selection.getDagPath(0)).setPoints(
+        om.MPointArray(points.tolist()), space)
+
+
+def get_cache_state(nodes):
+    """Every node with a cacheFile or historySwitch on one of its shapes,
+    found with a few queries for all of them instead of three per node
+
+    Args:
+        nodes (list): transforms
+
+    Returns:
+        dict: node as provided: [its cached shapes], only cached nodes
+    """
+    cache_nodes = cmds.ls(type=["cacheFile", "historySwitch"])
+    if not nodes or not cache_nodes:
+        return {}
+    connected = cmds.listConnections(cache_nodes, shapes=True) or []
+    cached_shapes = {}
+    for shape in cmds.ls(list(set(connected)), shapes=True, long=True):
+        parent = shape.rpartition("|")[0]
+        cached_shapes.setdefault(parent, []).append(shape)
+    if not cached_shapes:
+        return {}
+
+    cache_state = {}
+    for node in set(nodes):
+        # api lookup, no command per node
+        selection = om.MSelectionList()
+        try:
+            selection.add(node)
+            full_path = selection.getDagPath(0).fullPathName()
+        except (RuntimeError, TypeError):
+            continue
+        if full_path in cached_shapes:
+            cache_state[node] = cached_shapes[full_path]
+    return cache_state
+
+
+def get_incoming_connections(node):
+    """Every plug driving the node and what it drives, so which plug a curve
+    or constraint drives tells apart two otherwise identical graphs
+
+    Args:
+        node (str): name of node
+
+    Returns:
+        list: of sorted [source plug, destination plug]
+    """
+    connections = cmds.listConnections(node,
+                                       source=True,
+                                       destination=False,
+                                       plugs=True,
+                                       connections=True) or []
+    # pairs of destination on this node, source plug
+    return sorted([[source, destination] for destination, source
+                   in zip(connections[::2], connections[1::2])])
+
+
+def get_file_stamps(attr_info):
+    """Size and modification time of the files string attrs point to, an
+    alembic or image read by a node changes its output without its attrs
+
+    Args:
+        attr_info (dict): attrname:value
+
+    Returns:
+        dict: attrname: [path, size, mtime]
+    """
+    stamps = {}
+    for attr, value in attr_info.items():
+        if not isinstance(value, basestring) or not os.path.isfile(value):
+            continue
+        stat = os.stat(value)
+        stamps[attr] = [os.path.normpath(value),
+                        stat.st_size,
+                        int(stat.st_mtime)]
+    return stamps
+
+
+def release_cache_dirs(*args):
+    """Remove the in use markers this session left in cache dirs, its scene
+    is going away and the quota cleanup may evict them again
+    """
+    for cache_dir in list(_TOUCHED_DIRS.keys()):
+        try:
+            cache_quota.release_in_use(cache_dir)
+        except OSError:
+            pass
+    _TOUCHED_DIRS.clear()
+
+
+def add_release_callbacks():
+    """Release the in use markers before a new scene is made or opened and
+    when maya or mayapy quits, only added once
+    """
+    if _RELEASE_CALLBACKS:
+        return
+    for message in [om.MSceneMessage.kBeforeNew,
+                    om.MSceneMessage.kBeforeOpen,
+                    om.MSceneMessage.kMayaExiting]:
+        _RELEASE_CALLBACKS.append(
+            om.MSceneMessage.addCallback(message, release_cache_dirs))
+    # mayapy may exit without uninitializing
+    atexit.register(release_cache_dirs)
+
+
+def is_batch():
+    """Running without a UI, mayapy or maya -batch
+
+    Returns:
+        bool: True False
+    """
+    return bool(cmds.about(batch=True))
+
+
 def open_folder(path):
     """https://stackoverflow.com/questions/6631299/python-opening-a-folder-in-explorer-nautilus-mac-thingie
 
@@ -132,6 +381,168 @@ def open_folder(path):
         subprocess.Popen(["xdg-open", path])
 
 
+# =============================================================================
+# connections
+# =============================================================================
+
+def get_plug(plug_name):
+    """Plug of a node, the attr of a transform is looked up on its shape
+    like connectAttr does
+
+    Args:
+        plug_name (str): node.attr
+
+    Returns:
+        om.MPlug: plug
+
+    Raises:
+        RuntimeError: no such node or attr
+    """
+    node, _, attr = plug_name.partition(".")
+    selection = om.MSelectionList()
+    selection.add(node)
+    try:
+        dag_path = selection.getDagPath(0)
+    except TypeError:
+        # not a dag node
+        return om.MFnDependencyNode(selection.getDependNode(0)).findPlug(attr,
+                                                                         False)
+    if dag_path.apiType() == om.MFn.kTransform:
+        for index in range(dag_path.numberOfShapesDirectlyBelow()):
+            shape_path = om.MDagPath(dag_path).extendToShape(index)
+            if not om.MFnDagNode(shape_path).isIntermediateObject:
+                dag_path = shape_path
+                break
+    selection = om.MSelectionList()
+    selection.add("{}.{}".format(dag_path.fullPathName(), attr))
+    return selection.getPlug(0)
+
+
+class ConnectionBatch(object):
+    """Connections wanted between plugs, compared with what is connected and
+    made together with one MDGModifier instead of a command each. Like
+    connectAttr -f, a destination connected to another plug is taken over.
+    An MDGModifier is not on the undo queue, so in a UI session with undo
+    on the connections are made with connectAttr in one undo chunk instead.
+
+        connections = ConnectionBatch()
+        connections.add("shirt_output.outMesh", "char01:shirt.inMesh")
+        connections.apply()
+        connections.failed   {"shirt_output.outMesh >> char01:shirt.inMesh": error}
+
+    Attributes:
+        connections (list): of [label, source MPlug, destination MPlug]
+        failed (dict): "source >> destination": error, connections that
+        could not be found or made
+    """
+
+    def __init__(self):
+        self.connections = []
+        self.failed = {}
+
+    def __len__(self):
+        return len(self.connections)
+
+    def add(self, source, destination):
+        """Want source connected to destination, a plug that does not exist
+        is recorded in failed
+
+        Args:
+            source (str, om.MPlug): node.attr or plug
+            destination (str, om.MPlug): node.attr or plug
+        """
+        plugs = []
+        for plug in [source, destination]:
+            plugs.append(plug.info if isinstance(plug, om.MPlug) else plug)
+        label = "{} >> {}".format(*plugs)
+        try:
+            if not isinstance(source, om.MPlug):
+                source = get_plug(source)
+            if not isinstance(destination, om.MPlug):
+                destination = get_plug(destination)
+        except (RuntimeError, TypeError, ValueError) as e:
+            self.failed[label] = str(e)
+            return
+        self.connections.append([label, source, destination])
+
+    def get_changes(self):
+        """Connections not made yet
+
+        Returns:
+            list: of [label, source MPlug, destination MPlug]
+        """
+        return [x for x in self.connections if x[2].source() != x[1]]
+
+    def apply(self, undoable=None):
+        """Make every missing connection in one doIt. If it fails it is
+        undone and the connections are made one by one to find the failing
+        ones.
+
+        Args:
+            undoable (bool, optional): make them with connectAttr so one undo
+            takes them back, defaults to True in a UI session with undo on
+
+        Returns:
+            int: connections made
+        """
+        changes = self.get_changes()
+        if not changes:
+            return 0
+        if undoable is None:
+            undoable = (not is_batch() and
+                        cmds.undoInfo(query=True, state=True))
+        if undoable:
+            return self._apply_commands(changes)
+        modifier = om.MDGModifier()
+        for _, source, destination in changes:
+            self._add_to_modifier(modifier, source, destination)
+        try:
+            modifier.doIt()
+            return len(changes)
+        except RuntimeError:
+            modifier.undoIt()
+        made = 0
+        for label, source, destination in changes:
+            modifier = om.MDGModifier()
+            try:
+                self._add_to_modifier(modifier, source, destination)
+                modifier.doIt()
+                made += 1
+            except RuntimeError as e:
+                self.failed[label] = str(e)
+        return made
+
+    def _apply_commands(self, changes):
+        """Make the connections with connectAttr -f in one undo chunk
+
+        Args:
+            changes (list): from get_changes
+
+        Returns:
+            int: connections made
+        """
+        made = 0
+        cmds.undoInfo(openChunk=True, chunkName="techanim_connections")
+        try:
+            for label, source, destination in changes:
+                try:
+                    cmds.connectAttr(source.name(),
+                                     destination.name(),
+                                     force=True)
+                    made += 1
+                except RuntimeError as e:
+                    self.failed[label] = str(e)
+        finally:
+            cmds.undoInfo(closeChunk=True)
+        return made
+
+    def _add_to_modifier(self, modifier, source, destination):
+        current_source = destination.source()
+        if not current_source.isNull:
+            modifier.disconnect(current_source, destination)
+        modifier.connect(source, destination)
+
+
 class TechAnim_Setup(object):
 
     """Convencience functionality to manager a techanim setup for simulations
@@ -202,7 +613,6 @@ class TechAnim_Setup(object):
         # do shit
         self.target_namespace = namespace.strip(":")
 
-    @property
     def print_faulty_connections(self):
         """Summary
         """
@@ -242,7 +652,7 @@ class TechAnim_Setup(object):
         if existing_cache and os.path.exists(existing_cache):
             return existing_cache
 
-        cache_dir = os.environ.get(CACHE_DIR_ENV, CONFIG["cache_dir"])
+        cache_dir = config_io.get_cache_root()
         try:
             os.makedirs(cache_dir)
         except Exception:
@@ -263,6 +673,81 @@ class TechAnim_Setup(object):
         self.set_setup_info(self.setup_config)
         return os.path.abspath(cache_dir)
 
+    def touch_cache_dir(self, cache_dir):
+        """Record the dir as used now, and in use by this session, so the
+        quota cleanup leaves it alone. Called when caches are written to or
+        attached from the dir, at most once every TOUCH_INTERVAL seconds
+        per dir so attaching many caches writes to the shared disk once.
+
+        Args:
+            cache_dir (str): path
+        """
+        cache_dir = os.path.normpath(cache_dir)
+        if time.time() - _TOUCHED_DIRS.get(cache_dir, 0) < TOUCH_INTERVAL:
+            return
+        cache_quota.touch(cache_dir)
+        cache_quota.mark_in_use(cache_dir)
+        _TOUCHED_DIRS[cache_dir] = time.time()
+        add_release_callbacks()
+
+    def is_cache_dir_pinned(self):
+        """Is the cache dir of this setup protected from quota cleanup
+
+        Returns:
+            bool: True False
+        """
+        return cache_quota.is_pinned(self.get_cache_dir())
+
+    def set_cache_dir_pinned(self, pinned):
+        """Protect the cache dir of this setup from quota cleanup, or not
+
+        Args:
+            pinned (bool): True False
+        """
+        if pinned:
+            cache_quota.pin(self.get_cache_dir(), reason=self.root_node)
+        else:
+            cache_quota.unpin(self.get_cache_dir())
+
+    def get_cache_distribution(self):
+        """The cache file distribution this setup caches with, from the
+        stored setup config.
+
+        Returns:
+            str: OneFile or OneFilePerFrame
+        """
+        distribution = self.setup_config.get(CACHE_DISTRIBUTION_KEY,
+                                             cache_io.ONE_FILE)
+        if distribution not in cache_io.CACHE_DISTRIBUTIONS:
+            msg = "Unknown cache distribution {}, using {}"
+            cmds.warning(msg.format(distribution, cache_io.ONE_FILE))
+            distribution = cache_io.ONE_FILE
+        return distribution
+
+    def set_cache_distribution(self, distribution):
+        """Store the distribution to use on the setup config
+
+        Args:
+            distribution (str): OneFile or OneFilePerFrame
+        """
+        if distribution not in cache_io.CACHE_DISTRIBUTIONS:
+            raise ValueError("Unknown cache distribution: {}".format(distribution))
+        self.setup_config[CACHE_DISTRIBUTION_KEY] = distribution
+        self.set_setup_info(self.setup_config)
+
+    def index_cache_dir(self, cache_dir=None):
+        """Write the frame offset index for the OneFile caches in the dir so
+        readers can seek straight to a frame
+
+        Args:
+            cache_dir (str, optional): defaults to the setup cache dir
+
+        Returns:
+            list: of written index files
+        """
+        cache_dir = cache_dir or self.get_cache_dir()
+        return cache_io.write_cache_dir_indices(cache_dir)
+
     def set_setup_info(self, data):
         techanim_creator_utils.set_info(self.root_node,
                                         techanim_creator_utils.CONFIG_ATTR,
@@ -278,6 +763,9 @@ class TechAnim_Setup(object):
                 return func(self, *args, **kwargs)
             except Exception as e:
                 print(e)
+                # nobody reads the script editor in batch, let it fail
+                if is_batch():
+                    raise
             finally:
                 self.toggle_nuclei(value=1)
 
@@ -288,6 +776,9 @@ class TechAnim_Setup(object):
         """
         @wraps(func)
         def turn_off_display(self, *args, **kwargs):
+            # there is no viewport to turn off in batch
+            if is_batch():
+                return func(self, *args, **kwargs)
             gMainPane = mel.eval('global string $gMainPane; $temp = $gMainPane;')
             cmds.paneLayout(gMainPane, edit=True, manage=False)
             try:
@@ -377,6 +868,40 @@ class TechAnim_Setup(object):
         sim_layer = self._wrap_ns(self.setup_config["sim_layer"])
         return cmds.listRelatives(sim_layer, ad=True, type="nucleus") or []
 
+    def get_ncloth_nodes(self):
+        """nCloth transforms of the sim layer, what the manager lists as
+        cacheable
+
+        Returns:
+            list: of transforms
+        """
+        sim_layer = self._wrap_ns(self.setup_config["sim_layer"])
+        shapes = cmds.listRelatives(sim_layer, ad=True, type="nCloth") or []
+        nodes = []
+        for shape in shapes:
+            node = cmds.listRelatives(shape, parent=True)[0]
+            if node not in nodes:
+                nodes.append(node)
+        return nodes
+
+    def get_nucleus_ncloth_nodes(self):
+        """nCloth transforms of the sim layer grouped by the nucleus solving
+        them, nuclei are independent of each other and can be cached apart
+
+        Returns:
+            dict: nucleus: [nCloth transforms]
+        """
+        nucleus_info = {}
+        for nucleus in self.get_nuclei():
+            nodes = []
+            shapes = cmds.listConnections(nucleus, type="nCloth", shapes=True)
+            for shape in shapes or []:
+                node = cmds.listRelatives(shape, parent=True)[0]
+                if node not in nodes:
+                    nodes.append(node)
+            nucleus_info[nucleus] = nodes
+        return nucleus_info
+
     def toggle_nuclei(self, nuclei=None, value=0):
         if not nuclei:
             nuclei = self.get_nuclei()
@@ -395,6 +920,31 @@ class TechAnim_Setup(object):
         for nuc in nucleus_nodes:
             cmds.setAttr("{}.startFrame".format(nuc), start_frame)
 
+    def get_start_nuclei_frames(self, nucleus_nodes=None):
+        """start frame of every nucleus node in this setup, to put back with
+        restore_start_nuclei_frames
+
+        Args:
+            nucleus_nodes (list, optional): if not provided, will auto search
+
+        Returns:
+            dict: nucleus: start frame
+        """
+        if not nucleus_nodes:
+            nucleus_nodes = self.get_nuclei()
+        return dict([(nuc, cmds.getAttr("{}.startFrame".format(nuc)))
+                     for nuc in nucleus_nodes])
+
+    def restore_start_nuclei_frames(self, start_frames):
+        """set back the start frames from get_start_nuclei_frames
+
+        Args:
+            start_frames (dict): nucleus: start frame
+        """
+        for nuc, start_frame in start_frames.items():
+            if cmds.objExists(nuc):
+                self.set_start_nuclei_frame(start_frame, [nuc])
+
     def get_association_info(self):
         """after target ns set, put all the information together that the
         ui/user will need
@@ -430,29 +980,54 @@ class TechAnim_Setup(object):
 
         self.suffixes_to_hide = self.setup_config["suffixes_to_hide"]
 
-    def _create_input_layer_connections(self, input_info):
+    def _create_input_layer_connections(self,
+                                        input_info,
+                                        connections,
+                                        setup_nodes):
+        """Want the deformer of every render mesh driving its input mesh too
+
+        Args:
+            input_info (dict): render node: input node
+            connections (ConnectionBatch): the connections are added to
+            setup_nodes (set): full paths of every node of the setup
+        """
         for source, destination in input_info.iteritems():
-            source_deformer = cmds.listConnections("{}.inMesh".format(source),
-                                                   plugs=True)
-            if source_deformer:
-                # cycle fix, this was fun.
-                if (source_deformer[0].rpartition(".")[0]
-                        in cmds.listRelatives(self.root_node, ad=True)):
-                    continue
-                dest_plug = "{}.inMesh".format(destination)
-                if cmds.isConnected(source_deformer[0], dest_plug):
-                    continue
-                cmds.connectAttr(source_deformer[0], dest_plug, f=True)
+            try:
+                source_deformer = get_plug("{}.inMesh".format(source)).source()
+            except (RuntimeError, TypeError, ValueError) as e:
+                plug_str = "{}.inMesh >> {}.inMesh".format(source, destination)
+                connections.failed[plug_str] = str(e)
+                continue
+            if source_deformer.isNull:
+                continue
+            # cycle fix, this was fun.
+            deformer_node = source_deformer.node()
+            if (deformer_node.hasFn(om.MFn.kDagNode)
+                    and om.MFnDagNode(deformer_node).fullPathName()
+                    in setup_nodes):
+                continue
+            connections.add(source_deformer, "{}.inMesh".format(destination))
 
     def create_techanim_connections(self):
         """We are connecting the techanim to the rig on every initialization,
         check into this later to see if this is best practice or not.
+
+        Every connection wanted is collected first and only the missing ones
+        are made, together, see ConnectionBatch.
         """
         self.import_setup()
+        connections = ConnectionBatch()
+        setup_nodes = set(cmds.listRelatives(self.root_node,
+                                             ad=True,
+                                             fullPath=True) or [])
         input_info = self.techanim_info[techanim_creator_utils.RENDER_INPUT_KEY]
-        self._create_input_layer_connections(input_info)
+        self._create_input_layer_connections(input_info,
+                                             connections,
+                                             setup_nodes)
         rigid_info = self.techanim_info[techanim_creator_utils.RIGID_KEY]
-        self._create_input_layer_connections(rigid_info)
+        self._create_input_layer_connections(rigid_info,
+                                             connections,
+                                             setup_nodes)
 
         # output connections to the rig/alembic
         layers = [self._wrap_ns(self.setup_config["render_output"])]
@@ -465,14 +1040,9 @@ class TechAnim_Setup(object):
                 render_node = "{}:{}".format(self.target_namespace,
                                              render_node)
                 dest_plug = "{}.inMesh".format(render_node)
-                # test if already connected so we do not get the warnings
-                if not cmds.isConnected(src_plug, dest_plug):
-                    try:
-                        cmds.connectAttr(src_plug, dest_plug, f=True)
-                    except Exception as e:
-                        plug_str = "{} >> {}".format(src_plug, dest_plug)
-                        msg = str(e)
-                        self.potentionally_faulty_connections[plug_str] = msg
+                connections.add(src_plug, dest_plug)
+        connections.apply()
+        self.potentionally_faulty_connections.update(connections.failed)
         if self.potentionally_faulty_connections:
             self.print_faulty_connections()
 
@@ -501,13 +1071,31 @@ class TechAnim_Setup(object):
 
     @toggle_view
     @__toggle_nuclei
-    def cache_input_layer(self, start_frame, end_frame, cache_dir=None):
+    def cache_input_layer(self,
+                          start_frame,
+                          end_frame,
+                          cache_dir=None,
+                          distribution=None,
+                          use_store=None,
+                          preroll=0,
+                          postroll=0,
+                          shards=None):
         """Using mel to create the caches on the input later nodes
 
         Args:
             start_frame (int): start frame
             end_frame (int): end frame
             cache_dir (str, optional): path to desired dir, or will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+            use_store (bool, optional): reattach a stored cache made from the
+            same inputs, defaults to the config. Ignored with a cache_dir
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
+            shards (int, optional): split the range between this many mayapy
+            processes, defaults to the config, 1 caches here
         """
         # Description:
         # Create cache files on disk for the selected shape(s) according
@@ -548,18 +1136,234 @@ class TechAnim_Setup(object):
             self.delete_input_layer_cache()
         except Exception:
             pass
-        cache_cmd = 'doCreateGeometryCache 6 {{ "0", "{start_frame}", "{end_frame}", "OneFile", "1", "{cache_dir}", "1", "", "0", "replace", "1", "1", "1","0","1","mcx","{world_space}" }} ;'
+        distribution = distribution or self.get_cache_distribution()
+        input_nodes = self.get_layer_nodes_info([self.input_layer])
+        cache_inputs = self.get_input_cache_inputs(start_frame,
+                                                   end_frame,
+                                                   distribution)
+        use_store = self.is_store_enabled(use_store) and not cache_dir
+        if use_store:
+            store_key = cache_store.get_inputs_key(cache_inputs)
+            if self.attach_store_entry(store_key, input_nodes.values()[0]):
+                # the entry may be shared, record this setup and range in it
+                self.write_cache_manifest("input",
+                                          input_nodes.values()[0],
+                                          start_frame,
+                                          end_frame,
+                                          preroll=preroll,
+                                          postroll=postroll,
+                                          distribution=distribution,
+                                          inputs=cache_inputs)
+                return
+            cache_dir = cache_store.begin_entry(store_key).replace("\\", "/")
+
+        cache_cmd = 'doCreateGeometryCache 6 {{ "0", "{start_frame}", "{end_frame}", "{distribution}", "1", "{cache_dir}", "1", "", "0", "replace", "1", "1", "1","0","1","mcx","{world_space}" }} ;'
         cache_arg_info = {
             "start_frame": start_frame,
             "end_frame": end_frame,
             "cache_dir": cache_dir or self.get_cache_dir().replace("\\", "/"),
+            "distribution": distribution,
             "world_space": 1
         }
 
         cache_cmd = cache_cmd.format(**cache_arg_info)
-        input_nodes = self.get_layer_nodes_info([self.input_layer])
-        cmds.select(input_nodes.values()[0])
-        mel.eval(cache_cmd)
+        if shards is None:
+            shards = CONFIG.get(INPUT_SHARDS_KEY, 1)
+        shards = min(shards or 1, max(end_frame - start_frame, 1))
+        if shards > 1 and cache_io.np is None:
+            print("numpy is required to merge shards, caching in one pass.")
+            shards = 1
+        cache_time = time.time()
+        if shards > 1:
+            self.cache_input_layer_sharded(input_nodes.values()[0],
+                                           start_frame,
+                                           end_frame,
+                                           shards,
+                                           cache_arg_info["cache_dir"],
+                                           distribution)
+        else:
+            cmds.select(input_nodes.values()[0])
+            mel.eval(cache_cmd)
+        cache_time = time.time() - cache_time
+        self.index_cache_dir(cache_arg_info["cache_dir"])
+        if use_store:
+            self.commit_store_entry(store_key,
+                                    cache_inputs,
+                                    input_nodes.values()[0],
+                                    cache_dir)
+        self.write_cache_manifest("input",
+                                  input_nodes.values()[0],
+                                  start_frame,
+                                  end_frame,
+                                  preroll=preroll,
+                                  postroll=postroll,
+                                  distribution=distribution,
+                                  seconds=cache_time,
+                                  inputs=cache_inputs)
+
+    def export_scene_snapshot(self, root_dir, prefix):
+        """Export the scene as it is now for batch processes to open, unsaved
+        changes included
+
+        Args:
+            root_dir (str): a new dir is made in here
+            prefix (str): of the new dir
+
+        Returns:
+            tuple: new dir, scene path
+        """
+        snapshot_dir = get_temp_dir(root_dir, prefix=prefix)
+        scene_path = os.path.join(snapshot_dir, "snapshot_scene.ma")
+        cmds.file(scene_path,
+                  exportAll=True,
+                  preserveReferences=True,
+                  type="mayaAscii",
+                  force=True)
+        return snapshot_dir, scene_path
+
+    def start_batch_shard(self, scene_path, shards_dir, name, layer, args,
+                          cache_dir=None):
+        """Start a mayapy caching a layer of this setup, in the background
+
+        Args:
+            scene_path (str): scene the shard opens
+            shards_dir (str): parent dir of the shard dir
+            name (str): of the shard dir, its log and result go there
+            layer (str): input or sim
+            args (list): more batch arguments
+            cache_dir (str, optional): defaults to the shard dir
+
+        Returns:
+            list: process, log file, result path, layer, see wait_batch_shards
+        """
+        shard_dir = os.path.join(shards_dir, name)
+        os.makedirs(shard_dir)
+        result_path = os.path.join(shard_dir, "result.json")
+        command = job_scheduler.get_batch_command(scene_path,
+                                                  "--setups", self.root_node,
+                                                  "--layers", layer,
+                                                  "--cache-dir",
+                                                  cache_dir or shard_dir,
+                                                  "--no-store",
+                                                  "--json", result_path,
+                                                  *args)
+        log_file = open(os.path.join(shard_dir, "shard.log"), "w")
+        proc = subprocess.Popen(command,
+                                stdout=log_file,
+                                stderr=subprocess.STDOUT,
+                                env=job_scheduler.get_job_env())
+        return [proc, log_file, result_path, layer]
+
+    def wait_batch_shards(self, procs, shard_nodes):
+        """Wait for shards started with start_batch_shard
+
+        Args:
+            procs (list): from start_batch_shard
+            shard_nodes (list): nodes every shard has to cache, per shard
+
+        Returns:
+            list: node: [xml paths] per shard
+
+        Raises:
+            RuntimeError: if a shard failed or did not cache every node
+        """
+        shard_caches = []
+        errors = []
+        for (proc, log_file, result_path, layer), nodes in zip(procs,
+                                                               shard_nodes):
+            proc.wait()
+            log_file.close()
+            caches = {}
+            for setup_result in (read_json(result_path) or {}).get("setups", []):
+                layer_result = setup_result["layers"].get(layer, {})
+                caches.update(layer_result.get("caches", {}))
+            missing = [x for x in nodes if x not in caches]
+            if proc.returncode != 0 or missing:
+                errors.append("{} exit code {}, no cache for {}".format(
+                    os.path.dirname(result_path), proc.returncode, missing))
+            shard_caches.append(caches)
+        if errors:
+            raise RuntimeError("Shards failed:\n{}".format("\n".join(errors)))
+        return shard_caches
+
+    def run_batch_shards(self, scene_path, shards_dir, layer, nodes, shards):
+        """Cache a layer of this setup in one mayapy per shard at once, every
+        shard into its own dir under shards_dir
+
+        Args:
+            scene_path (str): scene the shards open
+            shards_dir (str): parent dir of the shard dirs
+            layer (str): input or sim
+            nodes (list): every shard has to cache these
+            shards (list): of [name, [more batch arguments]]
+
+        Returns:
+            list: node: [xml paths] per shard
+
+        Raises:
+            RuntimeError: if a shard failed or did not cache every node
+        """
+        procs = [self.start_batch_shard(scene_path, shards_dir, name, layer, args)
+                 for name, args in shards]
+        return self.wait_batch_shards(procs, [nodes] * len(procs))
+
+    def cache_input_layer_sharded(self,
+                                  nodes,
+                                  start_frame,
+                                  end_frame,
+                                  shards,
+                                  cache_dir,
+                                  distribution):
+        """Cache the input layer over consecutive pieces of the range, each
+        in its own mayapy from a snapshot of this scene, then merge the
+        pieces into one cache per node and attach them. Only right for rigs
+        that evaluate a frame without the frames before it.
+
+        Args:
+            nodes (list): of input layer nodes
+            start_frame (int): start frame
+            end_frame (int): end frame
+            shards (int): mayapy processes
+            cache_dir (str): where the merged caches go
+            distribution (str): OneFile or OneFilePerFrame
+
+        Returns:
+            dict: node: [merged xml paths]
+
+        Raises:
+            RuntimeError: if a shard failed or did not cache every node
+        """
+        shards_dir, scene_path = self.export_scene_snapshot(cache_dir,
+                                                            SHARDS_DIR_NAME)
+        segment_length = -(-(end_frame - start_frame) // shards)
+        segments = get_frame_segments(start_frame, end_frame, segment_length)
+        shard_args = []
+        for seg_start, seg_end in segments:
+            shard_args.append(["shard_{}_{}".format(seg_start, seg_end),
+                               ["--start", seg_start,
+                                "--end", seg_end,
+                                "--preroll", 0,
+                                "--postroll", 0,
+                                "--input-shards", 1]])
+        print("Caching {} frames in {} shards".format(end_frame - start_frame,
+                                                      len(shard_args)))
+        shard_caches = self.run_batch_shards(scene_path,
+                                             shards_dir,
+                                             "input",
+                                             nodes,
+                                             shard_args)
+
+        merged_caches = {}
+        for node in nodes:
+            for xml_paths in zip(*[x[node] for x in shard_caches]):
+                merged_xml = cache_io.merge_caches(xml_paths,
+                                                   cache_dir,
+                                                   cache_type=distribution,
+                                                   overwrite=True)
+                self.attach_cache(merged_xml, node)
+                merged_caches.setdefault(node, []).append(merged_xml)
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        return merged_caches
 
     def delete_sim_cache(self, nodes):
         """There is an annoying mel bug that if you run delete using mel
@@ -591,94 +1395,1929 @@ class TechAnim_Setup(object):
             except Exception:
                 pass
 
-    def is_input_layer_cached(self):
+    def is_input_layer_cached(self, cache_state=None):
         """does the input layer have any nodes with caches on them
 
+        Args:
+            cache_state (dict, optional): from get_cache_state, queried if
+            not provided
+
         Returns:
             list: of nodes with caches on them
         """
         input_nodes = self.get_layer_nodes_info([self.input_layer])
-        return self.is_node_cached(input_nodes.values()[0])
+        return self.is_node_cached(input_nodes.values()[0], cache_state)
 
-    def is_sim_layer_cached(self):
+    def is_sim_layer_cached(self, cache_state=None):
         """are there any nodes in the sim layer that have cache nodes on them
 
+        Args:
+            cache_state (dict, optional): from get_cache_state, queried if
+            not provided
+
         Returns:
             list: of nodes with caches on them
         """
         layers = [self._wrap_ns(self.setup_config["sim_layer"])]
         input_nodes = self.get_layer_nodes_info(layers)
-        return self.is_node_cached(input_nodes.values()[0])
+        return self.is_node_cached(input_nodes.values()[0], cache_state)
 
-    def is_node_cached(self, nodes):
+    def is_node_cached(self, nodes, cache_state=None):
         """are the specific nodes supplied cached in anyway
 
         Args:
             nodes (list): of nodes that may be cached
+            cache_state (dict, optional): from get_cache_state, queried if
+            not provided
 
         Returns:
-            list: of nodes containing cache nodes
+            list: of nodes containing cache nodes, and their cached shapes
         """
+        if cache_state is None:
+            cache_state = self.get_cache_state(nodes)
         nodes_with_cache = []
-        for node in nodes:
-            for shape in cmds.listRelatives(node, shapes=True) or []:
-                if cmds.listConnections(shape, type="historySwitch"):
-                    nodes_with_cache.extend([node, shape])
-                elif cmds.listConnections(shape, type="cacheFile"):
-                    nodes_with_cache.extend([node, shape])
-
+        for node in nodes or []:
+            if node in cache_state:
+                nodes_with_cache.append(node)
+                nodes_with_cache.extend(cache_state[node])
         return nodes_with_cache
 
+    def get_cache_state(self, nodes=None):
+        """Nodes of the setup with a cache on them, see get_cache_state
+
+        Args:
+            nodes (list, optional): transforms, defaults to every transform
+            of the setup
+
+        Returns:
+            dict: node as provided: [its cached shapes], only cached nodes
+        """
+        if nodes is None:
+            nodes = cmds.listRelatives(self.root_node,
+                                       ad=True,
+                                       type="transform") or []
+        return get_cache_state(nodes)
+
     @toggle_view
-    def cache_sim_nodes(self, nodes, start_frame, end_frame, cache_dir=None):
-        """More annoying mel shit, you cannot run a cache on a node
-        that already has a cache on it without getting a UI pop up.
+    def cache_sim_nodes(self,
+                        nodes,
+                        start_frame,
+                        end_frame,
+                        cache_dir=None,
+                        distribution=None,
+                        use_store=None,
+                        preroll=0,
+                        postroll=0,
+                        chunks=None,
+                        chunk_overlap=None,
+                        chunk_warmup=None):
+        """Cache the nCloth nodes over the whole range in a single pass, or
+        in chunks simulated at once, see cache_sim_nodes_chunked
 
         Args:
             nodes (list): of nodes to cache
             start_frame (int): start frame
             end_frame (int): end frame
             cache_dir (str, optional): if none, will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+            use_store (bool, optional): reattach a stored cache made from the
+            same inputs, defaults to the config. Ignored with a cache_dir
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
+            chunks (int, optional): mayapy processes simulating pieces of
+            the range, defaults to the config, 1 simulates here
+            chunk_overlap (int, optional): frames crossfaded at each seam,
+            defaults to the config
+            chunk_warmup (int, optional): frames each chunk settles for,
+            defaults to the config
         """
-        # Create cache files on disk for the select ncloth object(s) according
-        # to the specified flags described below.
+        distribution = distribution or self.get_cache_distribution()
+        if chunks is None:
+            chunks = CONFIG.get(SIM_CHUNKS_KEY, 1)
+        if chunks > 1 and cache_io.np is None:
+            print("numpy is required to stitch chunks, simulating in one pass.")
+            chunks = 1
+        if chunks > 1:
+            # a stitched cache is not what a single pass would make, it is
+            # kept out of the store
+            if chunk_overlap is None:
+                chunk_overlap = CONFIG.get(SIM_CHUNK_OVERLAP_KEY, 10)
+            if chunk_warmup is None:
+                chunk_warmup = CONFIG.get(SIM_CHUNK_WARMUP_KEY, 25)
+            self.cache_sim_nodes_chunked(nodes,
+                                         start_frame,
+                                         end_frame,
+                                         chunks,
+                                         overlap=chunk_overlap,
+                                         warmup=chunk_warmup,
+                                         cache_dir=cache_dir,
+                                         distribution=distribution,
+                                         preroll=preroll,
+                                         postroll=postroll)
+            return
+        cache_inputs = self.get_sim_cache_inputs(nodes,
+                                                 start_frame,
+                                                 end_frame,
+                                                 distribution)
+        # a live rig cannot be hashed, nothing to store without inputs
+        use_store = (self.is_store_enabled(use_store) and
+                     not cache_dir and
+                     cache_inputs is not None)
+        if use_store:
+            store_key = cache_store.get_inputs_key(cache_inputs)
+            if self.attach_store_entry(store_key, nodes):
+                # the entry may be shared, record this setup and range in it
+                self.write_cache_manifest("sim",
+                                          nodes,
+                                          start_frame,
+                                          end_frame,
+                                          preroll=preroll,
+                                          postroll=postroll,
+                                          distribution=distribution,
+                                          inputs=cache_inputs)
+                return
+            cache_dir = cache_store.begin_entry(store_key).replace("\\", "/")
+
+        cache_time = time.time()
+        self._create_ncloth_cache(nodes,
+                                  start_frame,
+                                  end_frame,
+                                  cache_dir=cache_dir,
+                                  distribution=distribution)
+        cache_time = time.time() - cache_time
+        if use_store:
+            self.commit_store_entry(store_key, cache_inputs, nodes, cache_dir)
+        self.write_cache_manifest("sim",
+                                  nodes,
+                                  start_frame,
+                                  end_frame,
+                                  preroll=preroll,
+                                  postroll=postroll,
+                                  distribution=distribution,
+                                  seconds=cache_time,
+                                  inputs=cache_inputs)
+
+    def cache_sim_nodes_chunked(self,
+                                nodes,
+                                start_frame,
+                                end_frame,
+                                chunks,
+                                overlap=10,
+                                warmup=25,
+                                cache_dir=None,
+                                distribution=None,
+                                preroll=0,
+                                postroll=0):
+        """Simulate the range in overlapping chunks, each in its own mayapy
+        from a snapshot of this scene, then crossfade them into one cache
+        per node and attach them. Every chunk but the first warms up from
+        the input cache before its overlap. A seam report is written next
+        to every cache, see cache_stitch.
 
-        # $version == 1:
-        # $args[0] = time range mode:
-        # time range mode = 0 : use $args[1] and $args[2] as start-end
-        # time range mode = 1 : use render globals
-        # time range mode = 2 : use timeline
-        # $args[1] = start frame (if time range mode == 0)
-        # $args[2] = end frame (if time range mode == 0)
+        Args:
+            nodes (list): of nCloth transforms to cache
+            start_frame (int): start frame
+            end_frame (int): end frame
+            chunks (int): mayapy processes
+            overlap (int, optional): frames crossfaded at each seam
+            warmup (int, optional): frames each chunk settles for
+            cache_dir (str, optional): if none, will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
 
-        # $version == 2:
-        # $args[3] = cache file distribution, either "OneFile" or "OneFilePerFrame"
-        # $args[4] = 0/1, whether to refresh during caching
-        # $args[5] = directory for cache files, if "", then use project data dir
-        # $args[6] = 0/1, whether to create a cache per geometry
-        # $args[7] = name of cache file. An empty string can be used to specify that an auto-generated name is acceptable.
-        # $args[8] = 0/1, whether the specified cache name is to be used as a prefix
-        # $version == 3:
-        # $args[9] = action to perform: "add", "replace", "merge" or "mergeDelete"
-        # $args[10] = force save even if it overwrites existing files
-        # $args[11] = simulation rate, the rate at which the cloth simulation is forced to run
-        # $args[12] = sample mulitplier, the rate at which samples are written, as a multiple of simulation rate.
-        # $version == 4:
-        # $args[13] = 0/1, whether modifications should be inherited from the cache about to be replaced.
-        # $args[14] = 0/1, whether to store doubles as floats
+        Returns:
+            dict: xml path: seam reports
+
+        Raises:
+            RuntimeError: if the input layer is not cached, or a chunk failed
+        """
+        if not self.is_input_layer_cached():
+            raise RuntimeError("Cache the input layer before chunking the sim.")
+        cache_dir = cache_dir or self.get_cache_dir()
+        distribution = distribution or self.get_cache_distribution()
+        chunk_list = cache_stitch.get_chunks(start_frame,
+                                             end_frame,
+                                             chunks,
+                                             overlap=overlap,
+                                             warmup=warmup)
+        chunks_dir, scene_path = self.export_scene_snapshot(cache_dir,
+                                                            CHUNKS_DIR_NAME)
+        node_names = [techanim_creator_utils.removeNS(x) for x in nodes]
+        shard_args = []
+        for chunk in chunk_list:
+            shard_args.append(["chunk_{}_{}".format(chunk["sim_start"],
+                                                    chunk["sim_end"]),
+                               ["--start", chunk["sim_start"],
+                                "--end", chunk["sim_end"],
+                                "--preroll", 0,
+                                "--postroll", 0,
+                                "--sim-chunks", 1,
+                                "--nodes"] + node_names])
+        print("Simulating {} frames in {} chunks".format(end_frame - start_frame,
+                                                         len(chunk_list)))
+        cache_time = time.time()
+        shard_caches = self.run_batch_shards(scene_path,
+                                             chunks_dir,
+                                             "sim",
+                                             nodes,
+                                             shard_args)
+
+        self.delete_sim_cache(nodes)
+        seam_reports = {}
+        for node in nodes:
+            for xml_paths in zip(*[x[node] for x in shard_caches]):
+                xml_path, seams = cache_stitch.stitch_caches(
+                    xml_paths,
+                    chunk_list,
+                    cache_dir,
+                    cache_type=distribution,
+                    overwrite=True)
+                cache_stitch.write_report(xml_path, seams)
+                self.attach_cache(xml_path, node)
+                seam_reports[xml_path] = seams
+                for seam in seams:
+                    msg = "{} seam at {}: max gap {:.4f} at frame {}, step ratio {}"
+                    print(msg.format(os.path.basename(xml_path),
+                                     seam["seam"],
+                                     seam["max_gap"],
+                                     seam["max_gap_frame"],
+                                     seam["step_ratio"]))
+        cache_time = time.time() - cache_time
+        self.index_cache_dir(cache_dir)
+        self.write_cache_manifest("sim",
+                                  nodes,
+                                  start_frame,
+                                  end_frame,
+                                  preroll=preroll,
+                                  postroll=postroll,
+                                  distribution=distribution,
+                                  seconds=cache_time)
+        shutil.rmtree(chunks_dir, ignore_errors=True)
+        return seam_reports
+
+    # =========================================================================
+    # pipeline
+    # =========================================================================
+
+    def get_input_layer_shapes(self):
+        """Mesh shape of every input layer node
+
+        Returns:
+            dict: node: shape
+        """
+        shapes = {}
+        input_nodes = self.get_layer_nodes_info([self.input_layer])
+        for node in input_nodes.values()[0] or []:
+            node_shapes = cmds.listRelatives(node,
+                                             shapes=True,
+                                             type="mesh",
+                                             noIntermediate=True)
+            if node_shapes:
+                shapes[node] = node_shapes[0]
+        return shapes
+
+    @toggle_view
+    @__toggle_nuclei
+    def stream_input_layer(self,
+                           start_frame,
+                           end_frame,
+                           ring_path,
+                           cache_dir=None,
+                           distribution=None,
+                           preroll=0,
+                           postroll=0,
+                           slots=None,
+                           timeout=None):
+        """Evaluate the input layer frame by frame into a frame ring, for
+        cache_sim_nodes_streamed to simulate from in another process at the
+        same time. The input cache is still written, on a thread, and
+        attached like cache_input_layer would.
+
+        Args:
+            start_frame (int): start frame
+            end_frame (int): end frame
+            ring_path (str): see frame_ring.get_ring_path, made here
+            cache_dir (str, optional): if none, will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
+            slots (int, optional): frames the ring holds, defaults to the config
+            timeout (float, optional): seconds to wait for the simulation to
+            take a frame, defaults to the config
+
+        Returns:
+            dict: node: xml path
+
+        Raises:
+            FrameRingError: the simulation gave up or stopped reading
+            ImportError: numpy is needed to stream
+        """
+        if cache_io.np is None:
+            raise ImportError("numpy is required to stream the input layer.")
+        try:
+            self.delete_input_layer_cache()
+        except Exception:
+            pass
+        cache_dir = cache_dir or self.get_cache_dir()
+        distribution = distribution or self.get_cache_distribution()
+        if slots is None:
+            slots = CONFIG.get(PIPELINE_SLOTS_KEY, frame_ring.DEFAULT_SLOTS)
+        if timeout is None:
+            timeout = CONFIG.get(PIPELINE_TIMEOUT_KEY) or None
+        shapes = self.get_input_layer_shapes()
+        fps = mel.eval("currentTimeUnitToFPS()")
+        writers = {}
+        channels = []
+        for shape in shapes.values():
+            writers[shape] = cache_io.CacheWriter(cache_dir,
+                                                  shape.replace(":", "_"),
+                                                  start_frame,
+                                                  end_frame=end_frame,
+                                                  fps=fps,
+                                                  cache_type=distribution)
+            channels.append([shape, cmds.polyEvaluate(shape, vertex=True)])
+
+        ring = frame_ring.FrameRing.create(ring_path, channels, slots=slots)
+        disk_writer = cache_io.AsyncCacheWriter(writers)
+        cache_time = time.time()
+        try:
+            for frame in range(int(start_frame), int(end_frame) + 1):
+                cmds.currentTime(frame)
+                points = dict((x, get_mesh_points(x)) for x in shapes.values())
+                ring.put(frame, points, timeout=timeout)
+                for shape, shape_points in points.items():
+                    disk_writer.write_frame(shape, frame, shape_points)
+        except Exception:
+            ring.finish(failed=True)
+            ring.close()
+            try:
+                disk_writer.close(write_xml=False)
+            except Exception:
+                pass
+            raise
+        ring.finish()
+        ring.close()
+        xml_paths = disk_writer.close()
+        cache_time = time.time() - cache_time
+
+        node_caches = {}
+        for node, shape in shapes.items():
+            self.attach_cache(xml_paths[shape], node)
+            node_caches[node] = xml_paths[shape]
+        self.index_cache_dir(cache_dir)
+        self.write_cache_manifest("input",
+                                  list(shapes.keys()),
+                                  start_frame,
+                                  end_frame,
+                                  preroll=preroll,
+                                  postroll=postroll,
+                                  distribution=distribution,
+                                  seconds=cache_time)
+        return node_caches
+
+    def get_ncloth_cache_writers(self,
+                                 nodes,
+                                 start_frame,
+                                 end_frame,
+                                 cache_dir,
+                                 distribution):
+        """Writers of positions caches named and laid out the way maya
+        makes them for the nCloth nodes, from a maya cache of two frames
+
+        Args:
+            nodes (list): of nCloth transforms, caching only positions
+            start_frame (int): start frame
+            end_frame (int): end frame
+            cache_dir (str): where the caches go
+            distribution (str): OneFile or OneFilePerFrame
+
+        Returns:
+            dict: node: cache_io.CacheWriter
+
+        Raises:
+            RuntimeError: if maya did not make a positions cache for a node
+        """
+        probe_dir = get_temp_dir(cache_dir, prefix=PIPELINE_DIR_NAME)
+        writers = {}
+        try:
+            self._create_ncloth_cache(nodes,
+                                      start_frame,
+                                      start_frame + 1,
+                                      cache_dir=probe_dir.replace("\\", "/"),
+                                      distribution=distribution)
+            probe_caches = self.get_cached_xml_paths(nodes)
+            self.delete_sim_cache(nodes)
+            for node in nodes:
+                xml_paths = probe_caches.get(node)
+                description = None
+                if xml_paths:
+                    description = cache_io.read_description(xml_paths[0])
+                if not description or len(description.channels) != 1:
+                    msg = "Maya made no positions cache for {}".format(node)
+                    raise RuntimeError(msg)
+                channel_info = dict((x["ChannelName"], x)
+                                    for x in description.channels)
+                writers[node] = cache_io.CacheWriter(
+                    cache_dir,
+                    description.base_name,
+                    start_frame,
+                    end_frame=end_frame,
+                    channels=description.channel_names,
+                    fps=description.fps,
+                    cache_type=distribution,
+                    cache_format=description.cache_format,
+                    channel_info=channel_info)
+        finally:
+            shutil.rmtree(probe_dir, ignore_errors=True)
+        return writers
+
+    @toggle_view
+    def cache_sim_nodes_streamed(self,
+                                 nodes,
+                                 start_frame,
+                                 end_frame,
+                                 ring_path,
+                                 cache_dir=None,
+                                 distribution=None,
+                                 preroll=0,
+                                 postroll=0,
+                                 timeout=None):
+        """Simulate the nCloth nodes from the input layer frames streamed by
+        stream_input_layer in another process, each frame as soon as it
+        comes in. The input layer history is cut while streaming and put
+        back after. Only positions are cached.
+
+        Args:
+            nodes (list): of nCloth transforms to cache
+            start_frame (int): start frame
+            end_frame (int): end frame
+            ring_path (str): see frame_ring.get_ring_path, removed when done
+            cache_dir (str, optional): if none, will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
+            timeout (float, optional): seconds to wait for a frame, defaults
+            to the config
+
+        Returns:
+            dict: node: xml path
+
+        Raises:
+            FrameRingError: the input layer process failed or stalled
+            ImportError: numpy is needed to stream
+            RuntimeError: the stream does not match the input layer, or ended
+            before the end frame
+        """
+        if cache_io.np is None:
+            raise ImportError("numpy is required to simulate from a stream.")
+        cache_dir = cache_dir or self.get_cache_dir()
+        distribution = distribution or self.get_cache_distribution()
+        if timeout is None:
+            timeout = CONFIG.get(PIPELINE_TIMEOUT_KEY) or None
+        try:
+            self.delete_input_layer_cache()
+        except Exception:
+            pass
+        shapes = self.get_input_layer_shapes()
+        cloth_shapes = dict((x, self.get_ncloth_shapes([x])[0]) for x in nodes)
+        cacheable = {}
+        connections = {}
+        disk_writer = None
+        ring = frame_ring.FrameRing.attach(ring_path, timeout=timeout)
+        try:
+            missing = [x for x, _ in ring.channels if x not in shapes.values()]
+            if missing:
+                msg = "Streamed meshes not in the input layer: {}"
+                raise RuntimeError(msg.format(missing))
+            for shape in cloth_shapes.values():
+                plug = "{}.cacheableAttributes".format(shape)
+                cacheable[plug] = cmds.getAttr(plug)
+                cmds.setAttr(plug, POSITIONS_CACHEABLE)
+            self.set_start_nuclei_frame(start_frame)
+            writers = self.get_ncloth_cache_writers(nodes,
+                                                    start_frame,
+                                                    end_frame,
+                                                    cache_dir,
+                                                    distribution)
+
+            # the stream drives the input layer instead of the rig
+            for channel, _ in ring.channels:
+                plug = "{}.inMesh".format(channel)
+                sources = cmds.listConnections(plug,
+                                               source=True,
+                                               destination=False,
+                                               plugs=True)
+                if sources:
+                    cmds.disconnectAttr(sources[0], plug)
+                    connections[plug] = sources[0]
+
+            disk_writer = cache_io.AsyncCacheWriter(writers)
+            cache_time = time.time()
+            last_frame = None
+            while True:
+                item = ring.get(timeout=timeout)
+                if item is None:
+                    break
+                frame, points = item
+                for shape, shape_points in points.items():
+                    set_mesh_points(shape, shape_points)
+                cmds.currentTime(frame)
+                for node, shape in cloth_shapes.items():
+                    plug = "{}.outputMesh".format(shape)
+                    disk_writer.write_frame(node, frame, get_mesh_points(plug))
+                last_frame = frame
+            if last_frame != end_frame:
+                msg = "The input layer stream ended at frame {}, not {}"
+                raise RuntimeError(msg.format(last_frame, end_frame))
+            xml_paths = disk_writer.close()
+            disk_writer = None
+            cache_time = time.time() - cache_time
+        except Exception:
+            ring.abort()
+            if disk_writer is not None:
+                try:
+                    disk_writer.close(write_xml=False)
+                except Exception:
+                    pass
+            raise
+        finally:
+            ring.close(unlink=True)
+            for plug, source in connections.items():
+                cmds.connectAttr(source, plug, force=True)
+            for plug, value in cacheable.items():
+                cmds.setAttr(plug, value)
+
+        for node, xml_path in xml_paths.items():
+            self.attach_cache(xml_path, node)
+        self.index_cache_dir(cache_dir)
+        self.write_cache_manifest("sim",
+                                  nodes,
+                                  start_frame,
+                                  end_frame,
+                                  preroll=preroll,
+                                  postroll=postroll,
+                                  distribution=distribution,
+                                  seconds=cache_time)
+        return xml_paths
+
+    def cache_pipelined(self,
+                        start_frame,
+                        end_frame,
+                        nodes=None,
+                        cache_dir=None,
+                        preroll=0,
+                        postroll=0):
+        """Cache the input layer and simulate the nCloth at the same time,
+        in two mayapy processes from a snapshot of this scene. The input
+        layer frames go to the simulation through shared memory as they are
+        evaluated, see frame_ring. Both caches are attached here once done.
+
+        Args:
+            start_frame (int): start frame, preroll included
+            end_frame (int): end frame, postroll included
+            nodes (list, optional): of nCloth transforms, defaults to all
+            cache_dir (str, optional): if none, will auto search
+            preroll (int, optional): frames of the range that are preroll
+            postroll (int, optional): frames of the range that are postroll
+
+        Returns:
+            dict: node: [xml paths], input layer and nCloth nodes
+
+        Raises:
+            ImportError: numpy is needed to stream
+            RuntimeError: if either process failed
+        """
+        if cache_io.np is None:
+            raise ImportError("numpy is required to pipeline the caching.")
+        cache_dir = cache_dir or self.get_cache_dir()
+        nodes = nodes or self.get_ncloth_nodes()
+        input_nodes = list(self.get_input_layer_shapes().keys())
+        pipeline_dir, scene_path = self.export_scene_snapshot(cache_dir,
+                                                              PIPELINE_DIR_NAME)
+        ring_path = frame_ring.get_ring_path(os.path.basename(pipeline_dir))
+        stream_args = ["--start", start_frame + preroll,
+                       "--end", end_frame - postroll,
+                       "--preroll", preroll,
+                       "--postroll", postroll,
+                       "--stream", ring_path]
+        node_names = [techanim_creator_utils.removeNS(x) for x in nodes]
+        print("Caching and simulating {} frames at once".format(
+            end_frame - start_frame))
+        procs = [self.start_batch_shard(scene_path,
+                                        pipeline_dir,
+                                        "input",
+                                        "input",
+                                        stream_args,
+                                        cache_dir=cache_dir),
+                 self.start_batch_shard(scene_path,
+                                        pipeline_dir,
+                                        "sim",
+                                        "sim",
+                                        stream_args + ["--nodes"] + node_names,
+                                        cache_dir=cache_dir)]
+        try:
+            input_caches, sim_caches = self.wait_batch_shards(procs,
+                                                              [input_nodes,
+                                                               nodes])
+        finally:
+            frame_ring.remove_ring(ring_path)
+
+        try:
+            self.delete_input_layer_cache()
+        except Exception:
+            pass
+        self.delete_sim_cache(nodes)
+        caches = {}
+        for node, xml_paths in list(input_caches.items()) + list(sim_caches.items()):
+            for xml_path in xml_paths:
+                self.attach_cache(xml_path, node)
+            caches[node] = xml_paths
+        shutil.rmtree(pipeline_dir, ignore_errors=True)
+        return caches
+
+    def start_background_sim(self,
+                             nodes,
+                             start_frame,
+                             end_frame,
+                             preroll=0,
+                             postroll=0,
+                             checkpoint_every=0):
+        """Simulate the nCloth in a local mayapy from a snapshot of the scene
+        as it is now, without waiting for it. The scene stays free to work
+        in, attach the caches with the returned BackgroundSim once done.
+
+        Args:
+            nodes (list): of nCloth transforms
+            start_frame (int): start frame, preroll included
+            end_frame (int): end frame, postroll included
+            preroll (int, optional): frames of the range that are preroll
+            postroll (int, optional): frames of the range that are postroll
+            checkpoint_every (int, optional): frames per checkpoint, 0 is off
+
+        Returns:
+            BackgroundSim: the running simulation
+        """
+        background_dir, scene_path = self.export_scene_snapshot(
+            self.get_cache_dir(), BACKGROUND_DIR_NAME)
+        progress_path = os.path.join(background_dir, "progress.json")
+        args = ["--start", start_frame + preroll,
+                "--end", end_frame - postroll,
+                "--preroll", preroll,
+                "--postroll", postroll,
+                "--progress", progress_path,
+                "--nodes"] + [techanim_creator_utils.removeNS(x) for x in nodes]
+        if checkpoint_every:
+            args.extend(["--checkpoint-every", checkpoint_every])
+        shard = self.start_batch_shard(scene_path,
+                                       background_dir,
+                                       "sim",
+                                       "sim",
+                                       args)
+        print("Simulating {} in the background, log in {}".format(
+            nodes, background_dir))
+        return BackgroundSim(self,
+                             nodes,
+                             shard,
+                             background_dir,
+                             scene_path,
+                             progress_path,
+                             start_frame,
+                             end_frame)
+
+    def _create_ncloth_cache(self,
+                             nodes,
+                             start_frame,
+                             end_frame,
+                             cache_dir=None,
+                             distribution=None):
+        """More annoying mel shit, you cannot run a cache on a node
+        that already has a cache on it without getting a UI pop up.
+
+        Args:
+            nodes (list): of nodes to cache
+            start_frame (int): start frame
+            end_frame (int): end frame
+            cache_dir (str, optional): if none, will auto search
+            distribution (str, optional): OneFile or OneFilePerFrame, defaults
+            to the setup config
+        """
+        # Create cache files on disk for the select ncloth object(s) according
+        # to the specified flags described below.
+
+        # $version == 1:
+        # $args[0] = time range mode:
+        # time range mode = 0 : use $args[1] and $args[2] as start-end
+        # time range mode = 1 : use render globals
+        # time range mode = 2 : use timeline
+        # $args[1] = start frame (if time range mode == 0)
+        # $args[2] = end frame (if time range mode == 0)
+
+        # $version == 2:
+        # $args[3] = cache file distribution, either "OneFile" or "OneFilePerFrame"
+        # $args[4] = 0/1, whether to refresh during caching
+        # $args[5] = directory for cache files, if "", then use project data dir
+        # $args[6] = 0/1, whether to create a cache per geometry
+        # $args[7] = name of cache file. An empty string can be used to specify that an auto-generated name is acceptable.
+        # $args[8] = 0/1, whether the specified cache name is to be used as a prefix
+        # $version == 3:
+        # $args[9] = action to perform: "add", "replace", "merge" or "mergeDelete"
+        # $args[10] = force save even if it overwrites existing files
+        # $args[11] = simulation rate, the rate at which the cloth simulation is forced to run
+        # $args[12] = sample mulitplier, the rate at which samples are written, as a multiple of simulation rate.
+        # $version == 4:
+        # $args[13] = 0/1, whether modifications should be inherited from the cache about to be replaced.
+        # $args[14] = 0/1, whether to store doubles as floats
         # $version == 5:
         # $args[15] = cache format type: mcc or mcx.
         #                          0    1     2       3       4    5  6   7  8     9     10   11   12  13  14   15
         # doCreateNclothCache 5 { "2", "1", "10", "OneFile", "1", "","0","","0", "add", "0", "1", "1","0","1","mcx" } ;
-        cache_cmd = 'doCreateNclothCache 5 {{ "3", "{start_frame}", "{end_frame}", "OneFile", "1", "{cache_dir}", "1", "", "0", "replace", "0", "1", "1","0","1","mcx" }};'
+        cache_cmd = 'doCreateNclothCache 5 {{ "3", "{start_frame}", "{end_frame}", "{distribution}", "1", "{cache_dir}", "1", "", "0", "replace", "0", "1", "1","0","1","mcx" }};'
 
         cache_arg_info = {
             "start_frame": start_frame,
             "end_frame": end_frame,
-            "cache_dir": cache_dir or self.get_cache_dir().replace("\\", "/")
+            "cache_dir": cache_dir or self.get_cache_dir().replace("\\", "/"),
+            "distribution": distribution or self.get_cache_distribution()
         }
         self.delete_sim_cache(nodes)
         cache_cmd = cache_cmd.format(**cache_arg_info)
         cmds.select(nodes)
         print(cache_cmd)
         mel.eval(cache_cmd)
+        self.index_cache_dir(cache_arg_info["cache_dir"])
+
+    # =========================================================================
+    # cache files
+    # =========================================================================
+
+    def get_cache_file_nodes(self, node):
+        """cacheFile nodes driving the node, directly for nCloth or through
+        a historySwitch for geometry caches
+
+        Args:
+            node (str): transform or shape
+
+        Returns:
+            list: of cacheFile nodes
+        """
+        cache_nodes = []
+        for shape in cmds.listRelatives(node, shapes=True) or [node]:
+            cache_nodes.extend(cmds.listConnections(shape,
+                                                    type="cacheFile") or [])
+            for switch in cmds.listConnections(shape,
+                                               type="historySwitch") or []:
+                cache_nodes.extend(cmds.listConnections(switch,
+                                                        type="cacheFile") or [])
+        return list(set(cache_nodes))
+
+    def get_cached_xml_paths(self, nodes):
+        """Get the xml of every cache attached to the nodes
+
+        Args:
+            nodes (list): of nodes that may be cached
+
+        Returns:
+            dict: node: [xml paths], only cached nodes
+        """
+        xml_paths = {}
+        for node in nodes:
+            for cache_node in self.get_cache_file_nodes(node):
+                cache_path = cmds.getAttr("{}.cachePath".format(cache_node))
+                cache_name = cmds.getAttr("{}.cacheName".format(cache_node))
+                xml_path = os.path.join(cache_path, "{}.xml".format(cache_name))
+                xml_paths.setdefault(node, []).append(os.path.normpath(xml_path))
+        return xml_paths
+
+    def attach_cache(self, xml_path, node):
+        """Attach an existing cache to a node, same as Attach Existing nCache
+
+        Args:
+            xml_path (str): cache description
+            node (str): nCloth or mesh, transform or shape
+        """
+        shapes = cmds.listRelatives(node, shapes=True, noIntermediate=True)
+        shapes = shapes or [node]
+        cmd = 'doImportCacheFile("{}", "", {{"{}"}}, {{}});'
+        mel.eval(cmd.format(xml_path.replace("\\", "/"), shapes[0]))
+        self.touch_cache_dir(os.path.dirname(xml_path))
+
+    # =========================================================================
+    # cache manifest
+    # =========================================================================
+
+    def write_cache_manifest(self,
+                             layer,
+                             nodes,
+                             start_frame,
+                             end_frame,
+                             preroll=0,
+                             postroll=0,
+                             distribution=None,
+                             seconds=None,
+                             inputs=None):
+        """Record the caches now attached to the nodes in the manifest of
+        every dir they were written to. Never fails the caching, a manifest
+        that cannot be written is only a warning.
+
+        Args:
+            layer (str): input or sim
+            nodes (list): that were just cached
+            start_frame (int): start frame, preroll included
+            end_frame (int): end frame, postroll included
+            preroll (int, optional): frames of the range that are preroll
+            postroll (int, optional): frames of the range that are postroll
+            distribution (str, optional): OneFile or OneFilePerFrame
+            seconds (float, optional): time it took to cache
+            inputs (dict, optional): from get_input_cache_inputs or
+            get_sim_cache_inputs
+
+        Returns:
+            list: of written manifest paths
+        """
+        entry = {"layer": layer,
+                 "frame_range": [start_frame, end_frame],
+                 "preroll": preroll,
+                 "postroll": postroll,
+                 "distribution": distribution,
+                 "cached_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if seconds is not None:
+            frame_count = max(end_frame - start_frame + 1, 1)
+            entry["seconds"] = round(seconds, 3)
+            entry["seconds_per_frame"] = round(seconds / frame_count, 4)
+        if inputs:
+            entry["inputs_key"] = cache_store.get_inputs_key(inputs)
+            entry["input_hashes"] = inputs.get("input_caches") or {
+                "references": inputs.get("references"),
+                "upstream": inputs.get("upstream")}
+
+        dir_caches = {}
+        for node, xml_paths in self.get_cached_xml_paths(nodes).iteritems():
+            name = techanim_creator_utils.removeNS(node)
+            for xml_path in xml_paths:
+                caches = dir_caches.setdefault(os.path.dirname(xml_path), {})
+                node_entry = caches.setdefault(name, dict(entry, node=node, xml=[]))
+                node_entry["xml"].append(xml_path)
+
+        manifest_paths = []
+        for cache_dir, caches in dir_caches.iteritems():
+            self.touch_cache_dir(cache_dir)
+            try:
+                cache_manifest.update_manifest(
+                    cache_dir,
+                    caches,
+                    setup=techanim_creator_utils.removeNS(self.root_node),
+                    target_namespace=self.target_namespace)
+            except Exception as e:
+                msg = "Could not write the cache manifest in {}: {}"
+                cmds.warning(msg.format(cache_dir, e))
+                continue
+            manifest_paths.append(cache_manifest.get_manifest_path(cache_dir))
+        return manifest_paths
+
+    def get_cached_ranges(self, layer=None):
+        """What is cached for the setup and for which range, from the
+        manifests of the setup cache dir and of every dir the attached caches
+        live in, store entries included
+
+        Args:
+            layer (str, optional): input or sim, defaults to all
+
+        Returns:
+            dict: node name without namespace: [start, end]
+        """
+        nodes = []
+        if layer in (None, "input"):
+            nodes.extend(self.get_layer_nodes_info(
+                [self.input_layer]).values()[0] or [])
+        if layer in (None, "sim"):
+            nodes.extend(self.get_ncloth_nodes())
+        cache_dirs = set()
+        for xml_paths in self.get_cached_xml_paths(nodes).values():
+            cache_dirs.update(os.path.dirname(x) for x in xml_paths)
+
+        ranges = {}
+        # asking get_cache_dir would make a dir for a setup never cached
+        setup_cache_dir = self.setup_config.get("cache_dir")
+        if setup_cache_dir and os.path.isdir(setup_cache_dir):
+            ranges.update(cache_manifest.get_cached_ranges(setup_cache_dir,
+                                                           layer))
+        # the attached caches win over older entries of the setup dir
+        for cache_dir in sorted(cache_dirs):
+            ranges.update(cache_manifest.get_cached_ranges(cache_dir, layer))
+        return ranges
+
+    # =========================================================================
+    # cache store
+    # =========================================================================
+
+    def is_store_enabled(self, use_store=None):
+        """Should caching go through the content addressed store
+
+        Args:
+            use_store (bool, optional): overrides the config when provided
+
+        Returns:
+            bool: True False
+        """
+        if use_store is None:
+            use_store = CONFIG.get(CACHE_STORE_KEY, False)
+        return bool(use_store)
+
+    def get_static_attr_info(self, node):
+        """Attr values of a node that describe its settings, leaving out
+        anything driven by a connection or the current time
+
+        Args:
+            node (str): name of node
+
+        Returns:
+            dict: attrname:value
+        """
+        attr_info = preset_share_utils.get_attr_info(node)
+        connections = cmds.listConnections(node,
+                                           source=True,
+                                           destination=False,
+                                           plugs=True,
+                                           connections=True) or []
+        # pairs of destination on this node, source plug
+        for plug in connections[::2]:
+            attr_info.pop(plug.partition(".")[2], None)
+        for attr in TIME_ATTRS:
+            attr_info.pop(attr, None)
+        return attr_info
+
+    def get_pre_layer_history_info(self):
+        """Settings of the deformers between the input layer and the sim
+        layer, anything in there changes what the sim sees
+
+        Returns:
+            dict: node: attr info
+        """
+        grouping_order = self.setup_config["grouping_order"]
+        sim_index = grouping_order.index(self.setup_config["sim_layer"])
+        pre_layers = [self._wrap_ns(x) for x in grouping_order[1:sim_index]]
+        history_info = {}
+        for nodes in self.get_layer_nodes_info(pre_layers).values():
+            for node in nodes or []:
+                shapes = cmds.listRelatives(node,
+                                            shapes=True,
+                                            noIntermediate=True,
+                                            type="mesh") or []
+                for shape in shapes:
+                    history = cmds.listHistory(shape,
+                                               pruneDagObjects=True) or []
+                    for hist_node in history:
+                        if cmds.nodeType(hist_node) in ["historySwitch",
+                                                        "cacheFile"]:
+                            continue
+                        name = techanim_creator_utils.removeNS(hist_node)
+                        history_info[name] = self.get_static_attr_info(hist_node)
+        return history_info
+
+    def get_upstream_info(self, nodes):
+        """Type, settings, incoming connections and read files of every node
+        upstream of the nodes, keys of anim curves and hashes of attached
+        caches included. Unkeyed values, constraints, expressions and
+        alembics are all nodes upstream, seen through their attrs.
+
+        Args:
+            nodes (list): of shapes
+
+        Returns:
+            dict: node: {"type", "attrs", "connections", "files", "keys"}
+        """
+        upstream_info = {}
+        if not nodes:
+            return upstream_info
+        for node in cmds.listHistory(nodes) or []:
+            node_type = cmds.nodeType(node)
+            attr_info = self.get_static_attr_info(node)
+            node_info = {"type": node_type,
+                         "attrs": attr_info,
+                         "connections": get_incoming_connections(node),
+                         "files": get_file_stamps(attr_info)}
+            if cmds.objectType(node, isAType="animCurve"):
+                node_info["keys"] = [
+                    cmds.keyframe(node,
+                                  q=True,
+                                  timeChange=True,
+                                  valueChange=True) or [],
+                    cmds.keyTangent(node,
+                                    q=True,
+                                    inAngle=True,
+                                    outAngle=True,
+                                    inTangentType=True,
+                                    outTangentType=True) or []]
+            elif node_type == "cacheFile":
+                cache_path = cmds.getAttr("{}.cachePath".format(node))
+                cache_name = cmds.getAttr("{}.cacheName".format(node))
+                xml_path = os.path.join(cache_path, "{}.xml".format(cache_name))
+                if os.path.exists(xml_path):
+                    node_info["files"]["xml"] = cache_store.hash_cache(xml_path)
+            upstream_info[node] = node_info
+        return upstream_info
+
+    def get_dynamic_constraint_info(self):
+        """Settings, connections and constrained components of every
+        dynamicConstraint of the nuclei of this setup
+
+        Returns:
+            dict: constraint: {"attrs", "connections", "components"}
+        """
+        constraints = cmds.listConnections(self.get_nuclei() or [],
+                                           type="dynamicConstraint") or []
+        constraint_info = {}
+        for constraint in sorted(set(constraints)):
+            components = {}
+            for component in sorted(set(cmds.listConnections(
+                    constraint, type="nComponent") or [])):
+                components[techanim_creator_utils.removeNS(component)] = [
+                    self.get_static_attr_info(component),
+                    cmds.getAttr("{}.componentIndices".format(component))]
+            name = techanim_creator_utils.removeNS(constraint)
+            constraint_info[name] = {
+                "attrs": self.get_static_attr_info(constraint),
+                "connections": [[techanim_creator_utils.removeNS(x)
+                                 for x in pair]
+                                for pair in get_incoming_connections(constraint)],
+                "components": components}
+        return constraint_info
+
+    def get_input_cache_inputs(self, start_frame, end_frame, distribution):
+        """Everything the input layer caches are made from: the files
+        referenced into the scene, the fps and every node upstream of the
+        input layer. Edits of mesh components and paint weights that are not
+        attrs are not seen.
+
+        Args:
+            start_frame (int): start frame
+            end_frame (int): end frame
+            distribution (str): OneFile or OneFilePerFrame
+
+        Returns:
+            dict: json serializable inputs
+        """
+        references = []
+        for ref_path in cmds.file(q=True, reference=True) or []:
+            ref_path = ref_path.partition("{")[0]
+            if os.path.exists(ref_path):
+                stat = os.stat(ref_path)
+                references.append([os.path.normpath(ref_path),
+                                   stat.st_size,
+                                   int(stat.st_mtime)])
+        upstream_info = self.get_upstream_info(
+            list(self.get_input_layer_shapes().values()))
+        return {"layer": "input",
+                "setup": techanim_creator_utils.removeNS(self.root_node),
+                "target_namespace": self.target_namespace,
+                "fps": cmds.currentUnit(q=True, time=True),
+                "references": sorted(references),
+                "upstream": cache_store.get_inputs_key(upstream_info),
+                "frame_range": [start_frame, end_frame],
+                "distribution": distribution}
+
+    def get_sim_cache_inputs(self, nodes, start_frame, end_frame, distribution):
+        """Everything the sim caches are made from: the input layer caches,
+        the pre layer deformers, every nCloth, nRigid and nucleus in the
+        sim layer, since they all collide with each other, the dynamic
+        constraints between them and the fps.
+
+        Args:
+            nodes (list): of nodes to cache
+            start_frame (int): start frame
+            end_frame (int): end frame
+            distribution (str): OneFile or OneFilePerFrame
+
+        Returns:
+            dict: json serializable inputs, None if the input layer is not
+            cached, a live rig cannot be hashed
+        """
+        input_nodes = self.get_layer_nodes_info([self.input_layer])
+        input_xmls = self.get_cached_xml_paths(input_nodes.values()[0] or [])
+        if not input_xmls:
+            return None
+        input_caches = {}
+        for node, xml_paths in input_xmls.items():
+            name = techanim_creator_utils.removeNS(node)
+            input_caches[name] = sorted(cache_store.hash_cache(x)
+                                        for x in xml_paths)
+
+        sim_layer = self._wrap_ns(self.setup_config["sim_layer"])
+        sim_shapes = cmds.listRelatives(sim_layer,
+                                        ad=True,
+                                        type=["nCloth", "nRigid"]) or []
+        sim_info = {}
+        for sim_node in sim_shapes + self.get_nuclei():
+            name = techanim_creator_utils.removeNS(sim_node)
+            sim_info[name] = self.get_static_attr_info(sim_node)
+
+        return {"layer": "sim",
+                "nodes": sorted(techanim_creator_utils.removeNS(x)
+                                for x in nodes),
+                "input_caches": input_caches,
+                "pre_history": self.get_pre_layer_history_info(),
+                "sim_nodes": sim_info,
+                "dynamic_constraints": self.get_dynamic_constraint_info(),
+                "fps": cmds.currentUnit(q=True, time=True),
+                "frame_range": [start_frame, end_frame],
+                "distribution": distribution}
+
+    def attach_store_entry(self, key, nodes):
+        """Attach the stored caches of a complete entry to the nodes,
+        matched on the name without namespace
+
+        Args:
+            key (str): inputs key
+            nodes (list): of nodes to attach to
+
+        Returns:
+            bool: True if every node with a shape had a stored cache and got
+            it attached
+        """
+        entry = cache_store.lookup(key)
+        if not entry:
+            return False
+        node_xmls = {}
+        for node in nodes:
+            # groups in the layer never get a cache
+            if not cmds.listRelatives(node, shapes=True):
+                continue
+            name = techanim_creator_utils.removeNS(node)
+            if name not in entry["caches"]:
+                return False
+            node_xmls[node] = entry["caches"][name]
+        self.delete_sim_cache(nodes)
+        self.touch_cache_dir(entry["entry_dir"])
+        for node, xml_paths in node_xmls.items():
+            for xml_path in xml_paths:
+                self.attach_cache(xml_path, node)
+        print("Attached stored caches, identical inputs: {}".format(
+            entry["entry_dir"]))
+        return True
+
+    def commit_store_entry(self, key, inputs, nodes, temp_dir):
+        """Record the caches now attached to the nodes as a store entry, then
+        attach them from the entry. If another process stored the key first
+        its caches are attached instead.
+
+        Args:
+            key (str): inputs key
+            inputs (dict): that made the key
+            nodes (list): that were just cached
+            temp_dir (str): from cache_store.begin_entry, the nodes were
+            cached into it
+        """
+        node_xmls = self.get_cached_xml_paths(nodes)
+        caches = {}
+        for node, xml_paths in node_xmls.items():
+            caches[techanim_creator_utils.removeNS(node)] = xml_paths
+        if not caches:
+            return
+        # nothing may hold the files while the dir is moved
+        self.delete_sim_cache(nodes)
+        try:
+            cache_store.commit_entry(key, inputs, caches, temp_dir)
+        except (IOError, OSError) as e:
+            print("Could not store the caches of {}: {}".format(self, e))
+            for node, xml_paths in node_xmls.items():
+                for xml_path in xml_paths:
+                    self.attach_cache(xml_path, node)
+            return
+        self.attach_store_entry(key, nodes)
+
+    # =========================================================================
+    # job bundles
+    # =========================================================================
+
+    def get_reference_files(self):
+        """Files referenced in the scene, nested ones included
+
+        Returns:
+            list: of paths
+        """
+        reference_files = []
+        for ref_node in cmds.ls(type="reference"):
+            try:
+                ref_file = cmds.referenceQuery(ref_node,
+                                               filename=True,
+                                               withoutCopyNumber=True)
+            except RuntimeError:
+                # sharedReferenceNode and unloaded leftovers
+                continue
+            ref_file = os.path.abspath(ref_file)
+            if ref_file not in reference_files:
+                reference_files.append(ref_file)
+        return reference_files
+
+    def export_job_bundle(self,
+                          bundle_root,
+                          name,
+                          start_frame,
+                          end_frame,
+                          preroll=0,
+                          postroll=0,
+                          nodes=None,
+                          presets=None,
+                          attrs=None):
+        """Pack a job simulating the nCloth of this setup into a bundle that
+        runs off this workstation, see job_bundle. The scene as it is now,
+        its references, the caches of the input layer, the presets and the
+        config go in it.
+
+        Args:
+            bundle_root (str): bundles and their shared objects go here
+            name (str): of the bundle
+            start_frame (int): start frame, preroll included
+            end_frame (int): end frame, postroll included
+            preroll (int, optional): frames of the range that are preroll
+            postroll (int, optional): frames of the range that are postroll
+            nodes (list, optional): of nCloth transforms, defaults to all
+            presets (list, optional): of [node, preset path] applied before
+            simulating, node without namespace
+            attrs (list, optional): of [node.attr, value] set before
+            simulating
+
+        Returns:
+            str: bundle dir
+
+        Raises:
+            RuntimeError: if the input layer is not cached
+        """
+        if not self.is_input_layer_cached():
+            raise RuntimeError("Cache the input layer before bundling a job.")
+        input_nodes = self.get_layer_nodes_info([self.input_layer])
+        cache_dirs = []
+        for xml_paths in self.get_cached_xml_paths(input_nodes.values()[0]).values():
+            for xml_path in xml_paths:
+                cache_dir = os.path.dirname(os.path.abspath(xml_path))
+                if cache_dir not in cache_dirs:
+                    cache_dirs.append(cache_dir)
+
+        args = ["--setups", self.root_node,
+                "--layers", "sim",
+                "--start", start_frame + preroll,
+                "--end", end_frame - postroll,
+                "--preroll", preroll,
+                "--postroll", postroll,
+                "--cache-dir", job_bundle.get_bundle_path(
+                    job_bundle.OUTPUT_DIR_NAME),
+                "--no-store",
+                "--json", job_bundle.get_bundle_path("result.json")]
+        if nodes:
+            args.append("--nodes")
+            args.extend([techanim_creator_utils.removeNS(x) for x in nodes])
+        for node, preset_path in presets or []:
+            args.extend(["--preset", node, os.path.abspath(preset_path)])
+        for plug, value in attrs or []:
+            args.extend(["--set", plug, value])
+
+        snapshot_dir, scene_path = self.export_scene_snapshot(
+            self.get_cache_dir(), BUNDLE_DIR_NAME)
+        try:
+            bundle_dir = job_bundle.pack(
+                bundle_root,
+                name,
+                scene_path,
+                references=self.get_reference_files(),
+                cache_dirs=cache_dirs,
+                presets=[os.path.abspath(x[1]) for x in presets or []],
+                args=args,
+                job={"setup": self.root_node,
+                     "target_namespace": self.target_namespace,
+                     "setup_config": self.setup_config,
+                     "source_scene": cmds.file(q=True, sceneName=True),
+                     "frame_range": [start_frame, end_frame],
+                     "preroll": preroll,
+                     "postroll": postroll})
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+        return bundle_dir
+
+    # =========================================================================
+    # wedging
+    # =========================================================================
+
+    def apply_wedge(self, presets=None, attrs=None):
+        """Apply the settings of a wedge, presets first then attributes.
+        See wedge.
+
+        Args:
+            presets (list, optional): of [node, preset path], node without
+            namespace
+            attrs (list, optional): of [node.attr, value], node without
+            namespace
+
+        Returns:
+            dict: previous values, for set_sim_state_attrs
+        """
+        state = {}
+        for node, preset_path in presets or []:
+            node = self._wrap_ns(node)
+            node_state = state.setdefault(node, {})
+            for attr, value in preset_share_utils.get_attr_info(node).items():
+                node_state.setdefault(attr, value)
+            preset_share_utils.apply_preset_file(preset_path, node)
+        for plug, value in attrs or []:
+            node, _, attr = self._wrap_ns(plug).partition(".")
+            plug = "{}.{}".format(node, attr)
+            previous = cmds.getAttr(plug)
+            if isinstance(previous, list) and previous:
+                # compound attrs come back as [(x, y, z)]
+                previous = list(previous[0])
+            state.setdefault(node, {}).setdefault(attr, previous)
+            if isinstance(value, basestring):
+                cmds.setAttr(plug, value, type="string")
+            elif isinstance(value, (list, tuple)):
+                # compound attrs, [0, 1, 0] for a double3
+                cmds.setAttr(plug, *value)
+            else:
+                cmds.setAttr(plug, value)
+        return state
+
+    def attach_wedge(self, wedge_info):
+        """Attach the caches of a wedge in place of the ones the nodes have,
+        to compare wedges in the scene
+
+        Args:
+            wedge_info (dict): a wedge of a wedge summary
+
+        Returns:
+            list: of nodes the caches were attached to
+        """
+        nodes = [x for x in wedge_info["caches"] if cmds.objExists(x)]
+        self.delete_sim_cache(nodes)
+        for node in nodes:
+            for xml_path in wedge_info["caches"][node]:
+                self.attach_cache(xml_path, node)
+        return nodes
+
+    # =========================================================================
+    # checkpointed caching
+    # =========================================================================
+
+    def get_ncloth_shapes(self, nodes):
+        """nCloth shapes of the provided transforms
+
+        Args:
+            nodes (list): of nCloth transforms
+
+        Returns:
+            list: of nCloth shapes
+        """
+        shapes = []
+        for node in nodes:
+            shapes.extend(cmds.listRelatives(node,
+                                             shapes=True,
+                                             type="nCloth") or [])
+        return shapes
+
+    def get_sim_state_attrs(self, nodes):
+        """Snapshot of the nCloth and nucleus settings, so a resumed
+        simulation runs with the exact same ones
+
+        Args:
+            nodes (list): of nCloth transforms
+
+        Returns:
+            dict: node: {attr: value}
+        """
+        state = {}
+        for node in self.get_ncloth_shapes(nodes) + self.get_nuclei():
+            state[node] = preset_share_utils.get_attr_info(node)
+        return state
+
+    def set_sim_state_attrs(self, state):
+        """Re-apply a snapshot from get_sim_state_attrs, skipping anything
+        locked or connected
+
+        Args:
+            state (dict): node: {attr: value}
+        """
+        for node, attr_info in state.iteritems():
+            if not cmds.objExists(node):
+                continue
+            for attr, value in attr_info.iteritems():
+                plug = "{}.{}".format(node, attr)
+                try:
+                    if isinstance(value, basestring):
+                        cmds.setAttr(plug, value, type="string")
+                    elif isinstance(value, (list, tuple)):
+                        cmds.setAttr(plug, *value)
+                    else:
+                        cmds.setAttr(plug, value)
+                except (RuntimeError, TypeError):
+                    continue
+
+    def stuff_start_state(self, nodes, frame):
+        """Make the state at the frame the new start state of the nCloth
+        nodes, then let go of the caches that were driving them. Undo it
+        with clear_start_state.
+
+        Args:
+            nodes (list): of cached nCloth transforms
+            frame (int): frame to take the state from
+        """
+        cmds.currentTime(frame)
+        cmds.nBase(self.get_ncloth_shapes(nodes), e=True, stuffStart=True)
+        self.delete_sim_cache(nodes)
+        self.set_start_nuclei_frame(frame)
+
+    def clear_start_state(self, nodes):
+        """Drop a start state stuffed by stuff_start_state, the nCloth nodes
+        start from their input mesh again
+
+        Args:
+            nodes (list): of nCloth transforms
+        """
+        shapes = self.get_ncloth_shapes(nodes)
+        if shapes:
+            cmds.nBase(shapes, e=True, clearStart=True)
+
+    def get_checkpoint_dir(self, nodes, cache_dir=None):
+        """Where the checkpoint of caching the nodes lives. Without a cache
+        dir it is the same for every run of this scene, setup and nodes, so
+        a run in a new maya finds the checkpoint of the one that died even
+        though it gets a new cache dir.
+
+        Args:
+            nodes (list): of nCloth transforms
+            cache_dir (str, optional): the checkpoint goes under it if given
+
+        Returns:
+            str: path
+        """
+        if cache_dir:
+            return os.path.join(cache_dir, CHECKPOINT_DIR_NAME)
+        key = cache_store.get_inputs_key({"scene": cmds.file(q=True, sn=True),
+                                          "setup": self.root_node,
+                                          "nodes": sorted(nodes)})
+        return os.path.join(cache_quota.get_techanim_dir(),
+                            CHECKPOINT_DIR_NAME,
+                            key)
+
+    def read_checkpoint(self, checkpoint_dir, nodes, start_frame, end_frame,
+                        checkpoint_every):
+        """Get the checkpoint of a previous run of the same caching job
+
+        Args:
+            checkpoint_dir (str): where the checkpoint lives
+            nodes (list): of nCloth transforms
+            start_frame (int): start frame
+            end_frame (int): end frame
+            checkpoint_every (int): frames per segment
+
+        Returns:
+            dict: checkpoint info, None if there is none or it is for a
+            different job or its segments are gone
+        """
+        checkpoint = read_json(os.path.join(checkpoint_dir,
+                                            CHECKPOINT_FILE_NAME))
+        if not checkpoint:
+            return None
+        job_info = [sorted(nodes), start_frame, end_frame, checkpoint_every]
+        if job_info != [sorted(checkpoint["nodes"]),
+                        checkpoint["start_frame"],
+                        checkpoint["end_frame"],
+                        checkpoint["checkpoint_every"]]:
+            return None
+        for segment in checkpoint["segments"]:
+            for xml_paths in segment["caches"].values():
+                for xml_path in xml_paths:
+                    if not os.path.exists(os.path.join(checkpoint_dir,
+                                                       xml_path)):
+                        return None
+        return checkpoint
+
+    def resume_checkpoint(self, checkpoint, checkpoint_dir):
+        """Put the nCloth nodes back in the state of the last completed
+        segment of the checkpoint
+
+        Args:
+            checkpoint (dict): from read_checkpoint
+            checkpoint_dir (str): where the checkpoint lives
+
+        Returns:
+            int: frame the simulation continues from
+        """
+        self.set_sim_state_attrs(checkpoint["state"])
+        segment = checkpoint["segments"][-1]
+        self.delete_sim_cache(list(segment["caches"].keys()))
+        for node, xml_paths in segment["caches"].iteritems():
+            for xml_path in xml_paths:
+                self.attach_cache(os.path.join(checkpoint_dir, xml_path), node)
+        self.stuff_start_state(list(segment["caches"].keys()), segment["end"])
+        print("Resuming {} from frame {}".format(self, segment["end"]))
+        return segment["end"]
+
+    @toggle_view
+    def cache_sim_nodes_checkpointed(self,
+                                     nodes,
+                                     start_frame,
+                                     end_frame,
+                                     checkpoint_every=100,
+                                     cache_dir=None,
+                                     resume=True,
+                                     preroll=0,
+                                     postroll=0):
+        """Cache the nCloth nodes in segments, storing a checkpoint after
+        every one. If maya dies, running this again with the same arguments
+        continues from the last completed segment instead of the start.
+        Segments are merged into the regular caches once all are done.
+
+        Args:
+            nodes (list): of nCloth transforms to cache
+            start_frame (int): start frame
+            end_frame (int): end frame
+            checkpoint_every (int, optional): frames per segment
+            cache_dir (str, optional): if none, will auto search
+            resume (bool, optional): continue an existing checkpoint
+            preroll (int, optional): frames of the range that are preroll,
+            recorded in the manifest
+            postroll (int, optional): frames of the range that are postroll,
+            recorded in the manifest
+
+        Returns:
+            dict: node: [merged xml paths]
+
+        Raises:
+            ImportError: numpy is needed to merge the segments
+            RuntimeError: if a segment did not produce caches for every node
+        """
+        if cache_io.np is None:
+            raise ImportError("numpy is required to merge checkpoint segments.")
+        checkpoint_dir = self.get_checkpoint_dir(nodes, cache_dir)
+        cache_dir = cache_dir or self.get_cache_dir()
+        checkpoint_path = os.path.join(checkpoint_dir, CHECKPOINT_FILE_NAME)
+        checkpoint = None
+        if resume:
+            checkpoint = self.read_checkpoint(checkpoint_dir,
+                                              nodes,
+                                              start_frame,
+                                              end_frame,
+                                              checkpoint_every)
+        if not checkpoint:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+            os.makedirs(checkpoint_dir)
+            checkpoint = {"nodes": nodes,
+                          "start_frame": start_frame,
+                          "end_frame": end_frame,
+                          "checkpoint_every": checkpoint_every,
+                          "scene": cmds.file(q=True, sn=True),
+                          "state": self.get_sim_state_attrs(nodes),
+                          "segments": []}
+
+        cloth_shapes = self.get_ncloth_shapes(nodes)
+        cacheable = {}
+        for shape in cloth_shapes:
+            plug = "{}.cacheableAttributes".format(shape)
+            cacheable[plug] = cmds.getAttr(plug)
+            cmds.setAttr(plug, FULL_STATE_CACHEABLE)
+        nuclei_frames = self.get_start_nuclei_frames()
+        stuffed = False
+
+        try:
+            self.delete_sim_cache(nodes)
+            resume_frame = start_frame
+            if checkpoint["segments"]:
+                stuffed = True
+                resume_frame = self.resume_checkpoint(checkpoint,
+                                                      checkpoint_dir)
+
+            segments = get_frame_segments(start_frame,
+                                          end_frame,
+                                          checkpoint_every)
+            for seg_start, seg_end in segments:
+                if seg_end <= resume_frame and checkpoint["segments"]:
+                    continue
+                seg_name = "segment_{}_{}".format(seg_start, seg_end)
+                seg_dir = os.path.join(checkpoint_dir, seg_name)
+                seg_time = time.time()
+                self.set_start_nuclei_frame(seg_start)
+                self._create_ncloth_cache(nodes,
+                                          seg_start,
+                                          seg_end,
+                                          cache_dir=seg_dir.replace("\\", "/"),
+                                          distribution=cache_io.ONE_FILE_PER_FRAME)
+                seg_caches = self.get_cached_xml_paths(nodes)
+                missing = [x for x in nodes if x not in seg_caches]
+                if missing:
+                    msg = "Segment {} produced no cache for {}"
+                    raise RuntimeError(msg.format(seg_name, missing))
+                for node, xml_paths in seg_caches.iteritems():
+                    seg_caches[node] = [os.path.relpath(x, checkpoint_dir)
+                                        for x in xml_paths]
+                checkpoint["segments"].append({"start": seg_start,
+                                               "end": seg_end,
+                                               "caches": seg_caches,
+                                               "seconds": time.time() - seg_time})
+                write_json(checkpoint, checkpoint_path)
+                print("Checkpoint written at frame {}".format(seg_end))
+                if seg_end < end_frame:
+                    stuffed = True
+                    self.stuff_start_state(nodes, seg_end)
+
+            # one cache per node, like a regular caching would have made
+            self.delete_sim_cache(nodes)
+            merged_caches = {}
+            for node in nodes:
+                segment_xmls = [x["caches"][node] for x in checkpoint["segments"]]
+                for xml_paths in zip(*segment_xmls):
+                    xml_paths = [os.path.join(checkpoint_dir, x)
+                                 for x in xml_paths]
+                    merged_xml = cache_io.merge_caches(
+                        xml_paths,
+                        cache_dir,
+                        cache_type=self.get_cache_distribution(),
+                        overwrite=True)
+                    self.attach_cache(merged_xml, node)
+                    merged_caches.setdefault(node, []).append(merged_xml)
+            self.index_cache_dir(cache_dir)
+            seconds = sum(x.get("seconds", 0) for x in checkpoint["segments"])
+            self.write_cache_manifest("sim",
+                                      nodes,
+                                      start_frame,
+                                      end_frame,
+                                      preroll=preroll,
+                                      postroll=postroll,
+                                      distribution=self.get_cache_distribution(),
+                                      seconds=seconds)
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        finally:
+            for plug, value in cacheable.iteritems():
+                cmds.setAttr(plug, value)
+            # later sims start from the input pose, not the last segment
+            if stuffed:
+                self.clear_start_state(nodes)
+            self.restore_start_nuclei_frames(nuclei_frames)
+
+        return merged_caches
+
+    # =========================================================================
+    # nucleus partition
+    # =========================================================================
+
+    def get_nucleus_colliders(self):
+        """nRigid transforms of the sim layer grouped by their nucleus
+
+        Returns:
+            dict: nucleus: [nRigid transforms]
+        """
+        nucleus_info = {}
+        for nucleus in self.get_nuclei():
+            nodes = []
+            shapes = cmds.listConnections(nucleus, type="nRigid", shapes=True)
+            for shape in shapes or []:
+                node = cmds.listRelatives(shape, parent=True)[0]
+                if node not in nodes:
+                    nodes.append(node)
+            nucleus_info[nucleus] = nodes
+        return nucleus_info
+
+    def get_constraint_links(self):
+        """nCloth transforms held together by a dynamicConstraint, they have
+        to be solved together
+
+        Returns:
+            list: of lists of nCloth transforms
+        """
+        links = []
+        for nucleus in self.get_nuclei():
+            constraints = cmds.listConnections(nucleus,
+                                               type="dynamicConstraint",
+                                               shapes=True) or []
+            for constraint in set(constraints):
+                nodes = []
+                components = cmds.listConnections(constraint,
+                                                  type="nComponent") or []
+                for component in set(components):
+                    shapes = cmds.listConnections(component,
+                                                  type="nCloth",
+                                                  shapes=True) or []
+                    for shape in shapes:
+                        node = cmds.listRelatives(shape, parent=True)[0]
+                        if node not in nodes:
+                            nodes.append(node)
+                if len(nodes) > 1:
+                    links.append(nodes)
+        return links
+
+    def get_input_layer_source(self, node, input_nodes=None):
+        """The input layer node upstream of a sim layer nCloth or nRigid
+
+        Args:
+            node (str): transform
+            input_nodes (list, optional): input layer nodes, queried if None
+
+        Returns:
+            str: input layer transform, None if not found
+        """
+        if input_nodes is None:
+            input_nodes = self.get_layer_nodes_info([self.input_layer])
+            input_nodes = input_nodes.values()[0] or []
+        shapes = cmds.listRelatives(node, shapes=True) or [node]
+        for history_node in cmds.listHistory(shapes[0]) or []:
+            if cmds.nodeType(history_node) != "mesh":
+                continue
+            parent = cmds.listRelatives(history_node, parent=True)[0]
+            if parent in input_nodes:
+                return parent
+
+    def get_partition(self, margin=None):
+        """Split the nCloth of every nucleus into groups that never come
+        close enough to interact, from the bounds of the input layer caches.
+        See nucleus_partition.
+
+        Args:
+            margin (float, optional): how far the cloth may stray from its
+            input, defaults to the config
+
+        Returns:
+            dict: nucleus: {"groups": [{"cloths", "colliders"}], "contacts"}
+
+        Raises:
+            ImportError: numpy is needed to read the caches
+            RuntimeError: if the input layer is not cached
+        """
+        if cache_io.np is None:
+            raise ImportError("numpy is required to partition nuclei.")
+        if not self.is_input_layer_cached():
+            raise RuntimeError("Cache the input layer before partitioning.")
+        if margin is None:
+            margin = CONFIG.get(PARTITION_MARGIN_KEY,
+                                nucleus_partition.DEFAULT_MARGIN)
+        input_nodes = self.get_layer_nodes_info([self.input_layer])
+        input_nodes = input_nodes.values()[0] or []
+        colliders_info = self.get_nucleus_colliders()
+        links = self.get_constraint_links()
+
+        def get_tracks(nodes, tracks, padding):
+            for node in nodes:
+                source = self.get_input_layer_source(node, input_nodes)
+                xml_paths = self.get_cached_xml_paths([source]).get(source)
+                if not xml_paths:
+                    msg = "No input cache upstream of {}".format(node)
+                    raise RuntimeError(msg)
+                tracks[node] = nucleus_partition.get_bounds_track(xml_paths)
+                shape = cmds.listRelatives(node, shapes=True)[0]
+                padding[node] = cmds.getAttr("{}.thickness".format(shape))
+
+        partition_info = {}
+        for nucleus, nodes in self.get_nucleus_ncloth_nodes().items():
+            cloth_tracks = {}
+            collider_tracks = {}
+            padding = {}
+            get_tracks(nodes, cloth_tracks, padding)
+            get_tracks(colliders_info.get(nucleus, []), collider_tracks, padding)
+            partition_info[nucleus] = nucleus_partition.partition(
+                cloth_tracks,
+                collider_tracks,
+                padding=padding,
+                margin=margin,
+                links=links)
+        return partition_info
+
+    def isolate_sim_nodes(self, nodes, colliders):
+        """Take every other nCloth of the nuclei of nodes out of the solve,
+        and stop the nRigids not in colliders from colliding, so a group of
+        a partition simulates alone
+
+        Args:
+            nodes (list): nCloth transforms to keep simulating
+            colliders (list): nRigid transforms to keep colliding
+
+        Returns:
+            dict: previous values, for set_sim_state_attrs
+        """
+        ncloth_info = self.get_nucleus_ncloth_nodes()
+        colliders_info = self.get_nucleus_colliders()
+        state = {}
+        for nucleus, ncloth_nodes in ncloth_info.items():
+            if not set(ncloth_nodes) & set(nodes):
+                continue
+            others = [x for x in ncloth_nodes if x not in nodes]
+            for shape in self.get_ncloth_shapes(others):
+                state[shape] = {}
+                for attr in ["isDynamic", "collide"]:
+                    plug = "{}.{}".format(shape, attr)
+                    state[shape][attr] = cmds.getAttr(plug)
+                    cmds.setAttr(plug, 0)
+            for node in colliders_info.get(nucleus, []):
+                if node in colliders:
+                    continue
+                shape = cmds.listRelatives(node, shapes=True, type="nRigid")[0]
+                plug = "{}.collide".format(shape)
+                state[shape] = {"collide": cmds.getAttr(plug)}
+                cmds.setAttr(plug, 0)
+        return state
+
+
+# =============================================================================
+# background simulation
+# =============================================================================
+
+class BackgroundSim(object):
+    """An nCloth simulation running in a local mayapy, started with
+    TechAnim_Setup.start_background_sim. Poll it from a timer, the caches
+    stay in its dir and are attached with attach once it is done.
+
+    Attributes:
+        background_dir (str): snapshot, log, progress and caches
+        end_frame (int): last frame, postroll included
+        log_path (str): output of the mayapy
+        nodes (list): of nCloth transforms being simulated
+        setup (TechAnim_Setup): the nodes belong to
+        start_frame (int): first frame, preroll included
+    """
+
+    def __init__(self,
+                 setup,
+                 nodes,
+                 shard,
+                 background_dir,
+                 scene_path,
+                 progress_path,
+                 start_frame,
+                 end_frame):
+        self.setup = setup
+        self.nodes = nodes
+        self.background_dir = background_dir
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.log_path = shard[1].name
+        self._shard = shard
+        self._scene_path = scene_path
+        self._progress_path = progress_path
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.background_dir)
+
+    def poll(self):
+        """Exit code of the mayapy, None while it runs
+
+        Returns:
+            int: exit code
+        """
+        return self._shard[0].poll()
+
+    def get_frame(self):
+        """Frame the simulation is on, from its progress file
+
+        Returns:
+            float: frame, None before it started caching
+        """
+        progress = read_json(self._progress_path) or {}
+        return progress.get("frame")
+
+    def get_progress(self):
+        """How far along the range the simulation is
+
+        Returns:
+            float: 0 to 1
+        """
+        frame = self.get_frame()
+        if frame is None:
+            return 0.0
+        length = max(self.end_frame - self.start_frame, 1)
+        return min(max((frame - self.start_frame) / length, 0.0), 1.0)
+
+    def cancel(self):
+        """Stop the mayapy and remove everything it made
+        """
+        proc, log_file = self._shard[:2]
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+        log_file.close()
+        shutil.rmtree(self.background_dir, ignore_errors=True)
+
+    def attach(self):
+        """Wait for the simulation and attach its caches in place of the
+        ones the nodes have, only the snapshot scene is removed
+
+        Returns:
+            dict: node: [xml paths]
+
+        Raises:
+            RuntimeError: if the simulation failed, see log_path
+        """
+        caches = self.setup.wait_batch_shards([self._shard], [self.nodes])[0]
+        self.setup.delete_sim_cache(self.nodes)
+        for node, xml_paths in caches.items():
+            for xml_path in xml_paths:
+                self.setup.attach_cache(xml_path, node)
+        if os.path.exists(self._scene_path):
+            os.remove(self._scene_path)
+        return caches
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""Simulate a setup once per variant of its settings, all at once.
+
+A wedge is one variant: preset_share presets applied to nCloth or nucleus
+nodes and attribute values set on top. Presets are one axis, every attribute
+range another, and a wedge is made for every combination of them. The input
+layer is cached once, then every wedge simulates from that scene on the
+job_scheduler workers into its own cache dir:
+
+<work dir>/wedges/<wedge>/         caches of one wedge
+<work dir>/wedges.json             summary, what each wedge changed and made
+
+python -m techanim_flow.wedge /work/shot010_wedges --scene shot010.ma --setup char01_TA:techanim_setup --presets shirt_nClothShape=/presets/nCloth_stiff_v0002.preset --attr shirt_nClothShape.stretchResistance 10 80 4 --workers 8
+
+Node names are without namespace, like batch --nodes. A preset without
+NODE= goes on the node it was saved from. Running again on a work dir
+resumes it. The manager loads the summary to flip between the wedges.
+
+Attributes:
+    SUMMARY_NAME (str): summary in the work dir
+    WEDGE_DIR_NAME (str): dir of the wedge cache dirs in the work dir
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import itertools
+
+# techanim
+from techanim_flow import batch
+from techanim_flow import config_io
+from techanim_flow import job_scheduler
+
+# =============================================================================
+# constants
+# =============================================================================
+SUMMARY_NAME = "wedges.json"
+WEDGE_DIR_NAME = "wedges"
+KIND_WEDGE = "wedge"
+
+
+# =============================================================================
+# variants
+# =============================================================================
+
+def get_range_values(start, end, steps):
+    """Evenly spaced values from start to end, both included
+
+    Args:
+        start (float): first value
+        end (float): last value
+        steps (int): how many values
+
+    Returns:
+        list: of floats
+    """
+    if steps < 2:
+        return [float(start)]
+    step = (end - start) / (steps - 1)
+    return [float(start + step * x) for x in range(steps)]
+
+
+def get_preset_node(preset_path):
+    """Node a preset was saved from, without namespace or path
+
+    Args:
+        preset_path (str): preset_share preset
+
+    Returns:
+        str: node name
+    """
+    with open(preset_path, "r") as f:
+        node_name = json.load(f)["node_name"]
+    return node_name.rpartition("|")[2].rpartition(":")[2]
+
+
+def get_wedges(presets=None, attr_ranges=None):
+    """Every combination of the presets and the attribute values
+
+    Args:
+        presets (list, optional): of [node, preset path], node None for the
+        node the preset was saved from
+        attr_ranges (list, optional): of [node.attr, start, end, steps]
+
+    Returns:
+        list: of dicts, name, presets [[node, path]], attrs [[plug, value]]
+    """
+    axes = []
+    if presets:
+        axes.append([[("preset", node or get_preset_node(path),
+                       os.path.abspath(path))]
+                     for node, path in presets])
+    for plug, start, end, steps in attr_ranges or []:
+        axes.append([[("attr", plug, value)]
+                     for value in get_range_values(start, end, steps)])
+
+    wedges = []
+    for index, variant in enumerate(itertools.product(*axes)):
+        wedge = {"name": "w{:03d}".format(index), "presets": [], "attrs": []}
+        for kind, target, value in itertools.chain(*variant):
+            wedge["{}s".format(kind)].append([target, value])
+        wedges.append(wedge)
+    return wedges
+
+
+def get_wedge_args(wedge):
+    """Batch arguments applying a wedge
+
+    Args:
+        wedge (dict): from get_wedges
+
+    Returns:
+        list: arguments
+    """
+    args = []
+    for node, preset_path in wedge["presets"]:
+        args.extend(["--preset", node, preset_path])
+    for plug, value in wedge["attrs"]:
+        args.extend(["--set", plug, value])
+    return args
+
+
+def get_wedge_label(wedge):
+    """Short description of what a wedge changes
+
+    Args:
+        wedge (dict): from get_wedges
+
+    Returns:
+        str: label
+    """
+    parts = [wedge["name"]]
+    for node, preset_path in wedge["presets"]:
+        parts.append("{}={}".format(node, os.path.splitext(
+            os.path.basename(preset_path))[0]))
+    for plug, value in wedge["attrs"]:
+        parts.append("{}={:g}".format(plug, value))
+    return " ".join(parts)
+
+
+# =============================================================================
+# jobs
+# =============================================================================
+
+def expand_wedges(scene_path,
+                  work_dir,
+                  setup_root,
+                  wedges,
+                  start_frame,
+                  end_frame,
+                  preroll,
+                  postroll,
+                  nodes=None,
+                  retries=1):
+    """An input job caching the input layer once, and a sim job per wedge
+    from the scene it saves
+
+    Args:
+        scene_path (str): shot scene
+        work_dir (str): scenes, results, logs and wedges go here
+        setup_root (str): setup to wedge
+        wedges (list): from get_wedges
+        start_frame (int): first frame of the shot
+        end_frame (int): last frame of the shot
+        preroll (int): frames simulated before the start
+        postroll (int): frames simulated after the end
+        nodes (list, optional): nCloth names without namespace, default all
+        retries (int, optional): extra attempts of a failed job
+
+    Returns:
+        list: of jobs, dependencies first
+    """
+    scenes_dir = os.path.join(work_dir, "scenes")
+    results_dir = os.path.join(work_dir, "results")
+    scene_ext = os.path.splitext(scene_path)[1] or ".ma"
+    range_args = ["--start", start_frame,
+                  "--end", end_frame,
+                  "--preroll", preroll,
+                  "--postroll", postroll]
+    input_id = "{}:{}".format(job_scheduler.KIND_INPUT, setup_root)
+    input_scene = os.path.join(scenes_dir, "{}{}".format(
+        job_scheduler.get_safe_name(input_id), scene_ext))
+    result_path = os.path.join(results_dir, "{}.json".format(
+        job_scheduler.get_safe_name(input_id)))
+    command = job_scheduler.get_batch_command(scene_path,
+                                              "--setups", setup_root,
+                                              "--layers", batch.LAYER_INPUT,
+                                              "--save-as", input_scene,
+                                              "--json", result_path,
+                                              *range_args)
+    jobs = [job_scheduler.new_job(input_id,
+                                  job_scheduler.KIND_INPUT,
+                                  command,
+                                  retries=retries,
+                                  setup=setup_root,
+                                  result=result_path)]
+
+    for wedge in wedges:
+        wedge_id = "{}:{}".format(KIND_WEDGE, wedge["name"])
+        cache_dir = os.path.join(work_dir, WEDGE_DIR_NAME, wedge["name"])
+        result_path = os.path.join(results_dir, "{}.json".format(
+            job_scheduler.get_safe_name(wedge_id)))
+        args = ["--setups", setup_root,
+                "--layers", batch.LAYER_SIM,
+                "--cache-dir", cache_dir,
+                "--no-store",
+                "--json", result_path]
+        if nodes:
+            args.append("--nodes")
+            args.extend(nodes)
+        args.extend(get_wedge_args(wedge))
+        command = job_scheduler.get_batch_command(input_scene,
+                                                  *(args + range_args))
+        jobs.append(job_scheduler.new_job(wedge_id,
+                                          job_scheduler.KIND_SIM,
+                                          command,
+                                          deps=[input_id],
+                                          retries=retries,
+                                          setup=setup_root,
+                                          wedge=wedge["name"],
+                                          cache_dir=cache_dir,
+                                          result=result_path))
+    return jobs
+
+
+# =============================================================================
+# summary
+# =============================================================================
+
+def get_summary(state):
+    """What every wedge changed, how it went and the caches it made
+
+    Args:
+        state (dict): job state of a wedge work dir
+
+    Returns:
+        dict: setup, frame range and wedges
+    """
+    jobs = dict((x.get("wedge"), x) for x in state["jobs"] if x.get("wedge"))
+    summary = {"scene": state["scene"],
+               "setup": state["setup"],
+               "frame_range": state["frame_range"],
+               "preroll": state["preroll"],
+               "postroll": state["postroll"],
+               "wedges": []}
+    for wedge in state["wedges"]:
+        job = jobs[wedge["name"]]
+        caches = {}
+        try:
+            with open(job["result"], "r") as f:
+                result = json.load(f)
+            for setup_result in result["setups"]:
+                caches.update(setup_result["layers"][batch.LAYER_SIM]["caches"])
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        wedge_info = dict(wedge)
+        wedge_info.update({"label": get_wedge_label(wedge),
+                           "status": job["status"],
+                           "seconds": job["seconds"],
+                           "error": job["error"],
+                           "cache_dir": job["cache_dir"],
+                           "caches": caches})
+        summary["wedges"].append(wedge_info)
+    return summary
+
+
+def write_summary(work_dir, summary):
+    """Write the summary of a wedge work dir, for the manager to load
+
+    Args:
+        work_dir (str): path
+        summary (dict): from get_summary
+
+    Returns:
+        str: summary path
+    """
+    summary_path = os.path.join(work_dir, SUMMARY_NAME)
+    batch.write_result(summary, summary_path)
+    return summary_path
+
+
+def read_summary(work_dir):
+    """Read the summary of a wedge work dir
+
+    Args:
+        work_dir (str): path, or the summary itself
+
+    Returns:
+        dict: summary, None if there is none
+    """
+    summary_path = work_dir
+    if os.path.isdir(work_dir):
+        summary_path = os.path.join(work_dir, SUMMARY_NAME)
+    try:
+        with open(summary_path, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def print_summary(summary):
+    """Table of the wedges, a column per preset node and attribute
+
+    Args:
+        summary (dict): from get_summary
+    """
+    columns = []
+    for wedge in summary["wedges"]:
+        for target, _ in wedge["presets"] + wedge["attrs"]:
+            if target not in columns:
+                columns.append(target)
+    widths = [max(len(x), 12) for x in columns]
+    row = "{:<6} " + " ".join(["{{:<{}}}".format(x) for x in widths]) + \
+        " {:<10} {:>10}  {}"
+    print(row.format("wedge", *(columns + ["status", "seconds", "cache dir"])))
+    for wedge in summary["wedges"]:
+        values = dict(wedge["attrs"])
+        for node, preset_path in wedge["presets"]:
+            values[node] = os.path.splitext(os.path.basename(preset_path))[0]
+        cells = []
+        for column in columns:
+            value = values.get(column, "")
+            cells.append("{:g}".format(value) if isinstance(value, float)
+                         else value)
+        print(row.format(wedge["name"],
+                         *(cells + [wedge["status"],
+                                    wedge["seconds"] or "",
+                                    wedge["cache_dir"]])))
+
+
+# =============================================================================
+# command line
+# =============================================================================
+
+def run(options):
+    """Expand the wedges on a new work dir and run, or resume
+
+    Returns:
+        int: 0 if every wedge is done
+    """
+    work_dir = os.path.abspath(options.work_dir)
+    state = job_scheduler.read_state(work_dir)
+    if state is None:
+        if not options.scene or not options.setup:
+            print("--scene and --setup are needed to start a new work dir")
+            return 2
+        presets = []
+        for preset in options.presets or []:
+            node, _, preset_path = preset.rpartition("=")
+            presets.append([node or None, preset_path])
+        attr_ranges = [[plug, float(start), float(end), int(steps)]
+                       for plug, start, end, steps in options.attrs or []]
+        if not presets and not attr_ranges:
+            print("Nothing to wedge, give --presets or --attr")
+            return 2
+        wedges = get_wedges(presets, attr_ranges)
+        scene_path = os.path.abspath(options.scene)
+        for dir_name in ["logs", "results", "scenes", WEDGE_DIR_NAME]:
+            dir_path = os.path.join(work_dir, dir_name)
+            if not os.path.isdir(dir_path):
+                os.makedirs(dir_path)
+        start_frame = options.start
+        end_frame = options.end
+        if start_frame is None or end_frame is None:
+            description = job_scheduler.run_describe(scene_path, work_dir)
+            if start_frame is None:
+                start_frame = description["frame_range"][0]
+            if end_frame is None:
+                end_frame = description["frame_range"][1]
+        preroll = options.preroll
+        if preroll is None:
+            preroll = config_io.CONFIG.get("preroll", 0)
+        postroll = options.postroll
+        if postroll is None:
+            postroll = config_io.CONFIG.get("postroll", 0)
+        jobs = expand_wedges(scene_path,
+                             work_dir,
+                             options.setup,
+                             wedges,
+                             start_frame,
+                             end_frame,
+                             preroll,
+                             postroll,
+                             nodes=options.nodes,
+                             retries=options.retries)
+        state = {"version": job_scheduler.STATE_VERSION,
+                 "scene": scene_path,
+                 "setup": options.setup,
+                 "frame_range": [start_frame, end_frame],
+                 "preroll": preroll,
+                 "postroll": postroll,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "scheduler_pid": None,
+                 "wedges": wedges,
+                 "jobs": jobs}
+        job_scheduler.write_state(work_dir, state)
+    elif "wedges" not in state:
+        print("{} is not a wedge work dir".format(work_dir))
+        return 2
+
+    warm = options.warm
+    if warm is None:
+        warm = config_io.CONFIG.get("scheduler_warm", False)
+    scheduler = job_scheduler.JobScheduler(work_dir,
+                                           workers=options.workers,
+                                           memory_gb=options.memory_gb,
+                                           warm=warm)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    print("Running {} wedges on {} workers".format(len(state["wedges"]),
+                                                    scheduler.workers))
+    all_done = scheduler.run()
+    summary = get_summary(scheduler.state)
+    print_summary(summary)
+    print("Summary in {}".format(write_summary(work_dir, summary)))
+    return 0 if all_done else 1
+
+
+def main(args=None):
+    """Command line entry
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("work_dir")
+    parser.add_argument("--scene", default=None,
+                        help="shot scene, needed on a new work dir")
+    parser.add_argument("--setup", default=None,
+                        help="setup root to wedge, needed on a new work dir")
+    parser.add_argument("--presets", nargs="+", default=None,
+                        metavar="[NODE=]PRESET",
+                        help="preset_share presets, a wedge each")
+    parser.add_argument("--attr", dest="attrs", nargs=4, action="append",
+                        default=None, metavar=("NODE.ATTR", "START", "END",
+                                               "STEPS"),
+                        help="values from START to END, a wedge each")
+    parser.add_argument("--nodes", nargs="+", default=None,
+                        help="nCloth names without namespace, default all")
+    parser.add_argument("--start", type=int, default=None)
+    parser.add_argument("--end", type=int, default=None)
+    parser.add_argument("--preroll", type=int, default=None)
+    parser.add_argument("--postroll", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="defaults to the config, then the cores")
+    parser.add_argument("--memory-gb", type=float, default=None,
+                        help="defaults to the config, then most of the RAM")
+    parser.add_argument("--retries", type=int,
+                        default=config_io.CONFIG.get("scheduler_retries", 1))
+    warm_group = parser.add_mutually_exclusive_group()
+    warm_group.add_argument("--warm", dest="warm", action="store_true",
+                            default=None,
+                            help="run jobs on warm mayapy workers")
+    warm_group.add_argument("--cold", dest="warm", action="store_false",
+                            help="start a mayapy per job")
+    return run(parser.parse_args(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
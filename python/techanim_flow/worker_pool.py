@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""Pool of warm mayapy workers running batch jobs one after another.
+
+Starting mayapy, initializing maya.standalone, loading plugins and importing
+techanim_flow costs more than many small cache jobs. A warm worker pays it
+once and then runs batch command lines in the same interpreter, starting
+every job from a new scene.
+
+Workers talk json lines over their stdin and stdout. Anything Maya prints
+goes to stderr, or to the log of the job running.
+
+    worker -> {"ready": true, "pid": 123, "seconds": 25.1}
+    pool   -> {"id": "job1", "args": ["shot.ma", "--layers", "sim"], "log": "job1.log"}
+    worker -> {"id": "job1", "exit_code": 0, "seconds": 80.2}
+    pool   -> {"quit": true}
+
+mayapy -m techanim_flow.worker_pool --max-jobs 20
+
+A worker quits after max-jobs jobs to give back what Maya leaks, the pool
+starts a new one in its place. A worker that dies fails its job.
+
+Attributes:
+    EXIT_WORKER_DIED (int): exit code of a job whose worker died
+"""
+from __future__ import division
+from __future__ import generators
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# Standard
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+# techanim
+from techanim_flow import batch
+from techanim_flow import config_io
+
+# =============================================================================
+# constants
+# =============================================================================
+EXIT_WORKER_DIED = -1
+MAX_JOBS_CONFIG_KEY = "worker_max_jobs"
+
+
+# =============================================================================
+# worker side, in mayapy
+# =============================================================================
+
+def reset_scene():
+    """Start the next job from nothing, plugins stay loaded
+    """
+    import maya.cmds as cmds
+    cmds.file(new=True, force=True)
+    cmds.flushUndo()
+
+
+def run_job(args, log_path=None):
+    """Run a batch command line, all output to the log of the job
+
+    Args:
+        args (list): batch arguments
+        log_path (str, optional): output of the job, else stderr
+
+    Returns:
+        int: exit code
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = [os.dup(1), os.dup(2)]
+    log_file = None
+    if log_path:
+        log_file = open(log_path, "w")
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+    try:
+        try:
+            exit_code = batch.run_args(args)
+        except SystemExit as e:
+            # argparse exits on bad arguments
+            exit_code = e.code if isinstance(e.code, int) else batch.EXIT_FAILED
+        finally:
+            reset_scene()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for fd in saved_fds:
+            os.close(fd)
+        if log_file:
+            log_file.close()
+    return exit_code
+
+
+def serve(max_jobs=0):
+    """Initialize Maya and run jobs from stdin until told to quit, stdin
+    closes or max_jobs are done
+
+    Args:
+        max_jobs (int, optional): 0 is no limit
+    """
+    # keep the real stdout for replies, everything else printed goes to
+    # stderr, maya writes to the file descriptor directly
+    reply_file = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+
+    def reply(data):
+        reply_file.write(json.dumps(data) + "\n")
+        reply_file.flush()
+
+    start = time.time()
+    batch.initialize()
+    reply({"ready": True,
+           "pid": os.getpid(),
+           "seconds": round(time.time() - start, 3)})
+    jobs_done = 0
+    try:
+        while not max_jobs or jobs_done < max_jobs:
+            line = sys.stdin.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            if request.get("quit"):
+                break
+            start = time.time()
+            exit_code = run_job(request["args"], log_path=request.get("log"))
+            jobs_done += 1
+            reply({"id": request["id"],
+                   "exit_code": exit_code,
+                   "seconds": round(time.time() - start, 3)})
+    finally:
+        reply_file.close()
+        batch.uninitialize()
+
+
+# =============================================================================
+# pool side
+# =============================================================================
+
+class WarmJob(object):
+    """A job sent to a warm worker, polled like a subprocess.Popen
+
+    Attributes:
+        job_id (str): id sent to the worker
+        pid (int): of the worker running it
+        returncode (int): None until the worker replies
+    """
+
+    def __init__(self, worker, job_id):
+        self.worker = worker
+        self.job_id = job_id
+        self.pid = worker.pid
+        self.returncode = None
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.job_id)
+
+    def finish(self, exit_code):
+        self.returncode = exit_code
+        self._done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        while not self._done.is_set():
+            self._done.wait(1.0)
+        return self.returncode
+
+    def terminate(self):
+        """A job cannot be stopped inside Maya, the worker is killed and the
+        pool starts another one
+        """
+        self.worker.kill()
+
+
+class Worker(object):
+    """One warm mayapy process, reading its replies on a thread
+
+    Attributes:
+        jobs_done (int): jobs finished by this worker
+        job (WarmJob): running, None if idle
+        pid (int): process id
+        ready_seconds (float): startup time, None while warming up
+    """
+
+    def __init__(self, mayapy, env=None, max_jobs=0, stderr=None):
+        command = [mayapy, "-m", "techanim_flow.worker_pool"]
+        if max_jobs:
+            command.extend(["--max-jobs", "{}".format(max_jobs)])
+        self.proc = subprocess.Popen(command,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=stderr,
+                                     env=env,
+                                     universal_newlines=True)
+        self.pid = self.proc.pid
+        self.max_jobs = max_jobs
+        self.started = time.time()
+        self.ready_seconds = None
+        self.jobs_done = 0
+        self.job = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_replies)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def __repr__(self):
+        return "{}(pid={})".format(self.__class__.__name__, self.pid)
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def is_idle(self):
+        """Alive, not running a job and not about to quit
+
+        Returns:
+            bool: True False
+        """
+        if self.job is not None or not self.is_alive():
+            return False
+        return not self.max_jobs or self.jobs_done < self.max_jobs
+
+    def _read_replies(self):
+        for line in iter(self.proc.stdout.readline, ""):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if data.get("ready"):
+                self.ready_seconds = data["seconds"]
+                continue
+            with self._lock:
+                job, self.job = self.job, None
+                self.jobs_done += 1
+            if job is not None and job.job_id == data.get("id"):
+                job.finish(data["exit_code"])
+        # stdout closed, the worker quit or died
+        self.proc.wait()
+        with self._lock:
+            self._closed = True
+            job, self.job = self.job, None
+        if job is not None:
+            job.finish(EXIT_WORKER_DIED)
+
+    def submit(self, job_id, args, log_path=None):
+        """Send a job to the worker, it has to be idle
+
+        Args:
+            job_id (str): id of the job
+            args (list): batch arguments
+            log_path (str, optional): output of the job
+
+        Returns:
+            WarmJob: to poll
+        """
+        job = WarmJob(self, job_id)
+        with self._lock:
+            if self._closed:
+                job.finish(EXIT_WORKER_DIED)
+                return job
+            self.job = job
+        request = {"id": job_id, "args": args, "log": log_path}
+        try:
+            self.proc.stdin.write(json.dumps(request) + "\n")
+            self.proc.stdin.flush()
+        except (IOError, OSError, ValueError):
+            # the reader fails the job once the worker is gone
+            self.kill()
+        return job
+
+    def quit(self):
+        """Ask the worker to quit once idle
+        """
+        try:
+            self.proc.stdin.write(json.dumps({"quit": True}) + "\n")
+            self.proc.stdin.close()
+        except (IOError, OSError, ValueError):
+            pass
+
+    def kill(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+
+class WorkerPool(object):
+    """Fixed number of warm workers, dead or retired ones are replaced when
+    a job is submitted
+
+    Attributes:
+        size (int): workers at once
+        workers (list): of Worker
+    """
+
+    def __init__(self, size, mayapy="mayapy", env=None, max_jobs=None,
+                 stderr=None):
+        self.size = max(size, 1)
+        self.mayapy = mayapy
+        self.env = env
+        if max_jobs is None:
+            max_jobs = config_io.CONFIG.get(MAX_JOBS_CONFIG_KEY, 0)
+        self.max_jobs = max_jobs
+        self.stderr = stderr
+        self.workers = []
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.size)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _new_worker(self):
+        worker = Worker(self.mayapy,
+                        env=self.env,
+                        max_jobs=self.max_jobs,
+                        stderr=self.stderr)
+        self.workers.append(worker)
+        return worker
+
+    def start(self):
+        """Start every worker now so they warm up together, before the
+        first jobs come
+        """
+        self._prune()
+        while len(self.workers) < self.size:
+            self._new_worker()
+
+    def _prune(self):
+        """Drop dead workers and retire the ones done with their jobs
+        """
+        for worker in list(self.workers):
+            if worker.job is not None:
+                continue
+            if not worker.is_alive():
+                self.workers.remove(worker)
+            elif worker.max_jobs and worker.jobs_done >= worker.max_jobs:
+                worker.quit()
+                self.workers.remove(worker)
+
+    def get_idle_count(self):
+        """Jobs that can be submitted right now, counting replacements
+
+        Returns:
+            int: count
+        """
+        self._prune()
+        idle = len([x for x in self.workers if x.is_idle()])
+        return idle + self.size - len(self.workers)
+
+    def submit(self, job_id, args, log_path=None):
+        """Run a job on an idle worker, starting one if needed
+
+        Args:
+            job_id (str): id of the job
+            args (list): batch arguments
+            log_path (str, optional): output of the job
+
+        Returns:
+            WarmJob: to poll
+
+        Raises:
+            RuntimeError: if every worker is busy
+        """
+        self._prune()
+        for worker in self.workers:
+            if worker.is_idle():
+                return worker.submit(job_id, args, log_path=log_path)
+        if len(self.workers) < self.size:
+            return self._new_worker().submit(job_id, args, log_path=log_path)
+        raise RuntimeError("All {} workers are busy.".format(self.size))
+
+    def shutdown(self, timeout=30):
+        """Let idle workers quit, kill the rest
+
+        Args:
+            timeout (int, optional): seconds to wait for them to quit
+        """
+        for worker in self.workers:
+            if worker.job is None:
+                worker.quit()
+            else:
+                worker.kill()
+        end_time = time.time() + timeout
+        for worker in self.workers:
+            while worker.is_alive() and time.time() < end_time:
+                time.sleep(0.1)
+            if worker.is_alive():
+                worker.kill()
+        self.workers = []
+
+
+def main(args=None):
+    """Worker entry, run by the pool in mayapy
+
+    Args:
+        args (list, optional): defaults to sys.argv
+
+    Returns:
+        int: exit code
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--max-jobs", type=int, default=0,
+                        help="quit after this many jobs, 0 is no limit")
+    options = parser.parse_args(args)
+    serve(max_jobs=options.max_jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Round trips of cache_io, no maya needed.
+
+python -m unittest discover tests
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+from techanim_flow import cache_io  # noqa: E402
+
+
+@unittest.skipIf(cache_io.np is None, "numpy is required to write caches")
+class TestNegativeFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def write(self, frames):
+        """OneFilePerFrame cache of a point moving with the frame
+
+        Returns:
+            str: xml path
+        """
+        np = cache_io.np
+        writer = cache_io.CacheWriter(self.cache_dir,
+                                      "clothShape",
+                                      start_frame=frames[0],
+                                      end_frame=frames[-1],
+                                      cache_type=cache_io.ONE_FILE_PER_FRAME)
+        with writer:
+            for frame in frames:
+                writer.write_frame(frame, np.array([[frame, 0, 0]],
+                                                   dtype=np.float32))
+        return writer.xml_path
+
+    def test_subframe_names(self):
+        self.write([-2, -1.5, -1, -0.5, 0, 0.5])
+        names = sorted(os.path.splitext(x)[0]
+                       for x in os.listdir(self.cache_dir)
+                       if x.endswith(cache_io.MCX_EXT))
+        self.assertEqual(names, sorted(["clothShapeFrame-2",
+                                        "clothShapeFrame-2Tick125",
+                                        "clothShapeFrame-1",
+                                        "clothShapeFrame-1Tick125",
+                                        "clothShapeFrame0",
+                                        "clothShapeFrame0Tick125"]))
+
+    def test_round_trip(self):
+        frames = [-2, -1.5, -1, -0.5, 0, 0.5, 1]
+        reader = cache_io.CacheReader(self.write(frames))
+        try:
+            self.assertEqual(reader.frames, frames)
+            for frame in frames:
+                points = reader.get_frame(frame)
+                self.assertAlmostEqual(float(points[0][0]), frame)
+        finally:
+            reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()